@@ -0,0 +1,24 @@
+-- Migration: Covering index for windowed bookings fetch (BB_03_04)
+-- Date: 2026-10-18
+-- Purpose: Let "DB: Get Bookings" run as an index-only range scan on
+--          idx_bookings_provider_time instead of reading a provider's whole
+--          booking history from the heap.
+--
+-- The query filters on deleted_at and returns id, so both are added as
+-- INCLUDE columns. Key columns and predicate are unchanged, so the overlap
+-- checks that already use this index keep working.
+--
+-- Run outside a transaction (CONCURRENTLY):
+--   psql "$DATABASE_URL" -f database/migrations/20261018_01_bookings_window_index.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_bookings_provider_time_v2
+    ON public.bookings USING btree (provider_id, start_time, end_time)
+    INCLUDE (id, deleted_at)
+    WHERE (status <> 'cancelled'::public.booking_status);
+
+DROP INDEX CONCURRENTLY IF EXISTS public.idx_bookings_provider_time;
+
+ALTER INDEX IF EXISTS public.idx_bookings_provider_time_v2 RENAME TO idx_bookings_provider_time;
+
+-- Index-only scans need an up-to-date visibility map
+VACUUM (ANALYZE) public.bookings;
@@ -0,0 +1,62 @@
+-- Migration: Replace overlap triggers with a GiST exclusion constraint
+-- Date: 2026-10-18
+-- Purpose: Enforce "no two active bookings of a provider overlap" in the
+--          index itself instead of in trg_check_overlap_with_lock.
+--
+-- The trigger ran an EXISTS probe per row under an advisory lock keyed on
+-- (provider_id, start_time). Bookings that overlap but start at different
+-- times took different locks, so two concurrent transactions could both
+-- pass the probe and commit a double booking. The exclusion constraint is
+-- checked against uncommitted rows too: the second writer waits for the
+-- first and then fails with SQLSTATE 23P01 (exclusion_violation).
+--
+-- Same semantics as the trigger: cancelled rows are ignored and ranges are
+-- half-open, so back-to-back bookings (10:00-10:30, 10:30-11:00) are fine.
+-- unique_booking_slot is a strict subset of the constraint and is dropped,
+-- so every double booking surfaces as 23P01 on bookings_no_overlap; the
+-- BB_04 workflows map that to BOOK_SLOT_OCCUPIED.
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_02_bookings_no_overlap_constraint.sql
+
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+BEGIN;
+
+-- Existing overlaps would make ADD CONSTRAINT fail with a bare 23P01;
+-- report them in a readable form instead.
+DO $$
+DECLARE
+    v_overlaps integer;
+BEGIN
+    SELECT COUNT(*) INTO v_overlaps
+    FROM (
+        SELECT start_time,
+               MAX(end_time) OVER (
+                   PARTITION BY provider_id ORDER BY start_time, end_time
+                   ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+               ) AS prev_end
+        FROM public.bookings
+        WHERE status <> 'cancelled'
+    ) s
+    WHERE s.prev_end > s.start_time;
+
+    IF v_overlaps > 0 THEN
+        RAISE EXCEPTION 'bookings_no_overlap: % active booking(s) overlap an earlier booking of the same provider', v_overlaps
+            USING HINT = 'Cancel or move the duplicates before running this migration.';
+    END IF;
+END;
+$$;
+
+ALTER TABLE public.bookings
+    ADD CONSTRAINT bookings_no_overlap
+    EXCLUDE USING gist (provider_id WITH =, tstzrange(start_time, end_time) WITH &&)
+    WHERE (status <> 'cancelled'::public.booking_status);
+
+DROP TRIGGER IF EXISTS trg_check_overlap_with_lock ON public.bookings;
+DROP FUNCTION IF EXISTS public.check_booking_overlap_with_lock();
+DROP FUNCTION IF EXISTS public.check_booking_overlap();
+
+DROP INDEX IF EXISTS public.unique_booking_slot;
+
+COMMIT;
@@ -0,0 +1,97 @@
+-- Migration: Blocking-wait booking lock (no pg_sleep polling)
+-- Date: 2026-10-18
+-- Purpose: acquire_booking_lock() polled pg_try_advisory_xact_lock every
+--          10 ms for up to p_timeout_seconds. Each waiter kept a backend busy
+--          issuing 100 lock attempts per second. Now it waits in the lock
+--          manager and is woken by the holder's commit/rollback, bounded by
+--          lock_timeout.
+--
+-- Also:
+--   - booking_lock_key() is the one place that derives the advisory key.
+--     release_booking_lock() used a different (pgcrypto digest) key.
+--   - release_booking_lock() and check_booking_lock() called
+--     pg_advisory_unlock_xact(), which does not exist. Transaction-level
+--     advisory locks can only be released by ending the transaction.
+--     Release is therefore a no-op, and check reads pg_locks instead of
+--     taking the lock.
+--
+-- Signatures and return types are unchanged.
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_03_booking_lock_blocking_wait.sql
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION public.booking_lock_key(p_provider_id uuid, p_start_time timestamp with time zone) RETURNS bigint
+    LANGUAGE sql IMMUTABLE
+    AS $$
+    SELECT ('x' || substring(encode(sha256((p_provider_id::text || p_start_time::text)::bytea), 'hex'), 1, 15))::bit(64)::bigint;
+$$;
+
+ALTER FUNCTION public.booking_lock_key(p_provider_id uuid, p_start_time timestamp with time zone) OWNER TO neondb_owner;
+
+
+CREATE OR REPLACE FUNCTION public.acquire_booking_lock(p_provider_id uuid, p_start_time timestamp with time zone, p_timeout_seconds integer DEFAULT 30) RETURNS boolean
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    lock_key bigint := public.booking_lock_key(p_provider_id, p_start_time);
+    prev_lock_timeout text := current_setting('lock_timeout');
+BEGIN
+    -- lock_timeout = 0 means "wait forever", so a zero timeout is a plain try
+    IF COALESCE(p_timeout_seconds, 0) <= 0 THEN
+        RETURN pg_try_advisory_xact_lock(lock_key);
+    END IF;
+
+    BEGIN
+        PERFORM set_config('lock_timeout', (p_timeout_seconds * 1000)::text, true);
+        PERFORM pg_advisory_xact_lock(lock_key);
+    EXCEPTION WHEN lock_not_available THEN
+        -- the block's subtransaction abort already restored lock_timeout
+        RETURN false;
+    END;
+
+    -- keep the caller's lock_timeout for the rest of its transaction
+    PERFORM set_config('lock_timeout', prev_lock_timeout, true);
+    RETURN true;
+END;
+$$;
+
+ALTER FUNCTION public.acquire_booking_lock(p_provider_id uuid, p_start_time timestamp with time zone, p_timeout_seconds integer) OWNER TO neondb_owner;
+
+
+CREATE OR REPLACE FUNCTION public.check_booking_lock(p_provider_id uuid, p_start_time timestamp with time zone) RETURNS boolean
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    lock_key bigint := public.booking_lock_key(p_provider_id, p_start_time);
+BEGIN
+    -- bigint advisory keys show up in pg_locks split into classid/objid, objsubid = 1
+    RETURN EXISTS (
+        SELECT 1 FROM pg_locks
+        WHERE locktype = 'advisory'
+          AND granted
+          AND objsubid = 1
+          AND classid = ((lock_key >> 32) & 4294967295)::bigint::oid
+          AND objid = (lock_key & 4294967295)::bigint::oid
+    );
+END;
+$$;
+
+ALTER FUNCTION public.check_booking_lock(p_provider_id uuid, p_start_time timestamp with time zone) OWNER TO neondb_owner;
+
+
+CREATE OR REPLACE FUNCTION public.release_booking_lock(p_provider_id uuid, p_start_time timestamp with time zone) RETURNS void
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    -- acquire_booking_lock() takes a transaction-level lock; it is released
+    -- when the acquiring transaction commits or rolls back. Kept so existing
+    -- callers (BB_04_Booking_Create "Rollback Lock") stay valid.
+    RETURN;
+END;
+$$;
+
+ALTER FUNCTION public.release_booking_lock(p_provider_id uuid, p_start_time timestamp with time zone) OWNER TO neondb_owner;
+
+COMMIT;
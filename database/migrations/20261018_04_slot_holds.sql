@@ -0,0 +1,164 @@
+-- Migration: slot_holds - short-lived slot reservations with TTL
+-- Date: 2026-10-18
+-- Purpose: Keep a slot reserved across n8n nodes. BB_04_Booking_Create
+--          used to take an advisory xact lock in "Lock Slot", but that lock
+--          was released when the node's transaction ended, before the slow
+--          Google Calendar call and the insert.
+--
+-- Flow (each step is its own short transaction):
+--   hold_slot()          -> hold id, or NULL if the slot is booked or held
+--   ... Google Calendar call, no DB transaction open ...
+--   confirm_slot_hold()  -> inserts the booking and deletes the hold atomically
+--   release_slot_hold()  -> gives the slot back (e.g. GCal failed)
+--
+-- Expiry is lazy. There is no sweeper. hold_slot() deletes expired holds that
+-- overlap the requested range before inserting its own. An expired hold
+-- that nobody has taken over can still be confirmed, so a slow GCal call
+-- does not orphan a calendar event. hold_slot() calls for the same provider
+-- are serialized by a transaction-scoped advisory lock, so the loser sees
+-- the winner's committed hold. The exclusion constraint is the backstop:
+-- if it is violated, the call returns NULL.
+--
+-- Requires btree_gist (20261018_02).
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_04_slot_holds.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.slot_holds (
+    id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+    provider_id uuid NOT NULL REFERENCES public.providers(id) ON DELETE CASCADE,
+    user_id uuid NOT NULL REFERENCES public.users(id) ON DELETE CASCADE,
+    start_time timestamp with time zone NOT NULL,
+    end_time timestamp with time zone NOT NULL,
+    expires_at timestamp with time zone NOT NULL,
+    created_at timestamp with time zone DEFAULT now() NOT NULL,
+    CONSTRAINT valid_hold_time CHECK (end_time > start_time),
+    CONSTRAINT slot_holds_no_overlap
+        EXCLUDE USING gist (provider_id WITH =, tstzrange(start_time, end_time) WITH &&)
+);
+
+ALTER TABLE public.slot_holds OWNER TO neondb_owner;
+
+CREATE INDEX IF NOT EXISTS idx_slot_holds_expires ON public.slot_holds (expires_at);
+
+
+CREATE OR REPLACE FUNCTION public.hold_slot(p_provider_id uuid, p_user_id uuid, p_start_time timestamp with time zone, p_end_time timestamp with time zone, p_ttl_seconds integer DEFAULT 120) RETURNS uuid
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_hold_id uuid;
+BEGIN
+    -- Serialize holds per provider. hold_slot() is a handful of index probes,
+    -- and without this many concurrent inserters conflicting on the GiST
+    -- exclusion constraint wait on each other and deadlock (40P01 after
+    -- deadlock_timeout) instead of failing fast.
+    PERFORM pg_advisory_xact_lock(hashtext('slot_holds'), hashtext(p_provider_id::text));
+
+    -- Same user retrying the same slot: extend the hold instead of failing
+    UPDATE public.slot_holds
+    SET expires_at = NOW() + make_interval(secs => p_ttl_seconds)
+    WHERE provider_id = p_provider_id
+      AND user_id = p_user_id
+      AND start_time = p_start_time
+      AND end_time = p_end_time
+    RETURNING id INTO v_hold_id;
+
+    IF v_hold_id IS NOT NULL THEN
+        RETURN v_hold_id;
+    END IF;
+
+    IF EXISTS (
+        SELECT 1 FROM public.bookings
+        WHERE provider_id = p_provider_id
+          AND status <> 'cancelled'
+          AND tstzrange(start_time, end_time) && tstzrange(p_start_time, p_end_time)
+    ) THEN
+        RETURN NULL;
+    END IF;
+
+    -- Lazy expiry: only the stale holds that would block this one
+    DELETE FROM public.slot_holds
+    WHERE provider_id = p_provider_id
+      AND tstzrange(start_time, end_time) && tstzrange(p_start_time, p_end_time)
+      AND expires_at <= NOW();
+
+    BEGIN
+        INSERT INTO public.slot_holds (provider_id, user_id, start_time, end_time, expires_at)
+        VALUES (p_provider_id, p_user_id, p_start_time, p_end_time, NOW() + make_interval(secs => p_ttl_seconds))
+        RETURNING id INTO v_hold_id;
+    EXCEPTION WHEN exclusion_violation THEN
+        RETURN NULL;
+    END;
+
+    RETURN v_hold_id;
+END;
+$$;
+
+ALTER FUNCTION public.hold_slot(p_provider_id uuid, p_user_id uuid, p_start_time timestamp with time zone, p_end_time timestamp with time zone, p_ttl_seconds integer) OWNER TO neondb_owner;
+
+
+CREATE OR REPLACE FUNCTION public.confirm_slot_hold(p_hold_id uuid, p_service_id uuid DEFAULT NULL, p_gcal_event_id text DEFAULT NULL) RETURNS public.bookings
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_provider_id uuid;
+    v_hold public.slot_holds;
+    v_booking public.bookings;
+BEGIN
+    SELECT provider_id INTO v_provider_id FROM public.slot_holds WHERE id = p_hold_id;
+
+    -- Same lock as hold_slot(), taken before touching the hold row: a
+    -- concurrent hold_slot() must not see the hold gone while the booking
+    -- is not committed yet
+    IF v_provider_id IS NOT NULL THEN
+        PERFORM pg_advisory_xact_lock(hashtext('slot_holds'), hashtext(v_provider_id::text));
+    END IF;
+
+    DELETE FROM public.slot_holds WHERE id = p_hold_id RETURNING * INTO v_hold;
+
+    -- Released, or expired and taken over by another hold_slot()
+    IF v_hold.id IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO public.bookings (user_id, provider_id, service_id, start_time, end_time, status, gcal_event_id)
+    VALUES (v_hold.user_id, v_hold.provider_id, p_service_id, v_hold.start_time, v_hold.end_time, 'confirmed', p_gcal_event_id)
+    RETURNING * INTO v_booking;
+
+    RETURN v_booking;
+END;
+$$;
+
+ALTER FUNCTION public.confirm_slot_hold(p_hold_id uuid, p_service_id uuid, p_gcal_event_id text) OWNER TO neondb_owner;
+
+
+CREATE OR REPLACE FUNCTION public.release_slot_hold(p_hold_id uuid) RETURNS boolean
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    DELETE FROM public.slot_holds WHERE id = p_hold_id;
+    RETURN FOUND;
+END;
+$$;
+
+ALTER FUNCTION public.release_slot_hold(p_hold_id uuid) OWNER TO neondb_owner;
+
+
+-- Optional housekeeping. Correctness does not depend on it.
+CREATE OR REPLACE FUNCTION public.purge_expired_slot_holds() RETURNS integer
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_deleted integer;
+BEGIN
+    DELETE FROM public.slot_holds WHERE expires_at <= NOW();
+    GET DIAGNOSTICS v_deleted = ROW_COUNT;
+    RETURN v_deleted;
+END;
+$$;
+
+ALTER FUNCTION public.purge_expired_slot_holds() OWNER TO neondb_owner;
+
+COMMIT;
@@ -0,0 +1,91 @@
+-- Migration: create_booking() - one round trip for BB_04_Booking_Create
+-- Date: 2026-10-18
+-- Purpose: Replace the Validate FKs -> Hold Slot -> Confirm Hold sequence
+--          (one n8n Postgres node and one transaction each) with a single
+--          statement. It validates provider and user, checks the slot,
+--          inserts, and returns a Standard Contract-shaped result.
+--
+-- Result (jsonb):
+--   { "success": true,  "error_code": null, "error_message": null,
+--     "data": { "id", "provider_id", "user_id", "start_time", "end_time", "status" } }
+--   { "success": false, "error_code": "BOOK_INVALID_PROVIDER" | "BOOK_INVALID_USER"
+--                                   | "BOOK_SLOT_OCCUPIED" | "BOOK_SLOT_LOCKED",
+--     "error_message": "...", "data": null }
+--
+-- BB_04_Booking_Create now runs GCal Create -> Create Booking, with this
+-- function as its only Postgres node. If the function rejects the booking,
+-- the calendar event is deleted. Holds from slot_holds (20261018_04) are
+-- honoured: another user's live hold on an overlapping range gives
+-- BOOK_SLOT_LOCKED. The caller's own hold is consumed.
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_05_create_booking_function.sql
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION public.create_booking(p_provider_id uuid, p_user_id uuid, p_start_time timestamp with time zone, p_end_time timestamp with time zone, p_service_id uuid DEFAULT NULL, p_gcal_event_id text DEFAULT NULL) RETURNS jsonb
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_booking public.bookings;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM public.providers WHERE id = p_provider_id AND deleted_at IS NULL) THEN
+        RETURN jsonb_build_object('success', false, 'error_code', 'BOOK_INVALID_PROVIDER',
+                                  'error_message', 'Provider not found or inactive', 'data', NULL);
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM public.users WHERE id = p_user_id AND deleted_at IS NULL) THEN
+        RETURN jsonb_build_object('success', false, 'error_code', 'BOOK_INVALID_USER',
+                                  'error_message', 'User not found or inactive', 'data', NULL);
+    END IF;
+
+    -- Same per-provider lock as hold_slot()/confirm_slot_hold()
+    PERFORM pg_advisory_xact_lock(hashtext('slot_holds'), hashtext(p_provider_id::text));
+
+    IF EXISTS (
+        SELECT 1 FROM public.slot_holds
+        WHERE provider_id = p_provider_id
+          AND user_id <> p_user_id
+          AND expires_at > NOW()
+          AND tstzrange(start_time, end_time) && tstzrange(p_start_time, p_end_time)
+    ) THEN
+        RETURN jsonb_build_object('success', false, 'error_code', 'BOOK_SLOT_LOCKED',
+                                  'error_message', 'Slot is being processed by another request', 'data', NULL);
+    END IF;
+
+    -- The caller's own holds, and anyone's expired ones, stop blocking the range
+    DELETE FROM public.slot_holds
+    WHERE provider_id = p_provider_id
+      AND (user_id = p_user_id OR expires_at <= NOW())
+      AND tstzrange(start_time, end_time) && tstzrange(p_start_time, p_end_time);
+
+    BEGIN
+        INSERT INTO public.bookings (user_id, provider_id, service_id, start_time, end_time, status, gcal_event_id)
+        VALUES (p_user_id, p_provider_id, p_service_id, p_start_time, p_end_time, 'confirmed', p_gcal_event_id)
+        RETURNING * INTO v_booking;
+    EXCEPTION WHEN exclusion_violation THEN
+        RETURN jsonb_build_object('success', false, 'error_code', 'BOOK_SLOT_OCCUPIED',
+                                  'error_message', 'Slot is already booked', 'data', NULL);
+    END;
+
+    RETURN jsonb_build_object(
+        'success', true,
+        'error_code', NULL,
+        'error_message', NULL,
+        'data', jsonb_build_object(
+            'id', v_booking.id,
+            'provider_id', v_booking.provider_id,
+            'user_id', v_booking.user_id,
+            'service_id', v_booking.service_id,
+            'start_time', v_booking.start_time,
+            'end_time', v_booking.end_time,
+            'status', v_booking.status,
+            'gcal_event_id', v_booking.gcal_event_id
+        )
+    );
+END;
+$$;
+
+ALTER FUNCTION public.create_booking(p_provider_id uuid, p_user_id uuid, p_start_time timestamp with time zone, p_end_time timestamp with time zone, p_service_id uuid, p_gcal_event_id text) OWNER TO neondb_owner;
+
+COMMIT;
@@ -0,0 +1,144 @@
+-- Migration: Idempotency keys for BB_04 create / cancel / reschedule
+-- Date: 2026-10-18
+-- Purpose: Telegram redelivers webhooks and users double-tap, so one intent
+--          can reach BB_04_Booking_Create/Cancel/Reschedule several times.
+--          The first execution claims the key and stores its response.
+--          Duplicates within the TTL get that response back from one
+--          primary-key lookup, without touching GCal or the booking tables.
+--
+-- Key: "tg:<update_id>" from BB_01_Telegram_Gateway, or a client-supplied
+-- idempotency_key. It is scoped by workflow (the scope column).
+--
+-- API:
+--   idempotency_begin(scope, key, request, ttl, lease) -> jsonb
+--     { "state": "new" }                      caller owns the key, go ahead
+--     { "state": "replay", "response": {...} } finished before, return response
+--     { "state": "in_progress" }              another execution holds the lease
+--     { "state": "mismatch" }                 same key, different request body
+--     An empty key returns "new" without touching the table.
+--   idempotency_finish(scope, key, response) -> void
+--     Stores the response. For transient failures (DB, GCal, lock contention)
+--     it deletes the key instead, so a retry runs for real.
+--
+-- The in_progress lease (default 60 s) stops a crashed execution from
+-- blocking its key until the TTL ends. Expired rows are reclaimed lazily by
+-- idempotency_begin(). purge_idempotency_keys() is optional housekeeping.
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_06_idempotency_keys.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.idempotency_keys (
+    scope text NOT NULL,
+    idempotency_key text NOT NULL,
+    request_hash text NOT NULL,
+    status text DEFAULT 'in_progress' NOT NULL,
+    response jsonb,
+    locked_until timestamp with time zone,
+    expires_at timestamp with time zone NOT NULL,
+    created_at timestamp with time zone DEFAULT now() NOT NULL,
+    CONSTRAINT idempotency_keys_pkey PRIMARY KEY (scope, idempotency_key),
+    CONSTRAINT idempotency_keys_status_check CHECK (status IN ('in_progress', 'completed'))
+);
+
+ALTER TABLE public.idempotency_keys OWNER TO neondb_owner;
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON public.idempotency_keys (expires_at);
+
+
+CREATE OR REPLACE FUNCTION public.idempotency_begin(p_scope text, p_key text, p_request jsonb DEFAULT '{}'::jsonb, p_ttl_seconds integer DEFAULT 86400, p_lease_seconds integer DEFAULT 60) RETURNS jsonb
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_hash text := md5(COALESCE(p_request, '{}'::jsonb)::text);
+    v_row public.idempotency_keys;
+BEGIN
+    IF p_key IS NULL OR p_key = '' THEN
+        RETURN jsonb_build_object('state', 'new');
+    END IF;
+
+    -- Claim a fresh key, or take over one whose TTL or lease has run out
+    INSERT INTO public.idempotency_keys (scope, idempotency_key, request_hash, status, locked_until, expires_at)
+    VALUES (p_scope, p_key, v_hash, 'in_progress',
+            NOW() + make_interval(secs => p_lease_seconds),
+            NOW() + make_interval(secs => p_ttl_seconds))
+    ON CONFLICT (scope, idempotency_key) DO UPDATE
+        SET request_hash = EXCLUDED.request_hash,
+            status = 'in_progress',
+            response = NULL,
+            locked_until = EXCLUDED.locked_until,
+            expires_at = EXCLUDED.expires_at,
+            created_at = NOW()
+        WHERE idempotency_keys.expires_at <= NOW()
+           OR (idempotency_keys.status = 'in_progress' AND idempotency_keys.locked_until <= NOW())
+    RETURNING * INTO v_row;
+
+    IF v_row.scope IS NOT NULL THEN
+        RETURN jsonb_build_object('state', 'new');
+    END IF;
+
+    SELECT * INTO v_row
+    FROM public.idempotency_keys
+    WHERE scope = p_scope AND idempotency_key = p_key;
+
+    IF v_row.request_hash <> v_hash THEN
+        RETURN jsonb_build_object('state', 'mismatch');
+    END IF;
+
+    IF v_row.status = 'completed' THEN
+        RETURN jsonb_build_object('state', 'replay', 'response', v_row.response);
+    END IF;
+
+    RETURN jsonb_build_object('state', 'in_progress');
+END;
+$$;
+
+ALTER FUNCTION public.idempotency_begin(p_scope text, p_key text, p_request jsonb, p_ttl_seconds integer, p_lease_seconds integer) OWNER TO neondb_owner;
+
+
+CREATE OR REPLACE FUNCTION public.idempotency_finish(p_scope text, p_key text, p_response jsonb) RETURNS void
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    IF p_key IS NULL OR p_key = '' THEN
+        RETURN;
+    END IF;
+
+    -- Transient outcomes: release the key so a retry runs for real
+    IF NOT COALESCE((p_response->>'success')::boolean, false)
+       AND COALESCE(p_response->>'error_code', 'INTERNAL_ERROR') IN (
+           'DB_ERROR', 'INTERNAL_ERROR', 'SYS_NO_OUTPUT', 'GCAL_ERROR',
+           'BOOK_GCAL_FAILED', 'BOOK_SLOT_LOCKED', 'BOOK_TRANSACTION_FAILED')
+    THEN
+        DELETE FROM public.idempotency_keys
+        WHERE scope = p_scope AND idempotency_key = p_key AND status = 'in_progress';
+        RETURN;
+    END IF;
+
+    UPDATE public.idempotency_keys
+    SET status = 'completed',
+        response = p_response,
+        locked_until = NULL
+    WHERE scope = p_scope AND idempotency_key = p_key;
+END;
+$$;
+
+ALTER FUNCTION public.idempotency_finish(p_scope text, p_key text, p_response jsonb) OWNER TO neondb_owner;
+
+
+CREATE OR REPLACE FUNCTION public.purge_idempotency_keys() RETURNS integer
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_deleted integer;
+BEGIN
+    DELETE FROM public.idempotency_keys WHERE expires_at <= NOW();
+    GET DIAGNOSTICS v_deleted = ROW_COUNT;
+    RETURN v_deleted;
+END;
+$$;
+
+ALTER FUNCTION public.purge_idempotency_keys() OWNER TO neondb_owner;
+
+COMMIT;
@@ -0,0 +1,167 @@
+-- Migration: reschedule_booking() - atomic swap for BB_04_Booking_Reschedule
+-- Date: 2026-10-18
+-- Purpose: The workflow inserted the new booking and then marked the old one
+--          'rescheduled', as separate statements with GCal delete/create in
+--          between. Both bookings existed for a while, and a failure
+--          needed a compensating "Rollback GCal". reschedule_booking() does
+--          the swap in one transaction with one overlap check. Google
+--          Calendar is synced after the commit and does not decide the
+--          outcome.
+--
+-- A 'rescheduled' booking is history, so it no longer occupies its slot.
+-- Before this migration, the old row kept blocking its range forever, and a
+-- booking could not be moved to a time that overlaps its current one (e.g.
+-- 10:00 -> 10:15). "Active" now means status NOT IN ('cancelled',
+-- 'rescheduled'), for:
+--   - bookings_no_overlap (exclusion constraint)
+--   - idx_bookings_provider_time (covering index used by BB_03_04)
+--   - hold_slot()
+-- Rebuilding the constraint takes a short ACCESS EXCLUSIVE lock on bookings.
+--
+-- Result (jsonb), Standard Contract shape:
+--   success: data = { old_booking_id, new_booking_id, provider_id, start_time,
+--                     end_time, old_gcal_event_id }
+--   errors:  BOOK_NOT_FOUND | BOOK_SLOT_OCCUPIED | BOOK_SLOT_LOCKED
+--
+-- Run (the index rebuild at the end must be outside a transaction):
+--   psql "$DATABASE_URL" -f database/migrations/20261018_07_reschedule_booking_function.sql
+
+BEGIN;
+
+ALTER TABLE public.bookings DROP CONSTRAINT IF EXISTS bookings_no_overlap;
+
+ALTER TABLE public.bookings
+    ADD CONSTRAINT bookings_no_overlap
+    EXCLUDE USING gist (provider_id WITH =, tstzrange(start_time, end_time) WITH &&)
+    WHERE (status NOT IN ('cancelled'::public.booking_status, 'rescheduled'::public.booking_status));
+
+
+CREATE OR REPLACE FUNCTION public.hold_slot(p_provider_id uuid, p_user_id uuid, p_start_time timestamp with time zone, p_end_time timestamp with time zone, p_ttl_seconds integer DEFAULT 120) RETURNS uuid
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_hold_id uuid;
+BEGIN
+    -- Serialize holds per provider. hold_slot() is a handful of index probes,
+    -- and without this many concurrent inserters conflicting on the GiST
+    -- exclusion constraint wait on each other and deadlock (40P01 after
+    -- deadlock_timeout) instead of failing fast.
+    PERFORM pg_advisory_xact_lock(hashtext('slot_holds'), hashtext(p_provider_id::text));
+
+    -- Same user retrying the same slot: extend the hold instead of failing
+    UPDATE public.slot_holds
+    SET expires_at = NOW() + make_interval(secs => p_ttl_seconds)
+    WHERE provider_id = p_provider_id
+      AND user_id = p_user_id
+      AND start_time = p_start_time
+      AND end_time = p_end_time
+    RETURNING id INTO v_hold_id;
+
+    IF v_hold_id IS NOT NULL THEN
+        RETURN v_hold_id;
+    END IF;
+
+    IF EXISTS (
+        SELECT 1 FROM public.bookings
+        WHERE provider_id = p_provider_id
+          AND status NOT IN ('cancelled', 'rescheduled')
+          AND tstzrange(start_time, end_time) && tstzrange(p_start_time, p_end_time)
+    ) THEN
+        RETURN NULL;
+    END IF;
+
+    -- Lazy expiry: only the stale holds that would block this one
+    DELETE FROM public.slot_holds
+    WHERE provider_id = p_provider_id
+      AND tstzrange(start_time, end_time) && tstzrange(p_start_time, p_end_time)
+      AND expires_at <= NOW();
+
+    BEGIN
+        INSERT INTO public.slot_holds (provider_id, user_id, start_time, end_time, expires_at)
+        VALUES (p_provider_id, p_user_id, p_start_time, p_end_time, NOW() + make_interval(secs => p_ttl_seconds))
+        RETURNING id INTO v_hold_id;
+    EXCEPTION WHEN exclusion_violation THEN
+        RETURN NULL;
+    END;
+
+    RETURN v_hold_id;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION public.reschedule_booking(p_booking_id uuid, p_user_id uuid, p_new_start_time timestamp with time zone, p_new_end_time timestamp with time zone) RETURNS jsonb
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_old public.bookings;
+    v_new public.bookings;
+BEGIN
+    SELECT * INTO v_old
+    FROM public.bookings
+    WHERE id = p_booking_id
+      AND user_id = p_user_id
+      AND deleted_at IS NULL
+      AND status = 'confirmed'
+    FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('success', false, 'error_code', 'BOOK_NOT_FOUND',
+                                  'error_message', 'Booking not found', 'data', NULL);
+    END IF;
+
+    -- Same per-provider lock as hold_slot()/create_booking()
+    PERFORM pg_advisory_xact_lock(hashtext('slot_holds'), hashtext(v_old.provider_id::text));
+
+    IF EXISTS (
+        SELECT 1 FROM public.slot_holds
+        WHERE provider_id = v_old.provider_id
+          AND user_id <> p_user_id
+          AND expires_at > NOW()
+          AND tstzrange(start_time, end_time) && tstzrange(p_new_start_time, p_new_end_time)
+    ) THEN
+        RETURN jsonb_build_object('success', false, 'error_code', 'BOOK_SLOT_LOCKED',
+                                  'error_message', 'Slot is being processed by another request', 'data', NULL);
+    END IF;
+
+    -- Retire the old row first so the new range is checked once, against
+    -- everything except the booking being moved
+    BEGIN
+        UPDATE public.bookings SET status = 'rescheduled', updated_at = NOW() WHERE id = v_old.id;
+
+        INSERT INTO public.bookings (user_id, provider_id, service_id, start_time, end_time, status, notes)
+        VALUES (v_old.user_id, v_old.provider_id, v_old.service_id, p_new_start_time, p_new_end_time, 'confirmed', v_old.notes)
+        RETURNING * INTO v_new;
+    EXCEPTION WHEN exclusion_violation THEN
+        RETURN jsonb_build_object('success', false, 'error_code', 'BOOK_SLOT_OCCUPIED',
+                                  'error_message', 'New slot is already booked', 'data', NULL);
+    END;
+
+    RETURN jsonb_build_object(
+        'success', true,
+        'error_code', NULL,
+        'error_message', NULL,
+        'data', jsonb_build_object(
+            'old_booking_id', v_old.id,
+            'new_booking_id', v_new.id,
+            'provider_id', v_new.provider_id,
+            'start_time', v_new.start_time,
+            'end_time', v_new.end_time,
+            'old_gcal_event_id', v_old.gcal_event_id
+        )
+    );
+END;
+$$;
+
+ALTER FUNCTION public.reschedule_booking(p_booking_id uuid, p_user_id uuid, p_new_start_time timestamp with time zone, p_new_end_time timestamp with time zone) OWNER TO neondb_owner;
+
+COMMIT;
+
+-- Covering index for BB_03_04 with the same notion of "active"
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_bookings_provider_time_v2
+    ON public.bookings USING btree (provider_id, start_time, end_time)
+    INCLUDE (id, deleted_at)
+    WHERE (status NOT IN ('cancelled'::public.booking_status, 'rescheduled'::public.booking_status));
+
+DROP INDEX CONCURRENTLY IF EXISTS public.idx_bookings_provider_time;
+
+ALTER INDEX IF EXISTS public.idx_bookings_provider_time_v2 RENAME TO idx_bookings_provider_time;
@@ -0,0 +1,208 @@
+-- Migration: calendar_outbox - Google Calendar side effects off the request path
+-- Date: 2026-10-18
+-- Purpose: BB_04_Booking_Create/Cancel/Reschedule called the Google Calendar
+--          node inline. GCal latency (hundreds of ms, sometimes seconds) was
+--          part of every booking's response time, and in Create it ran while
+--          the slot was being decided. Booking changes now write an outbox row
+--          in the same transaction. scripts-py/calendar_outbox_worker.py
+--          drains the outbox in batches with bounded concurrency and retries.
+--
+-- Enqueueing is done by a trigger on public.bookings, so every write path
+-- is covered: create_booking(), reschedule_booking(), the Cancel UPDATE and
+-- manual fixes.
+--   INSERT of an active booking without gcal_event_id     -> 'create'
+--   UPDATE of status from active to cancelled/rescheduled -> 'delete'
+--     If the 'create' is still pending (never sent), it is dropped and no
+--     'delete' is queued.
+--
+-- Ordering: rows for one booking are processed in id order. A row is not
+-- claimed while an earlier row for the same booking is pending or
+-- processing. A 'delete' whose event id was unknown at enqueue time picks up
+-- bookings.gcal_event_id when claimed, after its 'create' has completed.
+--
+-- API (used by the worker):
+--   claim_calendar_outbox(batch_size, lease_seconds) -> SETOF calendar_outbox
+--     Due rows, FOR UPDATE SKIP LOCKED. Also takes over rows whose lease
+--     expired (crashed worker).
+--   settle_calendar_outbox(results jsonb) -> integer
+--     One call per batch: [{ id, ok, gcal_event_id?, error?, retry_after?, permanent? }]
+--     ok        -> done; a 'create' stores gcal_event_id on the booking
+--     otherwise -> pending again with exponential backoff (Retry-After
+--                  honored), or failed after max_attempts / permanent errors
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_08_calendar_outbox.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.calendar_outbox (
+    id bigserial NOT NULL,
+    booking_id uuid NOT NULL,
+    operation text NOT NULL,
+    calendar_id text DEFAULT 'primary' NOT NULL,
+    payload jsonb DEFAULT '{}'::jsonb NOT NULL,
+    status text DEFAULT 'pending' NOT NULL,
+    attempts integer DEFAULT 0 NOT NULL,
+    max_attempts integer DEFAULT 8 NOT NULL,
+    next_attempt_at timestamp with time zone DEFAULT now() NOT NULL,
+    locked_until timestamp with time zone,
+    last_error text,
+    created_at timestamp with time zone DEFAULT now() NOT NULL,
+    processed_at timestamp with time zone,
+    CONSTRAINT calendar_outbox_pkey PRIMARY KEY (id),
+    CONSTRAINT calendar_outbox_booking_id_fkey FOREIGN KEY (booking_id) REFERENCES public.bookings(id) ON DELETE CASCADE,
+    CONSTRAINT calendar_outbox_operation_check CHECK (operation IN ('create', 'delete')),
+    CONSTRAINT calendar_outbox_status_check CHECK (status IN ('pending', 'processing', 'done', 'failed'))
+);
+
+ALTER TABLE public.calendar_outbox OWNER TO neondb_owner;
+
+-- Worker scan: only unfinished rows, so done/failed history costs nothing
+CREATE INDEX IF NOT EXISTS idx_calendar_outbox_due
+    ON public.calendar_outbox (next_attempt_at)
+    WHERE status IN ('pending', 'processing');
+
+CREATE INDEX IF NOT EXISTS idx_calendar_outbox_booking
+    ON public.calendar_outbox (booking_id, id)
+    WHERE status IN ('pending', 'processing');
+
+
+CREATE OR REPLACE FUNCTION public.enqueue_calendar_outbox() RETURNS trigger
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF NEW.status IN ('pending', 'confirmed') AND NEW.gcal_event_id IS NULL THEN
+            INSERT INTO public.calendar_outbox (booking_id, operation, payload)
+            VALUES (NEW.id, 'create', jsonb_build_object(
+                'summary', 'Reserva',
+                'start_time', NEW.start_time,
+                'end_time', NEW.end_time
+            ));
+        END IF;
+        RETURN NEW;
+    END IF;
+
+    IF OLD.status IN ('cancelled', 'rescheduled')
+       OR NEW.status NOT IN ('cancelled', 'rescheduled') THEN
+        RETURN NEW;
+    END IF;
+
+    -- Never sent to GCal: nothing to undo
+    DELETE FROM public.calendar_outbox
+    WHERE booking_id = NEW.id
+      AND operation = 'create'
+      AND status = 'pending'
+      AND attempts = 0;
+
+    IF FOUND THEN
+        RETURN NEW;
+    END IF;
+
+    INSERT INTO public.calendar_outbox (booking_id, operation, payload)
+    VALUES (NEW.id, 'delete', jsonb_build_object('event_id', OLD.gcal_event_id));
+
+    RETURN NEW;
+END;
+$$;
+
+ALTER FUNCTION public.enqueue_calendar_outbox() OWNER TO neondb_owner;
+
+DROP TRIGGER IF EXISTS trg_bookings_calendar_outbox ON public.bookings;
+
+CREATE TRIGGER trg_bookings_calendar_outbox
+    AFTER INSERT OR UPDATE OF status ON public.bookings
+    FOR EACH ROW EXECUTE FUNCTION public.enqueue_calendar_outbox();
+
+
+CREATE OR REPLACE FUNCTION public.claim_calendar_outbox(p_batch_size integer DEFAULT 50, p_lease_seconds integer DEFAULT 60) RETURNS SETOF public.calendar_outbox
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    RETURN QUERY
+    WITH due AS (
+        SELECT o.id
+        FROM public.calendar_outbox o
+        WHERE ((o.status = 'pending' AND o.next_attempt_at <= NOW())
+               OR (o.status = 'processing' AND o.locked_until <= NOW()))
+          AND NOT EXISTS (
+              SELECT 1 FROM public.calendar_outbox p
+              WHERE p.booking_id = o.booking_id
+                AND p.id < o.id
+                AND p.status IN ('pending', 'processing')
+          )
+        ORDER BY o.next_attempt_at, o.id
+        LIMIT p_batch_size
+        FOR UPDATE OF o SKIP LOCKED
+    )
+    UPDATE public.calendar_outbox c
+    SET status = 'processing',
+        attempts = c.attempts + 1,
+        locked_until = NOW() + make_interval(secs => p_lease_seconds),
+        -- Event id only known once the booking's 'create' has completed
+        payload = CASE
+            WHEN c.operation = 'delete' AND c.payload->>'event_id' IS NULL
+            THEN c.payload || jsonb_build_object('event_id', b.gcal_event_id)
+            ELSE c.payload
+        END
+    FROM due, public.bookings b
+    WHERE c.id = due.id
+      AND b.id = c.booking_id
+    RETURNING c.*;
+END;
+$$;
+
+ALTER FUNCTION public.claim_calendar_outbox(p_batch_size integer, p_lease_seconds integer) OWNER TO neondb_owner;
+
+
+CREATE OR REPLACE FUNCTION public.settle_calendar_outbox(p_results jsonb) RETURNS integer
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_settled integer;
+BEGIN
+    WITH r AS (
+        SELECT *
+        FROM jsonb_to_recordset(p_results)
+            AS x(id bigint, ok boolean, gcal_event_id text, error text, retry_after integer, permanent boolean)
+    ),
+    settled AS (
+        UPDATE public.calendar_outbox c
+        SET status = CASE
+                WHEN r.ok THEN 'done'
+                WHEN COALESCE(r.permanent, false) OR c.attempts >= c.max_attempts THEN 'failed'
+                ELSE 'pending'
+            END,
+            -- 5 s, 10 s, 20 s ... capped at 1 h, with jitter; Retry-After wins
+            next_attempt_at = CASE
+                WHEN r.ok THEN c.next_attempt_at
+                WHEN r.retry_after IS NOT NULL THEN NOW() + make_interval(secs => r.retry_after)
+                ELSE NOW() + make_interval(secs => LEAST(5 * power(2, c.attempts - 1), 3600) * (0.5 + random() / 2))
+            END,
+            locked_until = NULL,
+            last_error = CASE WHEN r.ok THEN NULL ELSE left(r.error, 1000) END,
+            processed_at = CASE WHEN r.ok THEN NOW() ELSE c.processed_at END
+        FROM r
+        WHERE c.id = r.id
+          AND c.status = 'processing'
+        RETURNING c.id, c.booking_id, c.operation, r.ok, r.gcal_event_id
+    ),
+    attached AS (
+        UPDATE public.bookings b
+        SET gcal_event_id = s.gcal_event_id
+        FROM settled s
+        WHERE s.ok
+          AND s.operation = 'create'
+          AND s.gcal_event_id IS NOT NULL
+          AND b.id = s.booking_id
+        RETURNING b.id
+    )
+    SELECT COUNT(*) INTO v_settled FROM settled;
+
+    RETURN v_settled;
+END;
+$$;
+
+ALTER FUNCTION public.settle_calendar_outbox(p_results jsonb) OWNER TO neondb_owner;
+
+COMMIT;
@@ -0,0 +1,64 @@
+-- Migration: claim_notifications() - SKIP LOCKED batch claim for notification workers
+-- Date: 2026-10-18
+-- Purpose: BB_05_Notification_Engine (LIMIT 10) and BB_07_Notification_Retry_Worker
+--          (LIMIT 20) read notification_queue with a plain SELECT. Two
+--          overlapping runs got the same rows and sent the same message
+--          twice, so neither workflow could run more than one instance.
+--          claim_notifications() hands out disjoint batches. Each claimed row
+--          is leased to its worker (locked_by / locked_until), and other
+--          claimers skip it until the lease ends.
+--
+-- A worker that dies mid-batch leaves its rows leased. They become
+-- claimable again when locked_until passes (at-least-once delivery).
+-- Status is not changed by the claim. The existing Mark Sent / Mark Retry
+-- updates settle the row and release the lease.
+--
+-- API:
+--   claim_notifications(worker_id, batch_size, lease_seconds, status) -> SETOF notification_queue
+--     status 'pending' (default) for BB_05. 'failed' for BB_07, limited to
+--     rows with retry_count < max_retries.
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_09_claim_notifications.sql
+
+BEGIN;
+
+ALTER TABLE public.notification_queue ADD COLUMN IF NOT EXISTS locked_by text;
+ALTER TABLE public.notification_queue ADD COLUMN IF NOT EXISTS locked_until timestamp with time zone;
+
+-- Claim order for BB_05; the planner walks it and stops after batch_size
+CREATE INDEX IF NOT EXISTS idx_notification_queue_claim
+    ON public.notification_queue USING btree (priority DESC, created_at)
+    WHERE (status = 'pending'::public.notification_status);
+
+
+CREATE OR REPLACE FUNCTION public.claim_notifications(p_worker_id text, p_batch_size integer DEFAULT 10, p_lease_seconds integer DEFAULT 120, p_status public.notification_status DEFAULT 'pending'::public.notification_status) RETURNS SETOF public.notification_queue
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    RETURN QUERY
+    WITH due AS (
+        SELECT n.id
+        FROM public.notification_queue n
+        WHERE n.status = p_status
+          AND (n.next_retry_at IS NULL OR n.next_retry_at <= NOW())
+          AND (n.locked_until IS NULL OR n.locked_until <= NOW())
+          AND (p_status <> 'failed' OR n.retry_count < COALESCE(n.max_retries, 3))
+        ORDER BY n.priority DESC, n.created_at ASC
+        LIMIT p_batch_size
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE public.notification_queue q
+    SET locked_by = p_worker_id,
+        locked_until = NOW() + make_interval(secs => p_lease_seconds)
+    FROM due
+    WHERE q.id = due.id
+    RETURNING q.*;
+END;
+$$;
+
+ALTER FUNCTION public.claim_notifications(p_worker_id text, p_batch_size integer, p_lease_seconds integer, p_status public.notification_status) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.claim_notifications(p_worker_id text, p_batch_size integer, p_lease_seconds integer, p_status public.notification_status) IS 'Claims up to p_batch_size due notifications for one worker (FOR UPDATE SKIP LOCKED + lease). Called by BB_05 and BB_07.';
+
+COMMIT;
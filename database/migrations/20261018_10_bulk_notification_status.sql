@@ -0,0 +1,98 @@
+-- Migration: Set-based status updates for notification batches
+-- Date: 2026-10-18
+-- Purpose: Mark Sent in BB_05_Notification_Engine, and Mark Sent / Mark Retry
+--          in BB_07_Notification_Retry_Worker, ran one
+--          "UPDATE notification_queue ... WHERE id = $1" per message. Each
+--          one cost a round trip and a plpgsql trigger call
+--          (update_notification_queue_timestamp). A claimed batch is now
+--          settled with one statement per outcome.
+--
+-- API:
+--   mark_notifications_sent(ids uuid[]) -> integer
+--   mark_notifications_failed(failures jsonb) -> integer
+--     failures: [{ "id": uuid, "error": text, "retry_after": seconds? }]
+--     retry_count + 1. Once it reaches max_retries the row becomes 'failed'.
+--     Otherwise it goes back to 'pending' and is due after retry_after
+--     (default 300 s, the old BB_07 interval).
+--   Both release the claim lease (locked_by / locked_until).
+--
+-- Retried rows now stay 'pending', and 'failed' only holds exhausted rows.
+-- BB_07 therefore claims due 'pending' rows, as a safety net behind BB_05,
+-- instead of status 'failed'.
+--
+-- The updated_at trigger on notification_queue now has a WHEN clause. Both
+-- functions set updated_at themselves, so the per-row plpgsql call is
+-- skipped for them. Other UPDATEs still get updated_at stamped as before.
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_10_bulk_notification_status.sql
+
+BEGIN;
+
+DROP TRIGGER IF EXISTS trg_notification_queue_update_timestamp ON public.notification_queue;
+
+CREATE TRIGGER trg_notification_queue_update_timestamp
+    BEFORE UPDATE ON public.notification_queue
+    FOR EACH ROW
+    WHEN (NEW.updated_at IS NOT DISTINCT FROM OLD.updated_at)
+    EXECUTE FUNCTION public.update_notification_queue_timestamp();
+
+
+CREATE OR REPLACE FUNCTION public.mark_notifications_sent(p_ids uuid[]) RETURNS integer
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_updated integer;
+BEGIN
+    UPDATE public.notification_queue
+    SET status = 'sent',
+        sent_at = NOW(),
+        updated_at = NOW(),
+        error_message = NULL,
+        locked_by = NULL,
+        locked_until = NULL
+    WHERE id = ANY(p_ids);
+
+    GET DIAGNOSTICS v_updated = ROW_COUNT;
+    RETURN v_updated;
+END;
+$$;
+
+ALTER FUNCTION public.mark_notifications_sent(p_ids uuid[]) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.mark_notifications_sent(p_ids uuid[]) IS 'Marks a batch of notifications as sent in one statement. Called by BB_05, BB_07 and notification_dispatcher.py.';
+
+
+CREATE OR REPLACE FUNCTION public.mark_notifications_failed(p_failures jsonb) RETURNS integer
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_updated integer;
+BEGIN
+    UPDATE public.notification_queue q
+    SET retry_count = q.retry_count + 1,
+        status = CASE
+            WHEN q.retry_count + 1 >= COALESCE(q.max_retries, 3) THEN 'failed'::public.notification_status
+            ELSE 'pending'::public.notification_status
+        END,
+        next_retry_at = CASE
+            WHEN q.retry_count + 1 >= COALESCE(q.max_retries, 3) THEN NULL
+            ELSE NOW() + make_interval(secs => COALESCE(f.retry_after, 300))
+        END,
+        error_message = left(COALESCE(f.error, 'Send failed'), 1000),
+        updated_at = NOW(),
+        locked_by = NULL,
+        locked_until = NULL
+    FROM jsonb_to_recordset(p_failures) AS f(id uuid, error text, retry_after integer)
+    WHERE q.id = f.id;
+
+    GET DIAGNOSTICS v_updated = ROW_COUNT;
+    RETURN v_updated;
+END;
+$$;
+
+ALTER FUNCTION public.mark_notifications_failed(p_failures jsonb) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.mark_notifications_failed(p_failures jsonb) IS 'Records a batch of failed sends in one statement: [{id, error, retry_after}]. Moves rows to failed after max_retries.';
+
+COMMIT;
@@ -0,0 +1,40 @@
+-- Migration: pg_notify on notification_queue inserts
+-- Date: 2026-10-18
+-- Purpose: BB_07_Notification_Retry_Worker ran every minute and BB_05 was
+--          polled. A confirmation could wait up to 60 s in the queue, and
+--          every empty poll was a wasted query. Inserts now signal the
+--          'notification_queue' channel. scripts-py/notification_dispatcher.py
+--          LISTENs on it and drains as soon as a row is committed.
+--
+-- The trigger fires on the table, not inside queue_notification(), so
+-- direct INSERTs are covered too. It is statement-level with an empty
+-- payload. A bulk insert sends one notification, and Postgres merges
+-- duplicate notifications within a transaction. Listeners get it only
+-- after COMMIT, so the rows are visible to claim_notifications().
+--
+-- Polling stays as the safety net, for a missed notification (listener
+-- reconnecting) and for retries whose next_retry_at arrives later.
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_11_notification_queue_notify.sql
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION public.notify_notification_queue() RETURNS trigger
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    PERFORM pg_notify('notification_queue', '');
+    RETURN NULL;
+END;
+$$;
+
+ALTER FUNCTION public.notify_notification_queue() OWNER TO neondb_owner;
+
+DROP TRIGGER IF EXISTS trg_notification_queue_notify ON public.notification_queue;
+
+CREATE TRIGGER trg_notification_queue_notify
+    AFTER INSERT ON public.notification_queue
+    FOR EACH STATEMENT EXECUTE FUNCTION public.notify_notification_queue();
+
+COMMIT;
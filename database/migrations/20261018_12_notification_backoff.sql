@@ -0,0 +1,173 @@
+-- Migration: Per-channel exponential backoff with jitter for notification retries
+-- Date: 2026-10-18
+-- Purpose: mark_notifications_failed() (and the Mark Retry node before it)
+--          rescheduled every failure at NOW() + retry_after, or NOW() + 5 min.
+--          When Telegram rate-limits a burst, every rejected message got the
+--          same retry_after and retried in lockstep. The retry wave hit the
+--          limit again, and most of it burned through max_retries.
+--
+-- Policy:
+--   app_config NOTIFICATION_RETRY_POLICY (json), one entry per channel plus
+--   'default':
+--     { "base_seconds": 30, "factor": 2, "max_seconds": 1800, "jitter": 1 }
+--   backoff = min(max_seconds, base_seconds * factor ^ retry_count)
+--   delay   = retry_after + backoff * (1 - jitter + jitter * random())
+--   With jitter 1 (full jitter) a wave of failures is spread evenly over
+--   [retry_after, retry_after + backoff). Telegram's retry_after is a floor,
+--   never shortened. The chosen delay is stored on the row (backoff_seconds).
+--
+-- Due-time scan:
+--   Pending rows now always carry next_retry_at (DEFAULT NOW(), existing
+--   NULLs backfilled). claim_notifications() filters on
+--   "status = $1 AND next_retry_at <= NOW()", in due-time order. That is one
+--   range scan on idx_notification_queue_due (status, next_retry_at), which
+--   stops after batch_size rows. Rows waiting out a backoff are never read.
+--   The old filter "next_retry_at IS NULL OR next_retry_at <= NOW()" could
+--   not use that index, so the claim walked every future retry.
+--   idx_notification_queue_claim (20261018_09) and the partial
+--   idx_notification_queue_pending are replaced by it.
+--
+-- Since 20261018_10 a retryable failure goes back to 'pending'. Only
+-- exhausted rows are 'failed', so BB_07's claim of 'failed' rows found
+-- nothing. BB_07 now claims due rows like BB_05, as the safety net.
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_12_notification_backoff.sql
+
+BEGIN;
+
+ALTER TABLE public.notification_queue ADD COLUMN IF NOT EXISTS backoff_seconds integer;
+
+COMMENT ON COLUMN public.notification_queue.backoff_seconds IS 'Delay chosen for the scheduled retry (NOTIFICATION_RETRY_POLICY). NULL until the first failure.';
+
+ALTER TABLE public.notification_queue ALTER COLUMN next_retry_at SET DEFAULT NOW();
+
+UPDATE public.notification_queue
+SET next_retry_at = COALESCE(created_at, NOW()),
+    updated_at = updated_at
+WHERE status = 'pending' AND next_retry_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_notification_queue_due
+    ON public.notification_queue USING btree (status, next_retry_at);
+
+DROP INDEX IF EXISTS public.idx_notification_queue_pending;
+DROP INDEX IF EXISTS public.idx_notification_queue_claim;
+
+INSERT INTO public.app_config (key, value, type, category, description, is_public)
+VALUES (
+    'NOTIFICATION_RETRY_POLICY',
+    '{"default": {"base_seconds": 60, "factor": 2, "max_seconds": 3600, "jitter": 0.5}, "telegram": {"base_seconds": 30, "factor": 2, "max_seconds": 1800, "jitter": 1}}',
+    'json',
+    'notifications',
+    'Backoff por canal para reintentos de notification_queue (base_seconds, factor, max_seconds, jitter 0-1)',
+    false
+)
+ON CONFLICT (key) DO NOTHING;
+
+
+CREATE OR REPLACE FUNCTION public.notification_backoff_seconds(p_policy jsonb, p_retry_count integer, p_retry_after integer DEFAULT NULL) RETURNS integer
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+    v_base numeric := COALESCE((p_policy->>'base_seconds')::numeric, 60);
+    v_factor numeric := COALESCE((p_policy->>'factor')::numeric, 2);
+    v_cap numeric := COALESCE((p_policy->>'max_seconds')::numeric, 3600);
+    v_jitter numeric := LEAST(GREATEST(COALESCE((p_policy->>'jitter')::numeric, 1), 0), 1);
+    v_backoff numeric;
+BEGIN
+    v_backoff := LEAST(v_cap, v_base * power(v_factor, LEAST(GREATEST(p_retry_count, 0), 30)));
+    RETURN GREATEST(
+        1,
+        ceil(COALESCE(p_retry_after, 0) + v_backoff * (1 - v_jitter + v_jitter * random()::numeric))
+    )::integer;
+END;
+$$;
+
+ALTER FUNCTION public.notification_backoff_seconds(p_policy jsonb, p_retry_count integer, p_retry_after integer) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.notification_backoff_seconds(p_policy jsonb, p_retry_count integer, p_retry_after integer) IS 'Jittered exponential retry delay in seconds for one channel policy. retry_after (Telegram 429) is a lower bound.';
+
+
+CREATE OR REPLACE FUNCTION public.mark_notifications_failed(p_failures jsonb) RETURNS integer
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_policies jsonb;
+    v_updated integer;
+BEGIN
+    -- Read once per batch, not per row
+    SELECT value::jsonb INTO v_policies
+    FROM public.app_config
+    WHERE key = 'NOTIFICATION_RETRY_POLICY';
+    v_policies := COALESCE(v_policies, '{}'::jsonb);
+
+    WITH f AS (
+        SELECT f.id, f.error, public.notification_backoff_seconds(
+                   COALESCE(v_policies->(q.channel::text), v_policies->'default', '{}'::jsonb),
+                   q.retry_count,
+                   f.retry_after
+               ) AS backoff
+        FROM jsonb_to_recordset(p_failures) AS f(id uuid, error text, retry_after integer)
+        JOIN public.notification_queue q ON q.id = f.id
+    )
+    UPDATE public.notification_queue q
+    SET retry_count = q.retry_count + 1,
+        status = CASE
+            WHEN q.retry_count + 1 >= COALESCE(q.max_retries, 3) THEN 'failed'::public.notification_status
+            ELSE 'pending'::public.notification_status
+        END,
+        next_retry_at = CASE
+            WHEN q.retry_count + 1 >= COALESCE(q.max_retries, 3) THEN NULL
+            ELSE NOW() + make_interval(secs => f.backoff)
+        END,
+        backoff_seconds = CASE
+            WHEN q.retry_count + 1 >= COALESCE(q.max_retries, 3) THEN NULL
+            ELSE f.backoff
+        END,
+        error_message = left(COALESCE(f.error, 'Send failed'), 1000),
+        updated_at = NOW(),
+        locked_by = NULL,
+        locked_until = NULL
+    FROM f
+    WHERE q.id = f.id;
+
+    GET DIAGNOSTICS v_updated = ROW_COUNT;
+    RETURN v_updated;
+END;
+$$;
+
+ALTER FUNCTION public.mark_notifications_failed(p_failures jsonb) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.mark_notifications_failed(p_failures jsonb) IS 'Records a batch of failed sends in one statement: [{id, error, retry_after}]. Reschedules with the channel backoff policy; moves rows to failed after max_retries.';
+
+
+CREATE OR REPLACE FUNCTION public.claim_notifications(p_worker_id text, p_batch_size integer DEFAULT 10, p_lease_seconds integer DEFAULT 120, p_status public.notification_status DEFAULT 'pending'::public.notification_status) RETURNS SETOF public.notification_queue
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    RETURN QUERY
+    WITH due AS (
+        SELECT n.id
+        FROM public.notification_queue n
+        WHERE n.status = p_status
+          AND n.next_retry_at <= NOW()
+          AND (n.locked_until IS NULL OR n.locked_until <= NOW())
+          AND (p_status <> 'failed' OR n.retry_count < COALESCE(n.max_retries, 3))
+        ORDER BY n.next_retry_at ASC
+        LIMIT p_batch_size
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE public.notification_queue q
+    SET locked_by = p_worker_id,
+        locked_until = NOW() + make_interval(secs => p_lease_seconds)
+    FROM due
+    WHERE q.id = due.id
+    RETURNING q.*;
+END;
+$$;
+
+ALTER FUNCTION public.claim_notifications(p_worker_id text, p_batch_size integer, p_lease_seconds integer, p_status public.notification_status) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.claim_notifications(p_worker_id text, p_batch_size integer, p_lease_seconds integer, p_status public.notification_status) IS 'Claims up to p_batch_size due notifications (next_retry_at <= NOW(), oldest first) for one worker (FOR UPDATE SKIP LOCKED + lease). Called by BB_05, BB_07 and notification_dispatcher.py.';
+
+COMMIT;
@@ -0,0 +1,166 @@
+-- Migration: notification_dead_letter - move exhausted notifications out of the hot queue
+-- Date: 2026-10-18
+-- Purpose: A notification that used up max_retries stayed in notification_queue
+--          as 'failed' forever. Every index on the queue carried it
+--          (idx_notification_queue_due, idx_notification_queue_priority,
+--          created_at, booking_id), so the claim and retry scans stepped over
+--          a growing pile of rows that would never be sent. Those rows now
+--          move to notification_dead_letter, and the queue keeps only live
+--          and recently sent rows.
+--
+-- API:
+--   mark_notifications_failed(failures jsonb) -> integer
+--     As in 20261018_12. An exhausted row is moved to the dead letter table
+--     in the same statement, instead of being set to 'failed'.
+--   move_dead_notifications(limit) -> integer
+--     Sweeps 'failed' rows still written by the legacy per-row
+--     mark_notification_failed(). NULL limit = all (used once below).
+--
+-- Inspecting, exporting and requeueing dead letters:
+--   python scripts-py/notification_dead_letters.py --help
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_13_notification_dead_letter.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.notification_dead_letter (
+    id uuid NOT NULL,
+    booking_id uuid,
+    user_id uuid,
+    message text NOT NULL,
+    priority integer DEFAULT 0,
+    retry_count integer DEFAULT 0,
+    max_retries integer DEFAULT 3,
+    error_message text,
+    channel character varying(50) DEFAULT 'telegram'::character varying,
+    recipient text,
+    payload jsonb DEFAULT '{}'::jsonb,
+    created_at timestamp with time zone,
+    last_attempt_at timestamp with time zone,
+    dead_at timestamp with time zone DEFAULT now() NOT NULL,
+    CONSTRAINT notification_dead_letter_pkey PRIMARY KEY (id)
+);
+
+ALTER TABLE public.notification_dead_letter OWNER TO neondb_owner;
+
+COMMENT ON TABLE public.notification_dead_letter IS 'Notifications that exhausted max_retries, moved out of notification_queue. Requeue with scripts-py/notification_dead_letters.py.';
+
+CREATE INDEX IF NOT EXISTS idx_notification_dead_letter_dead_at
+    ON public.notification_dead_letter USING btree (dead_at DESC);
+
+CREATE INDEX IF NOT EXISTS idx_notification_dead_letter_channel
+    ON public.notification_dead_letter USING btree (channel, dead_at DESC);
+
+
+CREATE OR REPLACE FUNCTION public.mark_notifications_failed(p_failures jsonb) RETURNS integer
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_policies jsonb;
+    v_updated integer;
+BEGIN
+    -- Read once per batch, not per row
+    SELECT value::jsonb INTO v_policies
+    FROM public.app_config
+    WHERE key = 'NOTIFICATION_RETRY_POLICY';
+    v_policies := COALESCE(v_policies, '{}'::jsonb);
+
+    WITH f AS (
+        SELECT f.id,
+               left(COALESCE(f.error, 'Send failed'), 1000) AS error,
+               q.retry_count + 1 >= COALESCE(q.max_retries, 3) AS exhausted,
+               public.notification_backoff_seconds(
+                   COALESCE(v_policies->(q.channel::text), v_policies->'default', '{}'::jsonb),
+                   q.retry_count,
+                   f.retry_after
+               ) AS backoff
+        FROM jsonb_to_recordset(p_failures) AS f(id uuid, error text, retry_after integer)
+        JOIN public.notification_queue q ON q.id = f.id
+    ),
+    dead AS (
+        DELETE FROM public.notification_queue q
+        USING f
+        WHERE q.id = f.id AND f.exhausted
+        RETURNING q.*, f.error AS last_error
+    ),
+    buried AS (
+        INSERT INTO public.notification_dead_letter (
+            id, booking_id, user_id, message, priority, retry_count, max_retries,
+            error_message, channel, recipient, payload, created_at, last_attempt_at
+        )
+        SELECT id, booking_id, user_id, message, priority, retry_count + 1, max_retries,
+               last_error, channel, recipient, payload, created_at, NOW()
+        FROM dead
+        ON CONFLICT (id) DO NOTHING
+        RETURNING 1
+    ),
+    retried AS (
+        UPDATE public.notification_queue q
+        SET retry_count = q.retry_count + 1,
+            status = 'pending'::public.notification_status,
+            next_retry_at = NOW() + make_interval(secs => f.backoff),
+            backoff_seconds = f.backoff,
+            error_message = f.error,
+            updated_at = NOW(),
+            locked_by = NULL,
+            locked_until = NULL
+        FROM f
+        WHERE q.id = f.id AND NOT f.exhausted
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM dead) + (SELECT COUNT(*) FROM retried) INTO v_updated;
+
+    RETURN v_updated;
+END;
+$$;
+
+ALTER FUNCTION public.mark_notifications_failed(p_failures jsonb) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.mark_notifications_failed(p_failures jsonb) IS 'Records a batch of failed sends in one statement: [{id, error, retry_after}]. Reschedules with the channel backoff policy; moves rows that exhausted max_retries to notification_dead_letter.';
+
+
+CREATE OR REPLACE FUNCTION public.move_dead_notifications(p_limit integer DEFAULT 1000) RETURNS integer
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_moved integer;
+BEGIN
+    -- The pick is a separate CTE so LIMIT ... SKIP LOCKED runs exactly once
+    WITH picked AS (
+        SELECT n.id
+        FROM public.notification_queue n
+        WHERE n.status = 'failed'
+        ORDER BY n.updated_at
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    ),
+    dead AS (
+        DELETE FROM public.notification_queue q
+        USING picked
+        WHERE q.id = picked.id
+        RETURNING q.*
+    )
+    INSERT INTO public.notification_dead_letter (
+        id, booking_id, user_id, message, priority, retry_count, max_retries,
+        error_message, channel, recipient, payload, created_at, last_attempt_at
+    )
+    SELECT id, booking_id, user_id, message, priority, retry_count, max_retries,
+           error_message, channel, recipient, payload, created_at, COALESCE(updated_at, NOW())
+    FROM dead
+    ON CONFLICT (id) DO NOTHING;
+
+    GET DIAGNOSTICS v_moved = ROW_COUNT;
+    RETURN v_moved;
+END;
+$$;
+
+ALTER FUNCTION public.move_dead_notifications(p_limit integer) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.move_dead_notifications(p_limit integer) IS 'Moves up to p_limit failed notifications (oldest first) from notification_queue to notification_dead_letter. NULL = all.';
+
+
+-- Existing backlog
+SELECT public.move_dead_notifications(NULL);
+
+COMMIT;
@@ -0,0 +1,86 @@
+-- Migration: claim_notification_digests() - coalesce pending notifications per recipient
+-- Date: 2026-10-18
+-- Purpose: When a provider cancels a day, the workflow queues one notification
+--          per booking, and BB_05 sent each one as a separate Telegram
+--          message to the same chat. A 200-booking cancellation was 200
+--          sendMessage calls to one chat. Telegram's per-chat limit is about
+--          1 msg/s, so most of them came back 429.
+--          claim_notification_digests() claims whole (channel, recipient)
+--          groups, and the workers send each group as one digest message
+--          (split only at Telegram's 4096-character limit).
+--
+-- Window (debounce):
+--   A group is claimed once its newest due row is p_window_seconds old, so
+--   a burst that is still being queued is not cut in half. A group that
+--   keeps receiving rows is released anyway once its oldest row is
+--   4 * p_window_seconds old. Retries (old created_at) are never held.
+--   p_window_seconds = 0 claims every due group immediately.
+--
+-- API:
+--   claim_notification_digests(worker_id, digests, lease_seconds, window_seconds)
+--     -> SETOF notification_queue, ordered by channel, recipient, created_at
+--   Up to p_digests groups, each with all of its due, unleased rows (rows
+--   leased by another worker are skipped). Rows are leased like
+--   claim_notifications(). A digest is settled by passing all of its ids to
+--   mark_notifications_sent(), or one failure per id to
+--   mark_notifications_failed().
+--   Rows with a NULL recipient form one group per channel (BB_05 sends those
+--   to the admin chat).
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_14_notification_digests.sql
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION public.claim_notification_digests(p_worker_id text, p_digests integer DEFAULT 10, p_lease_seconds integer DEFAULT 120, p_window_seconds integer DEFAULT 5) RETURNS SETOF public.notification_queue
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    RETURN QUERY
+    WITH due AS (
+        -- Range scan on idx_notification_queue_due; bounded so a huge
+        -- backlog is grouped a slice at a time
+        SELECT n.id, n.channel, n.recipient, n.created_at, n.next_retry_at
+        FROM public.notification_queue n
+        WHERE n.status = 'pending'
+          AND n.next_retry_at <= NOW()
+          AND (n.locked_until IS NULL OR n.locked_until <= NOW())
+        ORDER BY n.next_retry_at ASC
+        LIMIT p_digests * 500
+    ),
+    groups AS (
+        SELECT d.channel, d.recipient
+        FROM due d
+        GROUP BY d.channel, d.recipient
+        HAVING MAX(d.created_at) <= NOW() - make_interval(secs => p_window_seconds)
+            OR MIN(d.created_at) <= NOW() - make_interval(secs => 4 * p_window_seconds)
+        ORDER BY MIN(d.next_retry_at)
+        LIMIT p_digests
+    ),
+    picked AS (
+        SELECT n.id
+        FROM public.notification_queue n
+        JOIN due d ON d.id = n.id
+        JOIN groups g ON g.channel IS NOT DISTINCT FROM d.channel
+                     AND g.recipient IS NOT DISTINCT FROM d.recipient
+        FOR UPDATE OF n SKIP LOCKED
+    ),
+    leased AS (
+        UPDATE public.notification_queue q
+        SET locked_by = p_worker_id,
+            locked_until = NOW() + make_interval(secs => p_lease_seconds)
+        FROM picked
+        WHERE q.id = picked.id
+        RETURNING q.*
+    )
+    SELECT *
+    FROM leased
+    ORDER BY leased.channel, leased.recipient, leased.created_at;
+END;
+$$;
+
+ALTER FUNCTION public.claim_notification_digests(p_worker_id text, p_digests integer, p_lease_seconds integer, p_window_seconds integer) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.claim_notification_digests(p_worker_id text, p_digests integer, p_lease_seconds integer, p_window_seconds integer) IS 'Claims up to p_digests (channel, recipient) groups of due notifications, each quiet for p_window_seconds, for one digest message per group. Called by BB_05, BB_07 and notification_dispatcher.py.';
+
+COMMIT;
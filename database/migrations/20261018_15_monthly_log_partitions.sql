@@ -0,0 +1,492 @@
+-- Migration: monthly range partitions for error_logs, audit_logs and notification history
+-- Date: 2026-10-18
+-- Purpose: error_handling.cleanup_old_errors() and cleanup_old_notifications()
+--          expired rows with DELETE ... WHERE created_at < ... . On a busy
+--          month that is a long scan that leaves dead tuples for VACUUM and
+--          competes with BB_00's inserts. The log tables are now partitioned
+--          by month, so an expired month is removed with DROP TABLE, which
+--          is instant and leaves no bloat:
+--            error_handling.error_logs     (converted in place, data copied)
+--            public.audit_logs             (converted in place, data copied)
+--            public.notification_history   (new; sent rows archived from
+--                                           notification_queue)
+--          notification_queue itself stays a small, unpartitioned hot queue.
+--
+-- Layout:
+--   <table>_pYYYYMM  one partition per UTC calendar month, on created_at
+--   <table>_default  catches rows no partition covers, so a missed
+--                    maintenance run never fails an INSERT. The next
+--                    create_monthly_partitions() moves those rows into the
+--                    new month's partition.
+--   Indexes are defined on the parent table, so every partition gets its own
+--   copy (idx_error_logs_created_at, idx_audit_logs_timestamp, ...). Queries
+--   with a created_at bound only scan the matching months.
+--   Primary keys become (id, created_at), because a partitioned table's
+--   unique keys must include the partition key. ids are still unique.
+--
+-- API:
+--   create_monthly_partitions(parent, months_ahead) -> integer
+--     Creates the partitions from the current month through months_ahead.
+--   drop_monthly_partitions(parent, before) -> integer
+--     Drops every partition that ends at or before `before`.
+--   archive_sent_notifications(older_than_seconds, limit) -> integer
+--     Moves 'sent' rows from notification_queue to notification_history.
+--   error_handling.cleanup_old_errors(days)   (same signature as before)
+--     Drops expired months that have no unresolved errors. A month that
+--     still has unresolved errors is kept, and only its resolved rows are
+--     deleted, as before.
+--   cleanup_old_notifications(days)           (same signature as before)
+--     Archives sent rows, then drops notification_history months past `days`.
+--   maintain_partitions() -> TABLE(parent, created, dropped)
+--     Runs all of the above with app_config.PARTITION_RETENTION. Run it
+--     daily, e.g.:
+--       psql "$DATABASE_URL" -c "SELECT * FROM public.maintain_partitions()"
+--
+-- Retention is by whole months: a row is removed once the whole month it
+-- falls in is older than the retention, so rows live between `days` and
+-- `days` + 1 month. audit_logs has no retention by default.
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_15_monthly_log_partitions.sql
+
+BEGIN;
+
+-- ============================================================================
+-- Partition helpers
+-- ============================================================================
+
+CREATE OR REPLACE FUNCTION public.create_monthly_partitions(p_parent regclass, p_months_ahead integer DEFAULT 3) RETURNS integer
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_schema text;
+    v_table text;
+    v_default regclass;
+    v_month timestamp;
+    v_from timestamptz;
+    v_to timestamptz;
+    v_name text;
+    v_created integer := 0;
+BEGIN
+    SELECT n.nspname, c.relname INTO v_schema, v_table
+    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.oid = p_parent;
+
+    v_default := to_regclass(format('%I.%I', v_schema, v_table || '_default'));
+
+    FOR i IN 0..p_months_ahead LOOP
+        v_month := date_trunc('month', (NOW() AT TIME ZONE 'UTC')) + make_interval(months => i);
+        v_name := v_table || '_p' || to_char(v_month, 'YYYYMM');
+        CONTINUE WHEN to_regclass(format('%I.%I', v_schema, v_name)) IS NOT NULL;
+
+        -- Month boundaries in UTC, whatever the session time zone
+        v_from := v_month AT TIME ZONE 'UTC';
+        v_to := (v_month + INTERVAL '1 month') AT TIME ZONE 'UTC';
+
+        -- Built standalone and attached, so rows that landed in the default
+        -- partition can be moved in first (ATTACH refuses while the default
+        -- still holds rows of the new range)
+        EXECUTE format('CREATE TABLE %I.%I (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', v_schema, v_name, p_parent);
+        IF v_default IS NOT NULL THEN
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM %s WHERE created_at >= $1 AND created_at < $2 RETURNING *) '
+                'INSERT INTO %I.%I SELECT * FROM moved',
+                v_default, v_schema, v_name
+            ) USING v_from, v_to;
+        END IF;
+        EXECUTE format('ALTER TABLE %s ATTACH PARTITION %I.%I FOR VALUES FROM (%L) TO (%L)', p_parent, v_schema, v_name, v_from, v_to);
+        v_created := v_created + 1;
+    END LOOP;
+
+    RETURN v_created;
+END;
+$$;
+
+ALTER FUNCTION public.create_monthly_partitions(p_parent regclass, p_months_ahead integer) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.create_monthly_partitions(p_parent regclass, p_months_ahead integer) IS 'Creates the monthly created_at partitions of p_parent from the current UTC month through p_months_ahead, moving matching rows out of the default partition. Returns the number created.';
+
+
+-- Partitions of p_parent with their upper bound (NULL for the default)
+CREATE OR REPLACE FUNCTION public.monthly_partitions(p_parent regclass) RETURNS TABLE(partition_table regclass, range_end timestamp with time zone)
+    LANGUAGE sql STABLE
+    AS $$
+    SELECT c.oid::regclass,
+           (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \(''([^'']+)''\)'))[1]::timestamptz
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = p_parent
+    ORDER BY 2 NULLS LAST;
+$$;
+
+ALTER FUNCTION public.monthly_partitions(p_parent regclass) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.monthly_partitions(p_parent regclass) IS 'Lists the partitions of p_parent and the end of each range (NULL = default partition).';
+
+
+CREATE OR REPLACE FUNCTION public.drop_monthly_partitions(p_parent regclass, p_before timestamp with time zone) RETURNS integer
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    r record;
+    v_dropped integer := 0;
+BEGIN
+    FOR r IN SELECT * FROM public.monthly_partitions(p_parent) WHERE range_end <= p_before LOOP
+        EXECUTE format('DROP TABLE %s', r.partition_table);
+        v_dropped := v_dropped + 1;
+    END LOOP;
+    RETURN v_dropped;
+END;
+$$;
+
+ALTER FUNCTION public.drop_monthly_partitions(p_parent regclass, p_before timestamp with time zone) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.drop_monthly_partitions(p_parent regclass, p_before timestamp with time zone) IS 'Drops the monthly partitions of p_parent that end at or before p_before. Returns the number dropped.';
+
+
+-- Partitions for every month that has rows, through three months ahead
+CREATE OR REPLACE FUNCTION pg_temp.create_partitions_since(p_parent regclass, p_since timestamptz) RETURNS void
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+    v_schema text;
+    v_table text;
+    v_month timestamp;
+BEGIN
+    SELECT n.nspname, c.relname INTO v_schema, v_table
+    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.oid = p_parent;
+
+    v_month := date_trunc('month', COALESCE(p_since, NOW()) AT TIME ZONE 'UTC');
+    WHILE v_month < date_trunc('month', NOW() AT TIME ZONE 'UTC') LOOP
+        EXECUTE format(
+            'CREATE TABLE %I.%I PARTITION OF %s FOR VALUES FROM (%L) TO (%L)',
+            v_schema, v_table || '_p' || to_char(v_month, 'YYYYMM'), p_parent,
+            v_month AT TIME ZONE 'UTC', (v_month + INTERVAL '1 month') AT TIME ZONE 'UTC'
+        );
+        EXECUTE format('ALTER TABLE %I.%I OWNER TO neondb_owner', v_schema, v_table || '_p' || to_char(v_month, 'YYYYMM'));
+        v_month := v_month + INTERVAL '1 month';
+    END LOOP;
+    PERFORM public.create_monthly_partitions(p_parent, 3);
+    EXECUTE format('CREATE TABLE %I.%I PARTITION OF %s DEFAULT', v_schema, v_table || '_default', p_parent);
+    EXECUTE format('ALTER TABLE %I.%I OWNER TO neondb_owner', v_schema, v_table || '_default');
+END;
+$$;
+
+
+-- ============================================================================
+-- error_handling.error_logs
+-- ============================================================================
+
+LOCK TABLE error_handling.error_logs IN ACCESS EXCLUSIVE MODE;
+
+UPDATE error_handling.error_logs SET created_at = COALESCE(updated_at, NOW()) WHERE created_at IS NULL;
+
+ALTER TABLE error_handling.error_logs RENAME TO error_logs_unpartitioned;
+-- Keep the sequence (and its position) when the old table is dropped
+ALTER SEQUENCE error_handling.error_logs_id_seq OWNED BY NONE;
+
+CREATE TABLE error_handling.error_logs (
+    id bigint DEFAULT nextval('error_handling.error_logs_id_seq'::regclass) NOT NULL,
+    workflow_name character varying(255) NOT NULL,
+    error_type character varying(100) NOT NULL,
+    error_message text NOT NULL,
+    error_fingerprint character varying(64),
+    severity character varying(20) DEFAULT 'MEDIUM'::character varying,
+    occurrences integer DEFAULT 1,
+    metadata jsonb DEFAULT '{}'::jsonb,
+    input_data jsonb,
+    stack_trace text,
+    user_id character varying(100),
+    session_id character varying(100),
+    environment character varying(50) DEFAULT 'production'::character varying,
+    resolved boolean DEFAULT false,
+    resolved_at timestamp with time zone,
+    resolved_by character varying(100),
+    created_at timestamp with time zone DEFAULT now() NOT NULL,
+    updated_at timestamp with time zone DEFAULT now()
+) PARTITION BY RANGE (created_at);
+
+ALTER TABLE error_handling.error_logs OWNER TO neondb_owner;
+
+ALTER SEQUENCE error_handling.error_logs_id_seq OWNED BY error_handling.error_logs.id;
+
+SELECT pg_temp.create_partitions_since('error_handling.error_logs', (SELECT MIN(created_at) FROM error_handling.error_logs_unpartitioned));
+
+INSERT INTO error_handling.error_logs SELECT * FROM error_handling.error_logs_unpartitioned;
+
+-- The view is bound to the old table; recreated unchanged below
+DROP VIEW error_handling.v_recurring_errors;
+DROP TABLE error_handling.error_logs_unpartitioned;
+
+ALTER TABLE error_handling.error_logs
+    ADD CONSTRAINT error_logs_pkey PRIMARY KEY (id, created_at);
+
+CREATE INDEX idx_error_logs_created_at ON error_handling.error_logs USING btree (created_at DESC);
+CREATE INDEX idx_error_logs_environment ON error_handling.error_logs USING btree (environment, created_at DESC);
+CREATE INDEX idx_error_logs_fingerprint ON error_handling.error_logs USING btree (error_fingerprint, created_at DESC) WHERE (error_fingerprint IS NOT NULL);
+CREATE INDEX idx_error_logs_high_severity ON error_handling.error_logs USING btree (created_at DESC) WHERE (((severity)::text = ANY ((ARRAY['HIGH'::character varying, 'CRITICAL'::character varying])::text[])) AND (resolved = false));
+CREATE INDEX idx_error_logs_recurrence ON error_handling.error_logs USING btree (workflow_name, error_type, created_at DESC);
+CREATE INDEX idx_error_logs_unresolved ON error_handling.error_logs USING btree (workflow_name, created_at DESC) WHERE (resolved = false);
+
+CREATE TRIGGER trg_error_logs_updated_at BEFORE UPDATE ON error_handling.error_logs FOR EACH ROW EXECUTE FUNCTION error_handling.update_updated_at();
+
+GRANT SELECT,INSERT,DELETE,UPDATE ON TABLE error_handling.error_logs TO n8n_user;
+
+CREATE VIEW error_handling.v_recurring_errors AS
+ SELECT workflow_name,
+    error_type,
+    error_fingerprint,
+    severity,
+    count(*) AS occurrence_count,
+    max(created_at) AS last_occurrence,
+    min(created_at) AS first_occurrence,
+    array_agg(DISTINCT environment) AS environments,
+        CASE
+            WHEN (count(*) >= 20) THEN 'CRITICAL'::text
+            WHEN (count(*) >= 10) THEN 'HIGH'::text
+            WHEN (count(*) >= 3) THEN 'MEDIUM'::text
+            ELSE 'LOW'::text
+        END AS suggested_severity
+   FROM error_handling.error_logs el
+  WHERE ((created_at > (now() - '00:10:00'::interval)) AND (resolved = false))
+  GROUP BY workflow_name, error_type, error_fingerprint, severity
+ HAVING (count(*) >= 3);
+
+ALTER VIEW error_handling.v_recurring_errors OWNER TO neondb_owner;
+
+GRANT SELECT,INSERT,DELETE,UPDATE ON TABLE error_handling.v_recurring_errors TO n8n_user;
+
+
+CREATE OR REPLACE FUNCTION error_handling.cleanup_old_errors(p_days_to_keep integer DEFAULT 30) RETURNS integer
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_cutoff timestamptz := NOW() - make_interval(days => p_days_to_keep);
+    v_deleted_count INTEGER := 0;
+    v_rows INTEGER;
+    v_unresolved BOOLEAN;
+    r record;
+BEGIN
+    FOR r IN
+        SELECT * FROM public.monthly_partitions('error_handling.error_logs')
+        WHERE range_end <= v_cutoff OR range_end IS NULL
+    LOOP
+        v_unresolved := TRUE;
+        IF r.range_end IS NOT NULL THEN
+            EXECUTE format('SELECT EXISTS (SELECT 1 FROM %s WHERE resolved = false)', r.partition_table) INTO v_unresolved;
+        END IF;
+
+        IF v_unresolved THEN
+            -- Unresolved errors never expire: delete the resolved rows as before
+            EXECUTE format('DELETE FROM %s WHERE created_at < $1 AND resolved = TRUE', r.partition_table) USING v_cutoff;
+            GET DIAGNOSTICS v_rows = ROW_COUNT;
+        ELSE
+            EXECUTE format('SELECT COUNT(*) FROM %s', r.partition_table) INTO v_rows;
+            EXECUTE format('DROP TABLE %s', r.partition_table);
+        END IF;
+        v_deleted_count := v_deleted_count + v_rows;
+    END LOOP;
+
+    RETURN v_deleted_count;
+END;
+$$;
+
+ALTER FUNCTION error_handling.cleanup_old_errors(p_days_to_keep integer) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION error_handling.cleanup_old_errors(p_days_to_keep integer) IS 'Removes resolved errors older than p_days_to_keep by dropping whole expired months; months that still hold unresolved errors only lose their resolved rows. Returns rows removed.';
+
+
+-- ============================================================================
+-- public.audit_logs
+-- ============================================================================
+
+LOCK TABLE public.audit_logs IN ACCESS EXCLUSIVE MODE;
+
+UPDATE public.audit_logs SET created_at = NOW() WHERE created_at IS NULL;
+
+ALTER TABLE public.audit_logs RENAME TO audit_logs_unpartitioned;
+
+CREATE TABLE public.audit_logs (
+    id uuid DEFAULT public.uuid_generate_v4() NOT NULL,
+    table_name text NOT NULL,
+    record_id uuid NOT NULL,
+    action public.audit_action NOT NULL,
+    old_values jsonb,
+    new_values jsonb,
+    performed_by text DEFAULT 'system'::text,
+    ip_address inet,
+    created_at timestamp with time zone DEFAULT now() NOT NULL,
+    event_type text,
+    event_data jsonb
+) PARTITION BY RANGE (created_at);
+
+ALTER TABLE public.audit_logs OWNER TO neondb_owner;
+
+COMMENT ON TABLE public.audit_logs IS 'Audit trail for all critical operations. Tracks INSERT, UPDATE, SOFT_DELETE, HARD_DELETE, and security events. Partitioned by month on created_at (20261018_15).';
+
+SELECT pg_temp.create_partitions_since('public.audit_logs', (SELECT MIN(created_at) FROM public.audit_logs_unpartitioned));
+
+INSERT INTO public.audit_logs SELECT * FROM public.audit_logs_unpartitioned;
+
+DROP TABLE public.audit_logs_unpartitioned;
+
+ALTER TABLE public.audit_logs
+    ADD CONSTRAINT audit_logs_pkey PRIMARY KEY (id, created_at);
+
+CREATE INDEX idx_audit_logs_timestamp ON public.audit_logs USING btree (created_at DESC);
+
+
+-- ============================================================================
+-- public.notification_history
+-- ============================================================================
+
+CREATE TABLE IF NOT EXISTS public.notification_history (
+    id uuid NOT NULL,
+    booking_id uuid,
+    user_id uuid,
+    message text NOT NULL,
+    priority integer DEFAULT 0,
+    retry_count integer DEFAULT 0,
+    error_message text,
+    channel character varying(50) DEFAULT 'telegram'::character varying,
+    recipient text,
+    payload jsonb DEFAULT '{}'::jsonb,
+    created_at timestamp with time zone NOT NULL,
+    sent_at timestamp with time zone,
+    archived_at timestamp with time zone DEFAULT now() NOT NULL,
+    CONSTRAINT notification_history_pkey PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+ALTER TABLE public.notification_history OWNER TO neondb_owner;
+
+COMMENT ON TABLE public.notification_history IS 'Sent notifications archived from notification_queue by archive_sent_notifications(). Partitioned by month on created_at; expired by cleanup_old_notifications().';
+
+CREATE INDEX IF NOT EXISTS idx_notification_history_created_at
+    ON public.notification_history USING btree (created_at DESC);
+
+CREATE INDEX IF NOT EXISTS idx_notification_history_booking_id
+    ON public.notification_history USING btree (booking_id);
+
+SELECT pg_temp.create_partitions_since(
+    'public.notification_history',
+    (SELECT MIN(COALESCE(created_at, sent_at)) FROM public.notification_queue WHERE status = 'sent')
+);
+
+
+CREATE OR REPLACE FUNCTION public.archive_sent_notifications(p_older_than_seconds integer DEFAULT 3600, p_limit integer DEFAULT 5000) RETURNS integer
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_moved integer;
+BEGIN
+    WITH picked AS (
+        SELECT n.id
+        FROM public.notification_queue n
+        WHERE n.status = 'sent'
+          AND COALESCE(n.sent_at, n.updated_at) <= NOW() - make_interval(secs => p_older_than_seconds)
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    ),
+    sent AS (
+        DELETE FROM public.notification_queue q
+        USING picked
+        WHERE q.id = picked.id
+        RETURNING q.*
+    )
+    INSERT INTO public.notification_history (
+        id, booking_id, user_id, message, priority, retry_count, error_message,
+        channel, recipient, payload, created_at, sent_at
+    )
+    SELECT id, booking_id, user_id, message, priority, retry_count, error_message,
+           channel, recipient, payload, COALESCE(created_at, sent_at, NOW()), sent_at
+    FROM sent
+    ON CONFLICT DO NOTHING;
+
+    GET DIAGNOSTICS v_moved = ROW_COUNT;
+    RETURN v_moved;
+END;
+$$;
+
+ALTER FUNCTION public.archive_sent_notifications(p_older_than_seconds integer, p_limit integer) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.archive_sent_notifications(p_older_than_seconds integer, p_limit integer) IS 'Moves up to p_limit notifications sent more than p_older_than_seconds ago from notification_queue to notification_history. NULL limit = all.';
+
+
+CREATE OR REPLACE FUNCTION public.cleanup_old_notifications(p_days_to_keep integer DEFAULT 30) RETURNS integer
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_deleted_count integer;
+BEGIN
+    v_deleted_count := public.archive_sent_notifications(3600, NULL);
+    PERFORM public.drop_monthly_partitions('public.notification_history', NOW() - make_interval(days => p_days_to_keep));
+    RETURN v_deleted_count;
+END;
+$$;
+
+ALTER FUNCTION public.cleanup_old_notifications(p_days_to_keep integer) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.cleanup_old_notifications(p_days_to_keep integer) IS 'Archives sent notifications to notification_history and drops history months older than p_days_to_keep. Returns rows removed from notification_queue.';
+
+
+-- ============================================================================
+-- Scheduled maintenance
+-- ============================================================================
+
+INSERT INTO public.app_config (key, value, type, category, description, is_public)
+VALUES (
+    'PARTITION_RETENTION',
+    '{"months_ahead": 3, "retention_days": {"error_handling.error_logs": 30, "public.audit_logs": null, "public.notification_history": 30}}',
+    'json',
+    'maintenance',
+    'Particiones mensuales: meses creados por adelantado y días de retención por tabla (null = sin retención)',
+    false
+)
+ON CONFLICT (key) DO NOTHING;
+
+
+CREATE OR REPLACE FUNCTION public.maintain_partitions() RETURNS TABLE(parent text, created integer, dropped integer)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_config jsonb;
+    v_ahead integer;
+    v_days integer;
+    v_before integer;
+BEGIN
+    SELECT value::jsonb INTO v_config
+    FROM public.app_config
+    WHERE key = 'PARTITION_RETENTION';
+    v_config := COALESCE(v_config, '{}'::jsonb);
+    v_ahead := COALESCE((v_config->>'months_ahead')::integer, 3);
+
+    PERFORM public.archive_sent_notifications(3600, NULL);
+
+    FOREACH parent IN ARRAY ARRAY['error_handling.error_logs', 'public.audit_logs', 'public.notification_history'] LOOP
+        created := public.create_monthly_partitions(parent::regclass, v_ahead);
+        v_days := (v_config->'retention_days'->>parent)::integer;
+        dropped := 0;
+        IF v_days IS NOT NULL THEN
+            SELECT COUNT(*) INTO v_before FROM public.monthly_partitions(parent::regclass);
+            IF parent = 'error_handling.error_logs' THEN
+                PERFORM error_handling.cleanup_old_errors(v_days);
+            ELSE
+                PERFORM public.drop_monthly_partitions(parent::regclass, NOW() - make_interval(days => v_days));
+            END IF;
+            SELECT v_before - COUNT(*) INTO dropped FROM public.monthly_partitions(parent::regclass);
+        END IF;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$;
+
+ALTER FUNCTION public.maintain_partitions() OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.maintain_partitions() IS 'Daily partition maintenance: archives sent notifications, pre-creates monthly partitions and drops expired ones per app_config.PARTITION_RETENTION.';
+
+
+-- Existing sent rows
+SELECT public.archive_sent_notifications(3600, NULL);
+
+COMMIT;
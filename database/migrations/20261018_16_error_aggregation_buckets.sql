@@ -0,0 +1,271 @@
+-- Migration: error_aggregations - incremental per-minute counters for recurrence checks
+-- Date: 2026-10-18
+-- Purpose: check_error_recurrence() and count_error_recurrences() ran
+--          COUNT/MIN/MAX over error_logs for the fingerprint and window on
+--          every call. During an error storm the window holds thousands of
+--          rows, so each check got slower as the storm grew, and BB_00 runs
+--          one check per error. error_aggregations (present in the schema
+--          but never written) is now kept up to date on insert: one row per
+--          (workflow_name, error_type, error_fingerprint, minute). A check
+--          sums at most window_minutes + 1 buckets, however many errors
+--          the window holds.
+--
+-- Buckets:
+--   time_window_start = date_trunc('minute', created_at), end = start + 1 min
+--   occurrence_count, first/last_occurrence, severity_max (by
+--   error_handling.severity_rank()).
+--   Maintained by a statement-level AFTER INSERT trigger on error_logs, so
+--   a multi-row INSERT adds each bucket once. A NULL fingerprint is its own
+--   bucket key (the unique constraint becomes NULLS NOT DISTINCT).
+--   Deleting or resolving error_logs rows does not change the counters.
+--   error_handling.prune_error_aggregations() drops old buckets and runs
+--   from maintain_partitions().
+--
+-- Window semantics: the window is widened to whole minutes, so a
+-- 10-minute check counts errors since the start of the minute 10 minutes
+-- ago (up to 1 extra minute). first_occurrence can be up to a minute older
+-- than the window for the same reason.
+--
+-- Benchmark (10k errors/min):
+--   python tests/bb00/bench_error_recurrence.py
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_16_error_aggregation_buckets.sql
+
+BEGIN;
+
+-- No insert may slip between the trigger going live and the seed below
+LOCK TABLE error_handling.error_logs IN SHARE ROW EXCLUSIVE MODE;
+
+ALTER TABLE error_handling.error_aggregations
+    DROP CONSTRAINT IF EXISTS uk_error_aggregation;
+
+ALTER TABLE error_handling.error_aggregations
+    ADD CONSTRAINT uk_error_aggregation UNIQUE NULLS NOT DISTINCT (workflow_name, error_type, error_fingerprint, time_window_start);
+
+-- Fingerprint-less checks (p_use_fingerprint = false) scan every
+-- fingerprint's buckets of the pair by time
+CREATE INDEX IF NOT EXISTS idx_error_aggregations_window
+    ON error_handling.error_aggregations USING btree (workflow_name, error_type, time_window_start DESC);
+
+
+CREATE OR REPLACE FUNCTION error_handling.severity_rank(p_severity text) RETURNS integer
+    LANGUAGE sql IMMUTABLE
+    AS $$
+    SELECT CASE upper(p_severity)
+        WHEN 'CRITICAL' THEN 4
+        WHEN 'HIGH' THEN 3
+        WHEN 'MEDIUM' THEN 2
+        WHEN 'WARNING' THEN 1
+        WHEN 'LOW' THEN 1
+        ELSE 0
+    END;
+$$;
+
+ALTER FUNCTION error_handling.severity_rank(p_severity text) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION error_handling.severity_rank(p_severity text) IS 'Orders severities for error_aggregations.severity_max: CRITICAL 4, HIGH 3, MEDIUM 2, WARNING/LOW 1, other 0.';
+
+
+CREATE OR REPLACE FUNCTION error_handling.aggregate_new_errors() RETURNS trigger
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    -- Sorted so concurrent inserts lock shared buckets in the same order
+    INSERT INTO error_handling.error_aggregations AS a (
+        workflow_name, error_type, error_fingerprint, time_window_start, time_window_end,
+        occurrence_count, severity_max, first_occurrence, last_occurrence
+    )
+    SELECT workflow_name, error_type, error_fingerprint, bucket, bucket + INTERVAL '1 minute',
+           COUNT(*),
+           (array_agg(severity ORDER BY error_handling.severity_rank(severity) DESC))[1],
+           MIN(created_at), MAX(created_at)
+    FROM (
+        SELECT n.workflow_name, n.error_type, n.error_fingerprint, n.severity, n.created_at,
+               date_trunc('minute', n.created_at) AS bucket
+        FROM new_errors n
+    ) e
+    GROUP BY workflow_name, error_type, error_fingerprint, bucket
+    ORDER BY workflow_name, error_type, error_fingerprint, bucket
+    ON CONFLICT ON CONSTRAINT uk_error_aggregation DO UPDATE
+    SET occurrence_count = a.occurrence_count + EXCLUDED.occurrence_count,
+        severity_max = CASE
+            WHEN error_handling.severity_rank(EXCLUDED.severity_max) > error_handling.severity_rank(a.severity_max)
+            THEN EXCLUDED.severity_max ELSE a.severity_max END,
+        first_occurrence = LEAST(a.first_occurrence, EXCLUDED.first_occurrence),
+        last_occurrence = GREATEST(a.last_occurrence, EXCLUDED.last_occurrence),
+        updated_at = NOW();
+    RETURN NULL;
+END;
+$$;
+
+ALTER FUNCTION error_handling.aggregate_new_errors() OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION error_handling.aggregate_new_errors() IS 'Statement trigger on error_logs: adds the inserted rows to their per-minute error_aggregations buckets.';
+
+DROP TRIGGER IF EXISTS trg_error_logs_aggregate ON error_handling.error_logs;
+
+CREATE TRIGGER trg_error_logs_aggregate
+    AFTER INSERT ON error_handling.error_logs
+    REFERENCING NEW TABLE AS new_errors
+    FOR EACH STATEMENT EXECUTE FUNCTION error_handling.aggregate_new_errors();
+
+
+CREATE OR REPLACE FUNCTION error_handling.check_error_recurrence(p_workflow_name character varying, p_error_type character varying, p_error_message text DEFAULT NULL::text, p_time_window_minutes integer DEFAULT 10, p_use_fingerprint boolean DEFAULT true) RETURNS TABLE(occurrence_count integer, is_recurring boolean, severity_recommendation character varying, first_occurrence timestamp with time zone, last_occurrence timestamp with time zone)
+    LANGUAGE plpgsql STABLE
+    AS $$
+DECLARE
+    v_fingerprint VARCHAR(64);
+    v_since TIMESTAMP WITH TIME ZONE;
+    v_count INTEGER;
+    v_first TIMESTAMP WITH TIME ZONE;
+    v_last TIMESTAMP WITH TIME ZONE;
+    v_severity VARCHAR(20);
+BEGIN
+    v_since := date_trunc('minute', NOW() - make_interval(mins => p_time_window_minutes));
+
+    IF p_use_fingerprint AND p_error_message IS NOT NULL THEN
+        v_fingerprint := error_handling.generate_error_fingerprint(
+            p_workflow_name,
+            p_error_type,
+            p_error_message
+        );
+
+        SELECT SUM(a.occurrence_count), MIN(a.first_occurrence), MAX(a.last_occurrence)
+        INTO v_count, v_first, v_last
+        FROM error_handling.error_aggregations a
+        WHERE a.workflow_name = p_workflow_name
+          AND a.error_type = p_error_type
+          AND a.error_fingerprint = v_fingerprint
+          AND a.time_window_start >= v_since;
+    ELSE
+        SELECT SUM(a.occurrence_count), MIN(a.first_occurrence), MAX(a.last_occurrence)
+        INTO v_count, v_first, v_last
+        FROM error_handling.error_aggregations a
+        WHERE a.workflow_name = p_workflow_name
+          AND a.error_type = p_error_type
+          AND a.time_window_start >= v_since;
+    END IF;
+
+    v_severity := CASE
+        WHEN v_count >= 20 THEN 'CRITICAL'
+        WHEN v_count >= 10 THEN 'HIGH'
+        WHEN v_count >= 3 THEN 'MEDIUM'
+        ELSE 'LOW'
+    END;
+
+    RETURN QUERY SELECT
+        COALESCE(v_count, 0),
+        COALESCE(v_count, 0) >= 3,
+        v_severity,
+        v_first,
+        v_last;
+END;
+$$;
+
+ALTER FUNCTION error_handling.check_error_recurrence(p_workflow_name character varying, p_error_type character varying, p_error_message text, p_time_window_minutes integer, p_use_fingerprint boolean) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION error_handling.check_error_recurrence(p_workflow_name character varying, p_error_type character varying, p_error_message text, p_time_window_minutes integer, p_use_fingerprint boolean) IS 'Occurrences of an error in the last p_time_window_minutes (whole minutes), summed from the per-minute error_aggregations buckets.';
+
+
+CREATE OR REPLACE FUNCTION error_handling.count_error_recurrences(p_workflow_name character varying, p_error_type character varying, p_time_window_minutes integer DEFAULT 10) RETURNS integer
+    LANGUAGE plpgsql STABLE
+    AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    SELECT SUM(a.occurrence_count)
+    INTO v_count
+    FROM error_handling.error_aggregations a
+    WHERE a.workflow_name = p_workflow_name
+      AND a.error_type = p_error_type
+      AND a.time_window_start >= date_trunc('minute', NOW() - make_interval(mins => p_time_window_minutes));
+
+    RETURN COALESCE(v_count, 0);
+END;
+$$;
+
+ALTER FUNCTION error_handling.count_error_recurrences(p_workflow_name character varying, p_error_type character varying, p_time_window_minutes integer) OWNER TO neondb_owner;
+
+
+CREATE OR REPLACE FUNCTION error_handling.prune_error_aggregations(p_keep_hours integer DEFAULT 48) RETURNS integer
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_deleted integer;
+BEGIN
+    DELETE FROM error_handling.error_aggregations
+    WHERE time_window_end < NOW() - make_interval(hours => p_keep_hours);
+
+    GET DIAGNOSTICS v_deleted = ROW_COUNT;
+    RETURN v_deleted;
+END;
+$$;
+
+ALTER FUNCTION error_handling.prune_error_aggregations(p_keep_hours integer) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION error_handling.prune_error_aggregations(p_keep_hours integer) IS 'Deletes error_aggregations buckets that ended more than p_keep_hours ago. Run daily by maintain_partitions().';
+
+
+-- As in 20261018_15, plus the bucket pruning
+CREATE OR REPLACE FUNCTION public.maintain_partitions() RETURNS TABLE(parent text, created integer, dropped integer)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_config jsonb;
+    v_ahead integer;
+    v_days integer;
+    v_before integer;
+BEGIN
+    SELECT value::jsonb INTO v_config
+    FROM public.app_config
+    WHERE key = 'PARTITION_RETENTION';
+    v_config := COALESCE(v_config, '{}'::jsonb);
+    v_ahead := COALESCE((v_config->>'months_ahead')::integer, 3);
+
+    PERFORM public.archive_sent_notifications(3600, NULL);
+    PERFORM error_handling.prune_error_aggregations(48);
+
+    FOREACH parent IN ARRAY ARRAY['error_handling.error_logs', 'public.audit_logs', 'public.notification_history'] LOOP
+        created := public.create_monthly_partitions(parent::regclass, v_ahead);
+        v_days := (v_config->'retention_days'->>parent)::integer;
+        dropped := 0;
+        IF v_days IS NOT NULL THEN
+            SELECT COUNT(*) INTO v_before FROM public.monthly_partitions(parent::regclass);
+            IF parent = 'error_handling.error_logs' THEN
+                PERFORM error_handling.cleanup_old_errors(v_days);
+            ELSE
+                PERFORM public.drop_monthly_partitions(parent::regclass, NOW() - make_interval(days => v_days));
+            END IF;
+            SELECT v_before - COUNT(*) INTO dropped FROM public.monthly_partitions(parent::regclass);
+        END IF;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$;
+
+ALTER FUNCTION public.maintain_partitions() OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.maintain_partitions() IS 'Daily partition maintenance: archives sent notifications, prunes error_aggregations, pre-creates monthly partitions and drops expired ones per app_config.PARTITION_RETENTION.';
+
+
+-- Seed the buckets from recent history so checks are correct right away
+TRUNCATE error_handling.error_aggregations;
+
+INSERT INTO error_handling.error_aggregations (
+    workflow_name, error_type, error_fingerprint, time_window_start, time_window_end,
+    occurrence_count, severity_max, first_occurrence, last_occurrence
+)
+SELECT workflow_name, error_type, error_fingerprint, bucket, bucket + INTERVAL '1 minute',
+       COUNT(*),
+       (array_agg(severity ORDER BY error_handling.severity_rank(severity) DESC))[1],
+       MIN(created_at), MAX(created_at)
+FROM (
+    SELECT workflow_name, error_type, error_fingerprint, severity, created_at,
+           date_trunc('minute', created_at) AS bucket
+    FROM error_handling.error_logs
+    WHERE created_at > NOW() - INTERVAL '48 hours'
+) e
+GROUP BY workflow_name, error_type, error_fingerprint, bucket;
+
+COMMIT;
@@ -0,0 +1,142 @@
+-- Migration: error_fingerprint computed once, when the error is written
+-- Date: 2026-10-18
+-- Purpose: generate_error_fingerprint() (five REGEXP_REPLACE passes + MD5)
+--          ran every time a recurrence was checked, and BB_00 / BB_99 never
+--          stored it, so error_logs.error_fingerprint was NULL and the
+--          fingerprint branch of check_error_recurrence() matched nothing.
+--          A BEFORE INSERT trigger now fills error_fingerprint on write. It
+--          recomputes only when workflow_name, error_type or error_message
+--          change. Callers that already hold the fingerprint check it
+--          directly with check_fingerprint_recurrence().
+--
+-- Why a trigger and not a GENERATED column: a generated column would rewrite
+-- every partition of error_logs under an ACCESS EXCLUSIVE lock, and would
+-- reject the explicit error_fingerprint values some callers insert. A
+-- caller-supplied fingerprint is kept as is.
+--
+-- Historical rows are fingerprinted in short chunks, one transaction each:
+--   python scripts-py/error_fingerprint.py backfill [--chunk 5000] [--sleep 0.1]
+-- scripts-py/error_fingerprint.py also has a byte-identical Python
+-- implementation for tooling (`verify` compares it with stored rows).
+--
+-- API:
+--   check_fingerprint_recurrence(workflow, error_type, fingerprint, window)
+--     Same result as check_error_recurrence(), without recomputing the
+--     fingerprint.
+--   check_error_recurrence(...)   unchanged signature; the fingerprint
+--     branch computes the fingerprint and calls the function above.
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_17_error_fingerprint_on_write.sql
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION error_handling.set_error_fingerprint() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    IF TG_OP = 'INSERT' AND NEW.error_fingerprint IS NOT NULL THEN
+        RETURN NEW;
+    END IF;
+    NEW.error_fingerprint := error_handling.generate_error_fingerprint(
+        NEW.workflow_name,
+        NEW.error_type,
+        NEW.error_message
+    );
+    RETURN NEW;
+END;
+$$;
+
+ALTER FUNCTION error_handling.set_error_fingerprint() OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION error_handling.set_error_fingerprint() IS 'Fills error_logs.error_fingerprint on insert (unless given) and when the message, workflow or type changes.';
+
+DROP TRIGGER IF EXISTS trg_error_logs_fingerprint ON error_handling.error_logs;
+DROP TRIGGER IF EXISTS trg_error_logs_refingerprint ON error_handling.error_logs;
+
+CREATE TRIGGER trg_error_logs_fingerprint
+    BEFORE INSERT ON error_handling.error_logs
+    FOR EACH ROW EXECUTE FUNCTION error_handling.set_error_fingerprint();
+
+CREATE TRIGGER trg_error_logs_refingerprint
+    BEFORE UPDATE OF workflow_name, error_type, error_message ON error_handling.error_logs
+    FOR EACH ROW EXECUTE FUNCTION error_handling.set_error_fingerprint();
+
+
+CREATE OR REPLACE FUNCTION error_handling.check_fingerprint_recurrence(p_workflow_name character varying, p_error_type character varying, p_fingerprint character varying, p_time_window_minutes integer DEFAULT 10) RETURNS TABLE(occurrence_count integer, is_recurring boolean, severity_recommendation character varying, first_occurrence timestamp with time zone, last_occurrence timestamp with time zone)
+    LANGUAGE plpgsql STABLE
+    AS $$
+DECLARE
+    v_count INTEGER;
+    v_first TIMESTAMP WITH TIME ZONE;
+    v_last TIMESTAMP WITH TIME ZONE;
+BEGIN
+    SELECT SUM(a.occurrence_count), MIN(a.first_occurrence), MAX(a.last_occurrence)
+    INTO v_count, v_first, v_last
+    FROM error_handling.error_aggregations a
+    WHERE a.workflow_name = p_workflow_name
+      AND a.error_type = p_error_type
+      AND a.error_fingerprint = p_fingerprint
+      AND a.time_window_start >= date_trunc('minute', NOW() - make_interval(mins => p_time_window_minutes));
+
+    RETURN QUERY SELECT
+        COALESCE(v_count, 0),
+        COALESCE(v_count, 0) >= 3,
+        (CASE
+            WHEN v_count >= 20 THEN 'CRITICAL'
+            WHEN v_count >= 10 THEN 'HIGH'
+            WHEN v_count >= 3 THEN 'MEDIUM'
+            ELSE 'LOW'
+        END)::varchar,
+        v_first,
+        v_last;
+END;
+$$;
+
+ALTER FUNCTION error_handling.check_fingerprint_recurrence(p_workflow_name character varying, p_error_type character varying, p_fingerprint character varying, p_time_window_minutes integer) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION error_handling.check_fingerprint_recurrence(p_workflow_name character varying, p_error_type character varying, p_fingerprint character varying, p_time_window_minutes integer) IS 'check_error_recurrence() for a stored error_fingerprint (e.g. INSERT ... RETURNING error_fingerprint); no fingerprint is recomputed.';
+
+
+CREATE OR REPLACE FUNCTION error_handling.check_error_recurrence(p_workflow_name character varying, p_error_type character varying, p_error_message text DEFAULT NULL::text, p_time_window_minutes integer DEFAULT 10, p_use_fingerprint boolean DEFAULT true) RETURNS TABLE(occurrence_count integer, is_recurring boolean, severity_recommendation character varying, first_occurrence timestamp with time zone, last_occurrence timestamp with time zone)
+    LANGUAGE plpgsql STABLE
+    AS $$
+DECLARE
+    v_count INTEGER;
+    v_first TIMESTAMP WITH TIME ZONE;
+    v_last TIMESTAMP WITH TIME ZONE;
+BEGIN
+    IF p_use_fingerprint AND p_error_message IS NOT NULL THEN
+        RETURN QUERY SELECT * FROM error_handling.check_fingerprint_recurrence(
+            p_workflow_name,
+            p_error_type,
+            error_handling.generate_error_fingerprint(p_workflow_name, p_error_type, p_error_message),
+            p_time_window_minutes
+        );
+        RETURN;
+    END IF;
+
+    SELECT SUM(a.occurrence_count), MIN(a.first_occurrence), MAX(a.last_occurrence)
+    INTO v_count, v_first, v_last
+    FROM error_handling.error_aggregations a
+    WHERE a.workflow_name = p_workflow_name
+      AND a.error_type = p_error_type
+      AND a.time_window_start >= date_trunc('minute', NOW() - make_interval(mins => p_time_window_minutes));
+
+    RETURN QUERY SELECT
+        COALESCE(v_count, 0),
+        COALESCE(v_count, 0) >= 3,
+        (CASE
+            WHEN v_count >= 20 THEN 'CRITICAL'
+            WHEN v_count >= 10 THEN 'HIGH'
+            WHEN v_count >= 3 THEN 'MEDIUM'
+            ELSE 'LOW'
+        END)::varchar,
+        v_first,
+        v_last;
+END;
+$$;
+
+ALTER FUNCTION error_handling.check_error_recurrence(p_workflow_name character varying, p_error_type character varying, p_error_message text, p_time_window_minutes integer, p_use_fingerprint boolean) OWNER TO neondb_owner;
+
+COMMIT;
@@ -0,0 +1,245 @@
+-- Migration: alert_suppression - one Telegram alert per error fingerprint and window
+-- Date: 2026-10-18
+-- Purpose: BB_00_Global_Error_Handler inserted an error_logs row and sent a
+--          Telegram alert for every error. When a dependency fails, that is
+--          hundreds of inserts and alerts per minute: the handler slows
+--          down and the bot gets rate-limited. BB_00 now calls
+--          error_handling.log_error(). Only the first occurrence of a
+--          fingerprint in its recurrence window is logged and alerted.
+--          Repeats inside the window only bump a counter. A scheduled
+--          digest reports how many were suppressed.
+--
+-- Window and switches come from error_handling.recurrence_config, using the
+-- most specific enabled row: (workflow, type), then (workflow, 'DEFAULT'),
+-- then ('DEFAULT', type), then ('DEFAULT', 'DEFAULT'):
+--   time_window_minutes   suppression window after an alert (default 10)
+--   threshold_critical    a repeat that brings the window's count to this
+--                         value alerts once more (ESCALATED)
+--   suppress_alerts       new; false = log and alert every error as before
+--
+-- error_handling.alert_suppression (one row per fingerprint):
+--   alerted_at / suppress_until   current window, opened by the last alert
+--   window_count                  occurrences in the current window
+--   suppressed_count              repeats not yet reported by a digest
+--   total_suppressed              repeats ever reported
+--   last_message / last_metadata / severity_max / last_seen_at
+--
+-- Only alerted occurrences (FIRST, ESCALATED) are inserted into error_logs.
+-- Suppressed repeats are not. They are added to their
+-- per-minute error_aggregations bucket directly (20261018_16), so
+-- check_error_recurrence() still counts every occurrence.
+--
+-- API:
+--   log_error(workflow, type, message, severity, environment, metadata)
+--     -> error_id (NULL when suppressed), error_fingerprint, should_alert,
+--        alert_reason ('FIRST' | 'ESCALATED' | NULL), window_count,
+--        suppressed_count (pending from earlier windows), window_minutes
+--   take_alert_digest(limit)
+--     -> the fingerprints with pending repeats, largest first; resets their
+--        suppressed_count (FOR UPDATE SKIP LOCKED, so runs never overlap)
+--   prune_error_aggregations(keep_hours) also drops suppression rows idle
+--   for keep_hours with nothing pending.
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_18_error_alert_suppression.sql
+
+BEGIN;
+
+ALTER TABLE error_handling.recurrence_config
+    ADD COLUMN IF NOT EXISTS suppress_alerts boolean DEFAULT true NOT NULL;
+
+COMMENT ON COLUMN error_handling.recurrence_config.suppress_alerts IS 'log_error(): alert once per fingerprint and time_window_minutes, count the repeats for the digest. false = alert every error.';
+
+
+CREATE TABLE IF NOT EXISTS error_handling.alert_suppression (
+    workflow_name character varying(255) NOT NULL,
+    error_type character varying(100) NOT NULL,
+    error_fingerprint character varying(64) NOT NULL,
+    alerted_at timestamp with time zone DEFAULT now() NOT NULL,
+    suppress_until timestamp with time zone NOT NULL,
+    window_count integer DEFAULT 1 NOT NULL,
+    suppressed_count integer DEFAULT 0 NOT NULL,
+    total_suppressed bigint DEFAULT 0 NOT NULL,
+    severity_max character varying(20),
+    last_message text,
+    last_metadata jsonb,
+    last_seen_at timestamp with time zone DEFAULT now() NOT NULL,
+    digested_at timestamp with time zone,
+    CONSTRAINT alert_suppression_pkey PRIMARY KEY (workflow_name, error_type, error_fingerprint)
+);
+
+ALTER TABLE error_handling.alert_suppression OWNER TO neondb_owner;
+
+COMMENT ON TABLE error_handling.alert_suppression IS 'Alert window and suppressed-repeat counters per error fingerprint, written by log_error() and drained by take_alert_digest().';
+
+CREATE INDEX IF NOT EXISTS idx_alert_suppression_pending
+    ON error_handling.alert_suppression USING btree (suppressed_count DESC)
+    WHERE suppressed_count > 0;
+
+GRANT SELECT ON TABLE error_handling.alert_suppression TO n8n_user;
+
+
+CREATE OR REPLACE FUNCTION error_handling.log_error(p_workflow_name character varying, p_error_type character varying, p_error_message text, p_severity character varying DEFAULT 'CRITICAL'::character varying, p_environment character varying DEFAULT 'production'::character varying, p_metadata jsonb DEFAULT '{}'::jsonb) RETURNS TABLE(error_id bigint, error_fingerprint character varying, should_alert boolean, alert_reason character varying, window_count integer, suppressed_count integer, window_minutes integer)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_fingerprint VARCHAR(64);
+    v_window INTEGER;
+    v_critical INTEGER;
+    v_suppress BOOLEAN;
+    v_alerted_at TIMESTAMP WITH TIME ZONE;
+    v_count INTEGER;
+    v_pending INTEGER;
+    v_reason VARCHAR(20);
+    v_error_id BIGINT;
+BEGIN
+    v_fingerprint := error_handling.generate_error_fingerprint(p_workflow_name, p_error_type, p_error_message);
+
+    SELECT c.time_window_minutes, c.threshold_critical, c.suppress_alerts
+    INTO v_window, v_critical, v_suppress
+    FROM error_handling.recurrence_config c
+    WHERE c.enabled
+      AND c.workflow_name IN (p_workflow_name, 'DEFAULT')
+      AND c.error_type IN (p_error_type, 'DEFAULT')
+    ORDER BY (c.workflow_name = p_workflow_name) DESC, (c.error_type = p_error_type) DESC
+    LIMIT 1;
+
+    v_window := COALESCE(v_window, 10);
+    v_critical := COALESCE(v_critical, 20);
+
+    IF NOT COALESCE(v_suppress, true) THEN
+        v_reason := 'FIRST';
+        v_count := 1;
+        v_pending := 0;
+    ELSE
+        INSERT INTO error_handling.alert_suppression AS s (
+            workflow_name, error_type, error_fingerprint, alerted_at, suppress_until,
+            severity_max, last_message, last_metadata, last_seen_at
+        )
+        VALUES (
+            p_workflow_name, p_error_type, v_fingerprint, NOW(), NOW() + make_interval(mins => v_window),
+            p_severity, p_error_message, p_metadata, NOW()
+        )
+        ON CONFLICT ON CONSTRAINT alert_suppression_pkey DO UPDATE
+        SET alerted_at = CASE WHEN s.suppress_until <= NOW() THEN NOW() ELSE s.alerted_at END,
+            suppress_until = CASE WHEN s.suppress_until <= NOW() THEN NOW() + make_interval(mins => v_window) ELSE s.suppress_until END,
+            window_count = CASE WHEN s.suppress_until <= NOW() THEN 1 ELSE s.window_count + 1 END,
+            suppressed_count = s.suppressed_count + CASE WHEN s.suppress_until <= NOW() THEN 0 ELSE 1 END,
+            severity_max = CASE WHEN s.suppress_until <= NOW()
+                                  OR error_handling.severity_rank(EXCLUDED.severity_max) > error_handling.severity_rank(s.severity_max)
+                                THEN EXCLUDED.severity_max ELSE s.severity_max END,
+            last_message = EXCLUDED.last_message,
+            last_metadata = EXCLUDED.last_metadata,
+            last_seen_at = NOW()
+        RETURNING s.alerted_at, s.window_count, s.suppressed_count
+        INTO v_alerted_at, v_count, v_pending;
+
+        IF v_alerted_at = NOW() THEN
+            v_reason := 'FIRST';
+        ELSIF v_count = v_critical THEN
+            v_reason := 'ESCALATED';
+        END IF;
+    END IF;
+
+    IF v_reason IS NOT NULL THEN
+        INSERT INTO error_handling.error_logs (
+            workflow_name, error_type, error_message, error_fingerprint, severity, environment, metadata
+        )
+        VALUES (p_workflow_name, p_error_type, p_error_message, v_fingerprint, p_severity, p_environment, p_metadata)
+        RETURNING id INTO v_error_id;
+    ELSE
+        -- Not logged: count it where the recurrence checks look
+        INSERT INTO error_handling.error_aggregations AS a (
+            workflow_name, error_type, error_fingerprint, time_window_start, time_window_end,
+            occurrence_count, severity_max, first_occurrence, last_occurrence
+        )
+        VALUES (
+            p_workflow_name, p_error_type, v_fingerprint, date_trunc('minute', NOW()),
+            date_trunc('minute', NOW()) + INTERVAL '1 minute', 1, p_severity, NOW(), NOW()
+        )
+        ON CONFLICT ON CONSTRAINT uk_error_aggregation DO UPDATE
+        SET occurrence_count = a.occurrence_count + 1,
+            severity_max = CASE
+                WHEN error_handling.severity_rank(EXCLUDED.severity_max) > error_handling.severity_rank(a.severity_max)
+                THEN EXCLUDED.severity_max ELSE a.severity_max END,
+            first_occurrence = LEAST(a.first_occurrence, EXCLUDED.first_occurrence),
+            last_occurrence = GREATEST(a.last_occurrence, EXCLUDED.last_occurrence),
+            updated_at = NOW();
+    END IF;
+
+    RETURN QUERY SELECT
+        v_error_id,
+        v_fingerprint,
+        v_reason IS NOT NULL,
+        v_reason,
+        v_count,
+        CASE WHEN v_reason = 'FIRST' THEN v_pending ELSE 0 END,
+        v_window;
+END;
+$$;
+
+ALTER FUNCTION error_handling.log_error(p_workflow_name character varying, p_error_type character varying, p_error_message text, p_severity character varying, p_environment character varying, p_metadata jsonb) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION error_handling.log_error(p_workflow_name character varying, p_error_type character varying, p_error_message text, p_severity character varying, p_environment character varying, p_metadata jsonb) IS 'BB_00 entry point: logs and alerts the first occurrence of a fingerprint per recurrence_config window; repeats only bump alert_suppression and error_aggregations.';
+
+
+CREATE OR REPLACE FUNCTION error_handling.take_alert_digest(p_limit integer DEFAULT 50) RETURNS TABLE(workflow_name character varying, error_type character varying, error_fingerprint character varying, suppressed_count integer, severity_max character varying, last_message text, alerted_at timestamp with time zone, last_seen_at timestamp with time zone)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    RETURN QUERY
+    WITH picked AS (
+        SELECT s.workflow_name, s.error_type, s.error_fingerprint, s.suppressed_count,
+               s.severity_max, s.last_message, s.alerted_at, s.last_seen_at
+        FROM error_handling.alert_suppression s
+        WHERE s.suppressed_count > 0
+        ORDER BY s.suppressed_count DESC
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    ),
+    drained AS (
+        UPDATE error_handling.alert_suppression s
+        SET suppressed_count = 0,
+            total_suppressed = s.total_suppressed + picked.suppressed_count,
+            digested_at = NOW()
+        FROM picked
+        WHERE s.workflow_name = picked.workflow_name
+          AND s.error_type = picked.error_type
+          AND s.error_fingerprint = picked.error_fingerprint
+    )
+    SELECT p.workflow_name, p.error_type, p.error_fingerprint, p.suppressed_count,
+           p.severity_max, p.last_message, p.alerted_at, p.last_seen_at
+    FROM picked p
+    ORDER BY p.suppressed_count DESC;
+END;
+$$;
+
+ALTER FUNCTION error_handling.take_alert_digest(p_limit integer) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION error_handling.take_alert_digest(p_limit integer) IS 'Returns and resets the pending suppressed-repeat counts (largest first) for the BB_00 digest.';
+
+
+-- As in 20261018_16, plus idle alert_suppression rows
+CREATE OR REPLACE FUNCTION error_handling.prune_error_aggregations(p_keep_hours integer DEFAULT 48) RETURNS integer
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_deleted integer;
+BEGIN
+    DELETE FROM error_handling.alert_suppression
+    WHERE suppressed_count = 0
+      AND last_seen_at < NOW() - make_interval(hours => p_keep_hours);
+
+    DELETE FROM error_handling.error_aggregations
+    WHERE time_window_end < NOW() - make_interval(hours => p_keep_hours);
+
+    GET DIAGNOSTICS v_deleted = ROW_COUNT;
+    RETURN v_deleted;
+END;
+$$;
+
+ALTER FUNCTION error_handling.prune_error_aggregations(p_keep_hours integer) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION error_handling.prune_error_aggregations(p_keep_hours integer) IS 'Deletes error_aggregations buckets that ended more than p_keep_hours ago (returns that count) and alert_suppression rows idle as long with nothing pending. Run daily by maintain_partitions().';
+
+COMMIT;
@@ -0,0 +1,181 @@
+-- Migration: provider_cache - single-flight fill and NOTIFY invalidation
+-- Date: 2026-10-18
+-- Purpose: BB_95_Provider_Cache expired provider_cache rows after a blind
+--          30 minutes. On expiry every concurrent request for a hot slug ran
+--          the Fetch Provider join and raced on the Save Cache upsert (a
+--          cache stampede). Edits to providers/services stayed invisible
+--          until the TTL ran out. Now:
+--            - public.get_provider_cache(slug) returns the cached row or
+--              fills it. Fills are serialized per slug by a transaction
+--              advisory lock, and waiters re-read the row the winner wrote,
+--              so a cold slug is built once however many requests arrive.
+--            - Triggers on providers and services delete the affected
+--              rows and pg_notify('provider_cache', slug). In-process caches
+--              (scripts-py/provider_cache.py) LISTEN and evict. The TTL is
+--              only a safety net now (default 1440 minutes).
+--
+-- The cached payload is built by public.v_provider_cache_source, from
+-- providers' real columns plus the active services. The old Save Cache query
+-- read providers.timezone / settings, which do not exist, and dropped the
+-- services list.
+--
+-- API:
+--   get_provider_cache(slug, ttl_minutes)  -> provider_id, provider_slug,
+--       data, cached_at, from_cache (false = this call filled it); no row
+--       for an unknown or deleted slug
+--   invalidate_provider_cache(slug)        -> deletes the row and notifies,
+--       true if a row was cached
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_19_provider_cache_invalidation.sql
+
+BEGIN;
+
+CREATE OR REPLACE VIEW public.v_provider_cache_source AS
+SELECT p.id AS provider_id,
+       p.slug AS provider_slug,
+       p.public_booking_enabled,
+       jsonb_build_object(
+           'id', p.id,
+           'slug', p.slug,
+           'name', p.name,
+           'slot_duration_minutes', p.slot_duration_minutes,
+           'min_notice_hours', p.min_notice_hours,
+           'public_booking_enabled', p.public_booking_enabled,
+           'services', COALESCE(s.services, '[]'::jsonb)
+       ) AS data
+FROM public.providers p
+LEFT JOIN LATERAL (
+    SELECT jsonb_agg(jsonb_build_object(
+               'id', sv.id,
+               'name', sv.name,
+               'duration_minutes', sv.duration_minutes,
+               'price', sv.price,
+               'tier', sv.tier
+           ) ORDER BY sv.name, sv.id) AS services
+    FROM public.services sv
+    WHERE sv.provider_id = p.id
+      AND sv.active IS NOT FALSE
+) s ON true
+WHERE p.deleted_at IS NULL
+  AND p.slug IS NOT NULL;
+
+ALTER VIEW public.v_provider_cache_source OWNER TO neondb_owner;
+
+COMMENT ON VIEW public.v_provider_cache_source IS 'Payload cached in provider_cache.data: provider fields plus active services.';
+
+
+CREATE OR REPLACE FUNCTION public.get_provider_cache(p_slug text, p_ttl_minutes integer DEFAULT 1440) RETURNS TABLE(provider_id uuid, provider_slug text, data jsonb, cached_at timestamp with time zone, from_cache boolean)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    RETURN QUERY
+    SELECT c.provider_id, c.provider_slug, c.data, c.cached_at, true
+    FROM public.provider_cache c
+    WHERE c.provider_slug = p_slug AND c.expires_at > NOW();
+    IF FOUND THEN
+        RETURN;
+    END IF;
+
+    -- One filler per slug; the others wait here and read its row below
+    PERFORM pg_advisory_xact_lock(hashtextextended('provider_cache:' || p_slug, 0));
+
+    RETURN QUERY
+    SELECT c.provider_id, c.provider_slug, c.data, c.cached_at, true
+    FROM public.provider_cache c
+    WHERE c.provider_slug = p_slug AND c.expires_at > NOW();
+    IF FOUND THEN
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    INSERT INTO public.provider_cache AS c (provider_id, provider_slug, data, cached_at, expires_at)
+    SELECT v.provider_id, v.provider_slug, v.data, NOW(), NOW() + make_interval(mins => p_ttl_minutes)
+    FROM public.v_provider_cache_source v
+    WHERE v.provider_slug = p_slug
+    ON CONFLICT ON CONSTRAINT provider_cache_provider_slug_key DO UPDATE
+    SET provider_id = EXCLUDED.provider_id,
+        data = EXCLUDED.data,
+        cached_at = EXCLUDED.cached_at,
+        expires_at = EXCLUDED.expires_at
+    RETURNING c.provider_id, c.provider_slug, c.data, c.cached_at, false;
+END;
+$$;
+
+ALTER FUNCTION public.get_provider_cache(p_slug text, p_ttl_minutes integer) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.get_provider_cache(p_slug text, p_ttl_minutes integer) IS 'BB_95 get: cached provider payload, filled at most once per slug at a time (advisory lock).';
+
+
+CREATE OR REPLACE FUNCTION public.invalidate_provider_cache(p_slug text) RETURNS boolean
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_deleted boolean;
+BEGIN
+    DELETE FROM public.provider_cache WHERE provider_slug = p_slug;
+    v_deleted := FOUND;
+    PERFORM pg_notify('provider_cache', p_slug);
+    RETURN v_deleted;
+END;
+$$;
+
+ALTER FUNCTION public.invalidate_provider_cache(p_slug text) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.invalidate_provider_cache(p_slug text) IS 'Drops the cached payload for a slug and notifies the provider_cache channel so in-process caches evict it.';
+
+
+CREATE OR REPLACE FUNCTION public.notify_provider_change() RETURNS trigger
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_slug text;
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD IS NOT DISTINCT FROM NEW THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_TABLE_NAME = 'providers' THEN
+        FOR v_slug IN
+            SELECT DISTINCT s FROM unnest(ARRAY[
+                CASE WHEN TG_OP <> 'INSERT' THEN OLD.slug END,
+                CASE WHEN TG_OP <> 'DELETE' THEN NEW.slug END
+            ]) s WHERE s IS NOT NULL
+        LOOP
+            PERFORM public.invalidate_provider_cache(v_slug);
+        END LOOP;
+    ELSE
+        FOR v_slug IN
+            SELECT DISTINCT p.slug FROM public.providers p
+            WHERE p.slug IS NOT NULL
+              AND p.id IN (
+                  CASE WHEN TG_OP <> 'INSERT' THEN OLD.provider_id END,
+                  CASE WHEN TG_OP <> 'DELETE' THEN NEW.provider_id END
+              )
+        LOOP
+            PERFORM public.invalidate_provider_cache(v_slug);
+        END LOOP;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+ALTER FUNCTION public.notify_provider_change() OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.notify_provider_change() IS 'Row trigger on providers and services: invalidates provider_cache for the affected slug(s).';
+
+DROP TRIGGER IF EXISTS trg_providers_cache_invalidate ON public.providers;
+DROP TRIGGER IF EXISTS trg_services_cache_invalidate ON public.services;
+
+CREATE TRIGGER trg_providers_cache_invalidate
+    AFTER INSERT OR UPDATE OR DELETE ON public.providers
+    FOR EACH ROW EXECUTE FUNCTION public.notify_provider_change();
+
+CREATE TRIGGER trg_services_cache_invalidate
+    AFTER INSERT OR UPDATE OR DELETE ON public.services
+    FOR EACH ROW EXECUTE FUNCTION public.notify_provider_change();
+
+-- Rows written by the old Save Cache lack the services list
+DELETE FROM public.provider_cache;
+
+COMMIT;
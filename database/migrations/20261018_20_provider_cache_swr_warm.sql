@@ -0,0 +1,118 @@
+-- Migration: provider_cache - stale-while-revalidate and set-based warm-up
+-- Date: 2026-10-18
+-- Purpose: After 20261018_19 a provider_cache row past expires_at is rebuilt
+--          synchronously by the next request, and that request pays the
+--          v_provider_cache_source join plus the upsert. After a deploy or a
+--          cache flush every first request for every provider pays it. Now:
+--            - get_provider_cache() also serves a row that expired less than
+--              p_stale_minutes ago and flags it is_stale. The caller does not
+--              wait for the rebuild. Only rows past the grace period (or
+--              missing) are filled inline, still once per slug.
+--            - warm_provider_cache() refreshes in ONE INSERT ... SELECT:
+--                * every public_booking_enabled provider without a row,
+--                * every cached row that expires within
+--                  p_refresh_ahead_minutes (or is already stale),
+--                * or all of them, cached or public, when p_force (after a
+--                  deploy that changes the payload).
+--              BB_95 runs it on a schedule (refresh-ahead), and callers can
+--              run it on demand (operation 'warm',
+--              scripts-py/provider_cache.py warm).
+--
+-- The schedule interval must stay below the refresh-ahead window. Then
+-- expiring rows are rewritten before any request sees them stale, and the
+-- grace period only covers a missed run.
+--
+-- get_provider_cache() gains a parameter and an output column, so the old
+-- signature is dropped (an overload would make 2-argument calls ambiguous).
+--
+-- API:
+--   get_provider_cache(slug, ttl_minutes, stale_minutes)
+--       -> provider_id, provider_slug, data, cached_at, from_cache, is_stale
+--       stale_minutes = 0 disables stale serving, i.e. forces the refill of
+--       an expired row (used by background refreshes)
+--   warm_provider_cache(ttl_minutes, refresh_ahead_minutes, force)
+--       -> warmed (rows inserted), refreshed (rows rewritten)
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_20_provider_cache_swr_warm.sql
+
+BEGIN;
+
+DROP FUNCTION IF EXISTS public.get_provider_cache(text, integer);
+
+CREATE OR REPLACE FUNCTION public.get_provider_cache(p_slug text, p_ttl_minutes integer DEFAULT 1440, p_stale_minutes integer DEFAULT 60) RETURNS TABLE(provider_id uuid, provider_slug text, data jsonb, cached_at timestamp with time zone, from_cache boolean, is_stale boolean)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    -- Fresh, or expired less than p_stale_minutes ago: served without waiting
+    RETURN QUERY
+    SELECT c.provider_id, c.provider_slug, c.data, c.cached_at, true, c.expires_at <= NOW()
+    FROM public.provider_cache c
+    WHERE c.provider_slug = p_slug
+      AND c.expires_at > NOW() - make_interval(mins => GREATEST(p_stale_minutes, 0));
+    IF FOUND THEN
+        RETURN;
+    END IF;
+
+    -- One filler per slug; the others wait here and read its row below
+    PERFORM pg_advisory_xact_lock(hashtextextended('provider_cache:' || p_slug, 0));
+
+    RETURN QUERY
+    SELECT c.provider_id, c.provider_slug, c.data, c.cached_at, true, false
+    FROM public.provider_cache c
+    WHERE c.provider_slug = p_slug AND c.expires_at > NOW();
+    IF FOUND THEN
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    INSERT INTO public.provider_cache AS c (provider_id, provider_slug, data, cached_at, expires_at)
+    SELECT v.provider_id, v.provider_slug, v.data, NOW(), NOW() + make_interval(mins => p_ttl_minutes)
+    FROM public.v_provider_cache_source v
+    WHERE v.provider_slug = p_slug
+    ON CONFLICT ON CONSTRAINT provider_cache_provider_slug_key DO UPDATE
+    SET provider_id = EXCLUDED.provider_id,
+        data = EXCLUDED.data,
+        cached_at = EXCLUDED.cached_at,
+        expires_at = EXCLUDED.expires_at
+    RETURNING c.provider_id, c.provider_slug, c.data, c.cached_at, false, false;
+END;
+$$;
+
+ALTER FUNCTION public.get_provider_cache(p_slug text, p_ttl_minutes integer, p_stale_minutes integer) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.get_provider_cache(p_slug text, p_ttl_minutes integer, p_stale_minutes integer) IS 'BB_95 get: cached provider payload (stale-while-revalidate within p_stale_minutes), filled at most once per slug at a time (advisory lock).';
+
+
+CREATE OR REPLACE FUNCTION public.warm_provider_cache(p_ttl_minutes integer DEFAULT 1440, p_refresh_ahead_minutes integer DEFAULT 60, p_force boolean DEFAULT false) RETURNS TABLE(warmed integer, refreshed integer)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    RETURN QUERY
+    WITH written AS (
+        INSERT INTO public.provider_cache AS c (provider_id, provider_slug, data, cached_at, expires_at)
+        SELECT v.provider_id, v.provider_slug, v.data, NOW(), NOW() + make_interval(mins => p_ttl_minutes)
+        FROM public.v_provider_cache_source v
+        LEFT JOIN public.provider_cache pc ON pc.provider_slug = v.provider_slug
+        WHERE (pc.id IS NOT NULL OR v.public_booking_enabled)
+          AND (p_force
+               OR pc.id IS NULL
+               OR pc.expires_at <= NOW() + make_interval(mins => p_refresh_ahead_minutes))
+        ON CONFLICT ON CONSTRAINT provider_cache_provider_slug_key DO UPDATE
+        SET provider_id = EXCLUDED.provider_id,
+            data = EXCLUDED.data,
+            cached_at = EXCLUDED.cached_at,
+            expires_at = EXCLUDED.expires_at
+        RETURNING (xmax = 0) AS inserted
+    )
+    SELECT COUNT(*) FILTER (WHERE inserted)::integer,
+           COUNT(*) FILTER (WHERE NOT inserted)::integer
+    FROM written;
+END;
+$$;
+
+ALTER FUNCTION public.warm_provider_cache(p_ttl_minutes integer, p_refresh_ahead_minutes integer, p_force boolean) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.warm_provider_cache(p_ttl_minutes integer, p_refresh_ahead_minutes integer, p_force boolean) IS 'Set-based warm-up / refresh-ahead of provider_cache: missing public providers, rows expiring within the window, or all rows when forced.';
+
+COMMIT;
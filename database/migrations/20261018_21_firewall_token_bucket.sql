@@ -0,0 +1,220 @@
+-- Migration: security_firewall - token-bucket rate limiting and batched write-behind
+-- Date: 2026-10-18
+-- Purpose: BB_02_Security_Firewall ran a Check Firewall SELECT and then a Log
+--          Access upsert for every inbound Telegram message. Log Access also
+--          added 1 to strike_count on every granted message. So any user who
+--          had sent 10 messages and wrote again within the hour got
+--          SEC_RATE_LIMITED, whatever their pace. Now:
+--            - strike_count counts rate-limit violations only. The rate is a
+--              token bucket stored on the row (tokens, tokens_at): capacity
+--              10, refilled at 0.5 token/s.
+--            - A message that finds the bucket empty is a strike. Strikes
+--              reset after an hour without one. The 5th strike blocks the
+--              entity for 15 minutes and resets the count.
+--            - Blocks stay authoritative in the table: is_blocked with
+--              blocked_until in the future, or NULL for an indefinite block.
+--              Nothing here ever shortens or lifts a block.
+--
+--   firewall_hit(entity)  BB_02's single round trip. Checks the block, takes
+--                         a token, and writes the row only when the bucket or
+--                         the strikes changed.
+--   firewall_flush(...)   write-behind for scripts-py/firewall_engine.py,
+--                         which keeps the buckets in memory. Pending bucket
+--                         states and strike deltas of many entities are
+--                         applied as one set-based batch: missing rows
+--                         inserted, rows locked, then ONE UPDATE ... FROM
+--                         unnest(...). Entity ids must be distinct. It
+--                         returns the resulting block state.
+--
+-- Changes to is_blocked / blocked_until notify the 'security_firewall'
+-- channel with the entity_id (admin blocks and unblocks included), so
+-- in-memory engines pick them up without polling.
+--
+-- API:
+--   firewall_hit(entity_id, capacity, refill_per_sec, strikes_to_block,
+--                block_minutes, strike_reset_minutes)
+--       -> allowed, reason (NULL / SEC_BLOCKED / SEC_RATE_LIMITED),
+--          strike_count, blocked_until, retry_after_seconds
+--   firewall_flush(entity_ids[], strikes[], last_strike_at[], tokens[],
+--                  tokens_at[], strikes_to_block, block_minutes,
+--                  strike_reset_minutes)
+--       -> entity_id, strike_count, is_blocked, blocked_until
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_21_firewall_token_bucket.sql
+
+BEGIN;
+
+ALTER TABLE public.security_firewall
+    ADD COLUMN IF NOT EXISTS tokens double precision,
+    ADD COLUMN IF NOT EXISTS tokens_at timestamp with time zone;
+
+COMMENT ON COLUMN public.security_firewall.tokens IS 'Token bucket level at tokens_at (NULL = full).';
+COMMENT ON COLUMN public.security_firewall.strike_count IS 'Rate-limit violations since the last block or the last quiet strike_reset window.';
+
+-- Old rows counted every message; start everyone with a clean streak
+UPDATE public.security_firewall SET strike_count = 0 WHERE strike_count <> 0;
+
+
+-- Strike streak after adding p_delta strikes at p_at
+CREATE OR REPLACE FUNCTION public.firewall_next_strikes(p_count integer, p_last_strike_at timestamp with time zone, p_delta integer, p_at timestamp with time zone, p_reset_minutes integer) RETURNS integer
+    LANGUAGE sql IMMUTABLE
+    AS $$
+    SELECT CASE
+        WHEN p_delta <= 0 THEN COALESCE(p_count, 0)
+        WHEN p_last_strike_at IS NULL OR p_last_strike_at < p_at - make_interval(mins => p_reset_minutes) THEN p_delta
+        ELSE COALESCE(p_count, 0) + p_delta
+    END;
+$$;
+
+ALTER FUNCTION public.firewall_next_strikes(p_count integer, p_last_strike_at timestamp with time zone, p_delta integer, p_at timestamp with time zone, p_reset_minutes integer) OWNER TO neondb_owner;
+
+
+CREATE OR REPLACE FUNCTION public.firewall_hit(
+    p_entity_id text,
+    p_capacity double precision DEFAULT 10,
+    p_refill_per_sec double precision DEFAULT 0.5,
+    p_strikes_to_block integer DEFAULT 5,
+    p_block_minutes integer DEFAULT 15,
+    p_strike_reset_minutes integer DEFAULT 60
+) RETURNS TABLE(allowed boolean, reason text, strike_count integer, blocked_until timestamp with time zone, retry_after_seconds double precision)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_now timestamp with time zone := clock_timestamp();
+    v_row public.security_firewall%ROWTYPE;
+    v_tokens double precision;
+    v_strikes integer;
+BEGIN
+    -- Blocked entities are answered without a row lock or a write
+    SELECT * INTO v_row FROM public.security_firewall f WHERE f.entity_id = p_entity_id;
+    IF FOUND AND NOT (v_row.is_blocked AND (v_row.blocked_until IS NULL OR v_row.blocked_until > v_now)) THEN
+        SELECT * INTO v_row FROM public.security_firewall f WHERE f.entity_id = p_entity_id FOR UPDATE;
+    ELSIF NOT FOUND THEN
+        INSERT INTO public.security_firewall (entity_id, strike_count, last_strike_at, tokens, tokens_at)
+        VALUES (p_entity_id, 0, NULL, p_capacity - 1, v_now)
+        ON CONFLICT ON CONSTRAINT security_firewall_entity_id_key DO NOTHING;
+        IF FOUND THEN
+            RETURN QUERY SELECT true, NULL::text, 0, NULL::timestamp with time zone, 0::double precision;
+            RETURN;
+        END IF;
+        SELECT * INTO v_row FROM public.security_firewall f WHERE f.entity_id = p_entity_id FOR UPDATE;
+    END IF;
+
+    IF v_row.is_blocked AND (v_row.blocked_until IS NULL OR v_row.blocked_until > v_now) THEN
+        RETURN QUERY SELECT false, 'SEC_BLOCKED'::text, v_row.strike_count, v_row.blocked_until,
+            EXTRACT(EPOCH FROM v_row.blocked_until - v_now)::double precision;
+        RETURN;
+    END IF;
+
+    v_tokens := LEAST(p_capacity, COALESCE(v_row.tokens, p_capacity)
+        + GREATEST(EXTRACT(EPOCH FROM v_now - COALESCE(v_row.tokens_at, v_now)), 0) * p_refill_per_sec);
+
+    IF v_tokens >= 1 THEN
+        UPDATE public.security_firewall f SET tokens = v_tokens - 1, tokens_at = v_now WHERE f.id = v_row.id;
+        RETURN QUERY SELECT true, NULL::text, v_row.strike_count, NULL::timestamp with time zone, 0::double precision;
+        RETURN;
+    END IF;
+
+    v_strikes := public.firewall_next_strikes(v_row.strike_count, v_row.last_strike_at, 1, v_now, p_strike_reset_minutes);
+    IF v_strikes >= p_strikes_to_block THEN
+        UPDATE public.security_firewall f
+        SET strike_count = 0, last_strike_at = v_now, tokens = v_tokens, tokens_at = v_now,
+            is_blocked = true, blocked_until = v_now + make_interval(mins => p_block_minutes)
+        WHERE f.id = v_row.id;
+        RETURN QUERY SELECT false, 'SEC_BLOCKED'::text, v_strikes, v_now + make_interval(mins => p_block_minutes),
+            p_block_minutes * 60::double precision;
+        RETURN;
+    END IF;
+
+    UPDATE public.security_firewall f
+    SET strike_count = v_strikes, last_strike_at = v_now, tokens = v_tokens, tokens_at = v_now
+    WHERE f.id = v_row.id;
+    RETURN QUERY SELECT false, 'SEC_RATE_LIMITED'::text, v_strikes, NULL::timestamp with time zone,
+        (1 - v_tokens) / p_refill_per_sec;
+END;
+$$;
+
+ALTER FUNCTION public.firewall_hit(p_entity_id text, p_capacity double precision, p_refill_per_sec double precision, p_strikes_to_block integer, p_block_minutes integer, p_strike_reset_minutes integer) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.firewall_hit(p_entity_id text, p_capacity double precision, p_refill_per_sec double precision, p_strikes_to_block integer, p_block_minutes integer, p_strike_reset_minutes integer) IS 'BB_02: block check + token bucket + strike/block escalation for one message, one round trip.';
+
+
+CREATE OR REPLACE FUNCTION public.firewall_flush(
+    p_entity_ids text[],
+    p_strikes integer[],
+    p_last_strike_at timestamp with time zone[],
+    p_tokens double precision[],
+    p_tokens_at timestamp with time zone[],
+    p_strikes_to_block integer DEFAULT 5,
+    p_block_minutes integer DEFAULT 15,
+    p_strike_reset_minutes integer DEFAULT 60
+) RETURNS TABLE(entity_id text, strike_count integer, is_blocked boolean, blocked_until timestamp with time zone)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    INSERT INTO public.security_firewall (entity_id, strike_count, last_strike_at)
+    SELECT DISTINCT e, 0, NULL::timestamp with time zone FROM unnest(p_entity_ids) e
+    ON CONFLICT ON CONSTRAINT security_firewall_entity_id_key DO NOTHING;
+
+    -- Locked in a fixed order so concurrent flushes and firewall_hit() cannot
+    -- deadlock, and so the streaks below are computed from current rows
+    PERFORM 1 FROM public.security_firewall f WHERE f.entity_id = ANY(p_entity_ids) ORDER BY f.entity_id FOR UPDATE;
+
+    RETURN QUERY
+    UPDATE public.security_firewall f
+    SET strike_count = CASE WHEN s.streak >= p_strikes_to_block THEN 0 ELSE s.streak END,
+        last_strike_at = GREATEST(f.last_strike_at, s.last_strike_at),
+        tokens = CASE WHEN s.tokens_at IS NOT NULL AND (f.tokens_at IS NULL OR s.tokens_at >= f.tokens_at) THEN s.tokens ELSE f.tokens END,
+        tokens_at = GREATEST(f.tokens_at, s.tokens_at),
+        is_blocked = f.is_blocked OR s.streak >= p_strikes_to_block,
+        -- An indefinite block (NULL) stays indefinite; a timed one is only ever extended
+        blocked_until = CASE
+            WHEN f.is_blocked AND f.blocked_until IS NULL THEN NULL
+            WHEN s.streak >= p_strikes_to_block THEN GREATEST(f.blocked_until, s.last_strike_at + make_interval(mins => p_block_minutes))
+            ELSE f.blocked_until
+        END
+    FROM (
+        SELECT u.entity_id, u.last_strike_at, u.tokens, u.tokens_at,
+               public.firewall_next_strikes(c.strike_count, c.last_strike_at, u.strikes, u.last_strike_at, p_strike_reset_minutes) AS streak
+        FROM unnest(p_entity_ids, p_strikes, p_last_strike_at, p_tokens, p_tokens_at)
+             AS u(entity_id, strikes, last_strike_at, tokens, tokens_at)
+        JOIN public.security_firewall c ON c.entity_id = u.entity_id
+    ) s
+    WHERE f.entity_id = s.entity_id
+    RETURNING f.entity_id, f.strike_count, f.is_blocked, f.blocked_until;
+END;
+$$;
+
+ALTER FUNCTION public.firewall_flush(p_entity_ids text[], p_strikes integer[], p_last_strike_at timestamp with time zone[], p_tokens double precision[], p_tokens_at timestamp with time zone[], p_strikes_to_block integer, p_block_minutes integer, p_strike_reset_minutes integer) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.firewall_flush(p_entity_ids text[], p_strikes integer[], p_last_strike_at timestamp with time zone[], p_tokens double precision[], p_tokens_at timestamp with time zone[], p_strikes_to_block integer, p_block_minutes integer, p_strike_reset_minutes integer) IS 'Write-behind for in-memory firewall engines: one batched upsert of bucket levels and strike deltas; returns the resulting block state.';
+
+
+CREATE OR REPLACE FUNCTION public.notify_firewall_block() RETURNS trigger
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    IF TG_OP = 'INSERT' AND NOT NEW.is_blocked THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'UPDATE' AND OLD.is_blocked IS NOT DISTINCT FROM NEW.is_blocked
+       AND OLD.blocked_until IS NOT DISTINCT FROM NEW.blocked_until THEN
+        RETURN NULL;
+    END IF;
+    PERFORM pg_notify('security_firewall', COALESCE(NEW.entity_id, OLD.entity_id));
+    RETURN NULL;
+END;
+$$;
+
+ALTER FUNCTION public.notify_firewall_block() OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.notify_firewall_block() IS 'Row trigger on security_firewall: notifies the security_firewall channel when an entity''s block state changes.';
+
+DROP TRIGGER IF EXISTS trg_firewall_block_notify ON public.security_firewall;
+
+CREATE TRIGGER trg_firewall_block_notify
+    AFTER INSERT OR UPDATE OF is_blocked, blocked_until OR DELETE ON public.security_firewall
+    FOR EACH ROW EXECUTE FUNCTION public.notify_firewall_block();
+
+COMMIT;
@@ -0,0 +1,269 @@
+-- Migration: security_firewall - sliding-window message quota
+-- Date: 2026-10-18
+-- Purpose: The token bucket from 20261018_21 limits bursts (10 messages,
+--          then 0.5/s), but a sender who stays just under the refill rate
+--          gets 300 messages every 10 minutes. The table had no way to say
+--          "N messages per window". Each row now also keeps a
+--          sliding-window counter:
+--            - Fixed windows of p_window_seconds, aligned to the epoch.
+--              window_start / window_count are the current window, and
+--              prev_window_count is the one before it.
+--            - The sliding count is prev_window_count weighted by how much
+--              of the previous window still overlaps the last
+--              p_window_seconds, plus window_count. This is three columns
+--              instead of a log of every message.
+--            - A message is allowed when the bucket has a token AND the
+--              sliding count is under p_window_limit (60 per 10 minutes by
+--              default; 0 disables the quota). Only allowed messages are
+--              counted. A denied message is a strike, as before, and
+--              retry_after_seconds is the longer of the two waits.
+--
+--   firewall_hit(...)    gains p_window_limit and p_window_seconds at the
+--                        end, so BB_02's firewall_hit($1) call is unchanged.
+--   firewall_flush(...)  gains the engine's window deltas: the window they
+--                        were counted in, and the count for that window and
+--                        the one before it. They are added to the row's
+--                        counters, so several engines share one quota. The
+--                        merged counters are returned.
+--
+-- Blocked entities: scripts-py/firewall_engine.py now keeps them in a bloom
+-- filter rebuilt from the blocks in this table. Clean entities are answered
+-- without touching it. Nothing changes in the table for that.
+--
+-- API:
+--   firewall_hit(entity_id, capacity, refill_per_sec, strikes_to_block,
+--                block_minutes, strike_reset_minutes, window_limit,
+--                window_seconds)
+--       -> allowed, reason, strike_count, blocked_until, retry_after_seconds
+--   firewall_flush(entity_ids[], strikes[], last_strike_at[], tokens[],
+--                  tokens_at[], window_start[], window_count[],
+--                  prev_window_count[], strikes_to_block, block_minutes,
+--                  strike_reset_minutes, window_seconds)
+--       -> entity_id, strike_count, is_blocked, blocked_until,
+--          window_start, window_count, prev_window_count
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_22_firewall_sliding_window.sql
+
+BEGIN;
+
+ALTER TABLE public.security_firewall
+    ADD COLUMN IF NOT EXISTS window_start timestamp with time zone,
+    ADD COLUMN IF NOT EXISTS window_count integer DEFAULT 0 NOT NULL,
+    ADD COLUMN IF NOT EXISTS prev_window_count integer DEFAULT 0 NOT NULL;
+
+COMMENT ON COLUMN public.security_firewall.window_start IS 'Start of the fixed window counted in window_count (epoch-aligned).';
+COMMENT ON COLUMN public.security_firewall.window_count IS 'Allowed messages in the window starting at window_start.';
+COMMENT ON COLUMN public.security_firewall.prev_window_count IS 'Allowed messages in the window before window_start.';
+
+
+-- Seconds until the sliding count drops under p_limit. p_elapsed is the time
+-- since the current window started.
+CREATE OR REPLACE FUNCTION public.firewall_window_wait(p_count integer, p_prev integer, p_elapsed double precision, p_limit integer, p_seconds integer) RETURNS double precision
+    LANGUAGE sql IMMUTABLE
+    AS $$
+    SELECT GREATEST(CASE
+        -- The current window alone is over: wait until it has slid far enough out
+        WHEN p_count >= p_limit THEN p_seconds * (2 - p_limit::double precision / p_count) - p_elapsed
+        WHEN p_prev > 0 THEN p_seconds * (1 - (p_limit - p_count)::double precision / p_prev) - p_elapsed
+        ELSE 0
+    END, 0);
+$$;
+
+ALTER FUNCTION public.firewall_window_wait(p_count integer, p_prev integer, p_elapsed double precision, p_limit integer, p_seconds integer) OWNER TO neondb_owner;
+
+
+-- Adds window deltas counted elsewhere (u_*) to a row's counters (c_*)
+CREATE OR REPLACE FUNCTION public.firewall_merge_window(
+    c_start timestamp with time zone, c_count integer, c_prev integer,
+    u_start timestamp with time zone, u_count integer, u_prev integer,
+    p_seconds integer,
+    OUT window_start timestamp with time zone, OUT window_count integer, OUT prev_window_count integer
+)
+    LANGUAGE plpgsql IMMUTABLE
+    AS $$
+DECLARE
+    v_window interval := make_interval(secs => p_seconds);
+BEGIN
+    IF u_start IS NULL OR (u_count = 0 AND u_prev = 0) THEN
+        SELECT c_start, c_count, c_prev INTO window_start, window_count, prev_window_count;
+    ELSIF c_start IS NULL OR u_start >= c_start + 2 * v_window THEN
+        SELECT u_start, u_count, u_prev INTO window_start, window_count, prev_window_count;
+    ELSIF u_start = c_start + v_window THEN
+        SELECT u_start, u_count, c_count + u_prev INTO window_start, window_count, prev_window_count;
+    ELSIF u_start = c_start THEN
+        SELECT c_start, c_count + u_count, c_prev + u_prev INTO window_start, window_count, prev_window_count;
+    ELSIF u_start = c_start - v_window THEN
+        -- The row already moved on; the deltas' current window is its previous one
+        SELECT c_start, c_count, c_prev + u_count INTO window_start, window_count, prev_window_count;
+    ELSE
+        SELECT c_start, c_count, c_prev INTO window_start, window_count, prev_window_count;
+    END IF;
+END;
+$$;
+
+ALTER FUNCTION public.firewall_merge_window(c_start timestamp with time zone, c_count integer, c_prev integer, u_start timestamp with time zone, u_count integer, u_prev integer, p_seconds integer, OUT window_start timestamp with time zone, OUT window_count integer, OUT prev_window_count integer) OWNER TO neondb_owner;
+
+
+DROP FUNCTION IF EXISTS public.firewall_hit(text, double precision, double precision, integer, integer, integer);
+
+CREATE FUNCTION public.firewall_hit(
+    p_entity_id text,
+    p_capacity double precision DEFAULT 10,
+    p_refill_per_sec double precision DEFAULT 0.5,
+    p_strikes_to_block integer DEFAULT 5,
+    p_block_minutes integer DEFAULT 15,
+    p_strike_reset_minutes integer DEFAULT 60,
+    p_window_limit integer DEFAULT 60,
+    p_window_seconds integer DEFAULT 600
+) RETURNS TABLE(allowed boolean, reason text, strike_count integer, blocked_until timestamp with time zone, retry_after_seconds double precision)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_now timestamp with time zone := clock_timestamp();
+    v_window_start timestamp with time zone := to_timestamp(floor(EXTRACT(EPOCH FROM v_now) / p_window_seconds) * p_window_seconds);
+    v_elapsed double precision := EXTRACT(EPOCH FROM v_now - v_window_start);
+    v_row public.security_firewall%ROWTYPE;
+    v_tokens double precision;
+    v_count integer;
+    v_prev integer;
+    v_over_window boolean;
+    v_retry double precision;
+    v_strikes integer;
+BEGIN
+    -- Blocked entities are answered without a row lock or a write
+    SELECT * INTO v_row FROM public.security_firewall f WHERE f.entity_id = p_entity_id;
+    IF FOUND AND NOT (v_row.is_blocked AND (v_row.blocked_until IS NULL OR v_row.blocked_until > v_now)) THEN
+        SELECT * INTO v_row FROM public.security_firewall f WHERE f.entity_id = p_entity_id FOR UPDATE;
+    ELSIF NOT FOUND THEN
+        INSERT INTO public.security_firewall (entity_id, strike_count, last_strike_at, tokens, tokens_at, window_start, window_count)
+        VALUES (p_entity_id, 0, NULL, p_capacity - 1, v_now, v_window_start, 1)
+        ON CONFLICT ON CONSTRAINT security_firewall_entity_id_key DO NOTHING;
+        IF FOUND THEN
+            RETURN QUERY SELECT true, NULL::text, 0, NULL::timestamp with time zone, 0::double precision;
+            RETURN;
+        END IF;
+        SELECT * INTO v_row FROM public.security_firewall f WHERE f.entity_id = p_entity_id FOR UPDATE;
+    END IF;
+
+    IF v_row.is_blocked AND (v_row.blocked_until IS NULL OR v_row.blocked_until > v_now) THEN
+        RETURN QUERY SELECT false, 'SEC_BLOCKED'::text, v_row.strike_count, v_row.blocked_until,
+            EXTRACT(EPOCH FROM v_row.blocked_until - v_now)::double precision;
+        RETURN;
+    END IF;
+
+    v_tokens := LEAST(p_capacity, COALESCE(v_row.tokens, p_capacity)
+        + GREATEST(EXTRACT(EPOCH FROM v_now - COALESCE(v_row.tokens_at, v_now)), 0) * p_refill_per_sec);
+
+    -- The row's counters, rolled forward to the current window
+    IF v_row.window_start = v_window_start THEN
+        v_count := v_row.window_count;
+        v_prev := v_row.prev_window_count;
+    ELSE
+        v_count := 0;
+        v_prev := CASE WHEN v_row.window_start = v_window_start - make_interval(secs => p_window_seconds) THEN v_row.window_count ELSE 0 END;
+    END IF;
+    v_over_window := p_window_limit > 0
+        AND v_prev * (1 - v_elapsed / p_window_seconds) + v_count >= p_window_limit;
+
+    IF v_tokens >= 1 AND NOT v_over_window THEN
+        UPDATE public.security_firewall f
+        SET tokens = v_tokens - 1, tokens_at = v_now,
+            window_start = v_window_start, window_count = v_count + 1, prev_window_count = v_prev
+        WHERE f.id = v_row.id;
+        RETURN QUERY SELECT true, NULL::text, v_row.strike_count, NULL::timestamp with time zone, 0::double precision;
+        RETURN;
+    END IF;
+
+    v_retry := GREATEST(
+        CASE WHEN v_tokens < 1 THEN (1 - v_tokens) / p_refill_per_sec ELSE 0 END,
+        CASE WHEN v_over_window THEN public.firewall_window_wait(v_count, v_prev, v_elapsed, p_window_limit, p_window_seconds) ELSE 0 END
+    );
+
+    v_strikes := public.firewall_next_strikes(v_row.strike_count, v_row.last_strike_at, 1, v_now, p_strike_reset_minutes);
+    IF v_strikes >= p_strikes_to_block THEN
+        UPDATE public.security_firewall f
+        SET strike_count = 0, last_strike_at = v_now, tokens = v_tokens, tokens_at = v_now,
+            is_blocked = true, blocked_until = v_now + make_interval(mins => p_block_minutes)
+        WHERE f.id = v_row.id;
+        RETURN QUERY SELECT false, 'SEC_BLOCKED'::text, v_strikes, v_now + make_interval(mins => p_block_minutes),
+            p_block_minutes * 60::double precision;
+        RETURN;
+    END IF;
+
+    UPDATE public.security_firewall f
+    SET strike_count = v_strikes, last_strike_at = v_now, tokens = v_tokens, tokens_at = v_now
+    WHERE f.id = v_row.id;
+    RETURN QUERY SELECT false, 'SEC_RATE_LIMITED'::text, v_strikes, NULL::timestamp with time zone, v_retry;
+END;
+$$;
+
+ALTER FUNCTION public.firewall_hit(p_entity_id text, p_capacity double precision, p_refill_per_sec double precision, p_strikes_to_block integer, p_block_minutes integer, p_strike_reset_minutes integer, p_window_limit integer, p_window_seconds integer) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.firewall_hit(p_entity_id text, p_capacity double precision, p_refill_per_sec double precision, p_strikes_to_block integer, p_block_minutes integer, p_strike_reset_minutes integer, p_window_limit integer, p_window_seconds integer) IS 'BB_02: block check + token bucket + sliding-window quota + strike/block escalation for one message, one round trip.';
+
+
+DROP FUNCTION IF EXISTS public.firewall_flush(text[], integer[], timestamp with time zone[], double precision[], timestamp with time zone[], integer, integer, integer);
+
+CREATE FUNCTION public.firewall_flush(
+    p_entity_ids text[],
+    p_strikes integer[],
+    p_last_strike_at timestamp with time zone[],
+    p_tokens double precision[],
+    p_tokens_at timestamp with time zone[],
+    p_window_start timestamp with time zone[],
+    p_window_count integer[],
+    p_prev_window_count integer[],
+    p_strikes_to_block integer DEFAULT 5,
+    p_block_minutes integer DEFAULT 15,
+    p_strike_reset_minutes integer DEFAULT 60,
+    p_window_seconds integer DEFAULT 600
+) RETURNS TABLE(entity_id text, strike_count integer, is_blocked boolean, blocked_until timestamp with time zone,
+                window_start timestamp with time zone, window_count integer, prev_window_count integer)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    INSERT INTO public.security_firewall (entity_id, strike_count, last_strike_at)
+    SELECT DISTINCT e, 0, NULL::timestamp with time zone FROM unnest(p_entity_ids) e
+    ON CONFLICT ON CONSTRAINT security_firewall_entity_id_key DO NOTHING;
+
+    -- Locked in a fixed order so concurrent flushes and firewall_hit() cannot
+    -- deadlock, and so the streaks below are computed from current rows
+    PERFORM 1 FROM public.security_firewall f WHERE f.entity_id = ANY(p_entity_ids) ORDER BY f.entity_id FOR UPDATE;
+
+    RETURN QUERY
+    UPDATE public.security_firewall f
+    SET strike_count = CASE WHEN s.streak >= p_strikes_to_block THEN 0 ELSE s.streak END,
+        last_strike_at = GREATEST(f.last_strike_at, s.last_strike_at),
+        tokens = CASE WHEN s.tokens_at IS NOT NULL AND (f.tokens_at IS NULL OR s.tokens_at >= f.tokens_at) THEN s.tokens ELSE f.tokens END,
+        tokens_at = GREATEST(f.tokens_at, s.tokens_at),
+        window_start = s.merged_start,
+        window_count = s.merged_count,
+        prev_window_count = s.merged_prev,
+        is_blocked = f.is_blocked OR s.streak >= p_strikes_to_block,
+        -- An indefinite block (NULL) stays indefinite; a timed one is only ever extended
+        blocked_until = CASE
+            WHEN f.is_blocked AND f.blocked_until IS NULL THEN NULL
+            WHEN s.streak >= p_strikes_to_block THEN GREATEST(f.blocked_until, s.last_strike_at + make_interval(mins => p_block_minutes))
+            ELSE f.blocked_until
+        END
+    FROM (
+        SELECT u.entity_id, u.last_strike_at, u.tokens, u.tokens_at,
+               public.firewall_next_strikes(c.strike_count, c.last_strike_at, u.strikes, u.last_strike_at, p_strike_reset_minutes) AS streak,
+               w.window_start AS merged_start, w.window_count AS merged_count, w.prev_window_count AS merged_prev
+        FROM unnest(p_entity_ids, p_strikes, p_last_strike_at, p_tokens, p_tokens_at, p_window_start, p_window_count, p_prev_window_count)
+             AS u(entity_id, strikes, last_strike_at, tokens, tokens_at, window_start, window_count, prev_window_count)
+        JOIN public.security_firewall c ON c.entity_id = u.entity_id
+        CROSS JOIN LATERAL public.firewall_merge_window(c.window_start, c.window_count, c.prev_window_count,
+                                                        u.window_start, u.window_count, u.prev_window_count, p_window_seconds) w
+    ) s
+    WHERE f.entity_id = s.entity_id
+    RETURNING f.entity_id, f.strike_count, f.is_blocked, f.blocked_until, f.window_start, f.window_count, f.prev_window_count;
+END;
+$$;
+
+ALTER FUNCTION public.firewall_flush(p_entity_ids text[], p_strikes integer[], p_last_strike_at timestamp with time zone[], p_tokens double precision[], p_tokens_at timestamp with time zone[], p_window_start timestamp with time zone[], p_window_count integer[], p_prev_window_count integer[], p_strikes_to_block integer, p_block_minutes integer, p_strike_reset_minutes integer, p_window_seconds integer) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.firewall_flush(p_entity_ids text[], p_strikes integer[], p_last_strike_at timestamp with time zone[], p_tokens double precision[], p_tokens_at timestamp with time zone[], p_window_start timestamp with time zone[], p_window_count integer[], p_prev_window_count integer[], p_strikes_to_block integer, p_block_minutes integer, p_strike_reset_minutes integer, p_window_seconds integer) IS 'Write-behind for in-memory firewall engines: one batched upsert of bucket levels, window counts and strike deltas; returns the resulting block and window state.';
+
+COMMIT;
@@ -0,0 +1,328 @@
+-- Migration: circuit_breaker_state - rolling failure rate, per-workflow settings, HALF_OPEN probes
+-- Date: 2026-10-18
+-- Purpose: BB_05_Circuit_Breaker_Helper's Record Failure set state = 'OPEN'
+--          on the very first failure, and nothing ever lowered
+--          failure_count except a success. A dependency that failed one
+--          call in twenty was cut off for 60 s every few calls. HALF_OPEN
+--          admitted every caller. Now:
+--            - Every result (success or failure) is counted in a rolling
+--              window on the row. It is an epoch-aligned fixed window plus
+--              the previous one weighted by its overlap, as in
+--              security_firewall (20261018_22). The breaker opens when the
+--              window holds at least min_calls calls and the failure rate
+--              reaches failure_rate_threshold.
+--            - OPEN lasts open_seconds. The first check after that moves the
+--              breaker to HALF_OPEN and admits at most half_open_max_calls
+--              probe calls, claimed under the row lock, so the limit holds
+--              across every caller. All probes succeeding closes the breaker
+--              with an empty window; a failed probe reopens it. Probes that
+--              never report are written off after open_seconds, and a new
+--              round starts.
+--            - Settings are per workflow_name in circuit_breaker_config. The
+--              '*' row holds the defaults, and built-in defaults apply if
+--              it is missing.
+--
+-- Changes of state, and of settings, notify the 'circuit_breaker' channel
+-- with the workflow_name ('*' for the defaults), so in-process breakers
+-- (scripts-py/circuit_breaker.py) follow them without polling.
+--
+-- API:
+--   circuit_breaker_settings(workflow_name)
+--       -> failure_rate_threshold, min_calls, window_seconds, open_seconds,
+--          half_open_max_calls
+--   circuit_breaker_check(workflow_name)
+--       -> allowed, state, reason (closed / open / probe / probes_in_flight),
+--          failure_count, retry_after_seconds
+--   circuit_breaker_record(workflow_name, success)
+--       -> state, failure_count, failure_rate, next_attempt_at, transitioned
+--   circuit_breaker_trip(workflow_name, failure_count)
+--       -> state, next_attempt_at; opens a CLOSED breaker (used by
+--          in-process breakers whose own window tripped)
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_23_circuit_breaker_half_open.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.circuit_breaker_config (
+    workflow_name character varying(200) NOT NULL,
+    failure_rate_threshold double precision DEFAULT 0.5 NOT NULL,
+    min_calls integer DEFAULT 5 NOT NULL,
+    window_seconds integer DEFAULT 60 NOT NULL,
+    open_seconds integer DEFAULT 60 NOT NULL,
+    half_open_max_calls integer DEFAULT 3 NOT NULL,
+    updated_at timestamp with time zone DEFAULT now(),
+    CONSTRAINT circuit_breaker_config_pkey PRIMARY KEY (workflow_name),
+    CONSTRAINT circuit_breaker_config_rate_check CHECK (failure_rate_threshold > 0 AND failure_rate_threshold <= 1),
+    CONSTRAINT circuit_breaker_config_values_check CHECK (min_calls > 0 AND window_seconds > 0 AND open_seconds > 0 AND half_open_max_calls > 0)
+);
+
+ALTER TABLE public.circuit_breaker_config OWNER TO neondb_owner;
+
+COMMENT ON TABLE public.circuit_breaker_config IS 'Circuit breaker settings per workflow_name; the ''*'' row holds the defaults.';
+
+INSERT INTO public.circuit_breaker_config (workflow_name) VALUES ('*')
+ON CONFLICT (workflow_name) DO NOTHING;
+
+ALTER TABLE public.circuit_breaker_state
+    ADD COLUMN IF NOT EXISTS window_start timestamp with time zone,
+    ADD COLUMN IF NOT EXISTS window_calls integer DEFAULT 0 NOT NULL,
+    ADD COLUMN IF NOT EXISTS window_failures integer DEFAULT 0 NOT NULL,
+    ADD COLUMN IF NOT EXISTS prev_window_calls integer DEFAULT 0 NOT NULL,
+    ADD COLUMN IF NOT EXISTS prev_window_failures integer DEFAULT 0 NOT NULL,
+    ADD COLUMN IF NOT EXISTS half_open_calls integer DEFAULT 0 NOT NULL,
+    ADD COLUMN IF NOT EXISTS half_open_successes integer DEFAULT 0 NOT NULL;
+
+COMMENT ON COLUMN public.circuit_breaker_state.failure_count IS 'Failures in the rolling window (weighted, rounded) at the last recorded call.';
+COMMENT ON COLUMN public.circuit_breaker_state.next_attempt_at IS 'OPEN: end of the cool-down. HALF_OPEN: when unreported probes are written off.';
+
+-- Old counts never decayed and are not rates; start every window empty
+UPDATE public.circuit_breaker_state SET failure_count = 0 WHERE state = 'CLOSED' AND failure_count <> 0;
+
+
+CREATE OR REPLACE FUNCTION public.circuit_breaker_settings(p_workflow_name text)
+RETURNS TABLE(failure_rate_threshold double precision, min_calls integer, window_seconds integer, open_seconds integer, half_open_max_calls integer)
+    LANGUAGE sql STABLE
+    AS $$
+    SELECT s.failure_rate_threshold, s.min_calls, s.window_seconds, s.open_seconds, s.half_open_max_calls
+    FROM (
+        SELECT c.failure_rate_threshold, c.min_calls, c.window_seconds, c.open_seconds, c.half_open_max_calls,
+               CASE WHEN c.workflow_name = p_workflow_name THEN 0 ELSE 1 END AS rank
+        FROM public.circuit_breaker_config c
+        WHERE c.workflow_name IN (p_workflow_name, '*')
+        UNION ALL
+        SELECT 0.5, 5, 60, 60, 3, 2
+    ) s
+    ORDER BY s.rank
+    LIMIT 1;
+$$;
+
+ALTER FUNCTION public.circuit_breaker_settings(p_workflow_name text) OWNER TO neondb_owner;
+
+
+CREATE OR REPLACE FUNCTION public.circuit_breaker_check(p_workflow_name text)
+RETURNS TABLE(allowed boolean, state text, reason text, failure_count integer, retry_after_seconds double precision)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_now timestamp with time zone := clock_timestamp();
+    v_row public.circuit_breaker_state%ROWTYPE;
+    v_cfg record;
+BEGIN
+    -- CLOSED, and OPEN within the cool-down, are answered without a lock or a write
+    SELECT * INTO v_row FROM public.circuit_breaker_state c WHERE c.workflow_name = p_workflow_name;
+    IF NOT FOUND OR v_row.state = 'CLOSED' THEN
+        RETURN QUERY SELECT true, 'CLOSED'::text, 'closed'::text, COALESCE(v_row.failure_count, 0), 0::double precision;
+        RETURN;
+    END IF;
+    IF v_row.state = 'OPEN' AND v_row.next_attempt_at > v_now THEN
+        RETURN QUERY SELECT false, 'OPEN'::text, 'open'::text, v_row.failure_count,
+            EXTRACT(EPOCH FROM v_row.next_attempt_at - v_now)::double precision;
+        RETURN;
+    END IF;
+
+    -- Probe slots are claimed under the row lock
+    SELECT * INTO v_cfg FROM public.circuit_breaker_settings(p_workflow_name);
+    SELECT * INTO v_row FROM public.circuit_breaker_state c WHERE c.workflow_name = p_workflow_name FOR UPDATE;
+
+    IF v_row.state = 'CLOSED' THEN
+        RETURN QUERY SELECT true, 'CLOSED'::text, 'closed'::text, v_row.failure_count, 0::double precision;
+        RETURN;
+    END IF;
+    IF v_row.state = 'OPEN' AND v_row.next_attempt_at > v_now THEN
+        RETURN QUERY SELECT false, 'OPEN'::text, 'open'::text, v_row.failure_count,
+            EXTRACT(EPOCH FROM v_row.next_attempt_at - v_now)::double precision;
+        RETURN;
+    END IF;
+
+    IF v_row.state = 'OPEN' OR v_row.next_attempt_at IS NULL OR v_row.next_attempt_at <= v_now THEN
+        -- Cool-down over, or the last round's probes never reported: a new round
+        UPDATE public.circuit_breaker_state c
+        SET state = 'HALF_OPEN', half_open_calls = 1, half_open_successes = 0,
+            next_attempt_at = v_now + make_interval(secs => v_cfg.open_seconds), updated_at = v_now
+        WHERE c.id = v_row.id;
+        RETURN QUERY SELECT true, 'HALF_OPEN'::text, 'probe'::text, v_row.failure_count, 0::double precision;
+        RETURN;
+    END IF;
+
+    IF v_row.half_open_calls < v_cfg.half_open_max_calls THEN
+        UPDATE public.circuit_breaker_state c SET half_open_calls = c.half_open_calls + 1, updated_at = v_now WHERE c.id = v_row.id;
+        RETURN QUERY SELECT true, 'HALF_OPEN'::text, 'probe'::text, v_row.failure_count, 0::double precision;
+        RETURN;
+    END IF;
+
+    RETURN QUERY SELECT false, 'HALF_OPEN'::text, 'probes_in_flight'::text, v_row.failure_count,
+        EXTRACT(EPOCH FROM v_row.next_attempt_at - v_now)::double precision;
+END;
+$$;
+
+ALTER FUNCTION public.circuit_breaker_check(p_workflow_name text) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.circuit_breaker_check(p_workflow_name text) IS 'BB_05 check: whether a call may go ahead; moves OPEN to HALF_OPEN after the cool-down and claims bounded probe slots.';
+
+
+CREATE OR REPLACE FUNCTION public.circuit_breaker_record(p_workflow_name text, p_success boolean)
+RETURNS TABLE(state text, failure_count integer, failure_rate double precision, next_attempt_at timestamp with time zone, transitioned boolean)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_now timestamp with time zone := clock_timestamp();
+    v_row public.circuit_breaker_state%ROWTYPE;
+    v_cfg record;
+    v_window_start timestamp with time zone;
+    v_weight double precision;
+    v_calls integer;
+    v_failures integer;
+    v_prev_calls integer;
+    v_prev_failures integer;
+    v_weighted_calls double precision;
+    v_weighted_failures double precision;
+    v_rate double precision;
+    v_state text;
+    v_next timestamp with time zone;
+    v_successes integer;
+BEGIN
+    SELECT * INTO v_cfg FROM public.circuit_breaker_settings(p_workflow_name);
+    v_window_start := to_timestamp(floor(EXTRACT(EPOCH FROM v_now) / v_cfg.window_seconds) * v_cfg.window_seconds);
+    v_weight := 1 - EXTRACT(EPOCH FROM v_now - v_window_start) / v_cfg.window_seconds;
+
+    INSERT INTO public.circuit_breaker_state (workflow_name, state, failure_count)
+    VALUES (p_workflow_name, 'CLOSED', 0)
+    ON CONFLICT ON CONSTRAINT unique_circuit_workflow DO NOTHING;
+    SELECT * INTO v_row FROM public.circuit_breaker_state c WHERE c.workflow_name = p_workflow_name FOR UPDATE;
+
+    -- The row's counters, rolled forward to the current window
+    IF v_row.window_start = v_window_start THEN
+        v_calls := v_row.window_calls;
+        v_failures := v_row.window_failures;
+        v_prev_calls := v_row.prev_window_calls;
+        v_prev_failures := v_row.prev_window_failures;
+    ELSIF v_row.window_start = v_window_start - make_interval(secs => v_cfg.window_seconds) THEN
+        v_calls := 0;
+        v_failures := 0;
+        v_prev_calls := v_row.window_calls;
+        v_prev_failures := v_row.window_failures;
+    ELSE
+        v_calls := 0;
+        v_failures := 0;
+        v_prev_calls := 0;
+        v_prev_failures := 0;
+    END IF;
+    v_calls := v_calls + 1;
+    v_failures := v_failures + CASE WHEN p_success THEN 0 ELSE 1 END;
+    v_weighted_calls := v_prev_calls * v_weight + v_calls;
+    v_weighted_failures := v_prev_failures * v_weight + v_failures;
+    v_rate := v_weighted_failures / v_weighted_calls;
+
+    v_state := v_row.state;
+    v_next := v_row.next_attempt_at;
+    v_successes := v_row.half_open_successes;
+    IF v_row.state = 'HALF_OPEN' THEN
+        IF NOT p_success THEN
+            v_state := 'OPEN';
+            v_next := v_now + make_interval(secs => v_cfg.open_seconds);
+        ELSE
+            v_successes := v_successes + 1;
+            IF v_successes >= v_cfg.half_open_max_calls THEN
+                -- Recovered: judged from here on, not by the failures that opened it
+                v_state := 'CLOSED';
+                v_next := NULL;
+                v_calls := 0;
+                v_failures := 0;
+                v_prev_calls := 0;
+                v_prev_failures := 0;
+                v_weighted_failures := 0;
+                v_rate := 0;
+            END IF;
+        END IF;
+    ELSIF v_row.state = 'CLOSED' AND v_weighted_calls >= v_cfg.min_calls AND v_rate >= v_cfg.failure_rate_threshold THEN
+        v_state := 'OPEN';
+        v_next := v_now + make_interval(secs => v_cfg.open_seconds);
+    END IF;
+
+    UPDATE public.circuit_breaker_state c
+    SET state = v_state,
+        failure_count = round(v_weighted_failures)::integer,
+        last_failure_at = CASE WHEN p_success THEN c.last_failure_at ELSE v_now END,
+        opened_at = CASE WHEN v_state = 'OPEN' AND v_row.state <> 'OPEN' THEN v_now ELSE c.opened_at END,
+        next_attempt_at = v_next,
+        window_start = v_window_start,
+        window_calls = v_calls,
+        window_failures = v_failures,
+        prev_window_calls = v_prev_calls,
+        prev_window_failures = v_prev_failures,
+        half_open_calls = CASE WHEN v_state = 'HALF_OPEN' THEN c.half_open_calls ELSE 0 END,
+        half_open_successes = CASE WHEN v_state = 'HALF_OPEN' THEN v_successes ELSE 0 END,
+        updated_at = v_now
+    WHERE c.id = v_row.id;
+
+    RETURN QUERY SELECT v_state, round(v_weighted_failures)::integer, v_rate, v_next, v_state <> v_row.state;
+END;
+$$;
+
+ALTER FUNCTION public.circuit_breaker_record(p_workflow_name text, p_success boolean) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.circuit_breaker_record(p_workflow_name text, p_success boolean) IS 'BB_05 success/failure: counts the call in the rolling window and applies CLOSED->OPEN, HALF_OPEN->CLOSED/OPEN transitions.';
+
+
+CREATE OR REPLACE FUNCTION public.circuit_breaker_trip(p_workflow_name text, p_failure_count integer)
+RETURNS TABLE(state text, next_attempt_at timestamp with time zone)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_now timestamp with time zone := clock_timestamp();
+    v_open_seconds integer;
+BEGIN
+    SELECT s.open_seconds INTO v_open_seconds FROM public.circuit_breaker_settings(p_workflow_name) s;
+
+    INSERT INTO public.circuit_breaker_state (workflow_name, state, failure_count)
+    VALUES (p_workflow_name, 'CLOSED', 0)
+    ON CONFLICT ON CONSTRAINT unique_circuit_workflow DO NOTHING;
+
+    -- Only a CLOSED breaker is opened; an OPEN or HALF_OPEN one is already handled
+    UPDATE public.circuit_breaker_state c
+    SET state = 'OPEN', failure_count = p_failure_count, last_failure_at = v_now, opened_at = v_now,
+        next_attempt_at = v_now + make_interval(secs => v_open_seconds),
+        half_open_calls = 0, half_open_successes = 0, updated_at = v_now
+    WHERE c.workflow_name = p_workflow_name AND c.state = 'CLOSED';
+
+    RETURN QUERY SELECT c.state::text, c.next_attempt_at FROM public.circuit_breaker_state c WHERE c.workflow_name = p_workflow_name;
+END;
+$$;
+
+ALTER FUNCTION public.circuit_breaker_trip(p_workflow_name text, p_failure_count integer) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.circuit_breaker_trip(p_workflow_name text, p_failure_count integer) IS 'Opens a CLOSED breaker whose failure rate tripped in an in-process breaker; returns the resulting state.';
+
+
+CREATE OR REPLACE FUNCTION public.notify_circuit_breaker() RETURNS trigger
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'circuit_breaker_state' AND TG_OP = 'UPDATE' THEN
+        IF OLD.state IS NOT DISTINCT FROM NEW.state AND OLD.next_attempt_at IS NOT DISTINCT FROM NEW.next_attempt_at THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+    PERFORM pg_notify('circuit_breaker', COALESCE(NEW.workflow_name, OLD.workflow_name));
+    RETURN NULL;
+END;
+$$;
+
+ALTER FUNCTION public.notify_circuit_breaker() OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.notify_circuit_breaker() IS 'Row trigger on circuit_breaker_state / circuit_breaker_config: notifies the circuit_breaker channel when a breaker changes state or its settings change.';
+
+DROP TRIGGER IF EXISTS trg_circuit_breaker_notify ON public.circuit_breaker_state;
+
+CREATE TRIGGER trg_circuit_breaker_notify
+    AFTER INSERT OR UPDATE OF state, next_attempt_at OR DELETE ON public.circuit_breaker_state
+    FOR EACH ROW EXECUTE FUNCTION public.notify_circuit_breaker();
+
+DROP TRIGGER IF EXISTS trg_circuit_breaker_config_notify ON public.circuit_breaker_config;
+
+CREATE TRIGGER trg_circuit_breaker_config_notify
+    AFTER INSERT OR UPDATE OR DELETE ON public.circuit_breaker_config
+    FOR EACH ROW EXECUTE FUNCTION public.notify_circuit_breaker();
+
+COMMIT;
@@ -0,0 +1,50 @@
+-- Migration: Bound booking duration for the BB_03_04 lookback
+-- Date: 2026-10-18
+-- Purpose: "DB: Get Bookings" (BB_03_04) finds the bookings that overlap
+--          [from, to) with start_time >= from - 1 day, so the start_time
+--          range stays bounded for the index scan. Nothing enforced that
+--          bound. Only end_time > start_time was checked, and a booking
+--          longer than a day that overlapped the window was missed, so its
+--          time showed as available.
+--
+-- bookings_max_duration makes the lookback exact: a booking lasts at most
+-- one day. Slots are at most 480 min (providers.slot_duration_mins), so no
+-- booking written by BB_04 comes close.
+--
+-- The covering index also gets status in INCLUDE, so BB_03_04 returns
+-- b.status again and the fetch stays an index-only scan.
+--
+-- Run outside a transaction (CONCURRENTLY):
+--   psql "$DATABASE_URL" -f database/migrations/20261018_24_bookings_max_duration.sql
+
+-- Existing long bookings would make VALIDATE fail with a bare 23514;
+-- report them in a readable form instead.
+DO $$
+DECLARE
+    v_long integer;
+BEGIN
+    SELECT COUNT(*) INTO v_long
+    FROM public.bookings
+    WHERE end_time > start_time + INTERVAL '1 day';
+
+    IF v_long > 0 THEN
+        RAISE EXCEPTION 'bookings_max_duration: % booking(s) last longer than 1 day; shorten or split them first', v_long;
+    END IF;
+END;
+$$;
+
+ALTER TABLE public.bookings DROP CONSTRAINT IF EXISTS bookings_max_duration;
+ALTER TABLE public.bookings
+    ADD CONSTRAINT bookings_max_duration CHECK (end_time <= start_time + INTERVAL '1 day') NOT VALID;
+ALTER TABLE public.bookings VALIDATE CONSTRAINT bookings_max_duration;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_bookings_provider_time_v2
+    ON public.bookings USING btree (provider_id, start_time, end_time)
+    INCLUDE (id, deleted_at, status)
+    WHERE (status NOT IN ('cancelled'::public.booking_status, 'rescheduled'::public.booking_status));
+
+DROP INDEX CONCURRENTLY IF EXISTS public.idx_bookings_provider_time;
+
+ALTER INDEX IF EXISTS public.idx_bookings_provider_time_v2 RENAME TO idx_bookings_provider_time;
+
+VACUUM (ANALYZE) public.bookings;
@@ -0,0 +1,137 @@
+-- Migration: Drop slot_holds now that Google Calendar is off the booking path
+-- Date: 2026-10-18
+-- Purpose: slot_holds (20261018_04) kept a slot reserved while
+--          BB_04_Booking_Create waited on Google Calendar between two
+--          Postgres nodes. Since the calendar outbox (20261018_08), a booking
+--          is one create_booking() / reschedule_booking() statement and the
+--          calendar is synced after the commit. No workflow or script calls
+--          hold_slot() any more. The table was only read by those two
+--          functions, so it only cost them a lookup and kept BOOK_SLOT_LOCKED
+--          alive for holds that nobody could take.
+--
+-- create_booking() and reschedule_booking() keep their results, minus
+-- BOOK_SLOT_LOCKED. They still serialize writers per provider with a
+-- transaction-scoped advisory lock, so concurrent inserters into the
+-- bookings_no_overlap exclusion constraint queue up instead of deadlocking
+-- on each other's uncommitted rows. The lock key no longer mentions
+-- slot_holds.
+--
+-- Dropped: hold_slot(), confirm_slot_hold(), release_slot_hold(),
+-- purge_expired_slot_holds() and the slot_holds table.
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_25_drop_slot_holds.sql
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION public.create_booking(p_provider_id uuid, p_user_id uuid, p_start_time timestamp with time zone, p_end_time timestamp with time zone, p_service_id uuid DEFAULT NULL, p_gcal_event_id text DEFAULT NULL) RETURNS jsonb
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_booking public.bookings;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM public.providers WHERE id = p_provider_id AND deleted_at IS NULL) THEN
+        RETURN jsonb_build_object('success', false, 'error_code', 'BOOK_INVALID_PROVIDER',
+                                  'error_message', 'Provider not found or inactive', 'data', NULL);
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM public.users WHERE id = p_user_id AND deleted_at IS NULL) THEN
+        RETURN jsonb_build_object('success', false, 'error_code', 'BOOK_INVALID_USER',
+                                  'error_message', 'User not found or inactive', 'data', NULL);
+    END IF;
+
+    -- One writer per provider at a time (see header)
+    PERFORM pg_advisory_xact_lock(hashtext('bookings_no_overlap'), hashtext(p_provider_id::text));
+
+    BEGIN
+        INSERT INTO public.bookings (user_id, provider_id, service_id, start_time, end_time, status, gcal_event_id)
+        VALUES (p_user_id, p_provider_id, p_service_id, p_start_time, p_end_time, 'confirmed', p_gcal_event_id)
+        RETURNING * INTO v_booking;
+    EXCEPTION WHEN exclusion_violation THEN
+        RETURN jsonb_build_object('success', false, 'error_code', 'BOOK_SLOT_OCCUPIED',
+                                  'error_message', 'Slot is already booked', 'data', NULL);
+    END;
+
+    RETURN jsonb_build_object(
+        'success', true,
+        'error_code', NULL,
+        'error_message', NULL,
+        'data', jsonb_build_object(
+            'id', v_booking.id,
+            'provider_id', v_booking.provider_id,
+            'user_id', v_booking.user_id,
+            'service_id', v_booking.service_id,
+            'start_time', v_booking.start_time,
+            'end_time', v_booking.end_time,
+            'status', v_booking.status,
+            'gcal_event_id', v_booking.gcal_event_id
+        )
+    );
+END;
+$$;
+
+ALTER FUNCTION public.create_booking(p_provider_id uuid, p_user_id uuid, p_start_time timestamp with time zone, p_end_time timestamp with time zone, p_service_id uuid, p_gcal_event_id text) OWNER TO neondb_owner;
+
+
+CREATE OR REPLACE FUNCTION public.reschedule_booking(p_booking_id uuid, p_user_id uuid, p_new_start_time timestamp with time zone, p_new_end_time timestamp with time zone) RETURNS jsonb
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_old public.bookings;
+    v_new public.bookings;
+BEGIN
+    SELECT * INTO v_old
+    FROM public.bookings
+    WHERE id = p_booking_id
+      AND user_id = p_user_id
+      AND deleted_at IS NULL
+      AND status = 'confirmed'
+    FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RETURN jsonb_build_object('success', false, 'error_code', 'BOOK_NOT_FOUND',
+                                  'error_message', 'Booking not found', 'data', NULL);
+    END IF;
+
+    -- Same per-provider lock as create_booking()
+    PERFORM pg_advisory_xact_lock(hashtext('bookings_no_overlap'), hashtext(v_old.provider_id::text));
+
+    -- Retire the old row first so the new range is checked once, against
+    -- everything except the booking being moved
+    BEGIN
+        UPDATE public.bookings SET status = 'rescheduled', updated_at = NOW() WHERE id = v_old.id;
+
+        INSERT INTO public.bookings (user_id, provider_id, service_id, start_time, end_time, status, notes)
+        VALUES (v_old.user_id, v_old.provider_id, v_old.service_id, p_new_start_time, p_new_end_time, 'confirmed', v_old.notes)
+        RETURNING * INTO v_new;
+    EXCEPTION WHEN exclusion_violation THEN
+        RETURN jsonb_build_object('success', false, 'error_code', 'BOOK_SLOT_OCCUPIED',
+                                  'error_message', 'New slot is already booked', 'data', NULL);
+    END;
+
+    RETURN jsonb_build_object(
+        'success', true,
+        'error_code', NULL,
+        'error_message', NULL,
+        'data', jsonb_build_object(
+            'old_booking_id', v_old.id,
+            'new_booking_id', v_new.id,
+            'provider_id', v_new.provider_id,
+            'start_time', v_new.start_time,
+            'end_time', v_new.end_time,
+            'old_gcal_event_id', v_old.gcal_event_id
+        )
+    );
+END;
+$$;
+
+ALTER FUNCTION public.reschedule_booking(p_booking_id uuid, p_user_id uuid, p_new_start_time timestamp with time zone, p_new_end_time timestamp with time zone) OWNER TO neondb_owner;
+
+
+DROP FUNCTION IF EXISTS public.hold_slot(uuid, uuid, timestamp with time zone, timestamp with time zone, integer);
+DROP FUNCTION IF EXISTS public.confirm_slot_hold(uuid, uuid, text);
+DROP FUNCTION IF EXISTS public.release_slot_hold(uuid);
+DROP FUNCTION IF EXISTS public.purge_expired_slot_holds();
+DROP TABLE IF EXISTS public.slot_holds;
+
+COMMIT;
@@ -0,0 +1,118 @@
+-- Migration: Claim notifications by priority again, then by due time
+-- Date: 2026-10-18
+-- Purpose: 20261018_12 changed claim_notifications() to claim in
+--          next_retry_at order, and 20261018_14 did the same in
+--          claim_notification_digests(). The priority DESC, created_at
+--          order from 20261018_09 was lost. A high-priority notice (e.g.
+--          an admin alert queued with queue_notification(..., 10)) waited
+--          behind every older low-priority row, and during a backlog
+--          that meant behind a whole mass cancellation.
+--
+-- Order: priority DESC, next_retry_at ASC. Only due rows are claimed, as
+-- before, and within one priority the oldest due row goes first.
+-- claim_notification_digests() takes the highest-priority group first,
+-- where a group ranks by its highest-priority row.
+--
+-- Index: idx_notification_queue_claim (status, priority DESC, next_retry_at)
+-- replaces idx_notification_queue_due. Both claims read it in claim order
+-- and stop after the batch. Within one priority the due rows come first,
+-- so the scan only steps over rows still waiting out a backoff at a
+-- higher priority than the last row claimed. Almost every row has the
+-- default priority 0, so that is a handful of rows, not the whole retry
+-- backlog that 20261018_12 set out to avoid.
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_26_notification_claim_priority.sql
+
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS idx_notification_queue_claim
+    ON public.notification_queue USING btree (status, priority DESC, next_retry_at);
+
+DROP INDEX IF EXISTS public.idx_notification_queue_due;
+
+
+CREATE OR REPLACE FUNCTION public.claim_notifications(p_worker_id text, p_batch_size integer DEFAULT 10, p_lease_seconds integer DEFAULT 120, p_status public.notification_status DEFAULT 'pending'::public.notification_status) RETURNS SETOF public.notification_queue
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    RETURN QUERY
+    WITH due AS (
+        SELECT n.id
+        FROM public.notification_queue n
+        WHERE n.status = p_status
+          AND n.next_retry_at <= NOW()
+          AND (n.locked_until IS NULL OR n.locked_until <= NOW())
+          AND (p_status <> 'failed' OR n.retry_count < COALESCE(n.max_retries, 3))
+        ORDER BY n.priority DESC, n.next_retry_at ASC
+        LIMIT p_batch_size
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE public.notification_queue q
+    SET locked_by = p_worker_id,
+        locked_until = NOW() + make_interval(secs => p_lease_seconds)
+    FROM due
+    WHERE q.id = due.id
+    RETURNING q.*;
+END;
+$$;
+
+ALTER FUNCTION public.claim_notifications(p_worker_id text, p_batch_size integer, p_lease_seconds integer, p_status public.notification_status) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.claim_notifications(p_worker_id text, p_batch_size integer, p_lease_seconds integer, p_status public.notification_status) IS 'Claims up to p_batch_size due notifications (next_retry_at <= NOW(), highest priority first, then oldest) for one worker (FOR UPDATE SKIP LOCKED + lease). Called by BB_05, BB_07 and notification_dispatcher.py.';
+
+
+CREATE OR REPLACE FUNCTION public.claim_notification_digests(p_worker_id text, p_digests integer DEFAULT 10, p_lease_seconds integer DEFAULT 120, p_window_seconds integer DEFAULT 5) RETURNS SETOF public.notification_queue
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    RETURN QUERY
+    WITH due AS (
+        -- Range scan on idx_notification_queue_claim; bounded so a huge
+        -- backlog is grouped a slice at a time, high priority first
+        SELECT n.id, n.channel, n.recipient, n.priority, n.created_at, n.next_retry_at
+        FROM public.notification_queue n
+        WHERE n.status = 'pending'
+          AND n.next_retry_at <= NOW()
+          AND (n.locked_until IS NULL OR n.locked_until <= NOW())
+        ORDER BY n.priority DESC, n.next_retry_at ASC
+        LIMIT p_digests * 500
+    ),
+    groups AS (
+        SELECT d.channel, d.recipient
+        FROM due d
+        GROUP BY d.channel, d.recipient
+        HAVING MAX(d.created_at) <= NOW() - make_interval(secs => p_window_seconds)
+            OR MIN(d.created_at) <= NOW() - make_interval(secs => 4 * p_window_seconds)
+        ORDER BY MAX(d.priority) DESC, MIN(d.next_retry_at)
+        LIMIT p_digests
+    ),
+    picked AS (
+        SELECT n.id
+        FROM public.notification_queue n
+        JOIN due d ON d.id = n.id
+        JOIN groups g ON g.channel IS NOT DISTINCT FROM d.channel
+                     AND g.recipient IS NOT DISTINCT FROM d.recipient
+        FOR UPDATE OF n SKIP LOCKED
+    ),
+    leased AS (
+        UPDATE public.notification_queue q
+        SET locked_by = p_worker_id,
+            locked_until = NOW() + make_interval(secs => p_lease_seconds)
+        FROM picked
+        WHERE q.id = picked.id
+        RETURNING q.*
+    )
+    SELECT *
+    FROM leased
+    ORDER BY leased.channel, leased.recipient, leased.created_at;
+END;
+$$;
+
+ALTER FUNCTION public.claim_notification_digests(p_worker_id text, p_digests integer, p_lease_seconds integer, p_window_seconds integer) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.claim_notification_digests(p_worker_id text, p_digests integer, p_lease_seconds integer, p_window_seconds integer) IS 'Claims up to p_digests (channel, recipient) groups of due notifications, each quiet for p_window_seconds, highest priority first, for one digest message per group. Called by BB_05, BB_07 and notification_dispatcher.py.';
+
+ANALYZE public.notification_queue;
+
+COMMIT;
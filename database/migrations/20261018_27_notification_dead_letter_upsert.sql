@@ -0,0 +1,153 @@
+-- Migration: Keep the newest copy when a notification is dead-lettered twice
+-- Date: 2026-10-18
+-- Purpose: mark_notifications_failed() and move_dead_notifications()
+--          (20261018_13) DELETE the row from notification_queue and then
+--          INSERT it into notification_dead_letter with ON CONFLICT (id)
+--          DO NOTHING. If that id was already in the dead letter table, the
+--          insert was skipped but the delete still went through, so the
+--          notification was gone from both tables. Requeueing deletes the
+--          dead letter, so this needs a copy left behind, e.g. a requeue
+--          run by hand with INSERT ... SELECT, or a restore from an export.
+--
+-- Both functions now overwrite the dead letter with the row that just
+-- died (ON CONFLICT (id) DO UPDATE). That row carries the latest attempt,
+-- error and dead_at. Every deleted row lands in the table.
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_27_notification_dead_letter_upsert.sql
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION public.mark_notifications_failed(p_failures jsonb) RETURNS integer
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_policies jsonb;
+    v_updated integer;
+BEGIN
+    -- Read once per batch, not per row
+    SELECT value::jsonb INTO v_policies
+    FROM public.app_config
+    WHERE key = 'NOTIFICATION_RETRY_POLICY';
+    v_policies := COALESCE(v_policies, '{}'::jsonb);
+
+    WITH f AS (
+        SELECT f.id,
+               left(COALESCE(f.error, 'Send failed'), 1000) AS error,
+               q.retry_count + 1 >= COALESCE(q.max_retries, 3) AS exhausted,
+               public.notification_backoff_seconds(
+                   COALESCE(v_policies->(q.channel::text), v_policies->'default', '{}'::jsonb),
+                   q.retry_count,
+                   f.retry_after
+               ) AS backoff
+        FROM jsonb_to_recordset(p_failures) AS f(id uuid, error text, retry_after integer)
+        JOIN public.notification_queue q ON q.id = f.id
+    ),
+    dead AS (
+        DELETE FROM public.notification_queue q
+        USING f
+        WHERE q.id = f.id AND f.exhausted
+        RETURNING q.*, f.error AS last_error
+    ),
+    buried AS (
+        INSERT INTO public.notification_dead_letter (
+            id, booking_id, user_id, message, priority, retry_count, max_retries,
+            error_message, channel, recipient, payload, created_at, last_attempt_at
+        )
+        SELECT id, booking_id, user_id, message, priority, retry_count + 1, max_retries,
+               last_error, channel, recipient, payload, created_at, NOW()
+        FROM dead
+        ON CONFLICT (id) DO UPDATE
+        SET booking_id = EXCLUDED.booking_id,
+            user_id = EXCLUDED.user_id,
+            message = EXCLUDED.message,
+            priority = EXCLUDED.priority,
+            retry_count = EXCLUDED.retry_count,
+            max_retries = EXCLUDED.max_retries,
+            error_message = EXCLUDED.error_message,
+            channel = EXCLUDED.channel,
+            recipient = EXCLUDED.recipient,
+            payload = EXCLUDED.payload,
+            created_at = EXCLUDED.created_at,
+            last_attempt_at = EXCLUDED.last_attempt_at,
+            dead_at = EXCLUDED.dead_at
+        RETURNING 1
+    ),
+    retried AS (
+        UPDATE public.notification_queue q
+        SET retry_count = q.retry_count + 1,
+            status = 'pending'::public.notification_status,
+            next_retry_at = NOW() + make_interval(secs => f.backoff),
+            backoff_seconds = f.backoff,
+            error_message = f.error,
+            updated_at = NOW(),
+            locked_by = NULL,
+            locked_until = NULL
+        FROM f
+        WHERE q.id = f.id AND NOT f.exhausted
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM dead) + (SELECT COUNT(*) FROM retried) INTO v_updated;
+
+    RETURN v_updated;
+END;
+$$;
+
+ALTER FUNCTION public.mark_notifications_failed(p_failures jsonb) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.mark_notifications_failed(p_failures jsonb) IS 'Records a batch of failed sends in one statement: [{id, error, retry_after}]. Reschedules with the channel backoff policy; moves rows that exhausted max_retries to notification_dead_letter.';
+
+
+CREATE OR REPLACE FUNCTION public.move_dead_notifications(p_limit integer DEFAULT 1000) RETURNS integer
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_moved integer;
+BEGIN
+    -- The pick is a separate CTE so LIMIT ... SKIP LOCKED runs exactly once
+    WITH picked AS (
+        SELECT n.id
+        FROM public.notification_queue n
+        WHERE n.status = 'failed'
+        ORDER BY n.updated_at
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    ),
+    dead AS (
+        DELETE FROM public.notification_queue q
+        USING picked
+        WHERE q.id = picked.id
+        RETURNING q.*
+    )
+    INSERT INTO public.notification_dead_letter (
+        id, booking_id, user_id, message, priority, retry_count, max_retries,
+        error_message, channel, recipient, payload, created_at, last_attempt_at
+    )
+    SELECT id, booking_id, user_id, message, priority, retry_count, max_retries,
+           error_message, channel, recipient, payload, created_at, COALESCE(updated_at, NOW())
+    FROM dead
+    ON CONFLICT (id) DO UPDATE
+    SET booking_id = EXCLUDED.booking_id,
+        user_id = EXCLUDED.user_id,
+        message = EXCLUDED.message,
+        priority = EXCLUDED.priority,
+        retry_count = EXCLUDED.retry_count,
+        max_retries = EXCLUDED.max_retries,
+        error_message = EXCLUDED.error_message,
+        channel = EXCLUDED.channel,
+        recipient = EXCLUDED.recipient,
+        payload = EXCLUDED.payload,
+        created_at = EXCLUDED.created_at,
+        last_attempt_at = EXCLUDED.last_attempt_at,
+        dead_at = EXCLUDED.dead_at;
+
+    GET DIAGNOSTICS v_moved = ROW_COUNT;
+    RETURN v_moved;
+END;
+$$;
+
+ALTER FUNCTION public.move_dead_notifications(p_limit integer) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.move_dead_notifications(p_limit integer) IS 'Moves up to p_limit failed notifications (oldest first) from notification_queue to notification_dead_letter. NULL = all.';
+
+COMMIT;
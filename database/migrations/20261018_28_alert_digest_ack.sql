@@ -0,0 +1,101 @@
+-- Migration: Reset suppressed-repeat counts only after the digest is sent
+-- Date: 2026-10-18
+-- Purpose: take_alert_digest() (20261018_18) reset suppressed_count in the
+--          same statement that read it. BB_00 sends the digest to Telegram
+--          afterwards, with onError continueRegularOutput, so a failed send
+--          (Telegram down, 429, a message Telegram could not parse) lost
+--          the counts for good.
+--
+-- The digest is now taken and acknowledged in two steps, like a
+-- notification claim:
+--   take_alert_digest(limit, lease_seconds)
+--     -> the fingerprints with pending repeats, largest first. Leases them
+--        for lease_seconds (digest_locked_until) and leaves the counts
+--        alone. Leased rows are skipped by other runs until the lease ends.
+--   ack_alert_digest(items jsonb) -> integer
+--     items = [{workflow_name, error_type, error_fingerprint, suppressed_count}],
+--     the rows that went out. Subtracts the reported count (repeats logged
+--     since the take stay pending), adds it to total_suppressed and ends
+--     the lease. BB_00 calls it only after Send Digest succeeds.
+-- If the send fails, the lease runs out and the next digest reports the
+-- same repeats plus any new ones.
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_28_alert_digest_ack.sql
+
+BEGIN;
+
+ALTER TABLE error_handling.alert_suppression
+    ADD COLUMN IF NOT EXISTS digest_locked_until timestamp with time zone;
+
+COMMENT ON COLUMN error_handling.alert_suppression.digest_locked_until IS 'Lease taken by take_alert_digest() until ack_alert_digest() confirms the digest was sent.';
+
+DROP FUNCTION IF EXISTS error_handling.take_alert_digest(integer);
+
+
+CREATE OR REPLACE FUNCTION error_handling.take_alert_digest(p_limit integer DEFAULT 50, p_lease_seconds integer DEFAULT 600) RETURNS TABLE(workflow_name character varying, error_type character varying, error_fingerprint character varying, suppressed_count integer, severity_max character varying, last_message text, alerted_at timestamp with time zone, last_seen_at timestamp with time zone)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    RETURN QUERY
+    WITH picked AS (
+        SELECT s.workflow_name, s.error_type, s.error_fingerprint, s.suppressed_count,
+               s.severity_max, s.last_message, s.alerted_at, s.last_seen_at
+        FROM error_handling.alert_suppression s
+        WHERE s.suppressed_count > 0
+          AND (s.digest_locked_until IS NULL OR s.digest_locked_until <= NOW())
+        ORDER BY s.suppressed_count DESC
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    ),
+    leased AS (
+        UPDATE error_handling.alert_suppression s
+        SET digest_locked_until = NOW() + make_interval(secs => p_lease_seconds)
+        FROM picked
+        WHERE s.workflow_name = picked.workflow_name
+          AND s.error_type = picked.error_type
+          AND s.error_fingerprint = picked.error_fingerprint
+    )
+    SELECT p.workflow_name, p.error_type, p.error_fingerprint, p.suppressed_count,
+           p.severity_max, p.last_message, p.alerted_at, p.last_seen_at
+    FROM picked p
+    ORDER BY p.suppressed_count DESC;
+END;
+$$;
+
+ALTER FUNCTION error_handling.take_alert_digest(p_limit integer, p_lease_seconds integer) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION error_handling.take_alert_digest(p_limit integer, p_lease_seconds integer) IS 'Returns and leases the pending suppressed-repeat counts (largest first) for the BB_00 digest. Counts are reset by ack_alert_digest() once the digest is sent.';
+
+
+CREATE OR REPLACE FUNCTION error_handling.ack_alert_digest(p_items jsonb) RETURNS integer
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_acked integer;
+BEGIN
+    WITH sent AS (
+        SELECT i.workflow_name, i.error_type, i.error_fingerprint, i.suppressed_count
+        FROM jsonb_to_recordset(p_items) AS i(workflow_name character varying, error_type character varying,
+                                              error_fingerprint character varying, suppressed_count integer)
+    )
+    UPDATE error_handling.alert_suppression s
+    SET suppressed_count = GREATEST(s.suppressed_count - sent.suppressed_count, 0),
+        total_suppressed = s.total_suppressed + LEAST(sent.suppressed_count, s.suppressed_count),
+        digested_at = NOW(),
+        digest_locked_until = NULL
+    FROM sent
+    WHERE s.workflow_name = sent.workflow_name
+      AND s.error_type = sent.error_type
+      AND s.error_fingerprint = sent.error_fingerprint;
+
+    GET DIAGNOSTICS v_acked = ROW_COUNT;
+    RETURN v_acked;
+END;
+$$;
+
+ALTER FUNCTION error_handling.ack_alert_digest(p_items jsonb) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION error_handling.ack_alert_digest(p_items jsonb) IS 'Settles a sent BB_00 digest: [{workflow_name, error_type, error_fingerprint, suppressed_count}]. Subtracts the reported repeats, adds them to total_suppressed and ends the lease.';
+
+COMMIT;
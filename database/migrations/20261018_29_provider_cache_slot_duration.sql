@@ -0,0 +1,58 @@
+-- Migration: provider_cache - cache slot_duration_mins, the column slots use
+-- Date: 2026-10-18
+-- Purpose: v_provider_cache_source (20261018_19) cached
+--          providers.slot_duration_minutes, the legacy nullable column with
+--          only a > 0 check. BB_03_02 and the slot engine read
+--          slot_duration_mins (NOT NULL, 5-480, valid_slot_duration). The
+--          two are not kept in sync, so a cached provider could advertise a
+--          slot length that does not match the slots it offers.
+--
+-- The payload key is now 'slot_duration_mins', after the column. No
+-- workflow read the old key. Every cached row is rebuilt in place with
+-- warm_provider_cache(force), and a provider_cache notification per slug
+-- evicts the in-process copies (scripts-py/provider_cache.py).
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_29_provider_cache_slot_duration.sql
+
+BEGIN;
+
+CREATE OR REPLACE VIEW public.v_provider_cache_source AS
+SELECT p.id AS provider_id,
+       p.slug AS provider_slug,
+       p.public_booking_enabled,
+       jsonb_build_object(
+           'id', p.id,
+           'slug', p.slug,
+           'name', p.name,
+           'slot_duration_mins', p.slot_duration_mins,
+           'min_notice_hours', p.min_notice_hours,
+           'public_booking_enabled', p.public_booking_enabled,
+           'services', COALESCE(s.services, '[]'::jsonb)
+       ) AS data
+FROM public.providers p
+LEFT JOIN LATERAL (
+    SELECT jsonb_agg(jsonb_build_object(
+               'id', sv.id,
+               'name', sv.name,
+               'duration_minutes', sv.duration_minutes,
+               'price', sv.price,
+               'tier', sv.tier
+           ) ORDER BY sv.name, sv.id) AS services
+    FROM public.services sv
+    WHERE sv.provider_id = p.id
+      AND sv.active IS NOT FALSE
+) s ON true
+WHERE p.deleted_at IS NULL
+  AND p.slug IS NOT NULL;
+
+ALTER VIEW public.v_provider_cache_source OWNER TO neondb_owner;
+
+COMMENT ON VIEW public.v_provider_cache_source IS 'Payload cached in provider_cache.data: provider fields (slot_duration_mins as used by the slot engine) plus active services.';
+
+SELECT * FROM public.warm_provider_cache(1440, 60, true);
+
+SELECT pg_notify('provider_cache', c.provider_slug)
+FROM public.provider_cache c;
+
+COMMIT;
@@ -0,0 +1,31 @@
+-- Migration: Derive booking_lock_key() from the epoch, not timestamptz text
+-- Date: 2026-10-18
+-- Purpose: booking_lock_key() (20261018_03) hashed p_start_time::text. That
+--          text follows the session TimeZone and DateStyle, so two sessions
+--          asking for the same instant could get different keys and not
+--          block each other. It also made the IMMUTABLE label false, which
+--          lets the planner fold or cache a key computed under another
+--          setting.
+--
+-- The key now hashes the instant as integer microseconds since the epoch,
+-- which is the same in every session, so the function is really
+-- IMMUTABLE. Keys change once with this migration. A lock held across the
+-- deploy only protects bookings in that one transaction, and the
+-- bookings_no_overlap constraint still rejects any overlap.
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_30_booking_lock_key_utc.sql
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION public.booking_lock_key(p_provider_id uuid, p_start_time timestamp with time zone) RETURNS bigint
+    LANGUAGE sql IMMUTABLE
+    AS $$
+    SELECT ('x' || substring(encode(sha256((p_provider_id::text || ':' || (extract(epoch FROM p_start_time) * 1000000)::bigint::text)::bytea), 'hex'), 1, 15))::bit(64)::bigint;
+$$;
+
+ALTER FUNCTION public.booking_lock_key(p_provider_id uuid, p_start_time timestamp with time zone) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.booking_lock_key(p_provider_id uuid, p_start_time timestamp with time zone) IS 'Advisory lock key for (provider, start instant); independent of session TimeZone and DateStyle.';
+
+COMMIT;
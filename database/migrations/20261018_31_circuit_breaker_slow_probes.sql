@@ -0,0 +1,94 @@
+-- Migration: circuit_breaker_check() - keep a HALF_OPEN round's successes past its deadline
+-- Date: 2026-10-18
+-- Purpose: circuit_breaker_check() (20261018_23) started a new HALF_OPEN
+--          round whenever next_attempt_at had passed, resetting
+--          half_open_successes to 0 even when every probe had succeeded.
+--          The deadline is only there to write off probes that never
+--          report. A dependency called less often than about
+--          open_seconds / half_open_max_calls had its successes wiped
+--          before the last probe arrived and never left HALF_OPEN
+--          (open_seconds 2, 3 probes, calls 1.5 s apart: stuck with 2
+--          successes).
+--
+-- A round is now discarded only when a probe is still outstanding after
+-- the deadline (half_open_calls > half_open_successes). A failed probe
+-- already reopens the breaker in circuit_breaker_record(). Otherwise the
+-- next check claims another probe in the same round and moves the
+-- deadline to open_seconds after that claim. scripts-py/circuit_breaker.py
+-- hands HALF_OPEN to this function, so it gets the fix as well.
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_31_circuit_breaker_slow_probes.sql
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION public.circuit_breaker_check(p_workflow_name text)
+RETURNS TABLE(allowed boolean, state text, reason text, failure_count integer, retry_after_seconds double precision)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_now timestamp with time zone := clock_timestamp();
+    v_row public.circuit_breaker_state%ROWTYPE;
+    v_cfg record;
+BEGIN
+    -- CLOSED, and OPEN within the cool-down, are answered without a lock or a write
+    SELECT * INTO v_row FROM public.circuit_breaker_state c WHERE c.workflow_name = p_workflow_name;
+    IF NOT FOUND OR v_row.state = 'CLOSED' THEN
+        RETURN QUERY SELECT true, 'CLOSED'::text, 'closed'::text, COALESCE(v_row.failure_count, 0), 0::double precision;
+        RETURN;
+    END IF;
+    IF v_row.state = 'OPEN' AND v_row.next_attempt_at > v_now THEN
+        RETURN QUERY SELECT false, 'OPEN'::text, 'open'::text, v_row.failure_count,
+            EXTRACT(EPOCH FROM v_row.next_attempt_at - v_now)::double precision;
+        RETURN;
+    END IF;
+
+    -- Probe slots are claimed under the row lock
+    SELECT * INTO v_cfg FROM public.circuit_breaker_settings(p_workflow_name);
+    SELECT * INTO v_row FROM public.circuit_breaker_state c WHERE c.workflow_name = p_workflow_name FOR UPDATE;
+
+    IF v_row.state = 'CLOSED' THEN
+        RETURN QUERY SELECT true, 'CLOSED'::text, 'closed'::text, v_row.failure_count, 0::double precision;
+        RETURN;
+    END IF;
+    IF v_row.state = 'OPEN' AND v_row.next_attempt_at > v_now THEN
+        RETURN QUERY SELECT false, 'OPEN'::text, 'open'::text, v_row.failure_count,
+            EXTRACT(EPOCH FROM v_row.next_attempt_at - v_now)::double precision;
+        RETURN;
+    END IF;
+
+    IF v_row.state = 'OPEN' OR v_row.next_attempt_at IS NULL
+       OR (v_row.next_attempt_at <= v_now AND v_row.half_open_calls > v_row.half_open_successes) THEN
+        -- Cool-down over, or a probe of this round never reported: a new round
+        UPDATE public.circuit_breaker_state c
+        SET state = 'HALF_OPEN', half_open_calls = 1, half_open_successes = 0,
+            next_attempt_at = v_now + make_interval(secs => v_cfg.open_seconds), updated_at = v_now
+        WHERE c.id = v_row.id;
+        RETURN QUERY SELECT true, 'HALF_OPEN'::text, 'probe'::text, v_row.failure_count, 0::double precision;
+        RETURN;
+    END IF;
+
+    -- Every probe so far succeeded: keep their successes, even when the
+    -- next call comes after the deadline, and give this probe its own
+    IF v_row.half_open_calls < v_cfg.half_open_max_calls THEN
+        UPDATE public.circuit_breaker_state c
+        SET half_open_calls = c.half_open_calls + 1,
+            next_attempt_at = CASE WHEN c.next_attempt_at <= v_now
+                                   THEN v_now + make_interval(secs => v_cfg.open_seconds)
+                                   ELSE c.next_attempt_at END,
+            updated_at = v_now
+        WHERE c.id = v_row.id;
+        RETURN QUERY SELECT true, 'HALF_OPEN'::text, 'probe'::text, v_row.failure_count, 0::double precision;
+        RETURN;
+    END IF;
+
+    RETURN QUERY SELECT false, 'HALF_OPEN'::text, 'probes_in_flight'::text, v_row.failure_count,
+        EXTRACT(EPOCH FROM v_row.next_attempt_at - v_now)::double precision;
+END;
+$$;
+
+ALTER FUNCTION public.circuit_breaker_check(p_workflow_name text) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.circuit_breaker_check(p_workflow_name text) IS 'BB_05 check: whether a call may go ahead; moves OPEN to HALF_OPEN after the cool-down and claims bounded probe slots.';
+
+COMMIT;
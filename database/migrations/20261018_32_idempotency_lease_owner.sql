@@ -0,0 +1,122 @@
+-- Migration: Only the execution holding an idempotency lease may finish it
+-- Date: 2026-10-18
+-- Purpose: idempotency_finish() (20261018_06) updated or deleted the key
+--          without checking who held it. An execution that outlived its
+--          60 s lease could finish a key that a retry had already taken
+--          over: it overwrote the retry's stored response, or deleted the
+--          key under it so a third duplicate ran for real.
+--
+-- idempotency_begin() now hands out an owner token with the lease:
+--   { "state": "new", "owner": "<uuid>" }
+-- and idempotency_finish(scope, key, response, owner) -> boolean only
+-- touches the key while it is in_progress under that owner. It returns
+-- false when it matches no row (the lease was taken over, or the key was
+-- never claimed), and true otherwise, including for an empty key.
+--
+-- The three-argument idempotency_finish() is dropped, so a caller that
+-- does not pass the owner fails instead of skipping the check. Keys
+-- claimed before this migration have no owner and cannot be finished;
+-- their lease runs out within a minute and the next duplicate reclaims
+-- them.
+--
+-- Run:
+--   psql "$DATABASE_URL" -f database/migrations/20261018_32_idempotency_lease_owner.sql
+
+BEGIN;
+
+ALTER TABLE public.idempotency_keys
+    ADD COLUMN IF NOT EXISTS lease_owner uuid;
+
+COMMENT ON COLUMN public.idempotency_keys.lease_owner IS 'Token returned by idempotency_begin() to the execution holding the in_progress lease; idempotency_finish() must present it.';
+
+
+CREATE OR REPLACE FUNCTION public.idempotency_begin(p_scope text, p_key text, p_request jsonb DEFAULT '{}'::jsonb, p_ttl_seconds integer DEFAULT 86400, p_lease_seconds integer DEFAULT 60) RETURNS jsonb
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    v_hash text := md5(COALESCE(p_request, '{}'::jsonb)::text);
+    v_owner uuid := gen_random_uuid();
+    v_row public.idempotency_keys;
+BEGIN
+    IF p_key IS NULL OR p_key = '' THEN
+        RETURN jsonb_build_object('state', 'new');
+    END IF;
+
+    -- Claim a fresh key, or take over one whose TTL or lease has run out
+    INSERT INTO public.idempotency_keys (scope, idempotency_key, request_hash, status, lease_owner, locked_until, expires_at)
+    VALUES (p_scope, p_key, v_hash, 'in_progress', v_owner,
+            NOW() + make_interval(secs => p_lease_seconds),
+            NOW() + make_interval(secs => p_ttl_seconds))
+    ON CONFLICT (scope, idempotency_key) DO UPDATE
+        SET request_hash = EXCLUDED.request_hash,
+            status = 'in_progress',
+            response = NULL,
+            lease_owner = EXCLUDED.lease_owner,
+            locked_until = EXCLUDED.locked_until,
+            expires_at = EXCLUDED.expires_at,
+            created_at = NOW()
+        WHERE idempotency_keys.expires_at <= NOW()
+           OR (idempotency_keys.status = 'in_progress' AND idempotency_keys.locked_until <= NOW())
+    RETURNING * INTO v_row;
+
+    IF v_row.scope IS NOT NULL THEN
+        RETURN jsonb_build_object('state', 'new', 'owner', v_owner);
+    END IF;
+
+    SELECT * INTO v_row
+    FROM public.idempotency_keys
+    WHERE scope = p_scope AND idempotency_key = p_key;
+
+    IF v_row.request_hash <> v_hash THEN
+        RETURN jsonb_build_object('state', 'mismatch');
+    END IF;
+
+    IF v_row.status = 'completed' THEN
+        RETURN jsonb_build_object('state', 'replay', 'response', v_row.response);
+    END IF;
+
+    RETURN jsonb_build_object('state', 'in_progress');
+END;
+$$;
+
+ALTER FUNCTION public.idempotency_begin(p_scope text, p_key text, p_request jsonb, p_ttl_seconds integer, p_lease_seconds integer) OWNER TO neondb_owner;
+
+
+DROP FUNCTION IF EXISTS public.idempotency_finish(text, text, jsonb);
+
+CREATE OR REPLACE FUNCTION public.idempotency_finish(p_scope text, p_key text, p_response jsonb, p_owner uuid) RETURNS boolean
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    IF p_key IS NULL OR p_key = '' THEN
+        RETURN true;
+    END IF;
+
+    -- Transient outcomes: release the key so a retry runs for real
+    IF NOT COALESCE((p_response->>'success')::boolean, false)
+       AND COALESCE(p_response->>'error_code', 'INTERNAL_ERROR') IN (
+           'DB_ERROR', 'INTERNAL_ERROR', 'SYS_NO_OUTPUT', 'GCAL_ERROR',
+           'BOOK_GCAL_FAILED', 'BOOK_SLOT_LOCKED', 'BOOK_TRANSACTION_FAILED')
+    THEN
+        DELETE FROM public.idempotency_keys
+        WHERE scope = p_scope AND idempotency_key = p_key
+          AND status = 'in_progress' AND lease_owner = p_owner;
+        RETURN FOUND;
+    END IF;
+
+    UPDATE public.idempotency_keys
+    SET status = 'completed',
+        response = p_response,
+        lease_owner = NULL,
+        locked_until = NULL
+    WHERE scope = p_scope AND idempotency_key = p_key
+      AND status = 'in_progress' AND lease_owner = p_owner;
+    RETURN FOUND;
+END;
+$$;
+
+ALTER FUNCTION public.idempotency_finish(p_scope text, p_key text, p_response jsonb, p_owner uuid) OWNER TO neondb_owner;
+
+COMMENT ON FUNCTION public.idempotency_finish(p_scope text, p_key text, p_response jsonb, p_owner uuid) IS 'Stores the response for a claimed key, or releases it on a transient failure. Only the lease owner from idempotency_begin() can finish a key; returns false when the lease was lost.';
+
+COMMIT;
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Calendar Outbox Worker - drains public.calendar_outbox into Google Calendar
+
+BB_04_Booking_Create/Cancel/Reschedule no longer call Google Calendar
+inline. Booking changes enqueue 'create'/'delete' rows in the same transaction
+(database/migrations/20261018_08_calendar_outbox.sql). This worker syncs them:
+
+    claim_calendar_outbox(batch)  -> one round trip, FOR UPDATE SKIP LOCKED
+    GCal calls                    -> thread pool, at most --concurrency in flight
+    settle_calendar_outbox(json)  -> one round trip for the whole batch
+
+Several workers can run side by side. Retries, backoff and Retry-After are
+handled by settle_calendar_outbox(). A worker that dies mid-batch loses its
+lease, and the rows are claimed again after --lease seconds.
+
+Events are created with a deterministic id derived from the booking id. A
+retry after a lost response gets 409 from GCal instead of creating a second
+event.
+
+Rate limits (429, and 403 with a rateLimitExceeded-style reason), 401 and
+5xx are retried. Any other 4xx, or a row whose payload cannot be sent, is
+failed for good. Access tokens expire after about an hour. The worker
+refreshes them before they expire, and once more on a 401.
+
+Environment:
+    DATABASE_URL                Postgres connection string (see config.get_database_url)
+    GCAL_SERVICE_ACCOUNT_FILE   Service account key (JSON), needs google-auth
+    GCAL_CLIENT_ID              OAuth client for a refresh token (user calendar)
+    GCAL_CLIENT_SECRET
+    GCAL_REFRESH_TOKEN
+    GCAL_ACCESS_TOKEN           Fixed access token, only for tests and one-off runs
+    GCAL_API_BASE               Defaults to https://www.googleapis.com/calendar/v3
+                                (tests point it at a local fake server)
+    GCAL_TOKEN_URL              Defaults to https://oauth2.googleapis.com/token
+
+Usage:
+    python calendar_outbox_worker.py [--batch-size 50] [--concurrency 8] [--once]
+
+Requires:
+    pip install psycopg2-binary requests
+    pip install google-auth     # only for GCAL_SERVICE_ACCOUNT_FILE
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import psycopg2
+import requests
+from psycopg2.extras import RealDictCursor
+
+from config import get_database_url, load_env_file
+
+DEFAULT_API_BASE = "https://www.googleapis.com/calendar/v3"
+DEFAULT_TOKEN_URL = "https://oauth2.googleapis.com/token"
+CALENDAR_SCOPE = "https://www.googleapis.com/auth/calendar.events"
+
+# Status codes worth retrying; any other 4xx is a permanent failure. 401 is
+# an expired or revoked token, which the next attempt refreshes.
+TRANSIENT_STATUS = {401, 408, 429, 500, 502, 503, 504}
+
+# Calendar reports rate limits and quota as 403 with one of these reasons
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "quotaExceeded", "dailyLimitExceeded"}
+
+
+class GCalError(Exception):
+    """Failed Calendar API call, classified for settle_calendar_outbox()"""
+
+    def __init__(self, message: str, retry_after: Optional[int] = None, permanent: bool = False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.permanent = permanent
+
+
+def event_id_for(booking_id: str) -> str:
+    """GCal event id for a booking (base32hex: 0-9 a-v, 5-1024 chars)"""
+    return "bb" + str(booking_id).replace("-", "")
+
+
+def _retry_after(response: requests.Response) -> Optional[int]:
+    value = response.headers.get("Retry-After", "")
+    return int(value) if value.isdigit() else None
+
+
+def _error_reasons(response: requests.Response) -> set:
+    """error.errors[].reason from a Calendar API error body"""
+    try:
+        errors = response.json().get("error", {}).get("errors") or []
+    except (ValueError, AttributeError):
+        return set()
+    return {e.get("reason") for e in errors if isinstance(e, dict)}
+
+
+class AccessToken:
+    """
+    Bearer token for the Calendar API, fetched again shortly before it
+    expires. fetch() returns (token, seconds until it expires).
+    """
+
+    def __init__(self, fetch: Callable[[], Tuple[str, float]], margin: float = 60.0):
+        self.fetch = fetch
+        self.margin = margin
+        self.value = ""
+        self.expires_at = 0.0
+        self.refreshes = 0
+        self._lock = threading.Lock()
+
+    def get(self) -> str:
+        with self._lock:
+            if time.time() >= self.expires_at - self.margin:
+                self.value, expires_in = self.fetch()
+                self.expires_at = time.time() + expires_in
+                self.refreshes += 1
+            return self.value
+
+    def invalidate(self, value: str) -> None:
+        """Forget value (rejected with 401), unless another thread already replaced it"""
+        with self._lock:
+            if self.value == value:
+                self.expires_at = 0.0
+
+    @classmethod
+    def fixed(cls, value: str) -> "AccessToken":
+        return cls(lambda: (value, float("inf")))
+
+    @classmethod
+    def refresh_token(cls, client_id: str, client_secret: str, refresh_token: str,
+                      token_url: str = DEFAULT_TOKEN_URL) -> "AccessToken":
+        """OAuth refresh-token grant, for a user's calendar"""
+
+        def fetch():
+            response = requests.post(token_url, timeout=10, data={
+                "grant_type": "refresh_token",
+                "client_id": client_id,
+                "client_secret": client_secret,
+                "refresh_token": refresh_token,
+            })
+            response.raise_for_status()
+            body = response.json()
+            return body["access_token"], float(body.get("expires_in", 3600))
+
+        return cls(fetch)
+
+    @classmethod
+    def service_account(cls, key_file: str) -> "AccessToken":
+        """Service account key; google-auth signs the token request"""
+        from google.auth.transport.requests import Request
+        from google.oauth2 import service_account
+
+        credentials = service_account.Credentials.from_service_account_file(key_file, scopes=[CALENDAR_SCOPE])
+
+        def fetch():
+            credentials.refresh(Request())
+            if credentials.expiry is None:
+                return credentials.token, 3600.0
+            # google-auth keeps expiry as a naive UTC datetime
+            return credentials.token, credentials.expiry.replace(tzinfo=timezone.utc).timestamp() - time.time()
+
+        return cls(fetch)
+
+    @classmethod
+    def from_env(cls) -> "AccessToken":
+        if os.getenv("GCAL_SERVICE_ACCOUNT_FILE"):
+            return cls.service_account(os.environ["GCAL_SERVICE_ACCOUNT_FILE"])
+        if os.getenv("GCAL_REFRESH_TOKEN"):
+            return cls.refresh_token(
+                os.getenv("GCAL_CLIENT_ID", ""),
+                os.getenv("GCAL_CLIENT_SECRET", ""),
+                os.environ["GCAL_REFRESH_TOKEN"],
+                os.getenv("GCAL_TOKEN_URL", DEFAULT_TOKEN_URL),
+            )
+        return cls.fixed(os.getenv("GCAL_ACCESS_TOKEN", ""))
+
+
+class GCalClient:
+    """Minimal Calendar API v3 client, one keep-alive session per thread"""
+
+    def __init__(self, api_base: str = DEFAULT_API_BASE, access_token: Union[AccessToken, str] = "", timeout: float = 10.0):
+        self.api_base = api_base.rstrip("/")
+        self.token = access_token if isinstance(access_token, AccessToken) else AccessToken.fixed(access_token)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            self._local.session = session
+        return session
+
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response:
+        """One request; a 401 refreshes the token and is sent once more"""
+        for _ in range(2):
+            token = self.token.get()
+            response = self.session.request(
+                method, url, headers={"Authorization": f"Bearer {token}"}, timeout=self.timeout, **kwargs
+            )
+            if response.status_code != 401:
+                break
+            self.token.invalidate(token)
+        return response
+
+    def _events_url(self, calendar_id: str, event_id: str = "") -> str:
+        url = f"{self.api_base}/calendars/{requests.utils.quote(calendar_id, safe='')}/events"
+        return f"{url}/{event_id}" if event_id else url
+
+    def _raise_for(self, response: requests.Response, action: str) -> None:
+        if response.status_code in TRANSIENT_STATUS or (
+            response.status_code == 403 and _error_reasons(response) & RATE_LIMIT_REASONS
+        ):
+            raise GCalError(f"{action}: HTTP {response.status_code}", retry_after=_retry_after(response))
+        raise GCalError(f"{action}: HTTP {response.status_code} {response.text[:200]}", permanent=True)
+
+    def create_event(self, calendar_id: str, event_id: str, summary: str, start: str, end: str) -> str:
+        body = {"id": event_id, "summary": summary, "start": {"dateTime": start}, "end": {"dateTime": end}}
+        response = self._send("POST", self._events_url(calendar_id), json=body)
+        # 409: created by an earlier attempt whose response was lost
+        if response.status_code in (200, 201, 409):
+            return event_id
+        self._raise_for(response, "create")
+
+    def delete_event(self, calendar_id: str, event_id: str) -> None:
+        response = self._send("DELETE", self._events_url(calendar_id, event_id))
+        # 404/410: already gone, which is the desired end state
+        if response.status_code in (200, 204, 404, 410):
+            return
+        self._raise_for(response, "delete")
+
+
+def process_item(client: GCalClient, item: Dict[str, Any]) -> Dict[str, Any]:
+    """Apply one claimed outbox row; returns its settle_calendar_outbox() entry"""
+    payload = item["payload"] or {}
+    result: Dict[str, Any] = {"id": item["id"], "ok": False}
+    try:
+        if item["operation"] == "create":
+            result["gcal_event_id"] = client.create_event(
+                item["calendar_id"],
+                event_id_for(item["booking_id"]),
+                payload.get("summary", "Reserva"),
+                payload["start_time"],
+                payload["end_time"],
+            )
+        elif payload.get("event_id"):
+            client.delete_event(item["calendar_id"], payload["event_id"])
+        result["ok"] = True
+    except GCalError as e:
+        result.update(error=str(e), retry_after=e.retry_after, permanent=e.permanent)
+    except requests.RequestException as e:
+        result.update(error=f"{type(e).__name__}: {e}")
+    except (KeyError, TypeError, ValueError) as e:
+        # A row that cannot be sent never will be; settle it with the batch
+        result.update(error=f"invalid payload: {type(e).__name__}: {e}", permanent=True)
+    except Exception as e:
+        # e.g. the token refresh failed; retried like a network error
+        result.update(error=f"{type(e).__name__}: {e}")
+    return result
+
+
+class OutboxWorker:
+    """Claims, applies and settles calendar_outbox batches"""
+
+    def __init__(
+        self,
+        dsn: str,
+        client: GCalClient,
+        batch_size: int = 50,
+        concurrency: int = 8,
+        lease_seconds: int = 60,
+    ):
+        self.client = client
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.conn = psycopg2.connect(dsn)
+        self.conn.autocommit = True
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def claim(self) -> List[Dict[str, Any]]:
+        with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("SELECT * FROM public.claim_calendar_outbox(%s, %s)", (self.batch_size, self.lease_seconds))
+            return cur.fetchall()
+
+    def settle(self, results: List[Dict[str, Any]]) -> int:
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT public.settle_calendar_outbox(%s::jsonb)", (json.dumps(results),))
+            return cur.fetchone()[0]
+
+    def drain_once(self) -> Dict[str, int]:
+        """Process one batch; returns counts (claimed, ok, failed)"""
+        items = self.claim()
+        if not items:
+            return {"claimed": 0, "ok": 0, "failed": 0}
+        results = list(self.executor.map(lambda item: process_item(self.client, item), items))
+        self.settle(results)
+        ok = sum(1 for r in results if r["ok"])
+        return {"claimed": len(items), "ok": ok, "failed": len(items) - ok}
+
+    def run(self, idle_sleep: float = 2.0, stop: Optional[threading.Event] = None) -> None:
+        """Drain until stopped; sleeps only when the outbox has nothing due"""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            stats = self.drain_once()
+            if stats["claimed"]:
+                print(f"calendar_outbox: {stats['claimed']} claimed, {stats['ok']} ok, {stats['failed']} failed", flush=True)
+            if stats["claimed"] < self.batch_size:
+                stop.wait(idle_sleep)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drain public.calendar_outbox into Google Calendar")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8, help="Max GCal requests in flight")
+    parser.add_argument("--lease", type=int, default=60, help="Seconds before a claimed row can be taken over")
+    parser.add_argument("--idle-sleep", type=float, default=2.0)
+    parser.add_argument("--once", action="store_true", help="Process a single batch and exit")
+    args = parser.parse_args()
+
+    load_env_file()
+    client = GCalClient(os.getenv("GCAL_API_BASE", DEFAULT_API_BASE), AccessToken.from_env())
+    worker = OutboxWorker(get_database_url(), client, args.batch_size, args.concurrency, args.lease)
+    try:
+        if args.once:
+            stats = worker.drain_once()
+            print(f"calendar_outbox: {stats['claimed']} claimed, {stats['ok']} ok, {stats['failed']} failed")
+            sys.exit(0 if stats["failed"] == 0 else 1)
+        worker.run(args.idle_sleep)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.close()
+
+
+if __name__ == "__main__":
+    main()
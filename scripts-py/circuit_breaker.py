@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+Circuit Breaker - in-process breakers over circuit_breaker_state (BB_05)
+
+BB_05_Circuit_Breaker_Helper asks the database on every check and records
+every result there (circuit_breaker_check() / circuit_breaker_record(),
+database/migrations/20261018_23_circuit_breaker_half_open.sql). A
+long-running process can use these breakers instead. allow() is a memory
+read in CLOSED and OPEN, and the table is written only on transitions:
+
+    CLOSED     results are counted in memory, in a rolling window (the
+               current epoch-aligned window plus the previous one weighted
+               by its overlap, as in the table). When the window holds at
+               least min_calls calls and the failure rate reaches
+               failure_rate_threshold, the breaker opens here at once and
+               circuit_breaker_trip() persists it.
+    OPEN       calls are refused until next_attempt_at.
+    HALF_OPEN  after the cool-down, allow() goes to circuit_breaker_check(),
+               which claims one of half_open_max_calls probe slots under the
+               row lock. The bound therefore holds across every process and
+               BB_05. Probe results go to circuit_breaker_record(), which
+               closes the breaker or reopens it.
+
+Settings are per workflow_name (circuit_breaker_config, '*' = defaults) and
+are read with the state the first time a workflow is seen. Transitions and
+settings changes made anywhere arrive by LISTEN circuit_breaker. Each
+process counts its own CLOSED results, so one process trips on its own
+failure rate and the others follow the notification. If the database
+cannot be read, a breaker starts CLOSED with the default settings. A probe
+that cannot be claimed is refused.
+
+Environment:
+    DATABASE_URL   Postgres connection string (see config.get_database_url)
+
+Usage:
+    from circuit_breaker import CircuitBreakers
+    breakers = CircuitBreakers(dsn)
+    if breakers.allow("BB_04_GCal_Sync").allowed:
+        ok = call_google_calendar()
+        breakers.record("BB_04_GCal_Sync", ok)
+    breakers.close()
+
+    python circuit_breaker.py status
+    python circuit_breaker.py configure BB_04_GCal_Sync --failure-rate 0.3 --min-calls 10
+    python circuit_breaker.py reset BB_04_GCal_Sync
+
+Requires:
+    pip install psycopg2-binary
+"""
+
+import argparse
+import math
+import select
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import psycopg2
+
+from config import get_database_url
+
+NOTIFY_CHANNEL = "circuit_breaker"
+CLOSED, OPEN, HALF_OPEN = "CLOSED", "OPEN", "HALF_OPEN"
+
+STATE_SQL = """
+    SELECT s.failure_rate_threshold, s.min_calls, s.window_seconds, s.open_seconds, s.half_open_max_calls,
+           c.state, c.next_attempt_at
+    FROM public.circuit_breaker_settings(%s) s
+    LEFT JOIN public.circuit_breaker_state c ON c.workflow_name = %s
+"""
+CHECK_SQL = "SELECT allowed, state, reason, retry_after_seconds FROM public.circuit_breaker_check(%s)"
+RECORD_SQL = "SELECT state, next_attempt_at FROM public.circuit_breaker_record(%s, %s)"
+TRIP_SQL = "SELECT state, next_attempt_at FROM public.circuit_breaker_trip(%s, %s)"
+STATUS_SQL = """
+    SELECT c.workflow_name, c.state, c.failure_count, c.window_calls + c.prev_window_calls, c.next_attempt_at,
+           s.failure_rate_threshold, s.min_calls, s.window_seconds, s.open_seconds, s.half_open_max_calls
+    FROM public.circuit_breaker_state c
+    CROSS JOIN LATERAL public.circuit_breaker_settings(c.workflow_name) s
+    ORDER BY c.workflow_name
+"""
+
+
+@dataclass
+class Settings:
+    failure_rate_threshold: float = 0.5
+    min_calls: int = 5
+    window_seconds: int = 60
+    open_seconds: int = 60
+    half_open_max_calls: int = 3
+
+
+@dataclass
+class Decision:
+    allowed: bool
+    state: str
+    reason: str  # closed / open / probe / probes_in_flight / probe_unavailable
+    retry_after: float = 0.0
+
+
+class RollingWindow:
+    """Calls and failures in the current fixed window plus the previous one, weighted by its overlap"""
+
+    def __init__(self, seconds: int, clock=time.time):
+        self.seconds = seconds
+        self.clock = clock
+        self.reset()
+
+    def reset(self) -> None:
+        self.start = math.floor(self.clock() / self.seconds) * self.seconds
+        self.calls = self.failures = self.prev_calls = self.prev_failures = 0
+
+    def _roll(self, now: float) -> None:
+        start = math.floor(now / self.seconds) * self.seconds
+        if start == self.start:
+            return
+        if start == self.start + self.seconds:
+            self.prev_calls, self.prev_failures = self.calls, self.failures
+        else:
+            self.prev_calls = self.prev_failures = 0
+        self.start = start
+        self.calls = self.failures = 0
+
+    def record(self, success: bool) -> None:
+        self._roll(self.clock())
+        self.calls += 1
+        self.failures += not success
+
+    def totals(self):
+        """(calls, failures), weighted"""
+        now = self.clock()
+        self._roll(now)
+        weight = 1 - (now - self.start) / self.seconds
+        return self.prev_calls * weight + self.calls, self.prev_failures * weight + self.failures
+
+
+class _Breaker:
+    def __init__(self, settings: Settings, state: str, next_attempt: Optional[float], clock):
+        self.settings = settings
+        self.state = state
+        self.next_attempt = next_attempt
+        self.window = RollingWindow(settings.window_seconds, clock)
+
+
+def _epoch(value: Optional[datetime]) -> Optional[float]:
+    return None if value is None else value.timestamp()
+
+
+class CircuitBreakers:
+    def __init__(self, dsn: str, listen: bool = True, clock=time.time):
+        self.dsn = dsn
+        self.clock = clock
+        self.breakers: Dict[str, _Breaker] = {}
+        self.lock = threading.Lock()
+        self.db_lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.counters = {
+            "checks": 0, "allowed": 0, "refused": 0, "probes": 0,
+            "db_calls": 0, "db_errors": 0, "transitions": 0, "notifications": 0,
+        }
+        self.conn = None
+        self.stop = threading.Event()
+        self.listening = threading.Event()
+        self.thread = None
+        if listen:
+            self.thread = threading.Thread(target=self._listen, name="circuit-breaker-listen", daemon=True)
+            self.thread.start()
+            self.listening.wait(5.0)
+
+    def _query(self, sql: str, params) -> Optional[tuple]:
+        """One row from the database, or None if it could not be reached"""
+        with self.db_lock:
+            try:
+                if self.conn is None or self.conn.closed:
+                    self.conn = psycopg2.connect(self.dsn)
+                    self.conn.autocommit = True
+                with self.conn.cursor() as cur:
+                    cur.execute(sql, params)
+                    row = cur.fetchone()
+            except psycopg2.Error as e:
+                print(f"circuit breaker: {e}", file=sys.stderr)
+                if self.conn is not None:
+                    self.conn.close()
+                with self.lock:
+                    self.counters["db_errors"] += 1
+                return None
+        with self.lock:
+            self.counters["db_calls"] += 1
+        return row
+
+    def _load(self, workflow_name: str) -> _Breaker:
+        row = self._query(STATE_SQL, (workflow_name, workflow_name))
+        if row is None:
+            return _Breaker(Settings(), CLOSED, None, self.clock)
+        *settings, state, next_attempt = row
+        return _Breaker(Settings(*settings), state or CLOSED, _epoch(next_attempt), self.clock)
+
+    def _breaker(self, workflow_name: str) -> _Breaker:
+        breaker = self.breakers.get(workflow_name)
+        if breaker is None:
+            # One read per workflow however many threads see it first
+            with self.load_lock:
+                breaker = self.breakers.get(workflow_name)
+                if breaker is None:
+                    breaker = self._load(workflow_name)
+                    with self.lock:
+                        self.breakers[workflow_name] = breaker
+        return breaker
+
+    def _apply(self, breaker: _Breaker, state: str, next_attempt: Optional[float]) -> None:
+        """Caller holds self.lock. The table wins over the local state."""
+        if state != breaker.state:
+            self.counters["transitions"] += 1
+            if state == CLOSED:
+                breaker.window.reset()
+        breaker.state = state
+        breaker.next_attempt = next_attempt
+
+    # -- hot path -----------------------------------------------------------
+
+    def allow(self, workflow_name: str) -> Decision:
+        """Whether a call to workflow_name's dependency may go ahead"""
+        breaker = self._breaker(workflow_name)
+        now = self.clock()
+        with self.lock:
+            self.counters["checks"] += 1
+            if breaker.state == CLOSED:
+                self.counters["allowed"] += 1
+                return Decision(True, CLOSED, "closed")
+            if breaker.state == OPEN and breaker.next_attempt is not None and breaker.next_attempt > now:
+                self.counters["refused"] += 1
+                return Decision(False, OPEN, "open", breaker.next_attempt - now)
+
+        # Cool-down over or HALF_OPEN: probe slots are shared through the table
+        row = self._query(CHECK_SQL, (workflow_name,))
+        with self.lock:
+            if row is None:
+                self.counters["refused"] += 1
+                return Decision(False, breaker.state, "probe_unavailable")
+            allowed, state, reason, retry_after = row
+            next_attempt = now + retry_after if state == OPEN else breaker.next_attempt
+            self._apply(breaker, state, next_attempt)
+            self.counters["allowed" if allowed else "refused"] += 1
+            self.counters["probes"] += reason == "probe"
+            return Decision(allowed, state, reason, retry_after)
+
+    def record(self, workflow_name: str, success: bool) -> str:
+        """Counts the result of an allowed call; returns the breaker's state"""
+        breaker = self._breaker(workflow_name)
+        with self.lock:
+            state = breaker.state
+            if state == OPEN:
+                # A call allowed before the breaker opened
+                return state
+            if state == CLOSED:
+                breaker.window.record(success)
+                calls, failures = breaker.window.totals()
+                settings = breaker.settings
+                if success or calls < settings.min_calls or failures / calls < settings.failure_rate_threshold:
+                    return state
+                # Open here at once; the table is told below
+                self._apply(breaker, OPEN, self.clock() + settings.open_seconds)
+
+        if state == CLOSED:
+            row = self._query(TRIP_SQL, (workflow_name, round(failures)))
+        else:
+            row = self._query(RECORD_SQL, (workflow_name, success))
+        with self.lock:
+            if row is not None:
+                self._apply(breaker, row[0], _epoch(row[1]))
+            return breaker.state
+
+    # -- state from the table ----------------------------------------------------
+
+    def _refresh(self, workflow_name: str) -> None:
+        if workflow_name == "*":
+            names = list(self.breakers)
+        elif workflow_name in self.breakers:
+            names = [workflow_name]
+        else:
+            return
+        for name in names:
+            loaded = self._load(name)
+            with self.lock:
+                breaker = self.breakers.get(name)
+                if breaker is None:
+                    continue
+                if loaded.settings.window_seconds != breaker.settings.window_seconds:
+                    breaker.window = loaded.window
+                breaker.settings = loaded.settings
+                self._apply(breaker, loaded.state, loaded.next_attempt)
+
+    def _listen(self) -> None:
+        while not self.stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                # Changes made before LISTEN would otherwise be missed
+                self._refresh("*")
+                self.listening.set()
+                while not self.stop.is_set():
+                    if not select.select([conn], [], [], 1.0)[0]:
+                        continue
+                    conn.poll()
+                    names = {n.payload for n in conn.notifies}
+                    conn.notifies.clear()
+                    with self.lock:
+                        self.counters["notifications"] += len(names)
+                    for name in ("*",) if "*" in names else names:
+                        self._refresh(name)
+            except psycopg2.Error as e:
+                print(f"circuit breaker listener: {e}", file=sys.stderr)
+                self.listening.clear()
+                self.stop.wait(1.0)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            stats = dict(self.counters)
+            stats["breakers"] = {name: b.state for name, b in self.breakers.items()}
+        return stats
+
+    def close(self) -> None:
+        self.stop.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5.0)
+        with self.db_lock:
+            if self.conn is not None:
+                self.conn.close()
+
+
+def breaker_status(conn) -> List[tuple]:
+    with conn.cursor() as cur:
+        cur.execute(STATUS_SQL)
+        return cur.fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and configure circuit breakers")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="List breakers with their settings")
+    p_configure = sub.add_parser("configure", help="Set a workflow's settings ('*' = defaults)")
+    p_configure.add_argument("workflow_name")
+    p_configure.add_argument("--failure-rate", type=float)
+    p_configure.add_argument("--min-calls", type=int)
+    p_configure.add_argument("--window", type=int, help="Rolling window, seconds")
+    p_configure.add_argument("--open", type=int, help="Cool-down before probing, seconds")
+    p_configure.add_argument("--probes", type=int, help="Probe calls allowed in HALF_OPEN")
+    p_reset = sub.add_parser("reset", help="Close a breaker (breakers in other processes are notified)")
+    p_reset.add_argument("workflow_name")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(get_database_url())
+    conn.autocommit = True
+    try:
+        if args.command == "status":
+            rows = breaker_status(conn)
+            for name, state, failures, calls, next_attempt, rate, min_calls, window, open_s, probes in rows:
+                until = f" until {next_attempt.isoformat()}" if next_attempt and state != CLOSED else ""
+                print(f"{name:<32} {state:<9} {failures} of {calls} calls failed{until}"
+                      f"  [rate>={rate:g} min={min_calls} window={window}s open={open_s}s probes={probes}]")
+            print(f"{len(rows)} breaker(s)", file=sys.stderr)
+        elif args.command == "configure":
+            values = {
+                "failure_rate_threshold": args.failure_rate, "min_calls": args.min_calls,
+                "window_seconds": args.window, "open_seconds": args.open, "half_open_max_calls": args.probes,
+            }
+            values = {k: v for k, v in values.items() if v is not None}
+            if not values:
+                parser.error("nothing to configure")
+            columns = ", ".join(values)
+            updates = ", ".join(f"{k} = EXCLUDED.{k}" for k in values)
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"INSERT INTO public.circuit_breaker_config (workflow_name, {columns}) "
+                    f"VALUES (%s, {', '.join(['%s'] * len(values))}) "
+                    f"ON CONFLICT (workflow_name) DO UPDATE SET {updates}, updated_at = NOW()",
+                    (args.workflow_name, *values.values()),
+                )
+            print(f"{args.workflow_name}: {', '.join(f'{k}={v}' for k, v in values.items())}")
+        else:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE public.circuit_breaker_state SET state = 'CLOSED', failure_count = 0, next_attempt_at = NULL, "
+                    "window_calls = 0, window_failures = 0, prev_window_calls = 0, prev_window_failures = 0, "
+                    "half_open_calls = 0, half_open_successes = 0, updated_at = NOW() "
+                    "WHERE workflow_name = %s RETURNING workflow_name",
+                    (args.workflow_name,),
+                )
+                print(f"{args.workflow_name}: {'closed' if cur.fetchone() else 'not found'}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Error Fingerprint - Python twin of error_handling.generate_error_fingerprint()
+
+Since database/migrations/20261018_17_error_fingerprint_on_write.sql, error_logs
+rows get their error_fingerprint from a BEFORE INSERT trigger, and recurrence
+checks compare stored fingerprints. This module has:
+
+    fingerprint()   the same normalization and MD5 as the SQL function,
+                    byte for byte, so tooling can group or look up errors
+                    without a round trip
+    backfill        fingerprints rows logged before the trigger existed, in
+                    keyset chunks (id > last ORDER BY id LIMIT n). Each chunk is
+                    its own short transaction and only locks the rows it
+                    updates. The update goes through the SQL function, so
+                    stored values stay authoritative. updated_at is bumped by
+                    trg_error_logs_updated_at.
+    verify          recomputes stored fingerprints in Python and reports any
+                    mismatch
+
+The SQL passes run in this order and are replicated in the same order: digits
+first, so the later UUID / HASH / IP passes only see what the digit pass left.
+Postgres character classes and lower() follow the database's ctype. The
+twin targets a UTF-8 database with a Unicode ctype (C.UTF-8, en_US.UTF-8,
+pg_c_utf8). \\d is 0-9 only, and \\s is ASCII whitespace plus
+the Unicode spaces glibc's iswspace() accepts, as used below. lower() maps
+one character at a time (simple case mapping), unlike Python's str.lower():
+a final 'Σ' becomes 'σ', not 'ς', and 'İ' becomes 'i', not 'i' + U+0307. In a
+SQL_ASCII or C-ctype database only ASCII letters are lowered, so non-ASCII
+messages will not match there.
+
+Environment:
+    DATABASE_URL   Postgres connection string (see config.get_database_url)
+
+Usage:
+    python error_fingerprint.py fingerprint BB_02_Security_Firewall RUNTIME_ERROR "Timeout after 3000 ms"
+    python error_fingerprint.py backfill [--chunk 5000] [--sleep 0.1] [--start-id 0]
+    python error_fingerprint.py verify [--sample 1000]
+
+Requires:
+    pip install psycopg2-binary
+"""
+
+import argparse
+import hashlib
+import re
+import sys
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import psycopg2
+
+from config import get_database_url
+
+DIGITS = re.compile(r"[0-9]+")
+UUID = re.compile(r"[a-fA-F0-9]{8}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{12}")
+HASH = re.compile(r"[a-fA-F0-9]{32,}")
+IP = re.compile(r"[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}")
+SPACES = re.compile(
+    "[\t\n\v\f\r \u1680\u2000-\u2006\u2008-\u200a\u2028\u2029\u205f\u3000]+"
+)
+# The only character whose str.lower() is not a single character
+SIMPLE_LOWER = {"\u0130": "i"}
+
+BACKFILL_SQL = """
+    WITH picked AS (
+        SELECT id, created_at FROM error_handling.error_logs
+        WHERE id > %s AND error_fingerprint IS NULL
+        ORDER BY id
+        LIMIT %s
+    ),
+    updated AS (
+        UPDATE error_handling.error_logs e
+        SET error_fingerprint = error_handling.generate_error_fingerprint(e.workflow_name, e.error_type, e.error_message)
+        FROM picked
+        WHERE e.id = picked.id AND e.created_at = picked.created_at
+          AND e.error_fingerprint IS NULL
+        RETURNING 1
+    )
+    SELECT (SELECT MAX(id) FROM picked), (SELECT COUNT(*) FROM updated)
+"""
+
+
+def pg_lower(text: str) -> str:
+    """Postgres lower(): per-character simple case mapping, no final-sigma or expanding rules"""
+    if text.isascii():
+        return text.lower()
+    return "".join(SIMPLE_LOWER.get(c) or c.lower() for c in text)
+
+
+def normalize_message(message: Optional[str]) -> str:
+    """The normalized message of generate_error_fingerprint(), before hashing"""
+    if message is None:
+        return ""
+    normalized = DIGITS.sub("N", message)
+    normalized = UUID.sub("UUID", normalized)
+    normalized = HASH.sub("HASH", normalized)
+    normalized = IP.sub("IP", normalized)
+    normalized = SPACES.sub(" ", normalized)
+    return pg_lower(normalized.strip(" "))[:200]
+
+
+def fingerprint(workflow_name: Optional[str], error_type: Optional[str], error_message: Optional[str]) -> str:
+    """'fp_' + md5 hex, equal to error_handling.generate_error_fingerprint(workflow_name, error_type, error_message)"""
+    source = f"{workflow_name or ''}:{error_type or ''}:{normalize_message(error_message)}"
+    return "fp_" + hashlib.md5(source.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class BackfillProgress:
+    last_id: int = 0
+    updated: int = 0
+    chunks: int = 0
+
+
+class FingerprintStore:
+    """Chunked backfill and verification of error_logs.error_fingerprint over one connection"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def backfill_chunk(self, after_id: int, chunk: int):
+        """Fingerprints up to `chunk` rows with id > after_id in one transaction; returns (last id or None, updated)"""
+        with self.conn.cursor() as cur:
+            cur.execute(BACKFILL_SQL, (after_id, chunk))
+            last_id, updated = cur.fetchone()
+        self.conn.commit()
+        return last_id, updated
+
+    def backfill(self, chunk: int = 5000, sleep: float = 0.0, start_id: int = 0, progress=None) -> BackfillProgress:
+        state = BackfillProgress(last_id=start_id)
+        while True:
+            last_id, updated = self.backfill_chunk(state.last_id, chunk)
+            if last_id is None:
+                return state
+            state.last_id = last_id
+            state.updated += updated
+            state.chunks += 1
+            if progress:
+                progress(state)
+            if sleep:
+                time.sleep(sleep)
+
+    def remaining(self) -> int:
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM error_handling.error_logs WHERE error_fingerprint IS NULL")
+            count = cur.fetchone()[0]
+        self.conn.rollback()
+        return count
+
+    def verify(self, sample: int = 1000):
+        """Compares fingerprint() with the newest `sample` stored fingerprints; returns (checked, mismatches)"""
+        with self.conn.cursor() as cur:
+            cur.execute(
+                "SELECT id, workflow_name, error_type, error_message, error_fingerprint "
+                "FROM error_handling.error_logs WHERE error_fingerprint IS NOT NULL "
+                "ORDER BY created_at DESC LIMIT %s",
+                (sample,),
+            )
+            rows = cur.fetchall()
+        self.conn.rollback()
+        mismatches = [r for r in rows if fingerprint(r[1], r[2], r[3]) != r[4]]
+        return len(rows), mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute, backfill and verify error_logs fingerprints")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_fp = sub.add_parser("fingerprint", help="Print the fingerprint of one error")
+    p_fp.add_argument("workflow_name")
+    p_fp.add_argument("error_type")
+    p_fp.add_argument("error_message")
+    p_backfill = sub.add_parser("backfill", help="Fingerprint rows logged before the insert trigger")
+    p_backfill.add_argument("--chunk", type=int, default=5000, help="Rows per transaction")
+    p_backfill.add_argument("--sleep", type=float, default=0.0, help="Pause between chunks (seconds)")
+    p_backfill.add_argument("--start-id", type=int, default=0, help="Resume after this id")
+    p_verify = sub.add_parser("verify", help="Compare stored fingerprints with the Python implementation")
+    p_verify.add_argument("--sample", type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.command == "fingerprint":
+        print(fingerprint(args.workflow_name, args.error_type, args.error_message))
+        return
+
+    conn = psycopg2.connect(get_database_url())
+    store = FingerprintStore(conn)
+    try:
+        if args.command == "backfill":
+            def report(state):
+                print(f"  chunk {state.chunks}: up to id {state.last_id}, {state.updated} fingerprinted", file=sys.stderr)
+
+            state = store.backfill(args.chunk, args.sleep, args.start_id, progress=report)
+            print(f"{state.updated} error_logs rows fingerprinted in {state.chunks} chunk(s); {store.remaining()} still NULL")
+        elif args.command == "verify":
+            checked, mismatches = store.verify(args.sample)
+            for row in mismatches[:20]:
+                print(f"MISMATCH id={row[0]} stored={row[4]} python={fingerprint(row[1], row[2], row[3])}")
+            print(f"{checked} fingerprints checked, {len(mismatches)} mismatch(es)")
+            if mismatches:
+                sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
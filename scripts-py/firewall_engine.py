@@ -0,0 +1,560 @@
+#!/usr/bin/env python3
+"""
+Firewall Engine - in-memory token-bucket firewall with write-behind to security_firewall
+
+BB_02_Security_Firewall asks the database about every message, in one
+firewall_hit() round trip (database/migrations/20261018_21_firewall_token_bucket.sql).
+A long-running consumer can use this engine instead. check() only touches
+memory, and the database sees one batched write every few seconds:
+
+    per entity    TokenBucket (telegram_rate_limit), capacity / refill_rate,
+                  a SlidingWindow quota of window_limit messages per
+                  window_seconds, and the strike streak. A message over
+                  either limit is a strike, and strikes_to_block strikes
+                  block the entity for block_minutes.
+    blocks        a BloomFilter of the entities blocked in security_firewall,
+                  rebuilt every rebuild_interval seconds and kept current by
+                  LISTEN security_firewall (admin blocks and unblocks
+                  included). An entity the filter does not know is not
+                  blocked, so clean traffic never looks at the table. A
+                  filter hit is confirmed once with a read of its row. Hits
+                  are real blocks or the filter's false positives
+                  (filter_fp_rate). The table stays authoritative for blocks.
+    write-behind  every flush_interval seconds, the entities touched since
+                  the last flush go to ONE firewall_flush() call with their
+                  bucket level, window counts and strike delta. The window
+                  counts and block state it returns are merged over every
+                  process and BB_02, and they replace the local ones.
+
+The policy defaults match firewall_hit(), so both paths agree. A failed
+flush keeps its deltas for the next one. Persistence failures never block
+traffic, and blocks already known stay in force. A filter hit that cannot
+be confirmed is treated as blocked. Buckets start full after a restart;
+window counts come back with the first flush, and blocks do not reset.
+
+Environment:
+    DATABASE_URL   Postgres connection string (see config.get_database_url)
+
+Usage:
+    from firewall_engine import FirewallEngine
+    firewall = FirewallEngine(dsn)
+    verdict = firewall.check("123456789")   # Verdict(allowed, reason, retry_after)
+    firewall.stats()
+    firewall.close()                        # final flush
+
+    python firewall_engine.py blocks
+    python firewall_engine.py unblock 123456789
+
+Requires:
+    pip install psycopg2-binary
+"""
+
+import argparse
+import math
+import select
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import psycopg2
+
+from config import get_database_url
+from telegram_rate_limit import TokenBucket
+
+NOTIFY_CHANNEL = "security_firewall"
+CAPACITY = 10.0
+REFILL_RATE = 0.5
+STRIKES_TO_BLOCK = 5
+BLOCK_MINUTES = 15
+STRIKE_RESET_MINUTES = 60
+WINDOW_LIMIT = 60
+WINDOW_SECONDS = 600
+FLUSH_INTERVAL = 2.0
+FILTER_FP_RATE = 0.01
+FILTER_MIN_ENTRIES = 1024
+REBUILD_INTERVAL = 300.0
+MAX_ENTITIES = 100000
+
+FLUSH_SQL = """
+    SELECT entity_id, strike_count, is_blocked, blocked_until, window_start, window_count, prev_window_count
+    FROM public.firewall_flush(%s::text[], %s::integer[], %s::timestamptz[], %s::float8[], %s::timestamptz[],
+                               %s::timestamptz[], %s::integer[], %s::integer[], %s, %s, %s, %s)
+"""
+BLOCKS_SQL = """
+    SELECT entity_id, blocked_until FROM public.security_firewall
+    WHERE is_blocked AND (blocked_until IS NULL OR blocked_until > NOW())
+"""
+BLOCK_SQL = "SELECT is_blocked, blocked_until FROM public.security_firewall WHERE entity_id = %s"
+
+
+@dataclass
+class Verdict:
+    allowed: bool
+    reason: Optional[str] = None  # SEC_BLOCKED / SEC_RATE_LIMITED
+    retry_after: float = 0.0
+
+
+class SlidingWindow:
+    """
+    Sliding-window counter: the previous fixed window's count, weighted by the
+    part of it still inside the last `seconds`, plus the current window's.
+    Windows are aligned to the epoch, as in firewall_hit(). pending and
+    pending_prev are the counts not flushed yet.
+    """
+
+    def __init__(self, limit: int, seconds: int, clock=time.time):
+        self.limit = limit
+        self.seconds = seconds
+        self.clock = clock
+        self.start = self._window(clock())
+        self.count = self.prev = 0
+        self.pending = self.pending_prev = 0
+
+    def _window(self, now: float) -> int:
+        return math.floor(now / self.seconds) * self.seconds
+
+    def _roll(self, now: float) -> None:
+        start = self._window(now)
+        if start == self.start:
+            return
+        if start == self.start + self.seconds:
+            self.prev, self.pending_prev = self.count, self.pending
+        else:
+            self.prev = self.pending_prev = 0
+        self.start = start
+        self.count = self.pending = 0
+
+    def delay(self) -> float:
+        """Rolls the windows; returns 0 if a message fits, else the seconds until one does"""
+        now = self.clock()
+        self._roll(now)
+        if self.limit <= 0:
+            return 0.0
+        elapsed = now - self.start
+        if self.prev * (1 - elapsed / self.seconds) + self.count < self.limit:
+            return 0.0
+        if self.count >= self.limit:
+            return max(self.seconds * (2 - self.limit / self.count) - elapsed, 0.0)
+        return max(self.seconds * (1 - (self.limit - self.count) / self.prev) - elapsed, 0.0)
+
+    def take(self) -> None:
+        self.count += 1
+        self.pending += 1
+
+    @property
+    def idle(self) -> bool:
+        self._roll(self.clock())
+        return not (self.count or self.prev or self.pending or self.pending_prev)
+
+
+class BloomFilter:
+    """Set of strings with false positives (fp_rate at capacity) but no false negatives"""
+
+    def __init__(self, capacity: int, fp_rate: float = FILTER_FP_RATE):
+        self.capacity = capacity
+        self.size = max(64, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _hashes(self, key: str) -> Tuple[int, int]:
+        # str hashes are salted per process, which is fine: a filter is never shared
+        h = hash(key) & 0xFFFFFFFFFFFFFFFF
+        return h & 0xFFFFFFFF, (h >> 32) | 1
+
+    def add(self, key: str) -> None:
+        h1, h2 = self._hashes(key)
+        for i in range(self.hashes):
+            p = (h1 + i * h2) % self.size
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        h1, h2 = self._hashes(key)
+        bits, size = self.bits, self.size
+        for i in range(self.hashes):
+            p = (h1 + i * h2) % size
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    @property
+    def saturated(self) -> bool:
+        return self.count > self.capacity
+
+
+@dataclass
+class _Entity:
+    bucket: TokenBucket
+    window: SlidingWindow
+    strikes: int = 0
+    last_strike: Optional[float] = None
+    pending_strikes: int = 0
+    dirty: bool = False
+
+
+def _until(is_blocked: bool, blocked_until: Optional[datetime]) -> Optional[float]:
+    """Block expiry as epoch seconds (inf = indefinite), None if not blocked"""
+    if not is_blocked:
+        return None
+    return math.inf if blocked_until is None else blocked_until.timestamp()
+
+
+def _ts(epoch: Optional[float]) -> Optional[datetime]:
+    return None if epoch is None else datetime.fromtimestamp(epoch, tz=timezone.utc)
+
+
+class FirewallEngine:
+    def __init__(
+        self,
+        dsn: str,
+        capacity: float = CAPACITY,
+        refill_rate: float = REFILL_RATE,
+        strikes_to_block: int = STRIKES_TO_BLOCK,
+        block_minutes: int = BLOCK_MINUTES,
+        strike_reset_minutes: int = STRIKE_RESET_MINUTES,
+        window_limit: int = WINDOW_LIMIT,
+        window_seconds: int = WINDOW_SECONDS,
+        flush_interval: float = FLUSH_INTERVAL,
+        filter_fp_rate: float = FILTER_FP_RATE,
+        rebuild_interval: float = REBUILD_INTERVAL,
+        listen: bool = True,
+        clock=time.time,
+    ):
+        self.dsn = dsn
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.strikes_to_block = strikes_to_block
+        self.block_minutes = block_minutes
+        self.strike_reset_minutes = strike_reset_minutes
+        self.window_limit = window_limit
+        self.window_seconds = window_seconds
+        self.filter_fp_rate = filter_fp_rate
+        self.rebuild_interval = rebuild_interval
+        self.clock = clock
+        self.entities: Dict[str, _Entity] = {}
+        # Filter hits confirmed against the table: blocked until (inf = indefinite), or not blocked
+        self.block_filter = BloomFilter(FILTER_MIN_ENTRIES, filter_fp_rate)
+        self.blocks: Dict[str, float] = {}
+        self.cleared: Set[str] = set()
+        self.rebuilt_at = 0.0
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.counters = {
+            "checks": 0, "allowed": 0, "rate_limited": 0, "blocked": 0,
+            "filter_hits": 0, "confirms": 0, "false_positives": 0, "confirm_errors": 0,
+            "flushes": 0, "rows_flushed": 0, "flush_errors": 0, "notifications": 0,
+        }
+        self.conn = None
+        self.stop = threading.Event()
+        self.listening = threading.Event()
+        self.threads: List[threading.Thread] = []
+
+        self.load_blocks()
+        if listen:
+            self._start(self._listen, "firewall-listen")
+            self.listening.wait(5.0)
+        if flush_interval:
+            self._start(lambda: self._flush_loop(flush_interval), "firewall-flush")
+
+    def _start(self, target, name: str) -> None:
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def _db(self):
+        if self.conn is None or self.conn.closed:
+            self.conn = psycopg2.connect(self.dsn)
+            self.conn.autocommit = True
+        return self.conn
+
+    # -- hot path -----------------------------------------------------------
+
+    def check(self, entity_id: str) -> Verdict:
+        """Verdict for one message from entity_id; memory only unless the block filter hits"""
+        verdict = self._check(entity_id)
+        if verdict is None:
+            if not self._confirm(entity_id):
+                with self.lock:
+                    self.counters["checks"] += 1
+                    self.counters["blocked"] += 1
+                return Verdict(False, "SEC_BLOCKED")
+            verdict = self._check(entity_id, confirmed=True)
+        return verdict
+
+    def _check(self, entity_id: str, confirmed: bool = False) -> Optional[Verdict]:
+        """None when the block filter hit an entity not confirmed yet"""
+        now = self.clock()
+        with self.lock:
+            until = self.blocks.get(entity_id)
+            if until is not None:
+                if until > now:
+                    self.counters["checks"] += 1
+                    self.counters["blocked"] += 1
+                    return Verdict(False, "SEC_BLOCKED", until - now)
+                # Expired here; the table may hold a newer block, so it is confirmed again
+                del self.blocks[entity_id]
+            if not confirmed and entity_id not in self.cleared and entity_id in self.block_filter:
+                self.counters["filter_hits"] += 1
+                return None
+            self.counters["checks"] += 1
+
+            entity = self.entities.get(entity_id)
+            if entity is None:
+                entity = self._new_entity(entity_id)
+            entity.dirty = True
+            wait = max(entity.bucket.delay(), entity.window.delay())
+            if wait == 0:
+                entity.bucket.tokens -= 1
+                entity.window.take()
+                self.counters["allowed"] += 1
+                return Verdict(True)
+
+            if entity.last_strike is None or entity.last_strike < now - self.strike_reset_minutes * 60:
+                entity.strikes = 0
+            entity.strikes += 1
+            entity.last_strike = now
+            entity.pending_strikes += 1
+            if entity.strikes >= self.strikes_to_block:
+                # firewall_flush() reaches the same decision from the same deltas
+                entity.strikes = 0
+                self.blocks[entity_id] = now + self.block_minutes * 60
+                self.block_filter.add(entity_id)
+                self.cleared.discard(entity_id)
+                self.counters["blocked"] += 1
+                return Verdict(False, "SEC_BLOCKED", self.block_minutes * 60.0)
+            self.counters["rate_limited"] += 1
+            return Verdict(False, "SEC_RATE_LIMITED", wait)
+
+    def _confirm(self, entity_id: str) -> bool:
+        """Reads the row of a filter hit; False if the table could not be read"""
+        try:
+            with self._db().cursor() as cur:
+                cur.execute(BLOCK_SQL, (entity_id,))
+                row = cur.fetchone()
+        except psycopg2.Error as e:
+            print(f"firewall confirm failed for {entity_id}: {e}", file=sys.stderr)
+            with self.lock:
+                self.counters["confirm_errors"] += 1
+            return False
+        with self.lock:
+            self.counters["confirms"] += 1
+            self._apply_block(entity_id, *(row or (False, None)))
+            if entity_id in self.cleared:
+                self.counters["false_positives"] += 1
+        return True
+
+    def _new_entity(self, entity_id: str) -> _Entity:
+        if len(self.entities) >= MAX_ENTITIES:
+            # A clean entity with a full bucket and an empty window is the same as a new one
+            self.entities = {
+                k: e for k, e in self.entities.items()
+                if e.dirty or e.strikes or not e.bucket.idle or not e.window.idle
+            }
+        entity = self.entities[entity_id] = _Entity(
+            TokenBucket(self.refill_rate, self.capacity, clock=self.clock),
+            SlidingWindow(self.window_limit, self.window_seconds, clock=self.clock),
+        )
+        return entity
+
+    # -- write-behind ---------------------------------------------------------
+
+    def flush(self) -> int:
+        """Writes every entity touched since the last flush in one statement; returns the rows written"""
+        with self.flush_lock:
+            with self.lock:
+                batch = []
+                for entity_id, entity in self.entities.items():
+                    if not entity.dirty:
+                        continue
+                    window = entity.window
+                    batch.append((entity_id, entity.pending_strikes, entity.last_strike if entity.pending_strikes else None,
+                                  entity.bucket.tokens, entity.bucket.updated,
+                                  window.start, window.pending, window.pending_prev))
+                    entity.dirty = False
+                    entity.pending_strikes = 0
+                    window.pending = window.pending_prev = 0
+            if not batch:
+                return 0
+
+            ids, strikes, last_strike, tokens, tokens_at, window_start, window_count, prev_count = zip(*batch)
+            try:
+                with self._db().cursor() as cur:
+                    cur.execute(FLUSH_SQL, (
+                        list(ids), list(strikes), [_ts(t) for t in last_strike], list(tokens), [_ts(t) for t in tokens_at],
+                        [_ts(t) for t in window_start], list(window_count), list(prev_count),
+                        self.strikes_to_block, self.block_minutes, self.strike_reset_minutes, self.window_seconds,
+                    ))
+                    rows = cur.fetchall()
+            except psycopg2.Error as e:
+                print(f"firewall flush failed ({len(batch)} entities kept for retry): {e}", file=sys.stderr)
+                with self.lock:
+                    self.counters["flush_errors"] += 1
+                    for entity_id, pending, _, _, _, start, count, prev in batch:
+                        entity = self.entities.get(entity_id)
+                        if entity is None:
+                            continue
+                        entity.dirty = True
+                        entity.pending_strikes += pending
+                        window = entity.window
+                        if window.start == start:
+                            window.pending += count
+                            window.pending_prev += prev
+                        elif window.start == start + window.seconds:
+                            window.pending_prev += count
+                if self.conn is not None:
+                    self.conn.close()
+                return 0
+
+            with self.lock:
+                self.counters["flushes"] += 1
+                self.counters["rows_flushed"] += len(rows)
+                for entity_id, strike_count, is_blocked, blocked_until, start, count, prev in rows:
+                    entity = self.entities.get(entity_id)
+                    # A block decided while the flush ran is not in this result yet
+                    if is_blocked or entity is None or not entity.dirty:
+                        self._apply_block(entity_id, is_blocked, blocked_until)
+                    if entity is None:
+                        continue
+                    # Counts taken while the flush ran are still pending on top
+                    entity.strikes = strike_count + entity.pending_strikes
+                    window = entity.window
+                    start = start.timestamp() if start is not None else None
+                    if start == window.start:
+                        window.count = count + window.pending
+                        window.prev = prev + window.pending_prev
+                    elif start is not None and start == window.start - window.seconds:
+                        window.prev = count + window.pending_prev
+            return len(rows)
+
+    def _flush_loop(self, interval: float) -> None:
+        while not self.stop.wait(interval):
+            self.flush()
+
+    # -- block state from the table ----------------------------------------------
+
+    def _apply_block(self, entity_id: str, is_blocked: bool, blocked_until: Optional[datetime]) -> None:
+        """Caller holds self.lock. The table wins over the local decision."""
+        until = _until(is_blocked, blocked_until)
+        if until is not None and until > self.clock():
+            self.block_filter.add(entity_id)
+            self.blocks[entity_id] = until
+            self.cleared.discard(entity_id)
+            return
+        self.blocks.pop(entity_id, None)
+        if entity_id in self.block_filter:
+            if len(self.cleared) >= MAX_ENTITIES:
+                self.cleared.clear()
+            self.cleared.add(entity_id)
+
+    def load_blocks(self, conn=None) -> int:
+        """Rebuilds the block filter from the active blocks in security_firewall"""
+        with (conn or self._db()).cursor() as cur:
+            cur.execute(BLOCKS_SQL)
+            rows = cur.fetchall()
+        block_filter = BloomFilter(max(2 * len(rows), FILTER_MIN_ENTRIES), self.filter_fp_rate)
+        for entity_id, _ in rows:
+            block_filter.add(entity_id)
+        with self.lock:
+            # Blocks decided here but not flushed yet are kept; the others are confirmed again on their next hit
+            self.blocks = {k: v for k, v in self.blocks.items() if k in self.entities and self.entities[k].dirty}
+            for entity_id in self.blocks:
+                block_filter.add(entity_id)
+            self.block_filter = block_filter
+            self.cleared = set()
+            self.rebuilt_at = time.monotonic()
+        return len(rows)
+
+    def _listen(self) -> None:
+        while not self.stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                # Changes made before LISTEN would otherwise be missed
+                self.load_blocks(conn)
+                self.listening.set()
+                while not self.stop.is_set():
+                    if time.monotonic() - self.rebuilt_at >= self.rebuild_interval or self.block_filter.saturated:
+                        # Expired and lifted blocks stay in a bloom filter until it is rebuilt
+                        self.load_blocks(conn)
+                    if not select.select([conn], [], [], 1.0)[0]:
+                        continue
+                    conn.poll()
+                    entity_ids = {n.payload for n in conn.notifies}
+                    conn.notifies.clear()
+                    with conn.cursor() as cur:
+                        for entity_id in entity_ids:
+                            cur.execute(BLOCK_SQL, (entity_id,))
+                            row = cur.fetchone()
+                            with self.lock:
+                                self.counters["notifications"] += 1
+                                self._apply_block(entity_id, *(row or (False, None)))
+            except psycopg2.Error as e:
+                print(f"firewall listener: {e}", file=sys.stderr)
+                self.listening.clear()
+                self.stop.wait(1.0)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            stats = dict(self.counters)
+            stats["entities"] = len(self.entities)
+            stats["blocks"] = len(self.blocks)
+            stats["filter_entries"] = self.block_filter.count
+            stats["filter_bytes"] = len(self.block_filter.bits)
+            stats["pending"] = sum(1 for e in self.entities.values() if e.dirty)
+        return stats
+
+    def close(self) -> None:
+        self.stop.set()
+        for thread in self.threads:
+            thread.join(timeout=5.0)
+        self.flush()
+        if self.conn is not None:
+            self.conn.close()
+
+
+def list_blocks(conn) -> List[Tuple[str, Optional[datetime]]]:
+    with conn.cursor() as cur:
+        cur.execute(BLOCKS_SQL + " ORDER BY blocked_until NULLS FIRST")
+        return cur.fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and lift security_firewall blocks")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("blocks", help="List active blocks")
+    p_unblock = sub.add_parser("unblock", help="Lift a block (engines are notified)")
+    p_unblock.add_argument("entity_id")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(get_database_url())
+    conn.autocommit = True
+    try:
+        if args.command == "blocks":
+            rows = list_blocks(conn)
+            for entity_id, blocked_until in rows:
+                print(f"{entity_id:<24} {blocked_until.isoformat() if blocked_until else 'indefinite'}")
+            print(f"{len(rows)} active block(s)", file=sys.stderr)
+        else:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE public.security_firewall SET is_blocked = false, blocked_until = NULL, strike_count = 0 "
+                    "WHERE entity_id = %s RETURNING entity_id",
+                    (args.entity_id,),
+                )
+                print(f"{args.entity_id}: {'unblocked' if cur.fetchone() else 'not found'}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Notification Dead Letters - inspect, export and requeue public.notification_dead_letter
+
+Notifications that exhaust max_retries leave notification_queue and land in
+notification_dead_letter (database/migrations/20261018_13_notification_dead_letter.sql).
+This tool works on them in bulk. Each operation is one set-based statement,
+never a loop over rows:
+
+    list / stats     -> SELECT with the filters below
+    export           -> COPY (SELECT ...) TO STDOUT as CSV
+    requeue          -> DELETE ... RETURNING feeding INSERT INTO notification_queue
+                        (fresh retry_count, due now; the NOTIFY wakes the dispatcher)
+    requeue --ids-file ids.txt
+                     -> ids streamed with COPY FROM STDIN into a temp table,
+                        then the same single statement
+    sweep            -> move_dead_notifications(): 'failed' rows still left
+                        in the queue by the legacy mark_notification_failed()
+
+Filters (any combination): --channel, --error (substring, case-insensitive),
+--since / --until (dead_at), --booking-id, --recipient, --ids-file
+
+Environment:
+    DATABASE_URL   Postgres connection string (see config.get_database_url)
+
+Usage:
+    python notification_dead_letters.py list [--channel telegram] [--error "chat not found"] [--limit 20]
+    python notification_dead_letters.py stats [--since 2026-10-01]
+    python notification_dead_letters.py export [--out dead.csv] [filters]
+    python notification_dead_letters.py requeue (--all | filters) [--limit 1000] [--dry-run]
+    python notification_dead_letters.py sweep [--limit 1000]
+
+Requires:
+    pip install psycopg2-binary
+"""
+
+import argparse
+import sys
+from dataclasses import dataclass
+from typing import Any, Dict, IO, List, Optional, Tuple
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from config import get_database_url
+
+IDS_TABLE = "_dead_letter_ids"
+
+EXPORT_COLUMNS = (
+    "id, booking_id, user_id, channel, recipient, retry_count, max_retries, "
+    "error_message, message, payload, created_at, last_attempt_at, dead_at"
+)
+
+REQUEUE_SQL = """
+    WITH picked AS (
+        SELECT d.id FROM public.notification_dead_letter d
+        WHERE {where}
+        ORDER BY d.dead_at
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    ),
+    moved AS (
+        DELETE FROM public.notification_dead_letter d
+        USING picked
+        WHERE d.id = picked.id
+        RETURNING d.*
+    )
+    INSERT INTO public.notification_queue (
+        id, booking_id, user_id, message, priority, status, retry_count, max_retries,
+        error_message, channel, recipient, payload, created_at, next_retry_at
+    )
+    SELECT id, booking_id, user_id, message, priority, 'pending', 0, max_retries,
+           error_message, channel, recipient, payload, created_at, NOW()
+    FROM moved
+"""
+
+
+@dataclass
+class DeadLetterFilter:
+    channel: Optional[str] = None
+    error: Optional[str] = None
+    since: Optional[str] = None
+    until: Optional[str] = None
+    booking_id: Optional[str] = None
+    recipient: Optional[str] = None
+    use_ids: bool = False
+
+    def where(self) -> Tuple[str, List[Any]]:
+        """SQL condition on alias d, and its parameters"""
+        clauses, params = [], []
+        if self.channel:
+            clauses.append("d.channel = %s")
+            params.append(self.channel)
+        if self.error:
+            clauses.append("d.error_message ILIKE %s")
+            params.append(f"%{self.error}%")
+        if self.since:
+            clauses.append("d.dead_at >= %s::timestamptz")
+            params.append(self.since)
+        if self.until:
+            clauses.append("d.dead_at < %s::timestamptz")
+            params.append(self.until)
+        if self.booking_id:
+            clauses.append("d.booking_id = %s::uuid")
+            params.append(self.booking_id)
+        if self.recipient:
+            clauses.append("d.recipient = %s")
+            params.append(self.recipient)
+        if self.use_ids:
+            clauses.append(f"d.id IN (SELECT id FROM {IDS_TABLE})")
+        return (" AND ".join(clauses) or "TRUE"), params
+
+    def is_empty(self) -> bool:
+        return self.where()[0] == "TRUE"
+
+
+class DeadLetterStore:
+    """Set-based operations on notification_dead_letter over one connection"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def load_ids(self, stream: IO[str]) -> int:
+        """COPY notification ids (one per line) into a session temp table for DeadLetterFilter(use_ids=True)"""
+        with self.conn.cursor() as cur:
+            cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {IDS_TABLE} (id uuid PRIMARY KEY) ON COMMIT PRESERVE ROWS")
+            cur.execute(f"TRUNCATE {IDS_TABLE}")
+            cur.copy_expert(f"COPY {IDS_TABLE} (id) FROM STDIN", stream)
+            cur.execute(f"SELECT COUNT(*) FROM {IDS_TABLE}")
+            return cur.fetchone()[0]
+
+    def list(self, flt: DeadLetterFilter, limit: int = 20) -> List[Dict[str, Any]]:
+        where, params = flt.where()
+        with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                f"SELECT {EXPORT_COLUMNS} FROM public.notification_dead_letter d WHERE {where} ORDER BY d.dead_at DESC LIMIT %s",
+                params + [limit],
+            )
+            return cur.fetchall()
+
+    def count(self, flt: DeadLetterFilter) -> int:
+        where, params = flt.where()
+        with self.conn.cursor() as cur:
+            cur.execute(f"SELECT COUNT(*) FROM public.notification_dead_letter d WHERE {where}", params)
+            return cur.fetchone()[0]
+
+    def stats(self, flt: DeadLetterFilter) -> List[Dict[str, Any]]:
+        """Counts per channel and error (first 60 chars), largest first"""
+        where, params = flt.where()
+        with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                f"""
+                SELECT d.channel, left(COALESCE(d.error_message, ''), 60) AS error,
+                       COUNT(*) AS total, MIN(d.dead_at) AS first_dead, MAX(d.dead_at) AS last_dead
+                FROM public.notification_dead_letter d
+                WHERE {where}
+                GROUP BY 1, 2
+                ORDER BY total DESC
+                """,
+                params,
+            )
+            return cur.fetchall()
+
+    def export(self, flt: DeadLetterFilter, out: IO[str]) -> None:
+        """CSV with header, streamed by COPY"""
+        where, params = flt.where()
+        with self.conn.cursor() as cur:
+            query = cur.mogrify(
+                f"SELECT {EXPORT_COLUMNS} FROM public.notification_dead_letter d WHERE {where} ORDER BY d.dead_at",
+                params,
+            ).decode()
+            cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", out)
+
+    def requeue(self, flt: DeadLetterFilter, limit: Optional[int] = None) -> int:
+        """Moves matching dead letters back to notification_queue as pending; returns the count"""
+        where, params = flt.where()
+        with self.conn.cursor() as cur:
+            cur.execute(REQUEUE_SQL.format(where=where), params + [limit])
+            moved = cur.rowcount
+        self.conn.commit()
+        return moved
+
+    def sweep(self, limit: Optional[int] = 1000) -> int:
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT public.move_dead_notifications(%s)", (limit,))
+            moved = cur.fetchone()[0]
+        self.conn.commit()
+        return moved
+
+
+def print_rows(rows: List[Dict[str, Any]]) -> None:
+    if not rows:
+        print("No dead letters found.")
+        return
+    print(f"\n{'=' * 80}")
+    print(f"NOTIFICATION DEAD LETTERS - {len(rows)} record(s)")
+    print(f"{'=' * 80}\n")
+    for row in rows:
+        print(f"ID: {row['id']}")
+        print(f"   Channel: {row['channel']} | Recipient: {row['recipient']} | Booking: {row['booking_id']}")
+        print(f"   Attempts: {row['retry_count']}/{row['max_retries']} | Dead at: {row['dead_at']}")
+        print(f"   Error: {(row['error_message'] or '')[:100]}")
+        print(f"   Message: {(row['message'] or '')[:100]}")
+        print(f"{'-' * 80}")
+
+
+def print_stats(rows: List[Dict[str, Any]]) -> None:
+    if not rows:
+        print("No dead letters found.")
+        return
+    print("=" * 100)
+    print(f"{'channel':<12}{'total':>8}  {'first dead':<20}{'last dead':<20}error")
+    print("=" * 100)
+    for row in rows:
+        print(
+            f"{row['channel'] or '-':<12}{row['total']:>8}  "
+            f"{row['first_dead']:%Y-%m-%d %H:%M:%S}   {row['last_dead']:%Y-%m-%d %H:%M:%S}   {row['error']}"
+        )
+
+
+def main():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--channel")
+    common.add_argument("--error", help="Substring of error_message (case-insensitive)")
+    common.add_argument("--since", help="dead_at >= (ISO date/timestamp)")
+    common.add_argument("--until", help="dead_at < (ISO date/timestamp)")
+    common.add_argument("--booking-id")
+    common.add_argument("--recipient")
+    common.add_argument("--ids-file", help="File with one notification id per line ('-' = stdin)")
+
+    parser = argparse.ArgumentParser(description="Inspect, export and requeue notification dead letters")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_list = sub.add_parser("list", parents=[common], help="Show dead letters, newest first")
+    p_list.add_argument("--limit", type=int, default=20)
+    sub.add_parser("stats", parents=[common], help="Counts per channel and error")
+    p_export = sub.add_parser("export", parents=[common], help="CSV export via COPY")
+    p_export.add_argument("--out", help="Output file (default stdout)")
+    p_requeue = sub.add_parser("requeue", parents=[common], help="Move dead letters back to notification_queue")
+    p_requeue.add_argument("--all", action="store_true", help="Required when no filter is given")
+    p_requeue.add_argument("--limit", type=int, help="Requeue at most this many (oldest first)")
+    p_requeue.add_argument("--dry-run", action="store_true", help="Only count the matches")
+    p_sweep = sub.add_parser("sweep", help="Move 'failed' rows left in notification_queue")
+    p_sweep.add_argument("--limit", type=int, default=1000)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(get_database_url())
+    store = DeadLetterStore(conn)
+    try:
+        if args.command == "sweep":
+            print(f"notification_dead_letter: {store.sweep(args.limit)} moved from notification_queue")
+            return
+
+        flt = DeadLetterFilter(
+            channel=args.channel,
+            error=args.error,
+            since=args.since,
+            until=args.until,
+            booking_id=args.booking_id,
+            recipient=args.recipient,
+            use_ids=bool(args.ids_file),
+        )
+        if args.ids_file:
+            stream = sys.stdin if args.ids_file == "-" else open(args.ids_file, encoding="utf-8")
+            with stream:
+                print(f"Loaded {store.load_ids(stream)} ids", file=sys.stderr)
+
+        if args.command == "list":
+            print_rows(store.list(flt, args.limit))
+        elif args.command == "stats":
+            print_stats(store.stats(flt))
+        elif args.command == "export":
+            if args.out:
+                with open(args.out, "w", encoding="utf-8", newline="") as out:
+                    store.export(flt, out)
+            else:
+                store.export(flt, sys.stdout)
+        elif args.command == "requeue":
+            if flt.is_empty() and not args.all:
+                print("Refusing to requeue every dead letter without --all", file=sys.stderr)
+                sys.exit(2)
+            if args.dry_run:
+                matches = store.count(flt)
+                print(f"{min(matches, args.limit) if args.limit else matches} dead letters would be requeued")
+            else:
+                print(f"{store.requeue(flt, args.limit)} dead letters requeued")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
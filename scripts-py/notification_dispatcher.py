@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Notification Dispatcher - reference drain loop for public.notification_queue
+
+Python counterpart of BB_05_Notification_Engine / BB_07_Notification_Retry_Worker,
+built on the set-based queue API:
+
+    claim_notifications(worker, batch)   -> one round trip, SKIP LOCKED + lease
+    sender.send(notification)            -> Telegram sendMessage (or any sender)
+    mark_notifications_sent(ids) +
+    mark_notifications_failed(json)      -> one round trip for the whole batch
+
+Several dispatchers (and the n8n workflows) can drain the queue side by side
+without sending a message twice. A dispatcher that dies mid-batch loses its
+lease, and the rows are claimed again after --lease seconds.
+
+With --coalesce-window (default 5 s) the dispatcher claims whole
+(channel, recipient) groups with claim_notification_digests()
+(database/migrations/20261018_14_notification_digests.sql). Each group is
+sent as one digest message, so a 200-booking cancellation reaches a chat as
+a handful of messages instead of 200. --no-coalesce sends row by row.
+
+Sends go through RateLimitedSender (telegram_rate_limit.py): up to
+--concurrency requests in flight, paced by a global 30 msg/s bucket and a
+1 msg/s bucket per chat, so a full batch does not come back as 429s.
+--no-rate-limit falls back to a plain thread pool of --concurrency.
+
+By default the dispatcher LISTENs on the 'notification_queue' channel
+(database/migrations/20261018_11_notification_queue_notify.sql), so a new
+row is sent milliseconds after its INSERT commits. Between notifications it
+sleeps until the next scheduled retry is due, or at most --poll-interval
+(the safety net for a missed notification).
+
+Environment:
+    DATABASE_URL         Postgres connection string (see config.get_database_url)
+    TELEGRAM_BOT_TOKEN   Bot token for sendMessage
+    TELEGRAM_API_BASE    Defaults to https://api.telegram.org
+    BB_DEFAULT_ADMIN_CHAT_ID
+                         Chat for rows without a recipient, as in BB_05/BB_07
+                         (defaults to 5391760292)
+
+Usage:
+    from notification_dispatcher import NotificationDispatcher, TelegramSender
+    dispatcher = NotificationDispatcher(dsn, TelegramSender(token))
+    dispatcher.drain_once()   # {"claimed": n, "sent": n, "failed": n}
+
+    python notification_dispatcher.py [--batch-size 50] [--concurrency 16] [--poll-interval 60] [--coalesce-window 5]
+    python notification_dispatcher.py --once | --no-listen | --no-rate-limit
+
+Requires:
+    pip install psycopg2-binary requests
+"""
+
+import argparse
+import json
+import os
+import re
+import select
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg2
+import requests
+from psycopg2.extras import RealDictCursor
+
+from config import get_database_url, load_env_file
+from telegram_rate_limit import RateLimitedSender
+
+DEFAULT_TELEGRAM_API = "https://api.telegram.org"
+NOTIFY_CHANNEL = "notification_queue"
+TELEGRAM_MAX_LENGTH = 4096
+# BB_05 / BB_07 send rows without a recipient to the admin chat
+DEFAULT_ADMIN_CHAT_ID = "5391760292"
+# Characters that open an entity in Telegram's legacy Markdown
+MARKDOWN_SPECIAL = re.compile(r"([_*`\[])")
+
+CLAIM_SQL = "SELECT * FROM public.claim_notifications(%s, %s, %s)"
+DIGEST_CLAIM_SQL = "SELECT * FROM public.claim_notification_digests(%s, %s, %s, %s)"
+SETTLE_SQL = "SELECT public.mark_notifications_sent(%s::uuid[]), public.mark_notifications_failed(%s::jsonb)"
+# Earliest scheduled retry, or the end of a digest window still holding due rows
+NEXT_DUE_SQL = """
+    SELECT EXTRACT(EPOCH FROM LEAST(
+        (SELECT MIN(next_retry_at) FROM public.notification_queue
+         WHERE status = 'pending' AND next_retry_at > NOW()),
+        (SELECT MIN(created_at) + make_interval(secs => %(window)s) FROM public.notification_queue
+         WHERE status = 'pending' AND next_retry_at <= NOW() AND created_at > NOW() - make_interval(secs => %(window)s))
+    ) - NOW())
+"""
+
+
+def escape_markdown(text: Optional[str]) -> str:
+    """Escapes _ * ` [ so queued text is sent literally (BB_00's md())"""
+    return MARKDOWN_SPECIAL.sub(r"\\\1", text or "")
+
+
+@dataclass
+class SendResult:
+    ok: bool
+    error: Optional[str] = None
+    retry_after: Optional[int] = None
+
+
+class TelegramSender:
+    """
+    Bot API sendMessage, one keep-alive session per thread
+
+    Messages are plain text. They are escaped for parse_mode Markdown, so a
+    stray _ or * in one notification cannot get a whole digest rejected.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        api_base: str = DEFAULT_TELEGRAM_API,
+        timeout: float = 10.0,
+        admin_chat_id: Optional[str] = DEFAULT_ADMIN_CHAT_ID,
+    ):
+        self.url = f"{api_base.rstrip('/')}/bot{token}/sendMessage"
+        self.timeout = timeout
+        self.admin_chat_id = admin_chat_id
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def send(self, notification: Dict[str, Any]) -> SendResult:
+        chat_id = notification.get("recipient") or self.admin_chat_id
+        if not chat_id:
+            return SendResult(False, "No recipient")
+        body = {"chat_id": chat_id, "text": escape_markdown(notification["message"]), "parse_mode": "Markdown"}
+        try:
+            response = self.session.post(self.url, json=body, timeout=self.timeout)
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            return SendResult(False, f"{type(e).__name__}: {e}")
+        if data.get("ok"):
+            return SendResult(True)
+        return SendResult(
+            False,
+            f"HTTP {response.status_code}: {data.get('description', 'Unknown error')}",
+            (data.get("parameters") or {}).get("retry_after"),
+        )
+
+
+def build_digests(rows: List[Dict[str, Any]], max_length: int = TELEGRAM_MAX_LENGTH) -> List[Dict[str, Any]]:
+    """
+    Merges claimed rows into one message per (channel, recipient)
+
+    Returns sender-ready dicts (recipient, channel, message) carrying the
+    notification ids they settle. A group whose text would exceed max_length
+    is split into several digests, measured after Markdown escaping.
+    A single row is passed through unchanged.
+    """
+    groups: Dict[Tuple[Any, Any], List[Dict[str, Any]]] = {}
+    for row in rows:
+        groups.setdefault((row.get("channel"), row.get("recipient")), []).append(row)
+
+    digests = []
+    for (channel, recipient), group in groups.items():
+        chunks, current, size = [], [], 0
+        for row in group:
+            text = escape_markdown(row["message"])
+            if current and size + len(text) + 2 > max_length - 40:  # room for the header
+                chunks.append(current)
+                current, size = [], 0
+            current.append(row)
+            size += len(text) + 2
+        chunks.append(current)
+        for chunk in chunks:
+            if len(chunk) == 1:
+                message = chunk[0]["message"]
+            else:
+                message = f"📬 {len(chunk)} notificaciones\n\n" + "\n\n".join(r["message"] or "" for r in chunk)
+            digests.append({
+                "ids": [str(r["id"]) for r in chunk],
+                "channel": channel,
+                "recipient": recipient,
+                "message": message,
+            })
+    return digests
+
+
+class NotificationDispatcher:
+    """Claims, sends and settles notification_queue batches"""
+
+    def __init__(
+        self,
+        dsn: str,
+        sender,
+        worker_id: Optional[str] = None,
+        batch_size: int = 50,
+        lease_seconds: int = 120,
+        concurrency: int = 1,
+        coalesce_window: Optional[int] = None,
+    ):
+        self.dsn = dsn
+        self.sender = sender
+        self.worker_id = worker_id or f"dispatcher:{socket.gethostname()}:{os.getpid()}"
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        # None = one message per row; otherwise claim digests held for this many seconds
+        self.coalesce_window = coalesce_window
+        self.conn = psycopg2.connect(dsn)
+        self.conn.autocommit = True
+        self.executor = ThreadPoolExecutor(max_workers=concurrency) if concurrency > 1 else None
+        self.round_trips = 0
+
+    def claim(self) -> List[Dict[str, Any]]:
+        """Claimed rows; in coalescing mode batch_size counts digests, not rows"""
+        self.round_trips += 1
+        with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
+            if self.coalesce_window is None:
+                cur.execute(CLAIM_SQL, (self.worker_id, self.batch_size, self.lease_seconds))
+            else:
+                cur.execute(DIGEST_CLAIM_SQL, (self.worker_id, self.batch_size, self.lease_seconds, self.coalesce_window))
+            return cur.fetchall()
+
+    def send_batch(self, items: List[Dict[str, Any]]) -> Tuple[List[str], List[Dict[str, Any]]]:
+        """Returns (sent ids, mark_notifications_failed() entries); a digest settles all of its ids"""
+        if hasattr(self.sender, "send_many"):
+            # A rate-limited sender paces and parallelizes the batch itself
+            results = self.sender.send_many(items)
+        elif self.executor:
+            results = self.executor.map(self.sender.send, items)
+        else:
+            results = map(self.sender.send, items)
+        sent, failures = [], []
+        for item, result in zip(items, results):
+            ids = item.get("ids") or [str(item["id"])]
+            if result.ok:
+                sent.extend(ids)
+            else:
+                failures.extend({"id": i, "error": result.error, "retry_after": result.retry_after} for i in ids)
+        return sent, failures
+
+    def settle(self, sent: List[str], failures: List[Dict[str, Any]]) -> None:
+        self.round_trips += 1
+        with self.conn.cursor() as cur:
+            cur.execute(SETTLE_SQL, (sent, json.dumps(failures)))
+
+    def drain_once(self) -> Dict[str, int]:
+        """Process one batch; returns counts (claimed rows, messages sent to the API, sent, failed)"""
+        rows = self.claim()
+        if not rows:
+            return {"claimed": 0, "messages": 0, "sent": 0, "failed": 0}
+        items = build_digests(rows) if self.coalesce_window is not None else rows
+        sent, failures = self.send_batch(items)
+        self.settle(sent, failures)
+        return {"claimed": len(rows), "messages": len(items), "sent": len(sent), "failed": len(failures)}
+
+    def drain(self) -> Dict[str, int]:
+        """Process batches until the queue has nothing due"""
+        total = {"claimed": 0, "messages": 0, "sent": 0, "failed": 0}
+        while True:
+            stats = self.drain_once()
+            total = {k: total[k] + stats[k] for k in total}
+            if stats["messages"] < self.batch_size:
+                break
+        if total["claimed"]:
+            print(
+                f"notification_queue: {total['claimed']} claimed, {total['messages']} messages, "
+                f"{total['sent']} sent, {total['failed']} failed",
+                flush=True,
+            )
+        return total
+
+    def next_due_in(self) -> Optional[float]:
+        """Seconds until the earliest scheduled retry or digest window end, None if there is none"""
+        self.round_trips += 1
+        with self.conn.cursor() as cur:
+            cur.execute(NEXT_DUE_SQL, {"window": self.coalesce_window or 0})
+            due = cur.fetchone()[0]
+        return float(due) if due is not None else None
+
+    def run(self, idle_sleep: float = 5.0, stop: Optional[threading.Event] = None) -> None:
+        """Poll-only loop: drain, then sleep idle_sleep"""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            self.drain()
+            stop.wait(idle_sleep)
+
+    def run_listening(self, poll_interval: float = 60.0, stop: Optional[threading.Event] = None) -> None:
+        """Drain on every NOTIFY; otherwise wake for the next due retry or after poll_interval"""
+        stop = stop or threading.Event()
+        listener = psycopg2.connect(self.dsn)
+        listener.autocommit = True
+        with listener.cursor() as cur:
+            cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+        next_due, timed_out = None, True
+        try:
+            while not stop.is_set():
+                stats = self.drain()
+                # The retry schedule only moves when a send fails or a row
+                # arrives that is not due yet (a NOTIFY that claimed nothing).
+                # Digest windows can hold rows back after any drain.
+                if timed_out or stats["failed"] or not stats["claimed"] or self.coalesce_window:
+                    due = self.next_due_in()
+                    next_due = time.monotonic() + due if due is not None else None
+                deadline = time.monotonic() + poll_interval
+                if next_due is not None:
+                    deadline = min(deadline, next_due)
+                timed_out = True
+                # Short select() slices so stop is honored; waiting costs no queries
+                while not stop.is_set() and time.monotonic() < deadline:
+                    if select.select([listener], [], [], min(1.0, max(deadline - time.monotonic(), 0)))[0]:
+                        listener.poll()
+                        if listener.notifies:
+                            listener.notifies.clear()
+                            timed_out = False
+                            break
+        finally:
+            listener.close()
+
+    def close(self) -> None:
+        if self.executor:
+            self.executor.shutdown(wait=True)
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drain public.notification_queue via Telegram")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=16, help="Max sends in flight")
+    parser.add_argument("--lease", type=int, default=120, help="Seconds before a claimed row can be taken over")
+    parser.add_argument("--poll-interval", type=float, default=60.0, help="Safety-net poll while listening (seconds)")
+    parser.add_argument("--no-listen", action="store_true", help="Poll every --poll-interval instead of LISTEN")
+    parser.add_argument("--coalesce-window", type=int, default=5, help="Seconds a recipient's burst is held for one digest")
+    parser.add_argument("--no-coalesce", action="store_true", help="Send every notification as its own message")
+    parser.add_argument("--no-rate-limit", action="store_true", help="Send without Telegram's 30/s and 1/s-per-chat pacing")
+    parser.add_argument("--once", action="store_true", help="Process a single batch and exit")
+    args = parser.parse_args()
+
+    load_env_file()
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not token:
+        print("TELEGRAM_BOT_TOKEN not set", file=sys.stderr)
+        sys.exit(2)
+    sender = TelegramSender(
+        token,
+        os.getenv("TELEGRAM_API_BASE", DEFAULT_TELEGRAM_API),
+        admin_chat_id=os.getenv("BB_DEFAULT_ADMIN_CHAT_ID", DEFAULT_ADMIN_CHAT_ID),
+    )
+    if not args.no_rate_limit:
+        sender = RateLimitedSender(sender, max_in_flight=args.concurrency)
+    dispatcher = NotificationDispatcher(
+        get_database_url(),
+        sender,
+        batch_size=args.batch_size,
+        lease_seconds=args.lease,
+        # RateLimitedSender runs its own workers
+        concurrency=args.concurrency if args.no_rate_limit else 1,
+        coalesce_window=None if args.no_coalesce else args.coalesce_window,
+    )
+    try:
+        if args.once:
+            stats = dispatcher.drain_once()
+            print(
+                f"notification_queue: {stats['claimed']} claimed, {stats['messages']} messages, "
+                f"{stats['sent']} sent, {stats['failed']} failed"
+            )
+            sys.exit(0)
+        if args.no_listen:
+            dispatcher.run(args.poll_interval)
+        else:
+            dispatcher.run_listening(args.poll_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        dispatcher.close()
+        if isinstance(sender, RateLimitedSender):
+            sender.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+Provider Cache - two-tier provider lookup for BB_95_Provider_Cache callers
+
+    tier 1   in-process LRU (capacity / TTL bounded), no round trip
+    tier 2   public.provider_cache via public.get_provider_cache(slug), which
+             fills a missing row at most once per slug across all processes
+             (database/migrations/20261018_19_provider_cache_invalidation.sql)
+
+Misses are single-flight inside the process too: concurrent get() calls for
+the same slug share one database call. Changes to providers / services fire
+a trigger that deletes the provider_cache row and sends
+pg_notify('provider_cache', slug). A listener thread evicts that slug from
+the LRU. A fill that was in flight when its slug was invalidated is returned
+to its waiters but not cached. While the listener is reconnecting the LRU is
+cleared, because notifications may have been missed. The LRU TTL bounds
+staleness if a notification is lost anyway.
+
+Stale-while-revalidate (20261018_20_provider_cache_swr_warm.sql): an LRU
+entry past its TTL but still within stale_ttl is returned immediately, and
+one background thread per slug refreshes it. The same happens when the
+database hands back a row flagged is_stale. warm_cache() / `warm` fill the
+provider_cache rows of every public provider in one set-based statement
+(after a deploy or restart), and refresh rows that are about to expire.
+
+Unknown slugs return None and are not cached.
+
+Environment:
+    DATABASE_URL   Postgres connection string (see config.get_database_url)
+
+Usage:
+    from provider_cache import ProviderCache
+    cache = ProviderCache(dsn)
+    provider = cache.get("dr-smith")     # dict payload or None
+    cache.stats()                        # {"hits": .., "db_hits": .., "fills": .., ...}
+    cache.close()
+
+    python provider_cache.py get dr-smith
+    python provider_cache.py invalidate dr-smith
+    python provider_cache.py warm [--force] [--ahead-minutes 60]
+
+Requires:
+    pip install psycopg2-binary
+"""
+
+import argparse
+import json
+import select
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+from config import get_database_url
+
+NOTIFY_CHANNEL = "provider_cache"
+DEFAULT_CAPACITY = 1024
+DEFAULT_TTL = 300.0
+DEFAULT_STALE_TTL = 60.0
+DB_TTL_MINUTES = 1440
+DB_STALE_MINUTES = 60
+REFRESH_AHEAD_MINUTES = 60
+
+GET_SQL = "SELECT data, from_cache, is_stale FROM public.get_provider_cache(%s, %s, %s)"
+WARM_SQL = "SELECT warmed, refreshed FROM public.warm_provider_cache(%s, %s, %s)"
+
+MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe LRU with a per-entry TTL; entries stay servable as stale for stale_ttl more seconds"""
+
+    def __init__(
+        self,
+        capacity: int = DEFAULT_CAPACITY,
+        ttl: float = DEFAULT_TTL,
+        clock: Callable[[], float] = time.monotonic,
+        stale_ttl: float = 0.0,
+    ):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.clock = clock
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def lookup(self, key: str) -> Tuple[Any, bool]:
+        """(value, stale), or (MISSING, False) once the entry is past ttl + stale_ttl"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING, False
+            value, expires = entry
+            now = self.clock()
+            if expires + self.stale_ttl <= now:
+                del self.entries[key]
+                return MISSING, False
+            self.entries.move_to_end(key)
+            return value, expires <= now
+
+    def get(self, key: str) -> Any:
+        """The fresh cached value, or MISSING"""
+        value, stale = self.lookup(key)
+        return MISSING if stale else value
+
+    def put(self, key: str, value: Any, stale: bool = False) -> None:
+        """stale=True stores the value already expired (served stale until refreshed)"""
+        with self.lock:
+            self.entries[key] = (value, self.clock() + (0 if stale else self.ttl))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: str) -> bool:
+        with self.lock:
+            return self.entries.pop(key, None) is not None
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class _Flight:
+    """One in-progress fill; waiters block on done"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.db_stale = False
+        self.error: Optional[BaseException] = None
+        self.stale = False
+
+
+class ProviderCache:
+    def __init__(
+        self,
+        dsn: str,
+        capacity: int = DEFAULT_CAPACITY,
+        ttl: float = DEFAULT_TTL,
+        db_ttl_minutes: int = DB_TTL_MINUTES,
+        max_connections: int = 8,
+        listen: bool = True,
+        stale_ttl: float = DEFAULT_STALE_TTL,
+        db_stale_minutes: int = DB_STALE_MINUTES,
+    ):
+        self.dsn = dsn
+        self.lru = LRUCache(capacity, ttl, stale_ttl=stale_ttl)
+        self.db_ttl_minutes = db_ttl_minutes
+        self.db_stale_minutes = db_stale_minutes
+        self.pool = ThreadedConnectionPool(1, max_connections, dsn)
+        self.inflight: Dict[str, _Flight] = {}
+        self.refreshers: Set[threading.Thread] = set()
+        self.lock = threading.Lock()
+        self.counters = {
+            "hits": 0, "stale_hits": 0, "db_hits": 0, "db_stale_hits": 0, "fills": 0, "not_found": 0,
+            "coalesced": 0, "refreshes": 0, "refresh_errors": 0, "invalidations": 0,
+        }
+        self.stop = threading.Event()
+        self.listening = threading.Event()
+        self.listener: Optional[threading.Thread] = None
+        if listen:
+            self.listener = threading.Thread(target=self._listen, name="provider-cache-listen", daemon=True)
+            self.listener.start()
+            self.listening.wait(5.0)
+
+    def _count(self, key: str) -> None:
+        with self.lock:
+            self.counters[key] += 1
+
+    def get(self, slug: str) -> Optional[Dict[str, Any]]:
+        value, stale = self.lru.lookup(slug)
+        if value is not MISSING:
+            self._count("stale_hits" if stale else "hits")
+            if stale:
+                self._refresh_async(slug)
+            return value
+
+        with self.lock:
+            flight = self.inflight.get(slug)
+            leader = flight is None
+            if leader:
+                flight = self.inflight[slug] = _Flight()
+            else:
+                self.counters["coalesced"] += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error:
+                raise flight.error
+            return flight.value
+
+        self._lead(slug, flight, refresh=False)
+        if flight.db_stale:
+            self._refresh_async(slug)
+        return flight.value
+
+    def _lead(self, slug: str, flight: _Flight, refresh: bool) -> None:
+        """Runs the fill for a flight this thread registered, then releases its waiters"""
+        try:
+            flight.value, flight.db_stale = self._fetch(slug, refresh)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[slug]
+                if flight.error is None and flight.value is not None and not flight.stale:
+                    self.lru.put(slug, flight.value, stale=flight.db_stale)
+                elif refresh and flight.value is None:
+                    self.lru.invalidate(slug)
+            flight.done.set()
+
+    def _refresh_async(self, slug: str) -> None:
+        """Starts one background refresh per slug; callers keep getting the stale value meanwhile"""
+        with self.lock:
+            if slug in self.inflight or self.stop.is_set():
+                return
+            flight = self.inflight[slug] = _Flight()
+            thread = threading.Thread(target=self._refresh, args=(slug, flight), name=f"provider-cache-refresh-{slug}", daemon=True)
+            self.refreshers.add(thread)
+        thread.start()
+
+    def _refresh(self, slug: str, flight: _Flight) -> None:
+        try:
+            self._lead(slug, flight, refresh=True)
+            self._count("refreshes")
+        except Exception as e:
+            self._count("refresh_errors")
+            print(f"provider_cache refresh {slug}: {e}", file=sys.stderr)
+        finally:
+            with self.lock:
+                self.refreshers.discard(threading.current_thread())
+
+    def _fetch(self, slug: str, refresh: bool = False) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """Tier 2: (payload, is_stale) from provider_cache, filled by the database if missing.
+
+        refresh=True refuses stale database rows, so an expired row is rebuilt.
+        """
+        conn = self.pool.getconn()
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(GET_SQL, (slug, self.db_ttl_minutes, 0 if refresh else self.db_stale_minutes))
+                row = cur.fetchone()
+        except psycopg2.Error:
+            self.pool.putconn(conn, close=True)
+            raise
+        self.pool.putconn(conn)
+        if row is None:
+            self._count("not_found")
+            return None, False
+        data, from_cache, is_stale = row
+        self._count("fills" if not from_cache else "db_stale_hits" if is_stale else "db_hits")
+        return data, is_stale
+
+    def warm(self, force: bool = False, ahead_minutes: int = REFRESH_AHEAD_MINUTES) -> Tuple[int, int]:
+        """Database tier warm-up; (warmed, refreshed) rows. The LRU fills on demand."""
+        conn = self.pool.getconn()
+        try:
+            conn.autocommit = True
+            return warm_cache(conn, self.db_ttl_minutes, ahead_minutes, force)
+        finally:
+            self.pool.putconn(conn)
+
+    def invalidate(self, slug: Optional[str] = None) -> None:
+        """Evicts one slug (or everything) from this process only"""
+        with self.lock:
+            self.counters["invalidations"] += 1
+            if slug is None:
+                self.lru.clear()
+                for flight in self.inflight.values():
+                    flight.stale = True
+                return
+            self.lru.invalidate(slug)
+            if slug in self.inflight:
+                self.inflight[slug].stale = True
+
+    def _listen(self) -> None:
+        while not self.stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                # Anything cached before LISTEN may have missed a notification
+                self.invalidate()
+                self.listening.set()
+                while not self.stop.is_set():
+                    if select.select([conn], [], [], 1.0)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            self.invalidate(conn.notifies.pop(0).payload or None)
+            except psycopg2.Error as e:
+                print(f"provider_cache listener: {e}", file=sys.stderr)
+                self.listening.clear()
+                self.invalidate()
+                self.stop.wait(1.0)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            stats = dict(self.counters)
+        served = stats["hits"] + stats["stale_hits"]
+        lookups = served + stats["db_hits"] + stats["db_stale_hits"] + stats["fills"] + stats["not_found"] + stats["coalesced"]
+        stats["size"] = len(self.lru)
+        stats["evictions"] = self.lru.evictions
+        stats["hit_ratio"] = served / lookups if lookups else 0.0
+        return stats
+
+    def close(self) -> None:
+        self.stop.set()
+        if self.listener:
+            self.listener.join(timeout=5.0)
+        with self.lock:
+            refreshers = list(self.refreshers)
+        for thread in refreshers:
+            thread.join(timeout=5.0)
+        self.pool.closeall()
+
+
+def warm_cache(conn, ttl_minutes: int = DB_TTL_MINUTES, ahead_minutes: int = REFRESH_AHEAD_MINUTES, force: bool = False) -> Tuple[int, int]:
+    """One INSERT ... SELECT over v_provider_cache_source: (rows inserted, rows rewritten)"""
+    with conn.cursor() as cur:
+        cur.execute(WARM_SQL, (ttl_minutes, ahead_minutes, force))
+        return cur.fetchone()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read or invalidate cached provider data")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_get = sub.add_parser("get", help="Print the cached payload (filling it if needed)")
+    p_get.add_argument("slug")
+    p_invalidate = sub.add_parser("invalidate", help="Drop the cached payload everywhere")
+    p_invalidate.add_argument("slug")
+    p_warm = sub.add_parser("warm", help="Fill public providers and refresh rows about to expire (one statement)")
+    p_warm.add_argument("--ahead-minutes", type=int, default=REFRESH_AHEAD_MINUTES, help="Refresh rows expiring within this window")
+    p_warm.add_argument("--force", action="store_true", help="Rewrite every row (e.g. after a payload change)")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(get_database_url())
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            if args.command == "get":
+                cur.execute(
+                    "SELECT data, from_cache, is_stale, cached_at FROM public.get_provider_cache(%s, %s, %s)",
+                    (args.slug, DB_TTL_MINUTES, DB_STALE_MINUTES),
+                )
+                row = cur.fetchone()
+                if row is None:
+                    print(f"Provider {args.slug!r} not found", file=sys.stderr)
+                    sys.exit(1)
+                print(json.dumps(row[0], indent=2, ensure_ascii=False))
+                print(f"from_cache={row[1]} is_stale={row[2]} cached_at={row[3]}", file=sys.stderr)
+            elif args.command == "warm":
+                started = time.monotonic()
+                warmed, refreshed = warm_cache(conn, DB_TTL_MINUTES, args.ahead_minutes, args.force)
+                print(f"warmed={warmed} refreshed={refreshed} in {(time.monotonic() - started) * 1000:.0f} ms")
+            else:
+                cur.execute("SELECT public.invalidate_provider_cache(%s)", (args.slug,))
+                print(f"{args.slug}: {'invalidated' if cur.fetchone()[0] else 'was not cached'} (listeners notified)")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+Slot Engine - Vectorized availability calculation
+Reference implementation of BB_03_05_CalculateSlots
+
+Computes free slots for many providers x many days in a single batched,
+array-based pass (numpy). There are no per-slot Python loops: weekly
+schedules are expanded to windows, windows are expanded to slots with a
+ragged arange, and booking conflicts are resolved by searching each booking
+into the provider-keyed (sorted) slot array and marking the blocked runs with
+a difference array.
+
+Shift times are local wall-clock times. Slots are laid out in wall-clock
+minutes and converted to UTC with the offset in effect on their day, so a
+DST switch moves only the slots after it, and slots that fall in the skipped
+hour are not offered. On the repeated hour the first occurrence is used.
+
+Inputs mirror the database rows:
+    providers: id, slot_duration_mins, min_notice_hours
+    schedules: provider_id, day_of_week, start_time, end_time, is_active
+    bookings:  provider_id, start_time, end_time, status (non-cancelled)
+
+Usage:
+    from slot_engine import compute_slots
+    batch = compute_slots(providers, schedules, bookings,
+                          start_date="2026-03-02", days=7)
+    print(batch.to_records()[:3])
+
+Requires:
+    pip install numpy
+"""
+
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python < 3.9
+    ZoneInfo = None
+
+# public.day_of_week enum -> Python weekday()
+DAY_OF_WEEK = {
+    "Monday": 0,
+    "Tuesday": 1,
+    "Wednesday": 2,
+    "Thursday": 3,
+    "Friday": 4,
+    "Saturday": 5,
+    "Sunday": 6,
+}
+
+# Keys are provider_idx * KEY_STRIDE + minute offset. 2**32 minutes is ~8000
+# years, so minute offsets never spill into the next provider's key range.
+KEY_STRIDE = np.int64(2**32)
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+@dataclass
+class ScheduleArrays:
+    """Weekly schedules as parallel arrays (one entry per active shift)"""
+
+    provider_idx: np.ndarray  # int64
+    day_of_week: np.ndarray  # int64, 0=Monday
+    start_min: np.ndarray  # int64, minutes since local midnight
+    end_min: np.ndarray  # int64, minutes since local midnight
+
+
+@dataclass
+class DayArrays:
+    """The requested days, one entry per day (not per slot)"""
+
+    wall_start: np.ndarray  # int64, local midnight as wall-clock minutes since epoch
+    day_of_week: np.ndarray  # int64, 0=Monday
+    offset: np.ndarray  # int64, UTC offset in minutes at local midnight
+    change_min: np.ndarray  # int64, wall minute of the day the offset changes (1440 = none)
+    new_offset: np.ndarray  # int64, UTC offset in minutes after the change
+
+
+@dataclass
+class BookingArrays:
+    """Non-cancelled bookings as parallel arrays (absolute UTC minutes)"""
+
+    provider_idx: np.ndarray  # int64
+    start_min: np.ndarray  # int64, minutes since epoch (floored)
+    end_min: np.ndarray  # int64, minutes since epoch (ceiled)
+
+
+@dataclass
+class SlotBatch:
+    """Free slots for a batch of providers, sorted by provider then start"""
+
+    provider_ids: List[str]
+    provider_idx: np.ndarray  # int64 index into provider_ids
+    start_min: np.ndarray  # int64, minutes since epoch (UTC)
+    end_min: np.ndarray  # int64, minutes since epoch (UTC)
+
+    def __len__(self) -> int:
+        return int(self.start_min.size)
+
+    def counts(self) -> Dict[str, int]:
+        """Number of free slots per provider id"""
+        per_provider = np.bincount(self.provider_idx, minlength=len(self.provider_ids))
+        return dict(zip(self.provider_ids, per_provider.tolist()))
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        """
+        Serialize to the BB_03_05 output shape.
+        ISO strings are built with numpy, not per-slot datetime objects.
+        """
+        starts = np.datetime_as_string(
+            self.start_min.astype("datetime64[m]"), unit="s", timezone="UTC"
+        )
+        ends = np.datetime_as_string(
+            self.end_min.astype("datetime64[m]"), unit="s", timezone="UTC"
+        )
+        ids = np.asarray(self.provider_ids, dtype=object)[self.provider_idx]
+        return [
+            {"provider_id": p, "start_time": s, "end_time": e}
+            for p, s, e in zip(ids.tolist(), starts.tolist(), ends.tolist())
+        ]
+
+
+def ragged_arange(counts: np.ndarray) -> np.ndarray:
+    """
+    Concatenation of arange(n) for every n in counts, without a Python loop.
+    ragged_arange([2, 0, 3]) -> [0, 1, 0, 1, 2]
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    group_starts = np.cumsum(counts) - counts
+    return np.arange(total, dtype=np.int64) - np.repeat(group_starts, counts)
+
+
+def compute_slot_arrays(
+    slot_duration: np.ndarray,
+    min_notice_min: np.ndarray,
+    schedules: ScheduleArrays,
+    bookings: BookingArrays,
+    days: DayArrays,
+    now_min: int,
+):
+    """
+    Core vectorized pass.
+
+    Args:
+        slot_duration: Slot length in minutes, indexed by provider_idx
+        min_notice_min: Minimum notice in minutes, indexed by provider_idx
+        schedules: Active weekly shifts
+        bookings: Non-cancelled bookings
+        days: Requested days (see build_days)
+        now_min: Current absolute minute (UTC)
+
+    Returns:
+        (provider_idx, start_min, end_min) arrays of free slots,
+        sorted by provider then start time
+    """
+    empty = np.zeros(0, dtype=np.int64)
+
+    # 1. Expand weekly shifts x days into windows. Shifts are grouped by
+    #    weekday so each day picks its block with one ragged arange. Windows
+    #    stay in wall-clock minutes of their day until slots are laid out.
+    order = np.argsort(schedules.day_of_week, kind="stable")
+    s_prov = schedules.provider_idx[order]
+    s_start = schedules.start_min[order]
+    s_end = schedules.end_min[order]
+    per_dow = np.bincount(schedules.day_of_week, minlength=7).astype(np.int64)
+    dow_offset = np.cumsum(per_dow) - per_dow
+
+    shifts_per_day = per_dow[days.day_of_week]
+    shift_idx = np.repeat(dow_offset[days.day_of_week], shifts_per_day) + ragged_arange(shifts_per_day)
+    if shift_idx.size == 0:
+        return empty, empty, empty
+    w_day = np.repeat(np.arange(days.day_of_week.size, dtype=np.int64), shifts_per_day)
+    w_prov = s_prov[shift_idx]
+    w_start = s_start[shift_idx]
+    w_end = s_end[shift_idx]
+
+    # Windows (a few per provider-day) are cheap to sort; ordering them by
+    # provider then start makes the expanded slots come out already sorted.
+    order = np.lexsort((w_start, w_day, w_prov))
+    w_prov, w_day, w_start, w_end = w_prov[order], w_day[order], w_start[order], w_end[order]
+
+    # 2. Expand windows into fixed-length slots (only whole slots fit). The
+    #    minimum notice is applied per window by skipping its first k slots,
+    #    so no per-slot filter pass is needed on ordinary days. Slots are
+    #    placed with the offset at local midnight.
+    w_dur = slot_duration[w_prov]
+    slots_per_window = np.maximum((w_end - w_start) // w_dur, 0)
+    earliest = now_min + min_notice_min[w_prov]
+    w_midnight = days.wall_start[w_day] - days.offset[w_day]
+    switch = days.change_min[w_day] < 1440
+    # On DST switch days k uses the smaller of the two offsets, so it never
+    # skips a slot that is due, and the fix-up below trims the rest.
+    low = np.where(switch, np.minimum(days.offset, days.new_offset)[w_day] - days.offset[w_day], 0)
+    first_slot = np.clip(-((w_midnight + w_start - low - earliest) // w_dur), 0, slots_per_window)
+    counts = slots_per_window - first_slot
+    k = ragged_arange(counts) + np.repeat(first_slot, counts)
+    prov = np.repeat(w_prov, counts)
+    dur = np.repeat(w_dur, counts)
+    wall = np.repeat(w_start, counts) + k * dur
+    start = np.repeat(w_midnight, counts) + wall
+
+    # On DST switch days, slots from the switch on take the new offset, and
+    # a slot that starts in the skipped hour does not exist.
+    if switch.any():
+        on_switch = np.flatnonzero(np.repeat(switch, counts))
+        day = np.repeat(w_day, counts)[on_switch]
+        shift = days.new_offset[day] - days.offset[day]
+        after = wall[on_switch] >= days.change_min[day]
+        start[on_switch] -= np.where(after, shift, 0)
+        drop = (after & (wall[on_switch] < days.change_min[day] + shift)) | (
+            start[on_switch] < np.repeat(earliest, counts)[on_switch]
+        )
+        keep = np.ones(start.size, dtype=bool)
+        keep[on_switch[drop]] = False
+        prov, start, dur = prov[keep], start[keep], dur[keep]
+    end = start + dur
+    if start.size == 0:
+        return empty, empty, empty
+
+    # 3. Overlapping shifts of one provider can interleave; fall back to a
+    #    full sort only in that case, and drop the slots two shifts both
+    #    produce. Once sorted by (provider, start), slot ends are sorted too
+    #    because a provider has a single slot duration.
+    origin = int(start.min())
+    if bookings.start_min.size:
+        origin = min(origin, int(bookings.start_min.min()))
+    slot_keys = prov * KEY_STRIDE + (start - origin)
+    if slot_keys.size > 1 and np.any(slot_keys[1:] <= slot_keys[:-1]):
+        order = np.argsort(slot_keys, kind="stable")
+        sorted_keys = slot_keys[order]
+        order = order[np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1]))]
+        prov, start, end, dur, slot_keys = (
+            prov[order], start[order], end[order], dur[order], slot_keys[order]
+        )
+
+    # 4. Booking conflicts. Each booking [b0, b1) blocks the contiguous run of
+    #    its provider's slots with end > b0 and start < b1. Two searchsorted
+    #    calls over the bookings (not the slots) find every run, and a
+    #    difference array marks them all in one cumulative sum. The array
+    #    only needs the multisets of run starts/ends, so both boundary lists
+    #    are sorted independently to keep the searches cache-friendly.
+    if bookings.start_min.size:
+        span = int(KEY_STRIDE) - 1
+        b_base = bookings.provider_idx * KEY_STRIDE
+        b_start_keys = np.sort(b_base + np.clip(bookings.start_min - origin, 0, span))
+        b_end_keys = np.sort(b_base + np.clip(bookings.end_min - origin, 0, span))
+        lo = np.searchsorted(slot_keys + dur, b_start_keys, side="right")
+        hi = np.searchsorted(slot_keys, b_end_keys, side="left")
+        n = slot_keys.size + 1
+        runs = np.bincount(lo, minlength=n) - np.bincount(hi, minlength=n)
+        free = np.cumsum(runs[:-1]) == 0
+        prov, start, end = prov[free], start[free], end[free]
+
+    return prov, start, end
+
+
+def _to_minute(value: Union[str, datetime], ceil: bool = False) -> int:
+    """Absolute UTC minute for a timestamp (naive values are treated as UTC)"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    seconds = (value - _EPOCH).total_seconds()
+    return int(-(-seconds // 60)) if ceil else int(seconds // 60)
+
+
+def _time_to_min(value: Union[str, time]) -> int:
+    """Minutes since midnight for a schedules.start_time/end_time value"""
+    if isinstance(value, str):
+        value = time.fromisoformat(value)
+    return value.hour * 60 + value.minute
+
+
+def _resolve_tz(tz: Union[str, Any, None]):
+    if tz is None or tz == "UTC":
+        return timezone.utc
+    if isinstance(tz, str):
+        if ZoneInfo is None:
+            raise ValueError(f"Timezone '{tz}' requires Python 3.9+ (zoneinfo)")
+        return ZoneInfo(tz)
+    return tz
+
+
+def _offset_at(tzinfo, utc_min: int) -> int:
+    """UTC offset in minutes at an absolute UTC minute"""
+    moment = datetime.fromtimestamp(utc_min * 60, tz=timezone.utc).astimezone(tzinfo)
+    return int(moment.utcoffset().total_seconds() // 60)
+
+
+def build_days(start_date: Union[str, date], days: int, tz=None) -> DayArrays:
+    """
+    The requested range, one entry per day (not per slot). Each day carries
+    its offset at local midnight and, on a DST switch day, the wall-clock
+    minute of the switch and the offset after it.
+    """
+    tzinfo = _resolve_tz(tz)
+    if isinstance(start_date, str):
+        start_date = date.fromisoformat(start_date[:10])
+    dates = [start_date + timedelta(days=i) for i in range(days + 1)]
+    wall = [(d - _EPOCH.date()).days * 1440 for d in dates]
+    offsets = [
+        int(datetime(d.year, d.month, d.day, tzinfo=tzinfo).utcoffset().total_seconds() // 60)
+        for d in dates
+    ]
+
+    change_min = [1440] * days
+    for i in range(days):
+        if offsets[i] == offsets[i + 1]:
+            continue
+        # Bisect for the first UTC minute with the next day's offset
+        lo, hi = wall[i] - offsets[i], wall[i + 1] - offsets[i + 1]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if _offset_at(tzinfo, mid) == offsets[i + 1]:
+                hi = mid
+            else:
+                lo = mid + 1
+        change_min[i] = lo + offsets[i] - wall[i]
+
+    return DayArrays(
+        wall_start=np.asarray(wall[:-1], dtype=np.int64),
+        day_of_week=np.asarray([d.weekday() for d in dates[:-1]], dtype=np.int64),
+        offset=np.asarray(offsets[:-1], dtype=np.int64),
+        change_min=np.asarray(change_min, dtype=np.int64),
+        new_offset=np.asarray(offsets[1:], dtype=np.int64),
+    )
+
+
+def compute_slots(
+    providers: Sequence[Dict[str, Any]],
+    schedules: Iterable[Dict[str, Any]],
+    bookings: Iterable[Dict[str, Any]],
+    start_date: Union[str, date],
+    days: int = 7,
+    now: Optional[datetime] = None,
+    tz: Union[str, Any, None] = "UTC",
+) -> SlotBatch:
+    """
+    Compute free slots for a batch of providers.
+
+    Args:
+        providers: Rows with id, slot_duration_mins, min_notice_hours
+        schedules: Rows with provider_id, day_of_week, start_time, end_time[, is_active]
+        bookings: Rows with provider_id, start_time, end_time[, status]
+        start_date: First day (YYYY-MM-DD or date)
+        days: Number of days to compute
+        now: Reference time for min_notice_hours (defaults to current UTC time)
+        tz: Timezone the schedules are expressed in (app_config TIMEZONE)
+
+    Returns:
+        SlotBatch with every free slot, sorted by provider then start
+    """
+    provider_ids = [str(p["id"]) for p in providers]
+    index = {pid: i for i, pid in enumerate(provider_ids)}
+
+    slot_duration = np.asarray(
+        [p.get("slot_duration_mins") or p.get("slot_duration") or 30 for p in providers],
+        dtype=np.int64,
+    )
+    min_notice = np.asarray(
+        [(p.get("min_notice_hours") or 0) * 60 for p in providers], dtype=np.int64
+    )
+
+    s_rows = [
+        s
+        for s in schedules
+        if s.get("is_active", True) and str(s["provider_id"]) in index
+    ]
+    sched = ScheduleArrays(
+        provider_idx=np.asarray([index[str(s["provider_id"])] for s in s_rows], dtype=np.int64),
+        day_of_week=np.asarray([DAY_OF_WEEK[s["day_of_week"]] for s in s_rows], dtype=np.int64),
+        start_min=np.asarray([_time_to_min(s["start_time"]) for s in s_rows], dtype=np.int64),
+        end_min=np.asarray([_time_to_min(s["end_time"]) for s in s_rows], dtype=np.int64),
+    )
+
+    b_rows = [
+        b
+        for b in bookings
+        if b.get("status") != "cancelled" and str(b["provider_id"]) in index
+    ]
+    books = BookingArrays(
+        provider_idx=np.asarray([index[str(b["provider_id"])] for b in b_rows], dtype=np.int64),
+        start_min=np.asarray([_to_minute(b["start_time"]) for b in b_rows], dtype=np.int64),
+        end_min=np.asarray([_to_minute(b["end_time"], ceil=True) for b in b_rows], dtype=np.int64),
+    )
+
+    now_min = _to_minute(now or datetime.now(timezone.utc))
+    prov, start, end = compute_slot_arrays(
+        slot_duration, min_notice, sched, books, build_days(start_date, days, tz), now_min
+    )
+    return SlotBatch(provider_ids, prov, start, end)
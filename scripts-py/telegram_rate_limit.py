@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Telegram Rate Limit - token-bucket pacing for Bot API sends
+
+Telegram accepts roughly 30 messages/s per bot and 1 message/s per chat.
+Above that, sendMessage answers 429 "retry after N", and before the backoff
+work each 429 cost the message a 5-minute retry. BB_05/BB_07 and the thread
+pool in notification_dispatcher.py fired sends as fast as they could.
+
+RateLimitedSender wraps a sender (TelegramSender) and paces it:
+
+    per-chat bucket  chat_rate (1/s)     acquired first, FIFO within a chat
+    global bucket    global_rate (30/s)  shared by every chat
+    asyncio          up to max_in_flight requests at once; the blocking
+                     sender runs in a worker thread per request
+    429 retry_after  pauses the chat and the global bucket, then retries in
+                     place if retry_after <= max_inline_wait. Longer waits
+                     are returned as failures for the queue backoff.
+
+Both rates are scaled by `safety` (0.95) so clock skew and network jitter do
+not push a burst over the server's window. The buckets live on one
+background event loop and persist across send_many() calls, so consecutive
+batches share the same budget.
+
+Usage:
+    from notification_dispatcher import TelegramSender
+    from telegram_rate_limit import RateLimitedSender
+
+    sender = RateLimitedSender(TelegramSender(token), max_in_flight=16)
+    results = sender.send_many(notifications)   # [SendResult], input order
+    sender.close()
+
+Tests and benchmark against a local fake Bot API that enforces the limits:
+    python -m pytest tests/bb05_07/test_telegram_rate_limit.py -q
+    python tests/bb05_07/bench_telegram_rate_limit.py
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+GLOBAL_RATE = 30.0
+CHAT_RATE = 1.0
+MAX_CHAT_BUCKETS = 10000
+
+
+class TokenBucket:
+    """`rate` tokens per second, at most `capacity` banked; acquire() waits for one"""
+
+    def __init__(self, rate: float, capacity: float = 1.0, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+        self.paused_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    def delay(self) -> float:
+        """Seconds until a token is available (0 = now)"""
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = max(self.paused_until - now, 0.0)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        """Hands out nothing for `seconds` (a 429 retry_after)"""
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+    @property
+    def idle(self) -> bool:
+        return self.delay() == 0 and self.tokens >= self.capacity
+
+    async def acquire(self) -> None:
+        # Created lazily so the lock belongs to the loop that uses it
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while (wait := self.delay()) > 0:
+                await asyncio.sleep(wait)
+            self.tokens -= 1
+
+
+class RateLimitedSender:
+    """Sends notifications concurrently within Telegram's global and per-chat limits"""
+
+    def __init__(
+        self,
+        sender,
+        global_rate: float = GLOBAL_RATE,
+        chat_rate: float = CHAT_RATE,
+        max_in_flight: int = 16,
+        max_inline_wait: float = 5.0,
+        safety: float = 0.95,
+    ):
+        self.sender = sender
+        self.global_bucket = TokenBucket(global_rate * safety)
+        self.chat_rate = chat_rate * safety
+        self.chats: Dict[str, TokenBucket] = {}
+        self.max_in_flight = max_in_flight
+        self.max_inline_wait = max_inline_wait
+        self.throttled = 0  # 429s received
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def chat_bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            if len(self.chats) >= MAX_CHAT_BUCKETS:
+                # A full, unpaused bucket is the same as a new one
+                self.chats = {k: b for k, b in self.chats.items() if not b.idle}
+            bucket = self.chats[chat_id] = TokenBucket(self.chat_rate)
+        return bucket
+
+    async def _send_one(self, notification: Dict[str, Any]):
+        chat = self.chat_bucket(str(notification.get("recipient")))
+        while True:
+            await chat.acquire()
+            await self.global_bucket.acquire()
+            async with self._semaphore:
+                result = await self._loop.run_in_executor(self._executor, self.sender.send, notification)
+            if result.ok or not result.retry_after:
+                return result
+            # The API cannot tell us which limit we hit; back both off
+            self.throttled += 1
+            chat.pause(result.retry_after)
+            self.global_bucket.pause(result.retry_after)
+            if result.retry_after > self.max_inline_wait:
+                return result
+
+    async def _send_all(self, notifications: List[Dict[str, Any]]):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return await asyncio.gather(*(self._send_one(n) for n in notifications))
+
+    def send_many(self, notifications: List[Dict[str, Any]]) -> List[Any]:
+        """Sends a batch; blocks until every message is sent or has failed"""
+        if not notifications:
+            return []
+        return asyncio.run_coroutine_threadsafe(self._send_all(notifications), self._loop).result()
+
+    def send(self, notification: Dict[str, Any]):
+        return self.send_many([notification])[0]
+
+    def close(self) -> None:
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._executor.shutdown(wait=True)
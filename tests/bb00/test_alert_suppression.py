@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+# --- Watchdog Injection ---
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../scripts-py')))
+try:
+    import watchdog
+    watchdog.setup(300)
+except ImportError:
+    print('Warning: watchdog module not found', file=sys.stderr)
+# --------------------------
+
+"""
+Integration tests for BB_00 alert-storm suppression
+(database/migrations/20261018_18_error_alert_suppression.sql): log_error()
+alerts the first occurrence of a fingerprint per recurrence_config window,
+counts the repeats, and take_alert_digest() reports them until
+ack_alert_digest() (20261018_28_alert_digest_ack.sql) confirms they were sent.
+Needs a database with the migrations applied; skipped when DATABASE_URL is not set.
+
+Usage: DATABASE_URL=... python -m pytest tests/bb00/test_alert_suppression.py -q
+"""
+
+import json
+import threading
+import uuid
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+from config import get_database_url
+
+
+@pytest.fixture(scope="module")
+def dsn():
+    try:
+        return get_database_url()
+    except ValueError:
+        pytest.skip("DATABASE_URL not configured")
+
+
+@pytest.fixture
+def db(dsn):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def wf(db):
+    name = f"test-suppression-{uuid.uuid4()}"
+    yield name
+    with db.cursor() as cur:
+        cur.execute("DELETE FROM error_handling.error_logs WHERE workflow_name = %s", (name,))
+        cur.execute("DELETE FROM error_handling.error_aggregations WHERE workflow_name = %s", (name,))
+        cur.execute("DELETE FROM error_handling.alert_suppression WHERE workflow_name = %s", (name,))
+        cur.execute("DELETE FROM error_handling.recurrence_config WHERE workflow_name = %s", (name,))
+
+
+def log_error(conn, wf, message, severity="CRITICAL"):
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT error_id, should_alert, alert_reason, window_count, suppressed_count, window_minutes "
+            "FROM error_handling.log_error(%s, 'RUNTIME_ERROR', %s, %s, 'test', '{}'::jsonb)",
+            (wf, message, severity),
+        )
+        return cur.fetchone()
+
+
+def configure(conn, wf, window=10, critical=20, suppress=True):
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO error_handling.recurrence_config (workflow_name, error_type, time_window_minutes, threshold_critical, suppress_alerts) "
+            "VALUES (%s, 'RUNTIME_ERROR', %s, %s, %s)",
+            (wf, window, critical, suppress),
+        )
+
+
+def digest(conn, wf, sent=True, lease=600):
+    """Takes the digest rows of wf; sent=True acknowledges them like BB_00's Ack Digest"""
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT error_type, error_fingerprint, suppressed_count, severity_max, last_message "
+            "FROM error_handling.take_alert_digest(1000, %s) WHERE workflow_name = %s",
+            (lease, wf),
+        )
+        rows = cur.fetchall()
+        if sent and rows:
+            ack = [{"workflow_name": wf, "error_type": t, "error_fingerprint": f, "suppressed_count": n} for t, f, n, _, _ in rows]
+            cur.execute("SELECT error_handling.ack_alert_digest(%s::jsonb)", (json.dumps(ack),))
+        return [r[2:] for r in rows]
+
+
+def logged(conn, wf):
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM error_handling.error_logs WHERE workflow_name = %s", (wf,))
+        return cur.fetchone()[0]
+
+
+def test_first_occurrence_alerts_and_repeats_are_counted(db, wf):
+    first = log_error(db, wf, "Timeout after 3000 ms")
+    assert first[0] is not None and first[1:] == (True, "FIRST", 1, 0, 10)
+    for i in range(5):
+        repeat = log_error(db, wf, f"Timeout after {4000 + i} ms")
+        assert repeat[:3] == (None, False, None)
+    assert repeat[3] == 6
+    # A different message is a different fingerprint and alerts on its own
+    assert log_error(db, wf, "Invalid token")[1] is True
+
+    # Only alerted errors are logged; the recurrence check still sees all of them
+    assert logged(db, wf) == 2
+    with db.cursor() as cur:
+        cur.execute(
+            "SELECT occurrence_count FROM error_handling.check_error_recurrence(%s, 'RUNTIME_ERROR', 'Timeout after 1 ms', 10, true)",
+            (wf,),
+        )
+        assert cur.fetchone()[0] == 6
+
+
+def test_digest_reports_and_resets_suppressed_counts(db, wf):
+    for i in range(4):
+        log_error(db, wf, f"Slot {i} taken", severity="HIGH" if i == 2 else "WARNING")
+    assert digest(db, wf) == [(3, "HIGH", "Slot 3 taken")]
+    assert digest(db, wf) == []
+
+    # Once the window expires the next occurrence alerts again and carries the undigested repeats
+    log_error(db, wf, "Slot 9 taken")
+    with db.cursor() as cur:
+        cur.execute("UPDATE error_handling.alert_suppression SET suppress_until = NOW() - INTERVAL '1 second' WHERE workflow_name = %s", (wf,))
+    assert log_error(db, wf, "Slot 10 taken")[1:5] == (True, "FIRST", 1, 1)
+    assert digest(db, wf) == [(1, "CRITICAL", "Slot 10 taken")]
+
+
+def test_unsent_digest_is_reported_again(db, wf):
+    for i in range(4):
+        log_error(db, wf, f"Slot {i} taken")
+    # Send Digest failed: no ack, and the lease keeps other runs off the rows
+    assert digest(db, wf, sent=False, lease=0) == [(3, "CRITICAL", "Slot 3 taken")]
+    assert digest(db, wf, sent=False) == [(3, "CRITICAL", "Slot 3 taken")]
+    assert digest(db, wf) == []
+
+    # Lease ran out; repeats logged meanwhile are added, not lost
+    with db.cursor() as cur:
+        cur.execute("UPDATE error_handling.alert_suppression SET digest_locked_until = NOW() WHERE workflow_name = %s", (wf,))
+    log_error(db, wf, "Slot 4 taken")
+    with db.cursor() as cur:
+        cur.execute(
+            "SELECT error_type, error_fingerprint, suppressed_count FROM error_handling.take_alert_digest(1000) WHERE workflow_name = %s",
+            (wf,),
+        )
+        (error_type, fingerprint, reported), = cur.fetchall()
+        assert reported == 4
+        log_error(db, wf, "Slot 5 taken")
+        cur.execute(
+            "SELECT error_handling.ack_alert_digest(%s::jsonb)",
+            (json.dumps([{"workflow_name": wf, "error_type": error_type, "error_fingerprint": fingerprint, "suppressed_count": reported}]),),
+        )
+        cur.execute("SELECT suppressed_count, total_suppressed, digest_locked_until FROM error_handling.alert_suppression WHERE workflow_name = %s", (wf,))
+        assert cur.fetchone() == (1, 4, None)
+
+
+def test_window_and_escalation_come_from_recurrence_config(db, wf):
+    configure(db, wf, window=3, critical=4)
+    results = [log_error(db, wf, "Gateway Timeout") for _ in range(6)]
+    assert [r[2] for r in results] == ["FIRST", None, None, "ESCALATED", None, None]
+    assert results[0][5] == 3
+    assert logged(db, wf) == 2
+
+
+def test_suppression_can_be_disabled(db, wf):
+    configure(db, wf, suppress=False)
+    assert all(log_error(db, wf, "Gateway Timeout")[1] for _ in range(3))
+    assert logged(db, wf) == 3
+    assert digest(db, wf) == []
+
+
+def test_concurrent_first_occurrences_alert_once(dsn, wf):
+    alerts = []
+
+    def worker():
+        conn = psycopg2.connect(dsn)
+        conn.autocommit = True
+        try:
+            alerts.append(log_error(conn, wf, "Database connection refused")[1])
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(alerts) == [False] * 7 + [True]
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+# --- Watchdog Injection ---
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../scripts-py')))
+try:
+    import watchdog
+    watchdog.setup(300)
+except ImportError:
+    print('Warning: watchdog module not found', file=sys.stderr)
+# --------------------------
+
+"""
+Integration tests for the per-minute error_aggregations buckets
+(database/migrations/20261018_16_error_aggregation_buckets.sql): the insert
+trigger on error_logs, check_error_recurrence(), count_error_recurrences()
+and prune_error_aggregations().
+Needs a database with the migrations applied; skipped when DATABASE_URL is not set.
+
+Usage: DATABASE_URL=... python -m pytest tests/bb00/test_error_aggregations.py -q
+"""
+
+import uuid
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+from config import get_database_url
+
+
+@pytest.fixture(scope="module")
+def dsn():
+    try:
+        return get_database_url()
+    except ValueError:
+        pytest.skip("DATABASE_URL not configured")
+
+
+@pytest.fixture
+def db(dsn):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def wf(db):
+    name = f"test-aggregations-{uuid.uuid4()}"
+    yield name
+    with db.cursor() as cur:
+        cur.execute("DELETE FROM error_handling.error_logs WHERE workflow_name = %s", (name,))
+        cur.execute("DELETE FROM error_handling.error_aggregations WHERE workflow_name = %s", (name,))
+
+
+def log_errors(conn, wf, message, n, severity="HIGH", age="0 seconds", fingerprint=True):
+    """n errors in one multi-row INSERT, created `age` ago"""
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO error_handling.error_logs (workflow_name, error_type, error_message, error_fingerprint, severity, created_at) "
+            "SELECT %(wf)s, 'RUNTIME_ERROR', %(msg)s || ' #' || g, "
+            "       CASE WHEN %(fp)s THEN error_handling.generate_error_fingerprint(%(wf)s, 'RUNTIME_ERROR', %(msg)s || ' #' || g) END, "
+            "       %(sev)s, NOW() - %(age)s::interval "
+            "FROM generate_series(1, %(n)s) g",
+            {"wf": wf, "msg": message, "n": n, "sev": severity, "age": age, "fp": fingerprint},
+        )
+
+
+def recurrence(conn, wf, message, window=10, use_fingerprint=True):
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT occurrence_count, is_recurring, severity_recommendation "
+            "FROM error_handling.check_error_recurrence(%s, 'RUNTIME_ERROR', %s, %s, %s)",
+            (wf, message, window, use_fingerprint),
+        )
+        return cur.fetchone()
+
+
+def buckets(conn, wf):
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT error_fingerprint IS NOT NULL, occurrence_count, severity_max "
+            "FROM error_handling.error_aggregations WHERE workflow_name = %s ORDER BY time_window_start",
+            (wf,),
+        )
+        return cur.fetchall()
+
+
+def test_inserts_are_counted_per_minute_bucket(db, wf):
+    log_errors(db, wf, "API timeout after 3000 ms", 25)
+    log_errors(db, wf, "API timeout after 3000 ms", 5, severity="CRITICAL")
+    rows = buckets(db, wf)
+    # One bucket, or two if the inserts straddle a minute boundary
+    assert len(rows) <= 2 and sum(r[1] for r in rows) == 30
+    assert rows[-1][2] == "CRITICAL"
+    # Digits are normalized away, so every message shares one fingerprint
+    assert recurrence(db, wf, "API timeout after 9999 ms #7") == (30, True, "CRITICAL")
+
+
+def test_window_only_counts_recent_buckets(db, wf):
+    log_errors(db, wf, "Slot taken", 4, age="30 minutes")
+    log_errors(db, wf, "Slot taken", 2)
+    assert len(buckets(db, wf)) == 2
+    assert recurrence(db, wf, "Slot taken #1", window=10) == (2, False, "LOW")
+    assert recurrence(db, wf, "Slot taken #1", window=60) == (6, True, "MEDIUM")
+
+
+def test_checks_without_fingerprint_sum_every_fingerprint(db, wf):
+    log_errors(db, wf, "Slot taken", 3)
+    log_errors(db, wf, "Invalid token", 8)
+    log_errors(db, wf, "Unfingerprinted", 2, fingerprint=False)
+    assert recurrence(db, wf, None, use_fingerprint=False) == (13, True, "HIGH")
+    with db.cursor() as cur:
+        cur.execute("SELECT error_handling.count_error_recurrences(%s, 'RUNTIME_ERROR', 10)", (wf,))
+        assert cur.fetchone()[0] == 13
+    # Rows logged without a fingerprint get one from the insert trigger (20261018_17)
+    log_errors(db, wf, "Unfingerprinted", 1, fingerprint=False)
+    assert all(b[0] for b in buckets(db, wf))
+    assert recurrence(db, wf, "Unfingerprinted #9")[0] == 3
+
+
+def test_counts_match_a_full_scan(db, wf):
+    for i in range(5):
+        log_errors(db, wf, "Gateway Timeout", 10 + i, age=f"{i * 2} minutes")
+    with db.cursor() as cur:
+        cur.execute(
+            "SELECT COUNT(*) FROM error_handling.error_logs WHERE workflow_name = %s "
+            "AND created_at >= date_trunc('minute', NOW() - INTERVAL '10 minutes')",
+            (wf,),
+        )
+        scanned = cur.fetchone()[0]
+    assert recurrence(db, wf, "Gateway Timeout #1")[0] == scanned == 60
+
+
+def test_prune_drops_old_buckets(db, wf):
+    log_errors(db, wf, "Old failure", 3, age="3 days")
+    log_errors(db, wf, "New failure", 1)
+    with db.cursor() as cur:
+        cur.execute("SELECT error_handling.prune_error_aggregations(48)")
+        assert cur.fetchone()[0] >= 1
+    assert [b[1] for b in buckets(db, wf)] == [1]
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
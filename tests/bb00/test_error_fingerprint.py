@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+# --- Watchdog Injection ---
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../scripts-py')))
+try:
+    import watchdog
+    watchdog.setup(300)
+except ImportError:
+    print('Warning: watchdog module not found', file=sys.stderr)
+# --------------------------
+
+"""
+Integration tests for fingerprints stored at write time
+(database/migrations/20261018_17_error_fingerprint_on_write.sql): the
+error_logs triggers, check_fingerprint_recurrence(), and scripts-py/error_fingerprint.py
+(Python twin of generate_error_fingerprint() and the chunked backfill).
+Needs a database with the migrations applied; skipped when DATABASE_URL is not set.
+
+Usage: DATABASE_URL=... python -m pytest tests/bb00/test_error_fingerprint.py -q
+"""
+
+import uuid
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+from config import get_database_url
+from error_fingerprint import FingerprintStore, fingerprint
+
+MESSAGES = [
+    None,
+    "",
+    "   ",
+    "Timeout after 3000 ms",
+    "  Leading and trailing  \t\n spaces  ",
+    "Booking 6f1c2b9e-0d4a-4c1e-9b7a-3e2f1a0b9c8d not found",
+    "Provider ABCDEFABCDEFABCDEFABCDEFABCDEFABCDEF rejected",
+    "deadbeef-cafe-babe-face-feedfacecafe is a UUID made of letters",
+    "Connection refused from 192.168.0.12:5432",
+    "Mixed CASE Message WITH Upper Letters",
+    "Tabs\tand\r\nnewlines\x0band\x0cfeeds",
+    "x" * 250,
+    "HTTP 429: retry_after=17 (chat 5391760292)",
+]
+
+
+# Case mapping and whitespace outside ASCII: final sigma, dotted capital I,
+# titlecase digraph, sharp s, accented letters, Unicode spaces
+UNICODE_MESSAGES = [
+    "aΣ",
+    "ΟΔΟΣ ΚΛΕΙΣΤΗ: ΣΦΑΛΜΑ Σ",
+    "İstanbul İZMİR şube",
+    "Straße ẞ GROẞ",
+    "ǅemal ǄUMA",
+    "Reserva CANCELADA para ÁNGEL Muñoz",
+    "Wide\u3000space\u2003and\u00a0nbsp",
+    "É" * 250,
+]
+
+
+@pytest.fixture(scope="module")
+def dsn():
+    try:
+        return get_database_url()
+    except ValueError:
+        pytest.skip("DATABASE_URL not configured")
+
+
+@pytest.fixture
+def db(dsn):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def wf(db):
+    name = f"test-fingerprint-{uuid.uuid4()}"
+    yield name
+    with db.cursor() as cur:
+        cur.execute("DELETE FROM error_handling.error_logs WHERE workflow_name = %s", (name,))
+        cur.execute("DELETE FROM error_handling.error_aggregations WHERE workflow_name = %s", (name,))
+
+
+@pytest.fixture(scope="module")
+def utf8_db(dsn):
+    """A UTF-8 connection with generate_error_fingerprint(); a scratch database when DATABASE_URL's is not UTF-8"""
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("SHOW server_encoding")
+        if cur.fetchone()[0] == "UTF8":
+            yield conn
+            conn.close()
+            return
+        cur.execute("SELECT pg_get_functiondef('error_handling.generate_error_fingerprint'::regproc)")
+        definition = cur.fetchone()[0]
+        name = f"test_fingerprint_{uuid.uuid4().hex[:12]}"
+        try:
+            cur.execute(f"CREATE DATABASE {name} ENCODING 'UTF8' LOCALE 'C.UTF-8' TEMPLATE template0")
+        except psycopg2.Error as e:
+            conn.close()
+            pytest.skip(f"DATABASE_URL is not UTF-8 and no UTF-8 scratch database: {e}")
+    scratch = psycopg2.connect(psycopg2.extensions.make_dsn(dsn, dbname=name))
+    scratch.autocommit = True
+    with scratch.cursor() as cur:
+        cur.execute("CREATE SCHEMA error_handling")
+        cur.execute(definition)
+    yield scratch
+    scratch.close()
+    with conn.cursor() as cur:
+        cur.execute(f"DROP DATABASE {name}")
+    conn.close()
+
+
+def sql_fingerprint(conn, workflow_name, error_type, message):
+    with conn.cursor() as cur:
+        cur.execute("SELECT error_handling.generate_error_fingerprint(%s, %s, %s)", (workflow_name, error_type, message))
+        return cur.fetchone()[0]
+
+
+def log_error(conn, wf, message, fingerprint_value=None):
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO error_handling.error_logs (workflow_name, error_type, error_message, error_fingerprint, severity) "
+            "VALUES (%s, 'RUNTIME_ERROR', %s, %s, 'HIGH') RETURNING id, error_fingerprint",
+            (wf, message, fingerprint_value),
+        )
+        return cur.fetchone()
+
+
+@pytest.mark.parametrize("message", MESSAGES)
+def test_python_matches_sql(db, message):
+    assert fingerprint("BB_00_Global_Error_Handler", "RUNTIME_ERROR", message) == sql_fingerprint(
+        db, "BB_00_Global_Error_Handler", "RUNTIME_ERROR", message
+    )
+
+
+@pytest.mark.parametrize("message", UNICODE_MESSAGES)
+def test_python_matches_sql_outside_ascii(utf8_db, message):
+    assert fingerprint("BB_00_Global_Error_Handler", "RUNTIME_ERROR", message) == sql_fingerprint(
+        utf8_db, "BB_00_Global_Error_Handler", "RUNTIME_ERROR", message
+    )
+
+
+def test_python_matches_sql_with_null_names(db):
+    assert fingerprint(None, None, "Slot 9 taken") == sql_fingerprint(db, None, None, "Slot 9 taken")
+
+
+def test_insert_stores_the_fingerprint(db, wf):
+    _, stored = log_error(db, wf, "Timeout after 3000 ms")
+    assert stored == fingerprint(wf, "RUNTIME_ERROR", "Timeout after 3000 ms")
+    # A caller-supplied fingerprint is kept
+    assert log_error(db, wf, "Timeout after 3000 ms", "fp_custom")[1] == "fp_custom"
+    with db.cursor() as cur:
+        cur.execute(
+            "SELECT error_fingerprint, occurrence_count FROM error_handling.error_aggregations "
+            "WHERE workflow_name = %s AND error_fingerprint = %s",
+            (wf, stored),
+        )
+        assert cur.fetchone() == (stored, 1)
+
+
+def test_update_of_the_message_recomputes(db, wf):
+    error_id, before = log_error(db, wf, "Timeout after 3000 ms")
+    with db.cursor() as cur:
+        cur.execute("UPDATE error_handling.error_logs SET resolved = true WHERE id = %s RETURNING error_fingerprint", (error_id,))
+        assert cur.fetchone()[0] == before
+        cur.execute(
+            "UPDATE error_handling.error_logs SET error_message = 'Invalid token' WHERE id = %s RETURNING error_fingerprint",
+            (error_id,),
+        )
+        assert cur.fetchone()[0] == fingerprint(wf, "RUNTIME_ERROR", "Invalid token")
+
+
+def test_backfill_fills_null_fingerprints_in_chunks(db, wf):
+    ids = [log_error(db, wf, f"Legacy error {i}")[0] for i in range(7)]
+    with db.cursor() as cur:
+        # Rows logged before the trigger: only error_fingerprint changes, so no recompute
+        cur.execute("UPDATE error_handling.error_logs SET error_fingerprint = NULL WHERE workflow_name = %s", (wf,))
+
+    conn = psycopg2.connect(db.dsn)
+    try:
+        state = FingerprintStore(conn).backfill(chunk=3, start_id=min(ids) - 1)
+    finally:
+        conn.close()
+    assert state.updated >= 7 and state.chunks >= 3
+    with db.cursor() as cur:
+        cur.execute("SELECT DISTINCT error_fingerprint FROM error_handling.error_logs WHERE workflow_name = %s", (wf,))
+        assert cur.fetchall() == [(fingerprint(wf, "RUNTIME_ERROR", "Legacy error 0"),)]
+
+
+def test_check_fingerprint_recurrence_uses_the_stored_value(db, wf):
+    stored = None
+    for i in range(4):
+        stored = log_error(db, wf, f"Gateway Timeout {i}")[1]
+    with db.cursor() as cur:
+        cur.execute(
+            "SELECT occurrence_count, is_recurring, severity_recommendation "
+            "FROM error_handling.check_fingerprint_recurrence(%s, 'RUNTIME_ERROR', %s, 10)",
+            (wf, stored),
+        )
+        assert cur.fetchone() == (4, True, "MEDIUM")
+        cur.execute(
+            "SELECT occurrence_count FROM error_handling.check_error_recurrence(%s, 'RUNTIME_ERROR', 'Gateway Timeout 99', 10, true)",
+            (wf,),
+        )
+        assert cur.fetchone()[0] == 4
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+# --- Watchdog Injection ---
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../scripts-py')))
+try:
+    import watchdog
+    watchdog.setup(300)
+except ImportError:
+    print('Warning: watchdog module not found', file=sys.stderr)
+# --------------------------
+
+"""
+Integration tests for the monthly log partitions
+(database/migrations/20261018_15_monthly_log_partitions.sql): partition
+routing, per-partition indexes, create_monthly_partitions(),
+cleanup_old_errors(), archive_sent_notifications() and drop_monthly_partitions().
+Needs a database with the migrations applied; skipped when DATABASE_URL is not set.
+
+Expired months are simulated with partitions for January 2001, so the
+retention calls below never reach real rows.
+
+Usage: DATABASE_URL=... python -m pytest tests/bb00/test_log_partitions.py -q
+"""
+
+import uuid
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+from config import get_database_url
+
+OLD_MONTH = ("2001-01-01 00:00:00+00", "2001-02-01 00:00:00+00")
+TEN_YEARS = 3650
+
+
+@pytest.fixture(scope="module")
+def dsn():
+    try:
+        return get_database_url()
+    except ValueError:
+        pytest.skip("DATABASE_URL not configured")
+
+
+@pytest.fixture
+def db(dsn):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def tag(db):
+    t = f"test-partitions-{uuid.uuid4()}"
+    yield t
+    with db.cursor() as cur:
+        cur.execute("DELETE FROM error_handling.error_logs WHERE workflow_name = %s", (t,))
+        cur.execute("DELETE FROM error_handling.error_aggregations WHERE workflow_name = %s", (t,))
+        cur.execute("DELETE FROM public.notification_queue WHERE payload->>'test' = %s", (t,))
+        cur.execute("DELETE FROM public.notification_history WHERE payload->>'test' = %s", (t,))
+        for parent in ("error_handling.error_logs", "public.notification_history"):
+            cur.execute(f"DROP TABLE IF EXISTS {parent}_p200101")
+
+
+def old_partition(conn, parent):
+    with conn.cursor() as cur:
+        cur.execute(
+            f"CREATE TABLE {parent}_p200101 PARTITION OF {parent} FOR VALUES FROM (%s) TO (%s)",
+            OLD_MONTH,
+        )
+        # Retention runs as the owner of the migration's functions
+        cur.execute(f"ALTER TABLE {parent}_p200101 OWNER TO neondb_owner")
+
+
+def log_error(conn, tag, created_at="NOW()", resolved=False):
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO error_handling.error_logs (workflow_name, error_type, error_message, resolved, created_at) "
+            f"VALUES (%s, 'TEST', 'partition test', %s, {created_at}) RETURNING tableoid::regclass::text",
+            (tag, resolved),
+        )
+        return cur.fetchone()[0]
+
+
+def test_rows_land_in_their_month(db, tag):
+    with db.cursor() as cur:
+        cur.execute("SELECT to_char(NOW() AT TIME ZONE 'UTC', 'YYYYMM')")
+        month = cur.fetchone()[0]
+    assert log_error(db, tag) == f"error_handling.error_logs_p{month}"
+    assert log_error(db, tag, "TIMESTAMPTZ '1990-06-15 12:00+00'") == "error_handling.error_logs_default"
+
+    with db.cursor() as cur:
+        cur.execute(
+            "INSERT INTO public.audit_logs (table_name, record_id, action) "
+            "VALUES ('test', gen_random_uuid(), 'INSERT') RETURNING tableoid::regclass::text, id"
+        )
+        partition, audit_id = cur.fetchone()
+        cur.execute("DELETE FROM public.audit_logs WHERE id = %s", (audit_id,))
+    assert partition == f"audit_logs_p{month}"
+
+
+def test_created_at_indexes_exist_on_every_partition(db):
+    with db.cursor() as cur:
+        cur.execute(
+            "SELECT p.partition_table::text, COUNT(ix.indexrelid) "
+            "FROM public.monthly_partitions(%s::regclass) p "
+            "LEFT JOIN pg_index ix ON ix.indrelid = p.partition_table "
+            " AND pg_get_indexdef(ix.indexrelid) LIKE '%%(created_at DESC)' "
+            "GROUP BY 1",
+            ("public.audit_logs",),
+        )
+        audit = dict(cur.fetchall())
+        cur.execute(
+            "SELECT DISTINCT pg_get_indexdef(ix.indexrelid) ~ 'created_at DESC' FROM public.monthly_partitions(%s::regclass) p "
+            "JOIN pg_index ix ON ix.indrelid = p.partition_table",
+            ("error_handling.error_logs",),
+        )
+        error_flags = {r[0] for r in cur.fetchall()}
+    assert audit and all(n >= 1 for n in audit.values())
+    assert True in error_flags
+
+
+def test_recurrence_query_prunes_old_months(db):
+    with db.cursor() as cur:
+        cur.execute(
+            "EXPLAIN (ANALYZE, COSTS OFF) SELECT COUNT(*) FROM error_handling.error_logs "
+            "WHERE created_at > NOW() - INTERVAL '10 minutes'"
+        )
+        plan = "\n".join(r[0] for r in cur.fetchall())
+        cur.execute("SELECT COUNT(*) FROM public.monthly_partitions('error_handling.error_logs')")
+        partitions = cur.fetchone()[0]
+    scanned = plan.count("error_logs_p") + plan.count("error_logs_default")
+    assert scanned < partitions
+
+
+def test_default_rows_move_into_a_new_partition(db, tag):
+    with db.cursor() as cur:
+        cur.execute(
+            "SELECT MAX(range_end), NOW() AT TIME ZONE 'UTC' "
+            "FROM public.monthly_partitions('error_handling.error_logs')"
+        )
+        last_end, now = cur.fetchone()
+    # Just past the last pre-created month: the default partition takes it
+    assert log_error(db, tag, f"TIMESTAMPTZ '{last_end.isoformat()}' + INTERVAL '1 day'") == "error_handling.error_logs_default"
+
+    partition = f"error_handling.error_logs_p{last_end.strftime('%Y%m')}"
+    months_ahead = (last_end.year - now.year) * 12 + last_end.month - now.month
+    try:
+        with db.cursor() as cur:
+            cur.execute("SELECT public.create_monthly_partitions('error_handling.error_logs', %s)", (months_ahead,))
+            assert cur.fetchone()[0] == 1
+            cur.execute("SELECT tableoid::regclass::text FROM error_handling.error_logs WHERE workflow_name = %s", (tag,))
+            assert cur.fetchone()[0] == partition
+    finally:
+        with db.cursor() as cur:
+            cur.execute("DELETE FROM error_handling.error_logs WHERE workflow_name = %s", (tag,))
+            cur.execute(f"DROP TABLE IF EXISTS {partition}")
+
+
+def test_cleanup_old_errors_drops_resolved_months_and_keeps_unresolved(db, tag):
+    old_partition(db, "error_handling.error_logs")
+    for _ in range(3):
+        log_error(db, tag, "TIMESTAMPTZ '2001-01-10 00:00+00'", resolved=True)
+    with db.cursor() as cur:
+        cur.execute("SELECT error_handling.cleanup_old_errors(%s)", (TEN_YEARS,))
+        assert cur.fetchone()[0] == 3
+        cur.execute("SELECT to_regclass('error_handling.error_logs_p200101')")
+        assert cur.fetchone()[0] is None
+
+    # A month with an open error is kept; only its resolved rows go
+    old_partition(db, "error_handling.error_logs")
+    log_error(db, tag, "TIMESTAMPTZ '2001-01-10 00:00+00'", resolved=True)
+    log_error(db, tag, "TIMESTAMPTZ '2001-01-11 00:00+00'", resolved=False)
+    with db.cursor() as cur:
+        cur.execute("SELECT error_handling.cleanup_old_errors(%s)", (TEN_YEARS,))
+        assert cur.fetchone()[0] == 1
+        cur.execute("SELECT resolved FROM error_handling.error_logs_p200101 WHERE workflow_name = %s", (tag,))
+        assert cur.fetchall() == [(False,)]
+
+
+def test_sent_notifications_are_archived_and_expired_by_month(db, tag):
+    with db.cursor() as cur:
+        cur.execute(
+            "INSERT INTO public.notification_queue (message, recipient, status, sent_at, payload) "
+            "VALUES ('archivada', 'chat-1', 'sent', NOW() - INTERVAL '2 hours', jsonb_build_object('test', %s::text)), "
+            "       ('reciente', 'chat-1', 'sent', NOW(), jsonb_build_object('test', %s::text)) RETURNING id::text",
+            (tag, tag),
+        )
+        old_id, recent_id = (r[0] for r in cur.fetchall())
+        cur.execute("SELECT public.archive_sent_notifications(3600, NULL)")
+        assert cur.fetchone()[0] >= 1
+        cur.execute("SELECT id::text FROM public.notification_queue WHERE payload->>'test' = %s", (tag,))
+        assert [r[0] for r in cur.fetchall()] == [recent_id]
+        cur.execute("SELECT id::text, message FROM public.notification_history WHERE payload->>'test' = %s", (tag,))
+        assert cur.fetchall() == [(old_id, "archivada")]
+
+    old_partition(db, "public.notification_history")
+    with db.cursor() as cur:
+        cur.execute(
+            "INSERT INTO public.notification_history (id, message, created_at, payload) "
+            "VALUES (gen_random_uuid(), 'vieja', '2001-01-05 00:00+00', jsonb_build_object('test', %s::text))",
+            (tag,),
+        )
+        cur.execute("SELECT public.drop_monthly_partitions('public.notification_history', '2001-03-01 00:00+00')")
+        assert cur.fetchone()[0] == 1
+        cur.execute("SELECT COUNT(*) FROM public.notification_history WHERE message = 'vieja' AND payload->>'test' = %s", (tag,))
+        assert cur.fetchone()[0] == 0
+
+
+def test_maintain_partitions_keeps_months_ahead(db):
+    with db.cursor() as cur:
+        cur.execute("SELECT parent, created, dropped FROM public.maintain_partitions()")
+        report = {r[0]: r for r in cur.fetchall()}
+        cur.execute(
+            "SELECT COUNT(*) FROM public.monthly_partitions('public.audit_logs') "
+            "WHERE range_end > date_trunc('month', NOW() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'"
+        )
+        ahead = cur.fetchone()[0]
+    assert set(report) == {"error_handling.error_logs", "public.audit_logs", "public.notification_history"}
+    assert report["public.audit_logs"][2] == 0
+    assert ahead >= 4
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+# --- Watchdog Injection ---
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../scripts-py')))
+try:
+    import watchdog
+    watchdog.setup(300)
+except ImportError:
+    print('Warning: watchdog module not found', file=sys.stderr)
+# --------------------------
+
+"""
+Tests for the token-bucket firewall: public.firewall_hit() / firewall_flush()
+and the block NOTIFY trigger (database/migrations/20261018_21_firewall_token_bucket.sql),
+the sliding-window quota (database/migrations/20261018_22_firewall_sliding_window.sql),
+and the in-memory engine with write-behind and the blocked-entity bloom filter in
+scripts-py/firewall_engine.py.
+Needs a database with the migrations applied; skipped when DATABASE_URL is not set.
+
+Usage: DATABASE_URL=... python -m pytest tests/bb02/test_firewall_engine.py -q
+"""
+
+import time
+import uuid
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+from config import get_database_url
+from firewall_engine import BloomFilter, FirewallEngine, SlidingWindow
+
+
+@pytest.fixture(scope="module")
+def dsn():
+    try:
+        return get_database_url()
+    except ValueError:
+        pytest.skip("DATABASE_URL not configured")
+
+
+@pytest.fixture
+def db(dsn):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def entity(db):
+    entity_id = f"test-fw-{uuid.uuid4().hex[:12]}"
+    yield entity_id
+    with db.cursor() as cur:
+        cur.execute("DELETE FROM public.security_firewall WHERE entity_id = %s", (entity_id,))
+
+
+def hit(conn, entity_id, capacity=3, refill=0.001, strikes=3):
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT allowed, reason, strike_count FROM public.firewall_hit(%s, %s, %s, %s, 15, 60)",
+            (entity_id, capacity, refill, strikes),
+        )
+        return cur.fetchone()
+
+
+def window_hit(conn, entity_id, limit):
+    with conn.cursor() as cur:
+        cur.execute("SELECT allowed, reason FROM public.firewall_hit(%s, 100, 100, 5, 15, 60, %s, 600)", (entity_id, limit))
+        return cur.fetchone()
+
+
+def row(conn, entity_id):
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT strike_count, is_blocked, blocked_until > NOW() + INTERVAL '14 minutes' "
+            "FROM public.security_firewall WHERE entity_id = %s",
+            (entity_id,),
+        )
+        return cur.fetchone()
+
+
+def test_hit_spends_the_bucket_then_strikes_then_blocks(db, entity):
+    assert [hit(db, entity) for _ in range(3)] == [(True, None, 0)] * 3
+    assert hit(db, entity) == (False, "SEC_RATE_LIMITED", 1)
+    assert hit(db, entity) == (False, "SEC_RATE_LIMITED", 2)
+    assert hit(db, entity) == (False, "SEC_BLOCKED", 3)
+    assert row(db, entity) == (0, True, True)
+    assert hit(db, entity)[:2] == (False, "SEC_BLOCKED")
+
+
+def test_hit_honours_indefinite_and_expired_blocks(db, entity):
+    with db.cursor() as cur:
+        cur.execute("INSERT INTO public.security_firewall (entity_id, is_blocked, blocked_until) VALUES (%s, true, NULL)", (entity,))
+    assert hit(db, entity)[:2] == (False, "SEC_BLOCKED")
+    with db.cursor() as cur:
+        cur.execute("UPDATE public.security_firewall SET blocked_until = NOW() - INTERVAL '1 minute' WHERE entity_id = %s", (entity,))
+    assert hit(db, entity)[0] is True
+
+
+def test_hit_enforces_the_window_quota(db, entity):
+    assert [window_hit(db, entity, 3) for _ in range(3)] == [(True, None)] * 3
+    assert window_hit(db, entity, 3) == (False, "SEC_RATE_LIMITED")
+    with db.cursor() as cur:
+        cur.execute("SELECT window_count, strike_count FROM public.security_firewall WHERE entity_id = %s", (entity,))
+        assert cur.fetchone() == (3, 1)
+
+
+def test_sliding_window_weights_the_previous_window():
+    now = [1000.0]
+    window = SlidingWindow(10, 100, clock=lambda: now[0])
+    for _ in range(10):
+        assert window.delay() == 0
+        window.take()
+    assert window.delay() == pytest.approx(100)
+
+    # A quarter into the next window, 7.5 of the previous 10 still count
+    now[0] = 1125.0
+    assert window.delay() == 0
+    window.take()
+    window.take()
+    assert window.delay() == 0
+    window.take()
+    assert window.delay() == pytest.approx(5)
+    assert (window.prev, window.count, window.pending, window.pending_prev) == (10, 3, 3, 10)
+
+    now[0] = 1400.0
+    assert window.delay() == 0 and window.idle
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000, 0.01)
+    members = [f"telegram:{i}" for i in range(1000)]
+    for key in members:
+        bloom.add(key)
+    assert all(key in bloom for key in members)
+    false_positives = sum(f"other:{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+    assert len(bloom.bits) < 1300 and not bloom.saturated
+
+
+def test_engine_limits_in_memory_and_flushes_in_one_batch(dsn, db, entity):
+    others = [f"{entity}-{i}" for i in range(3)]
+    engine = FirewallEngine(dsn, capacity=3, refill_rate=0.001, strikes_to_block=3, flush_interval=0, listen=False)
+    try:
+        verdicts = [engine.check(entity) for _ in range(6)]
+        assert [v.reason for v in verdicts] == [None, None, None, "SEC_RATE_LIMITED", "SEC_RATE_LIMITED", "SEC_BLOCKED"]
+        assert engine.check(entity).reason == "SEC_BLOCKED"
+        for other in others:
+            assert engine.check(other).allowed
+        assert row(db, entity) is None
+
+        assert engine.flush() == 4
+        assert row(db, entity) == (0, True, True)
+        with db.cursor() as cur:
+            cur.execute("SELECT tokens FROM public.security_firewall WHERE entity_id = %s", (others[0],))
+            assert cur.fetchone()[0] == pytest.approx(2, abs=0.01)
+        assert engine.flush() == 0
+    finally:
+        engine.close()
+        with db.cursor() as cur:
+            cur.execute("DELETE FROM public.security_firewall WHERE entity_id = ANY(%s)", (others,))
+
+
+def test_engines_share_the_window_quota_through_flush(dsn, db, entity):
+    first = FirewallEngine(dsn, capacity=100, refill_rate=100, window_limit=3, flush_interval=0, listen=False)
+    second = FirewallEngine(dsn, capacity=100, refill_rate=100, window_limit=3, flush_interval=0, listen=False)
+    try:
+        assert first.check(entity).allowed and first.check(entity).allowed
+        first.flush()
+        assert second.check(entity).allowed and second.check(entity).allowed
+        second.flush()
+        assert second.check(entity).reason == "SEC_RATE_LIMITED"
+        with db.cursor() as cur:
+            cur.execute("SELECT window_count + prev_window_count FROM public.security_firewall WHERE entity_id = %s", (entity,))
+            assert cur.fetchone()[0] == 4
+    finally:
+        first.close()
+        second.close()
+
+
+def test_clean_entities_skip_the_table(dsn, db, entity):
+    clean = [f"{entity}-clean-{i}" for i in range(200)]
+    with db.cursor() as cur:
+        cur.execute("INSERT INTO public.security_firewall (entity_id, is_blocked, blocked_until) VALUES (%s, true, NULL)", (entity,))
+    engine = FirewallEngine(dsn, flush_interval=0, listen=False)
+    try:
+        assert all(engine.check(entity_id).allowed for entity_id in clean)
+        assert engine.stats()["confirms"] == 0
+
+        assert engine.check(entity).reason == "SEC_BLOCKED"
+        assert engine.check(entity).reason == "SEC_BLOCKED"
+        stats = engine.stats()
+        assert (stats["filter_hits"], stats["confirms"], stats["false_positives"]) == (1, 1, 0)
+    finally:
+        engine.close()
+        with db.cursor() as cur:
+            cur.execute("DELETE FROM public.security_firewall WHERE entity_id = ANY(%s)", (clean,))
+
+
+def test_flush_result_is_authoritative(dsn, db, entity):
+    engine = FirewallEngine(dsn, flush_interval=0, listen=False)
+    try:
+        assert engine.check(entity).allowed
+        with db.cursor() as cur:
+            cur.execute("INSERT INTO public.security_firewall (entity_id, is_blocked, blocked_until) VALUES (%s, true, NULL)", (entity,))
+        engine.flush()
+        assert engine.check(entity).reason == "SEC_BLOCKED"
+        assert row(db, entity)[1] is True
+    finally:
+        engine.close()
+
+
+def test_admin_block_and_unblock_reach_the_engine(dsn, db, entity):
+    engine = FirewallEngine(dsn, flush_interval=0)
+    try:
+        assert engine.check(entity).allowed
+
+        def wait_for(reason):
+            deadline = time.monotonic() + 3
+            while engine.check(entity).reason != reason:
+                assert time.monotonic() < deadline, f"engine never saw {reason}"
+                time.sleep(0.02)
+
+        with db.cursor() as cur:
+            cur.execute(
+                "INSERT INTO public.security_firewall (entity_id, is_blocked, blocked_until) VALUES (%s, true, NOW() + INTERVAL '1 hour')",
+                (entity,),
+            )
+        wait_for("SEC_BLOCKED")
+        with db.cursor() as cur:
+            cur.execute("UPDATE public.security_firewall SET is_blocked = false, blocked_until = NULL WHERE entity_id = %s", (entity,))
+        wait_for(None)
+        assert engine.stats()["notifications"] >= 2
+    finally:
+        engine.close()
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark: BB_03_05 slot engine (scripts-py/slot_engine.py)
+
+Computes availability for 10,000 providers x 30 days in one batched pass.
+Each provider works 5-6 shifts a week with 15-60 min slots and has ~20
+non-cancelled bookings in the range.
+
+Usage:
+    python tests/bb03/bench_slot_engine.py [--providers 10000] [--days 30] [--budget 1.0]
+
+Exit code 1 if the best run exceeds the time budget (seconds).
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../scripts-py')))
+
+import numpy as np
+
+from slot_engine import BookingArrays, ScheduleArrays, build_days, compute_slot_arrays
+
+
+def make_dataset(n_providers, days, seed=7):
+    rng = np.random.default_rng(seed)
+    slot_duration = rng.choice([15, 20, 30, 45, 60], size=n_providers).astype(np.int64)
+    min_notice = (rng.choice([0, 2, 24], size=n_providers) * 60).astype(np.int64)
+
+    # 5 or 6 working days per provider, one shift per day
+    shifts_per_provider = rng.choice([5, 6], size=n_providers)
+    s_prov = np.repeat(np.arange(n_providers, dtype=np.int64), shifts_per_provider)
+    s_dow = np.concatenate([np.arange(k) for k in shifts_per_provider]).astype(np.int64)
+    s_start = rng.integers(7, 11, size=s_prov.size).astype(np.int64) * 60
+    s_end = s_start + rng.integers(6, 10, size=s_prov.size).astype(np.int64) * 60
+    schedules = ScheduleArrays(s_prov, s_dow, s_start, s_end)
+
+    calendar = build_days("2026-03-02", days)
+    now_min = int(calendar.wall_start[0])
+
+    # ~20 bookings per provider, aligned to 15 min, inside working hours
+    n_book = n_providers * 20
+    b_prov = rng.integers(0, n_providers, size=n_book).astype(np.int64)
+    b_day = calendar.wall_start[rng.integers(0, days, size=n_book)]
+    b_start = b_day + 8 * 60 + rng.integers(0, 32, size=n_book).astype(np.int64) * 15
+    b_end = b_start + slot_duration[b_prov]
+    bookings = BookingArrays(b_prov, b_start, b_end)
+
+    return slot_duration, min_notice, schedules, bookings, calendar, now_min
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vectorized slot engine")
+    parser.add_argument("--providers", type=int, default=10000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=1.0, help="Max seconds allowed for the best run")
+    args = parser.parse_args()
+
+    data = make_dataset(args.providers, args.days)
+    compute_slot_arrays(*data)  # warm-up
+
+    timings = []
+    for _ in range(args.runs):
+        t0 = time.perf_counter()
+        prov, start, end = compute_slot_arrays(*data)
+        timings.append(time.perf_counter() - t0)
+
+    best = min(timings)
+    print("=" * 60)
+    print(f"SLOT ENGINE BENCHMARK - {args.providers} providers x {args.days} days")
+    print("=" * 60)
+    print(f"Shifts:        {data[2].provider_idx.size:,}")
+    print(f"Bookings:      {data[3].provider_idx.size:,}")
+    print(f"Free slots:    {start.size:,}")
+    print(f"Best run:      {best * 1000:.1f} ms")
+    print(f"Median run:    {sorted(timings)[len(timings) // 2] * 1000:.1f} ms")
+    print(f"Throughput:    {start.size / best / 1e6:.1f} M slots/s")
+    print(f"Budget:        {args.budget * 1000:.0f} ms -> {'OK' if best <= args.budget else 'FAIL'}")
+    sys.exit(0 if best <= args.budget else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+# --- Watchdog Injection ---
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../scripts-py')))
+try:
+    import watchdog
+    watchdog.setup(300)
+except ImportError:
+    print('Warning: watchdog module not found', file=sys.stderr)
+# --------------------------
+
+"""
+Unit tests for scripts-py/slot_engine.py (BB_03_05 reference engine).
+Offline: no n8n or database required.
+
+Usage: python -m pytest tests/bb03/test_slot_engine.py -q
+"""
+
+import random
+from datetime import datetime, timedelta, timezone
+
+from slot_engine import compute_slots, ragged_arange
+
+NOW = datetime(2026, 3, 1, 0, 0, tzinfo=timezone.utc)  # Sunday
+P1 = "b1b2b3b4-c5d6-7890-abcd-000000000001"
+P2 = "b1b2b3b4-c5d6-7890-abcd-000000000002"
+
+
+def provider(pid, duration=30, notice=0):
+    return {"id": pid, "slot_duration_mins": duration, "min_notice_hours": notice}
+
+
+def shift(pid, day, start, end, active=True):
+    return {"provider_id": pid, "day_of_week": day, "start_time": start, "end_time": end, "is_active": active}
+
+
+def booking(pid, start, end, status="confirmed"):
+    return {"provider_id": pid, "start_time": start, "end_time": end, "status": status}
+
+
+def test_ragged_arange():
+    assert ragged_arange([2, 0, 3]).tolist() == [0, 1, 0, 1, 2]
+    assert ragged_arange([]).tolist() == []
+
+
+def test_single_shift_slots():
+    batch = compute_slots(
+        [provider(P1, 30)],
+        [shift(P1, "Monday", "09:00:00", "11:00:00")],
+        [],
+        "2026-03-02", days=1, now=NOW,
+    )
+    records = batch.to_records()
+    assert [r["start_time"] for r in records] == [
+        "2026-03-02T09:00:00Z", "2026-03-02T09:30:00Z",
+        "2026-03-02T10:00:00Z", "2026-03-02T10:30:00Z",
+    ]
+    assert records[-1]["end_time"] == "2026-03-02T11:00:00Z"
+
+
+def test_partial_slot_is_dropped():
+    batch = compute_slots(
+        [provider(P1, 45)],
+        [shift(P1, "Monday", "09:00:00", "10:00:00")],
+        [], "2026-03-02", days=1, now=NOW,
+    )
+    assert len(batch) == 1
+
+
+def test_bookings_remove_overlapping_slots():
+    batch = compute_slots(
+        [provider(P1, 30)],
+        [shift(P1, "Monday", "09:00:00", "11:00:00")],
+        [
+            booking(P1, "2026-03-02T09:15:00Z", "2026-03-02T09:45:00Z"),
+            booking(P1, "2026-03-02T10:30:00Z", "2026-03-02T11:00:00Z", status="cancelled"),
+        ],
+        "2026-03-02", days=1, now=NOW,
+    )
+    assert [r["start_time"][11:16] for r in batch.to_records()] == ["10:00", "10:30"]
+
+
+def test_bookings_only_affect_their_provider():
+    batch = compute_slots(
+        [provider(P1), provider(P2)],
+        [shift(P1, "Monday", "09:00", "10:00"), shift(P2, "Monday", "09:00", "10:00")],
+        [booking(P1, "2026-03-02T09:00:00Z", "2026-03-02T10:00:00Z")],
+        "2026-03-02", days=1, now=NOW,
+    )
+    assert batch.counts() == {P1: 0, P2: 2}
+
+
+def test_overlapping_shifts_stay_sorted_without_duplicates():
+    batch = compute_slots(
+        [provider(P1, 60)],
+        [shift(P1, "Monday", "09:00", "12:00"), shift(P1, "Monday", "08:00", "10:00")],
+        [booking(P1, "2026-03-02T11:00:00Z", "2026-03-02T12:00:00Z")],
+        "2026-03-02", days=1, now=NOW,
+    )
+    assert [r["start_time"][11:16] for r in batch.to_records()] == ["08:00", "09:00", "10:00"]
+
+
+def test_min_notice_and_inactive_shifts():
+    now = datetime(2026, 3, 2, 8, 0, tzinfo=timezone.utc)
+    batch = compute_slots(
+        [provider(P1, 60, notice=2)],
+        [shift(P1, "Monday", "09:00", "12:00"), shift(P1, "Monday", "14:00", "15:00", active=False)],
+        [], "2026-03-02", days=1, now=now,
+    )
+    assert [r["start_time"][11:16] for r in batch.to_records()] == ["10:00", "11:00"]
+
+
+def test_weekdays_and_timezone():
+    batch = compute_slots(
+        [provider(P1, 60)],
+        [shift(P1, "Tuesday", "09:00", "10:00")],
+        [], "2026-03-02", days=7, now=NOW, tz="America/Santiago",
+    )
+    # Santiago is UTC-3 in March
+    assert [r["start_time"] for r in batch.to_records()] == ["2026-03-03T12:00:00Z"]
+
+
+def test_dst_switch_days_follow_wall_clock():
+    # New York: 2026-03-08 skips 02:00-03:00, 2026-11-01 repeats 01:00-02:00
+    batch = compute_slots(
+        [provider(P1, 60)],
+        [shift(P1, "Sunday", "00:00", "04:00"), shift(P1, "Sunday", "09:00", "10:00")],
+        [], "2026-03-08", days=1, now=NOW, tz="America/New_York",
+    )
+    assert [r["start_time"] for r in batch.to_records()] == [
+        "2026-03-08T05:00:00Z", "2026-03-08T06:00:00Z", "2026-03-08T07:00:00Z", "2026-03-08T13:00:00Z",
+    ]
+    batch = compute_slots(
+        [provider(P1, 60)],
+        [shift(P1, "Sunday", "01:00", "03:00"), shift(P1, "Sunday", "09:00", "10:00")],
+        [], "2026-11-01", days=1, now=NOW, tz="America/New_York",
+    )
+    assert [r["start_time"] for r in batch.to_records()] == [
+        "2026-11-01T05:00:00Z", "2026-11-01T07:00:00Z", "2026-11-01T14:00:00Z",
+    ]
+
+
+def test_dst_switch_at_midnight():
+    # Santiago skips 00:00-01:00 on 2026-09-06
+    batch = compute_slots(
+        [provider(P1, 60)],
+        [shift(P1, "Sunday", "00:00", "02:00"), shift(P1, "Sunday", "09:00", "10:00")],
+        [], "2026-09-05", days=2, now=NOW, tz="America/Santiago",
+    )
+    assert [r["start_time"] for r in batch.to_records()] == ["2026-09-06T04:00:00Z", "2026-09-06T12:00:00Z"]
+
+
+def brute_force(providers, schedules, bookings, start, days, now):
+    days_map = {"Monday": 0, "Tuesday": 1, "Wednesday": 2, "Thursday": 3, "Friday": 4, "Saturday": 5, "Sunday": 6}
+    out = []
+    for p in providers:
+        dur = timedelta(minutes=p["slot_duration_mins"])
+        earliest = now + timedelta(hours=p["min_notice_hours"])
+        busy = [
+            (datetime.fromisoformat(b["start_time"]), datetime.fromisoformat(b["end_time"]))
+            for b in bookings if b["provider_id"] == p["id"] and b["status"] != "cancelled"
+        ]
+        for i in range(days):
+            day = start + timedelta(days=i)
+            for s in schedules:
+                if s["provider_id"] != p["id"] or days_map[s["day_of_week"]] != day.weekday():
+                    continue
+                h1, m1 = map(int, s["start_time"].split(":")[:2])
+                h2, m2 = map(int, s["end_time"].split(":")[:2])
+                cur = day.replace(hour=h1, minute=m1)
+                stop = day.replace(hour=h2, minute=m2)
+                while cur + dur <= stop:
+                    if cur >= earliest and not any(b0 < cur + dur and b1 > cur for b0, b1 in busy):
+                        out.append((p["id"], cur))
+                    cur += dur
+    return sorted(set(out))
+
+
+def test_matches_brute_force():
+    rng = random.Random(42)
+    start = datetime(2026, 3, 2, tzinfo=timezone.utc)
+    names = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+    providers = [provider(f"p{i:03d}", rng.choice([15, 20, 30, 45, 60]), rng.choice([0, 2, 24])) for i in range(40)]
+    schedules, bookings = [], []
+    for p in providers:
+        for day in rng.sample(names, 4):
+            h = rng.randint(6, 12)
+            schedules.append(shift(p["id"], day, f"{h:02d}:00", f"{h + rng.randint(2, 8):02d}:00"))
+        for _ in range(rng.randint(0, 30)):
+            b0 = start + timedelta(minutes=rng.randrange(0, 14 * 24 * 60, 5))
+            b1 = b0 + timedelta(minutes=rng.choice([15, 30, 60, 90]))
+            bookings.append(booking(p["id"], b0.isoformat(), b1.isoformat(), rng.choice(["confirmed", "pending", "cancelled"])))
+
+    now = start + timedelta(hours=30)
+    batch = compute_slots(providers, schedules, bookings, start.date(), days=14, now=now)
+    got = sorted(
+        (r["provider_id"], datetime.fromisoformat(r["start_time"].replace("Z", "+00:00")))
+        for r in batch.to_records()
+    )
+    assert got == brute_force(providers, schedules, bookings, start, 14, now)
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-q"]))
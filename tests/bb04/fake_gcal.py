@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Fake Google Calendar API v3 for local tests and benchmarks
+
+Implements the calls calendar_outbox_worker.py makes:
+    POST   /calendars/{calendarId}/events             201, 409 if the id exists
+    DELETE /calendars/{calendarId}/events/{eventId}   204, 404 if missing
+    POST   /token                                     OAuth refresh: a new access token
+
+Knobs:
+    latency      seconds slept per request (simulates the real API)
+    fail_script  status codes returned by the next requests, in order
+                 (e.g. [503, 429]); a 429 carries Retry-After: retry_after.
+                 A (status, reason) pair sets error.errors[].reason,
+                 e.g. (403, "rateLimitExceeded").
+    tokens       accepted access tokens; None accepts any Bearer token.
+                 /token adds the token it issues.
+Stats: requests, token_requests, max_in_flight (to check the worker's
+concurrency bound).
+
+Usage:
+    with FakeGCal(latency=0.05) as gcal:
+        os.environ["GCAL_API_BASE"] = gcal.url
+        ...
+        assert ("primary", event_id) in gcal.events
+
+    python tests/bb04/fake_gcal.py [--port 8089] [--latency 0.3]
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+
+class FakeGCal:
+    def __init__(self, latency: float = 0.0, port: int = 0, retry_after: int = 0):
+        self.latency = latency
+        self.retry_after = retry_after
+        self.fail_script = []
+        self.events = {}
+        self.tokens = None
+        self.requests = 0
+        self.token_requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body=None, headers=None):
+                data = json.dumps(body).encode() if body is not None else b""
+                self.send_response(status)
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _route(self):
+                # /calendars/{calendarId}/events[/{eventId}]
+                parts = [unquote(p) for p in self.path.split("?")[0].strip("/").split("/")]
+                if len(parts) < 3 or parts[0] != "calendars" or parts[2] != "events":
+                    return None, None
+                return parts[1], parts[3] if len(parts) > 3 else None
+
+            def _handle(self, method):
+                if method == "POST" and self.path.split("?")[0] == "/token":
+                    return self._issue_token()
+                with fake._lock:
+                    fake.requests += 1
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                    scripted = fake.fail_script.pop(0) if fake.fail_script else None
+                try:
+                    time.sleep(fake.latency)
+                    auth = self.headers.get("Authorization", "")
+                    if not auth.startswith("Bearer ") or (fake.tokens is not None and auth[7:] not in fake.tokens):
+                        return self._reply(401, {"error": {"code": 401, "message": "Invalid Credentials"}})
+                    if scripted:
+                        status, reason = scripted if isinstance(scripted, tuple) else (scripted, "backendError")
+                        headers = {"Retry-After": str(fake.retry_after)} if status == 429 else None
+                        error = {"code": status, "message": "scripted failure", "errors": [{"reason": reason}]}
+                        return self._reply(status, {"error": error}, headers)
+
+                    calendar_id, event_id = self._route()
+                    if calendar_id is None:
+                        return self._reply(404, {"error": {"code": 404, "message": "Not Found"}})
+
+                    if method == "POST" and event_id is None:
+                        length = int(self.headers.get("Content-Length") or 0)
+                        body = json.loads(self.rfile.read(length) or b"{}")
+                        key = (calendar_id, body.get("id"))
+                        with fake._lock:
+                            if key in fake.events:
+                                return self._reply(409, {"error": {"code": 409, "message": "The requested identifier already exists."}})
+                            fake.events[key] = body
+                        return self._reply(201, {**body, "status": "confirmed"})
+
+                    if method == "DELETE" and event_id:
+                        with fake._lock:
+                            found = fake.events.pop((calendar_id, event_id), None)
+                        return self._reply(204) if found else self._reply(410, {"error": {"code": 410, "message": "Resource has been deleted"}})
+
+                    return self._reply(405, {"error": {"code": 405, "message": "Method Not Allowed"}})
+                finally:
+                    with fake._lock:
+                        fake.in_flight -= 1
+
+            def _issue_token(self):
+                with fake._lock:
+                    fake.token_requests += 1
+                    token = f"fake-token-{fake.token_requests}"
+                    fake.tokens = (fake.tokens or set()) | {token}
+                return self._reply(200, {"access_token": token, "expires_in": 3599, "token_type": "Bearer"})
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def do_DELETE(self):
+                self._handle("DELETE")
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake Google Calendar API on localhost")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.3, help="Seconds per request")
+    args = parser.parse_args()
+
+    gcal = FakeGCal(latency=args.latency, port=args.port).start()
+    print(f"Fake GCal listening on {gcal.url} (GCAL_API_BASE={gcal.url})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        gcal.stop()
+
+
+if __name__ == "__main__":
+    main()
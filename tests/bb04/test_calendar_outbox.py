@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+
+# --- Watchdog Injection ---
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../scripts-py')))
+try:
+    import watchdog
+    watchdog.setup(300)
+except ImportError:
+    print('Warning: watchdog module not found', file=sys.stderr)
+# --------------------------
+
+"""
+Integration tests for public.calendar_outbox and scripts-py/calendar_outbox_worker.py
+(database/migrations/20261018_08_calendar_outbox.sql) against the local fake
+Google Calendar in tests/bb04/fake_gcal.py.
+Needs a database with the migrations applied; skipped when DATABASE_URL is not set.
+
+Usage: DATABASE_URL=... python -m pytest tests/bb04/test_calendar_outbox.py -q
+"""
+
+import threading
+import time
+import uuid
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+pytest.importorskip("requests")
+
+from calendar_outbox_worker import AccessToken, GCalClient, OutboxWorker, event_id_for
+from config import get_database_url
+from fake_gcal import FakeGCal
+
+USERS = 24
+
+
+@pytest.fixture(scope="module")
+def dsn():
+    try:
+        return get_database_url()
+    except ValueError:
+        pytest.skip("DATABASE_URL not configured")
+
+
+@pytest.fixture
+def db(dsn):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def world(db):
+    """One provider and USERS users, removed afterwards"""
+    provider_id = str(uuid.uuid4())
+    user_ids = [str(uuid.uuid4()) for _ in range(USERS)]
+    base_tg = 900000000 + uuid.uuid4().int % 90000000
+    with db.cursor() as cur:
+        cur.execute(
+            "INSERT INTO public.providers (id, name, slug) VALUES (%s, 'Outbox Test', %s)",
+            (provider_id, f"outbox-test-{provider_id[:8]}"),
+        )
+        for i, user_id in enumerate(user_ids):
+            cur.execute(
+                "INSERT INTO public.users (id, telegram_id, first_name) VALUES (%s, %s, 'Outbox')",
+                (user_id, base_tg + i),
+            )
+    yield provider_id, user_ids
+    with db.cursor() as cur:
+        cur.execute("DELETE FROM public.bookings WHERE provider_id = %s", (provider_id,))
+        cur.execute("DELETE FROM public.providers WHERE id = %s", (provider_id,))
+        cur.execute("DELETE FROM public.users WHERE id = ANY(%s::uuid[])", (user_ids,))
+
+
+@pytest.fixture
+def gcal():
+    with FakeGCal(latency=0.01) as fake:
+        yield fake
+
+
+@pytest.fixture
+def worker(dsn, gcal):
+    w = OutboxWorker(dsn, GCalClient(gcal.url, "test-token"), batch_size=50, concurrency=4)
+    yield w
+    w.close()
+
+
+def call(conn, sql, params):
+    with conn.cursor() as cur:
+        cur.execute(sql, params)
+        return cur.fetchone()[0]
+
+
+def book(conn, provider_id, user_id, hour=10):
+    start, end = f"2030-05-06T{hour:02d}:00:00Z", f"2030-05-06T{hour:02d}:30:00Z"
+    result = call(conn, "SELECT public.create_booking(%s, %s, %s, %s)", (provider_id, user_id, start, end))
+    assert result["success"], result
+    return result["data"]["id"]
+
+
+def drain(worker):
+    total = {"claimed": 0, "ok": 0, "failed": 0}
+    while True:
+        stats = worker.drain_once()
+        if not stats["claimed"]:
+            return total
+        total = {k: total[k] + stats[k] for k in total}
+
+
+def outbox(conn, booking_id):
+    with conn.cursor() as cur:
+        cur.execute("SELECT operation, status, attempts FROM public.calendar_outbox WHERE booking_id = %s ORDER BY id", (booking_id,))
+        return cur.fetchall()
+
+
+def test_booking_enqueues_create_and_worker_attaches_event(db, world, gcal, worker):
+    provider_id, user_ids = world
+    booking_id = book(db, provider_id, user_ids[0])
+    assert outbox(db, booking_id) == [("create", "pending", 0)]
+    assert gcal.requests == 0  # booking did not wait for GCal
+
+    drain(worker)
+    event_id = event_id_for(booking_id)
+    assert call(db, "SELECT gcal_event_id FROM public.bookings WHERE id = %s", (booking_id,)) == event_id
+    assert ("primary", event_id) in gcal.events
+    assert outbox(db, booking_id) == [("create", "done", 1)]
+
+
+def test_cancel_after_sync_deletes_event(db, world, gcal, worker):
+    provider_id, user_ids = world
+    booking_id = book(db, provider_id, user_ids[0])
+    drain(worker)
+
+    call(db, "UPDATE public.bookings SET status = 'cancelled' WHERE id = %s RETURNING id", (booking_id,))
+    drain(worker)
+    assert gcal.events == {}
+    assert outbox(db, booking_id)[-1] == ("delete", "done", 1)
+
+
+def test_cancel_before_sync_never_calls_gcal(db, world, gcal, worker):
+    provider_id, user_ids = world
+    booking_id = book(db, provider_id, user_ids[0])
+    call(db, "UPDATE public.bookings SET status = 'cancelled' WHERE id = %s RETURNING id", (booking_id,))
+
+    assert outbox(db, booking_id) == []
+    drain(worker)
+    assert gcal.requests == 0
+
+
+def test_reschedule_moves_event(db, world, gcal, worker):
+    provider_id, user_ids = world
+    old_id = book(db, provider_id, user_ids[0])
+    drain(worker)
+
+    result = call(db, "SELECT public.reschedule_booking(%s, %s, %s, %s)",
+                  (old_id, user_ids[0], "2030-05-06T15:00:00Z", "2030-05-06T15:30:00Z"))
+    drain(worker)
+    assert set(gcal.events) == {("primary", event_id_for(result["data"]["new_booking_id"]))}
+
+
+def test_transient_failure_is_retried_with_backoff(db, world, gcal, worker):
+    provider_id, user_ids = world
+    booking_id = book(db, provider_id, user_ids[0])
+    gcal.fail_script = [503]
+
+    assert drain(worker)["failed"] == 1
+    assert outbox(db, booking_id) == [("create", "pending", 1)]
+    assert call(db, "SELECT next_attempt_at > NOW() FROM public.calendar_outbox WHERE booking_id = %s", (booking_id,))
+
+    call(db, "UPDATE public.calendar_outbox SET next_attempt_at = NOW() WHERE booking_id = %s RETURNING id", (booking_id,))
+    drain(worker)
+    assert outbox(db, booking_id) == [("create", "done", 2)]
+
+
+def test_retry_after_is_honored(db, world, gcal, worker):
+    provider_id, user_ids = world
+    booking_id = book(db, provider_id, user_ids[0])
+    gcal.retry_after = 120
+    gcal.fail_script = [429]
+
+    drain(worker)
+    wait = call(db, "SELECT EXTRACT(EPOCH FROM next_attempt_at - NOW()) FROM public.calendar_outbox WHERE booking_id = %s", (booking_id,))
+    assert 110 < wait <= 120
+
+
+def test_permanent_failure_is_not_retried(db, world, gcal, worker):
+    provider_id, user_ids = world
+    booking_id = book(db, provider_id, user_ids[0])
+    gcal.fail_script = [400]
+
+    drain(worker)
+    assert outbox(db, booking_id) == [("create", "failed", 1)]
+
+
+def test_rate_limit_403_is_retried(db, world, gcal, worker):
+    provider_id, user_ids = world
+    booking_id = book(db, provider_id, user_ids[0])
+    gcal.fail_script = [(403, "userRateLimitExceeded")]
+
+    drain(worker)
+    assert outbox(db, booking_id) == [("create", "pending", 1)]
+
+
+def test_expired_token_is_refreshed(dsn, db, world, gcal):
+    provider_id, user_ids = world
+    token = AccessToken.refresh_token("client", "secret", "refresh", token_url=f"{gcal.url}/token")
+    w = OutboxWorker(dsn, GCalClient(gcal.url, token), batch_size=50, concurrency=2)
+    try:
+        first = book(db, provider_id, user_ids[0])
+        drain(w)
+        assert gcal.token_requests == 1
+
+        gcal.tokens = set()  # the issued token expired server-side
+        second = book(db, provider_id, user_ids[1], hour=11)
+        assert drain(w)["failed"] == 0
+        assert gcal.token_requests == 2
+        assert outbox(db, first) == outbox(db, second) == [("create", "done", 1)]
+    finally:
+        w.close()
+
+
+def test_invalid_payload_fails_only_its_row(db, world, gcal, worker):
+    provider_id, user_ids = world
+    broken = book(db, provider_id, user_ids[0])
+    fine = book(db, provider_id, user_ids[1], hour=11)
+    call(db, "UPDATE public.calendar_outbox SET payload = payload - 'end_time' WHERE booking_id = %s RETURNING id", (broken,))
+
+    drain(worker)
+    assert outbox(db, broken) == [("create", "failed", 1)]
+    assert outbox(db, fine) == [("create", "done", 1)]
+
+
+def test_lost_response_does_not_duplicate_event(db, world, gcal, worker):
+    provider_id, user_ids = world
+    booking_id = book(db, provider_id, user_ids[0])
+    # an earlier attempt created the event but never settled
+    gcal.events[("primary", event_id_for(booking_id))] = {"id": event_id_for(booking_id)}
+
+    drain(worker)
+    assert outbox(db, booking_id) == [("create", "done", 1)]
+    assert len(gcal.events) == 1
+
+
+def test_parallel_workers_bounded_concurrency_no_duplicates(dsn, db, world, gcal):
+    provider_id, user_ids = world
+    gcal.latency = 0.05
+    booking_ids = [book(db, provider_id, user_ids[hour], hour=hour) for hour in range(24)]
+
+    workers = [OutboxWorker(dsn, GCalClient(gcal.url, "test-token"), batch_size=5, concurrency=3) for _ in range(2)]
+    threads = [threading.Thread(target=drain, args=(w,)) for w in workers]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    for w in workers:
+        w.close()
+
+    assert gcal.requests == len(booking_ids)
+    assert gcal.max_in_flight <= 6
+    assert len(gcal.events) == len(booking_ids)
+    # 24 x 50 ms spread over 6 slots, not serialized
+    assert elapsed < len(booking_ids) * gcal.latency
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+# --- Watchdog Injection ---
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../scripts-py')))
+try:
+    import watchdog
+    watchdog.setup(300)
+except ImportError:
+    print('Warning: watchdog module not found', file=sys.stderr)
+# --------------------------
+
+"""
+Integration tests for public.create_booking()
+(database/migrations/20261018_05_create_booking_function.sql, slot holds
+removed by 20261018_25_drop_slot_holds.sql).
+Needs a database with the migrations applied; skipped when DATABASE_URL is not set.
+
+Usage: DATABASE_URL=... python -m pytest tests/bb04/test_create_booking.py -q
+"""
+
+import threading
+import uuid
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+from config import get_database_url
+
+CREATORS = 40
+START = "2030-03-04T10:00:00Z"
+END = "2030-03-04T10:30:00Z"
+
+
+@pytest.fixture(scope="module")
+def dsn():
+    try:
+        return get_database_url()
+    except ValueError:
+        pytest.skip("DATABASE_URL not configured")
+
+
+@pytest.fixture
+def db(dsn):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def world(db):
+    """One provider and CREATORS users, removed afterwards"""
+    provider_id = str(uuid.uuid4())
+    user_ids = [str(uuid.uuid4()) for _ in range(CREATORS)]
+    base_tg = 700000000 + uuid.uuid4().int % 100000000
+    with db.cursor() as cur:
+        cur.execute(
+            "INSERT INTO public.providers (id, name, slug) VALUES (%s, 'Create Test', %s)",
+            (provider_id, f"create-test-{provider_id[:8]}"),
+        )
+        for i, user_id in enumerate(user_ids):
+            cur.execute(
+                "INSERT INTO public.users (id, telegram_id, first_name) VALUES (%s, %s, 'Create')",
+                (user_id, base_tg + i),
+            )
+    yield provider_id, user_ids
+    with db.cursor() as cur:
+        cur.execute("DELETE FROM public.bookings WHERE provider_id = %s", (provider_id,))
+        cur.execute("DELETE FROM public.providers WHERE id = %s", (provider_id,))
+        cur.execute("DELETE FROM public.users WHERE id = ANY(%s::uuid[])", (user_ids,))
+
+
+def call(conn, sql, params):
+    with conn.cursor() as cur:
+        cur.execute(sql, params)
+        return cur.fetchone()[0]
+
+
+def create(conn, provider_id, user_id, start=START, end=END):
+    return call(conn, "SELECT public.create_booking(%s, %s, %s, %s)", (provider_id, user_id, start, end))
+
+
+def race(dsn, n, fn):
+    """Run fn(conn, i) on n connections released at the same instant"""
+    conns = [psycopg2.connect(dsn) for _ in range(n)]
+    for c in conns:
+        c.autocommit = True
+    barrier, results = threading.Barrier(n), [None] * n
+
+    def run(i):
+        barrier.wait()
+        results[i] = fn(conns[i], i)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for c in conns:
+        c.close()
+    return results
+
+
+def test_many_creators_one_slot_single_booking(dsn, db, world):
+    provider_id, user_ids = world
+    results = race(dsn, CREATORS, lambda conn, i: create(conn, provider_id, user_ids[i]))
+    assert sum(r["success"] for r in results) == 1
+    assert {r["error_code"] for r in results if not r["success"]} == {"BOOK_SLOT_OCCUPIED"}
+    assert call(db, "SELECT COUNT(*) FROM public.bookings WHERE provider_id = %s", (provider_id,)) == 1
+
+
+def test_overlapping_ranges_race_single_booking(dsn, world):
+    provider_id, user_ids = world
+
+    # 30-minute bookings starting 10:00..10:25: different start times, but
+    # every pair overlaps, so only one may win
+    def grab(conn, i):
+        minute = 5 * (i % 6)
+        return create(conn, provider_id, user_ids[i], f"2030-03-04T10:{minute:02d}:00Z", f"2030-03-04T10:{minute + 30:02d}:00Z")
+
+    assert sum(r["success"] for r in race(dsn, CREATORS, grab)) == 1
+
+
+def test_booked_slot_rejects_overlap_but_not_back_to_back(db, world):
+    provider_id, (alice, bob, *_) = world
+    result = create(db, provider_id, alice)
+    assert result["success"] and result["data"]["id"]
+    assert create(db, provider_id, bob, "2030-03-04T10:15:00Z", "2030-03-04T10:45:00Z")["error_code"] == "BOOK_SLOT_OCCUPIED"
+    assert create(db, provider_id, bob, END, "2030-03-04T11:00:00Z")["success"]
+
+
+def test_invalid_provider_and_user(db, world):
+    provider_id, user_ids = world
+    assert create(db, str(uuid.uuid4()), user_ids[0])["error_code"] == "BOOK_INVALID_PROVIDER"
+    assert create(db, provider_id, str(uuid.uuid4()))["error_code"] == "BOOK_INVALID_USER"
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+# --- Watchdog Injection ---
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../scripts-py')))
+try:
+    import watchdog
+    watchdog.setup(300)
+except ImportError:
+    print('Warning: watchdog module not found', file=sys.stderr)
+# --------------------------
+
+"""
+Integration tests for public.idempotency_keys (database/migrations/20261018_06_idempotency_keys.sql,
+20261018_32_idempotency_lease_owner.sql).
+Needs a database with the migrations applied; skipped when DATABASE_URL is not set.
+
+Usage: DATABASE_URL=... python -m pytest tests/bb04/test_idempotency_keys.py -q
+"""
+
+import json
+import threading
+import uuid
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+from config import get_database_url
+
+SCOPE = "BB_04_Booking_Create"
+REQUEST = {"provider_id": "p", "user_id": "u", "start_time": "2030-01-01T10:00:00Z"}
+RESPONSE = {"success": True, "error_code": None, "error_message": None, "data": {"booking_id": "b"}}
+
+
+@pytest.fixture(scope="module")
+def dsn():
+    try:
+        return get_database_url()
+    except ValueError:
+        pytest.skip("DATABASE_URL not configured")
+
+
+@pytest.fixture
+def db(dsn):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def key(db):
+    k = f"test:{uuid.uuid4()}"
+    yield k
+    with db.cursor() as cur:
+        cur.execute("DELETE FROM public.idempotency_keys WHERE idempotency_key = %s", (k,))
+
+
+def begin(conn, key, request=REQUEST, ttl=86400, lease=60):
+    with conn.cursor() as cur:
+        cur.execute("SELECT public.idempotency_begin(%s, %s, %s::jsonb, %s, %s)", (SCOPE, key, json.dumps(request), ttl, lease))
+        return cur.fetchone()[0]
+
+
+def finish(conn, key, response, owner):
+    with conn.cursor() as cur:
+        cur.execute("SELECT public.idempotency_finish(%s, %s, %s::jsonb, %s)", (SCOPE, key, json.dumps(response), owner))
+        return cur.fetchone()[0]
+
+
+def test_concurrent_duplicates_single_owner(dsn, key):
+    n = 20
+    conns = [psycopg2.connect(dsn) for _ in range(n)]
+    for c in conns:
+        c.autocommit = True
+    barrier, states = threading.Barrier(n), [None] * n
+
+    def run(i):
+        barrier.wait()
+        states[i] = begin(conns[i], key)["state"]
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for c in conns:
+        c.close()
+
+    assert states.count("new") == 1
+    assert states.count("in_progress") == n - 1
+
+
+def test_finished_response_is_replayed(db, key):
+    claim = begin(db, key)
+    assert claim["state"] == "new"
+    assert finish(db, key, RESPONSE, claim["owner"]) is True
+    replay = begin(db, key)
+    assert replay == {"state": "replay", "response": RESPONSE}
+
+
+def test_business_error_is_replayed(db, key):
+    occupied = {"success": False, "error_code": "BOOK_SLOT_OCCUPIED", "error_message": "Slot is already booked", "data": None}
+    finish(db, key, occupied, begin(db, key)["owner"])
+    assert begin(db, key)["response"]["error_code"] == "BOOK_SLOT_OCCUPIED"
+
+
+@pytest.mark.parametrize("code", ["DB_ERROR", "BOOK_GCAL_FAILED", "BOOK_SLOT_LOCKED"])
+def test_transient_error_releases_key(db, key, code):
+    assert finish(db, key, {"success": False, "error_code": code, "error_message": "x", "data": None}, begin(db, key)["owner"]) is True
+    assert begin(db, key)["state"] == "new"
+
+
+def test_same_key_different_request_is_rejected(db, key):
+    finish(db, key, RESPONSE, begin(db, key)["owner"])
+    assert begin(db, key, {**REQUEST, "start_time": "2030-01-01T11:00:00Z"})["state"] == "mismatch"
+
+
+def test_stale_lease_and_expired_ttl_are_reclaimed(db, key):
+    assert begin(db, key, lease=0)["state"] == "new"
+    # owner crashed without finishing: the lease has run out
+    claim = begin(db, key)
+    assert claim["state"] == "new"
+    finish(db, key, RESPONSE, claim["owner"])
+    with db.cursor() as cur:
+        cur.execute("UPDATE public.idempotency_keys SET expires_at = NOW() WHERE idempotency_key = %s", (key,))
+    assert begin(db, key)["state"] == "new"
+
+
+def test_stale_owner_cannot_finish_a_taken_over_key(db, key):
+    stale = begin(db, key, lease=0)["owner"]
+    fresh = begin(db, key)["owner"]
+    assert stale != fresh
+    # the first execution outlived its lease: it can neither store nor release
+    assert finish(db, key, RESPONSE, stale) is False
+    assert finish(db, key, {"success": False, "error_code": "DB_ERROR", "error_message": "x", "data": None}, stale) is False
+    assert begin(db, key)["state"] == "in_progress"
+    assert finish(db, key, RESPONSE, fresh) is True
+    assert begin(db, key)["response"] == RESPONSE
+    assert finish(db, key, {**RESPONSE, "data": None}, fresh) is False
+    assert begin(db, key)["response"] == RESPONSE
+
+
+def test_empty_key_bypasses_table(db):
+    assert begin(db, "") == {"state": "new"}
+    assert begin(db, "")["state"] == "new"
+    assert finish(db, "", RESPONSE, None) is True
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
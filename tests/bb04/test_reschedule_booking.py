@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+# --- Watchdog Injection ---
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../scripts-py')))
+try:
+    import watchdog
+    watchdog.setup(300)
+except ImportError:
+    print('Warning: watchdog module not found', file=sys.stderr)
+# --------------------------
+
+"""
+Integration tests for public.reschedule_booking()
+(database/migrations/20261018_07_reschedule_booking_function.sql).
+Needs a database with the migrations applied; skipped when DATABASE_URL is not set.
+
+Usage: DATABASE_URL=... python -m pytest tests/bb04/test_reschedule_booking.py -q
+"""
+
+import threading
+import uuid
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+from config import get_database_url
+
+USERS = 10
+START = "2030-04-01T10:00:00Z"
+END = "2030-04-01T10:30:00Z"
+
+
+@pytest.fixture(scope="module")
+def dsn():
+    try:
+        return get_database_url()
+    except ValueError:
+        pytest.skip("DATABASE_URL not configured")
+
+
+@pytest.fixture
+def db(dsn):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def world(db):
+    """One provider and USERS users, removed afterwards"""
+    provider_id = str(uuid.uuid4())
+    user_ids = [str(uuid.uuid4()) for _ in range(USERS)]
+    base_tg = 800000000 + uuid.uuid4().int % 100000000
+    with db.cursor() as cur:
+        cur.execute(
+            "INSERT INTO public.providers (id, name, slug) VALUES (%s, 'Reschedule Test', %s)",
+            (provider_id, f"reschedule-test-{provider_id[:8]}"),
+        )
+        for i, user_id in enumerate(user_ids):
+            cur.execute(
+                "INSERT INTO public.users (id, telegram_id, first_name) VALUES (%s, %s, 'Resched')",
+                (user_id, base_tg + i),
+            )
+    yield provider_id, user_ids
+    with db.cursor() as cur:
+        cur.execute("DELETE FROM public.bookings WHERE provider_id = %s", (provider_id,))
+        cur.execute("DELETE FROM public.providers WHERE id = %s", (provider_id,))
+        cur.execute("DELETE FROM public.users WHERE id = ANY(%s::uuid[])", (user_ids,))
+
+
+def call(conn, sql, params):
+    with conn.cursor() as cur:
+        cur.execute(sql, params)
+        return cur.fetchone()[0]
+
+
+def book(conn, provider_id, user_id, start=START, end=END):
+    result = call(conn, "SELECT public.create_booking(%s, %s, %s, %s, NULL, 'evt-old')", (provider_id, user_id, start, end))
+    assert result["success"], result
+    return result["data"]["id"]
+
+
+def reschedule(conn, booking_id, user_id, start, end):
+    return call(conn, "SELECT public.reschedule_booking(%s, %s, %s, %s)", (booking_id, user_id, start, end))
+
+
+def status(conn, booking_id):
+    return call(conn, "SELECT status::text FROM public.bookings WHERE id = %s", (booking_id,))
+
+
+def test_reschedule_swaps_booking_and_frees_old_slot(db, world):
+    provider_id, user_ids = world
+    old_id = book(db, provider_id, user_ids[0])
+
+    result = reschedule(db, old_id, user_ids[0], "2030-04-01T12:00:00Z", "2030-04-01T12:30:00Z")
+    assert result["success"], result
+    assert result["data"]["old_booking_id"] == old_id
+    assert result["data"]["old_gcal_event_id"] == "evt-old"
+    assert status(db, old_id) == "rescheduled"
+    assert status(db, result["data"]["new_booking_id"]) == "confirmed"
+
+    # the old range is free again
+    book(db, provider_id, user_ids[1])
+
+
+def test_reschedule_into_overlapping_own_range(db, world):
+    provider_id, user_ids = world
+    old_id = book(db, provider_id, user_ids[0])
+
+    result = reschedule(db, old_id, user_ids[0], "2030-04-01T10:15:00Z", "2030-04-01T10:45:00Z")
+    assert result["success"], result
+
+
+def test_occupied_target_leaves_booking_untouched(db, world):
+    provider_id, user_ids = world
+    old_id = book(db, provider_id, user_ids[0])
+    book(db, provider_id, user_ids[1], "2030-04-01T11:00:00Z", "2030-04-01T11:30:00Z")
+
+    result = reschedule(db, old_id, user_ids[0], "2030-04-01T11:15:00Z", "2030-04-01T11:45:00Z")
+    assert result["error_code"] == "BOOK_SLOT_OCCUPIED"
+    assert status(db, old_id) == "confirmed"
+    assert call(db, "SELECT COUNT(*) FROM public.bookings WHERE provider_id = %s", (provider_id,)) == 2
+
+
+def test_only_owner_can_reschedule_a_confirmed_booking(db, world):
+    provider_id, user_ids = world
+    old_id = book(db, provider_id, user_ids[0])
+
+    assert reschedule(db, old_id, user_ids[1], "2030-04-01T14:00:00Z", "2030-04-01T14:30:00Z")["error_code"] == "BOOK_NOT_FOUND"
+    assert reschedule(db, old_id, user_ids[0], "2030-04-01T14:00:00Z", "2030-04-01T14:30:00Z")["success"]
+    # already rescheduled: a replay of the same request cannot move it twice
+    assert reschedule(db, old_id, user_ids[0], "2030-04-01T15:00:00Z", "2030-04-01T15:30:00Z")["error_code"] == "BOOK_NOT_FOUND"
+
+
+def test_concurrent_reschedules_into_one_slot_single_winner(dsn, db, world):
+    provider_id, user_ids = world
+    booking_ids = [book(db, provider_id, u, f"2030-04-02T{8 + i:02d}:00:00Z", f"2030-04-02T{8 + i:02d}:30:00Z") for i, u in enumerate(user_ids)]
+    conns = [psycopg2.connect(dsn) for _ in user_ids]
+    for c in conns:
+        c.autocommit = True
+    barrier, results = threading.Barrier(USERS), [None] * USERS
+
+    def run(i):
+        barrier.wait()
+        results[i] = reschedule(conns[i], booking_ids[i], user_ids[i], "2030-04-03T10:00:00Z", "2030-04-03T10:30:00Z")
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(USERS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for c in conns:
+        c.close()
+
+    assert sum(r["success"] for r in results) == 1
+    assert {r["error_code"] for r in results if not r["success"]} == {"BOOK_SLOT_OCCUPIED"}
+    # every loser still holds its original, confirmed booking
+    assert call(db, "SELECT COUNT(*) FROM public.bookings WHERE provider_id = %s AND status = 'confirmed'", (provider_id,)) == USERS
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
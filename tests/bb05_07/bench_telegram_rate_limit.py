@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark: Telegram sends - unpaced thread pool vs. RateLimitedSender
+
+Sends --messages notifications spread over --chats chats to
+tests/bb05_07/fake_telegram.py, which enforces Telegram's flood limits
+(30 msg/s per bot, 1 msg/s per chat) and answers 429 "retry after N" above
+them.
+  - unpaced:  TelegramSender in a --concurrency thread pool, as the
+              dispatcher sent before; 429s are resent after retry_after
+              (the queue would wait the full backoff instead)
+  - paced:    RateLimitedSender (scripts-py/telegram_rate_limit.py) with
+              --concurrency requests in flight
+Reports delivered msg/s until every message is accepted, and the 429 count.
+No database needed.
+
+Usage:
+    python tests/bb05_07/bench_telegram_rate_limit.py [--messages 300] [--chats 150] [--concurrency 16] [--latency 0.1]
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../scripts-py')))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fake_telegram import FakeTelegram
+from notification_dispatcher import TelegramSender
+from telegram_rate_limit import RateLimitedSender
+
+
+def run_unpaced(tg, items, concurrency):
+    sender = TelegramSender("bench-token", api_base=tg.url)
+    rounds = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while items:
+            rounds += 1
+            results = list(pool.map(sender.send, items))
+            retry = [n for n, r in zip(items, results) if not r.ok]
+            if retry:
+                time.sleep(max(r.retry_after or 1 for r in results if not r.ok))
+            items = retry
+    return rounds
+
+
+def run_paced(tg, items, concurrency):
+    sender = RateLimitedSender(TelegramSender("bench-token", api_base=tg.url), max_in_flight=concurrency)
+    try:
+        results = sender.send_many(items)
+    finally:
+        sender.close()
+    assert all(r.ok for r in results)
+    return 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Telegram pacing benchmark")
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--chats", type=int, default=150)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.1, help="Fake API seconds per request")
+    args = parser.parse_args()
+
+    items = [{"recipient": f"chat-{i % args.chats}", "message": f"Recordatorio {i}"} for i in range(args.messages)]
+    results = {}
+    for name, run in (("unpaced", run_unpaced), ("paced", run_paced)):
+        print(f"Sending {args.messages:,} messages to {args.chats:,} chats ({name})...")
+        with FakeTelegram(latency=args.latency) as tg:
+            started = time.perf_counter()
+            rounds = run(tg, list(items), args.concurrency)
+            elapsed = time.perf_counter() - started
+            results[name] = {
+                "elapsed": elapsed,
+                "per_sec": tg.accepted / elapsed,
+                "requests": tg.requests,
+                "rejected": tg.rejected,
+                "rounds": rounds,
+                "in_flight": tg.max_in_flight,
+            }
+
+    print("=" * 70)
+    print(f"TELEGRAM PACING BENCHMARK - {args.messages:,} msgs, {args.chats:,} chats, latency {args.latency * 1000:.0f} ms")
+    print("=" * 70)
+    print(f"{'variant':<10}{'requests':>10}{'429s':>8}{'rounds':>8}{'in flight':>11}{'seconds':>10}{'msg/s':>9}")
+    for name, r in results.items():
+        print(f"{name:<10}{r['requests']:>10,}{r['rejected']:>8,}{r['rounds']:>8}{r['in_flight']:>11}{r['elapsed']:>10.2f}{r['per_sec']:>9.1f}")
+    print("\nTelegram limit: 30 msg/s per bot, 1 msg/s per chat")
+
+    ok = results["paced"]["rejected"] == 0
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
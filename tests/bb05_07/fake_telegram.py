@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Fake Telegram Bot API for local tests and benchmarks
+
+Implements the call notification_dispatcher.py makes:
+    POST /bot{token}/sendMessage   {"ok": true, "result": {"message_id": n, ...}}
+
+and enforces Telegram's flood limits the way the real API reports them:
+    global    at most global_limit messages in any 1-second window (default 30)
+    per chat  at most one message per chat_interval seconds (default 1.0)
+A message over either limit gets
+    429 {"ok": false, "error_code": 429,
+         "description": "Too Many Requests: retry after N",
+         "parameters": {"retry_after": N}}
+
+With parse_mode "Markdown" an entity (* _ ` [) that is not closed gets
+    400 {"ok": false, "error_code": 400,
+         "description": "Bad Request: can't parse entities: ..."}
+as Telegram's legacy Markdown parser answers. \\_ \\* \\` \\[ are literal.
+
+Knobs:
+    latency      seconds slept per request (simulates the real API)
+    retry_after  seconds reported in 429 replies
+Stats: requests, sent (chat_id -> [accept times]), rejected (429 count),
+max_in_flight.
+
+Usage:
+    with FakeTelegram(latency=0.05) as tg:
+        sender = TelegramSender("test-token", api_base=tg.url)
+        ...
+        assert tg.rejected == 0
+
+    python tests/bb05_07/fake_telegram.py [--port 8090] [--latency 0.1]
+"""
+
+import argparse
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeTelegram:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        port: int = 0,
+        global_limit: int = 30,
+        chat_interval: float = 1.0,
+        retry_after: int = 1,
+    ):
+        self.latency = latency
+        self.global_limit = global_limit
+        self.chat_interval = chat_interval
+        self.retry_after = retry_after
+        self.sent = {}
+        self.requests = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._window = deque()
+        self._message_id = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def accepted(self) -> int:
+        return sum(len(times) for times in self.sent.values())
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _admit(self, chat_id) -> bool:
+        """Records the message if it is within both limits; caller holds _lock"""
+        now = time.monotonic()
+        while self._window and self._window[0] <= now - 1.0:
+            self._window.popleft()
+        chat = self.sent.setdefault(chat_id, [])
+        if len(self._window) >= self.global_limit or (chat and now - chat[-1] < self.chat_interval):
+            self.rejected += 1
+            return False
+        self._window.append(now)
+        chat.append(now)
+        self._message_id += 1
+        return True
+
+    @staticmethod
+    def _markdown_error(text: str):
+        """Offset of the first unclosed legacy-Markdown entity, None if it parses"""
+        i = 0
+        while i < len(text):
+            c = text[i]
+            if c == "\\" and i + 1 < len(text) and text[i + 1] in "_*`[":
+                i += 2
+                continue
+            if c in "_*`":
+                end = text.find(c, i + 1)
+                if end < 0:
+                    return i
+                i = end + 1
+                continue
+            if c == "[":
+                close = text.find("](", i + 1)
+                if close < 0 or text.find(")", close) < 0:
+                    return i
+                i = text.find(")", close) + 1
+                continue
+            i += 1
+        return None
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                with fake._lock:
+                    fake.requests += 1
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                try:
+                    time.sleep(fake.latency)
+                    if not self.path.startswith("/bot") or not self.path.endswith("/sendMessage"):
+                        return self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+                    chat_id = body.get("chat_id")
+                    if not chat_id or not body.get("text"):
+                        return self._reply(400, {"ok": False, "error_code": 400, "description": "Bad Request: message text is empty"})
+                    if body.get("parse_mode") == "Markdown":
+                        offset = fake._markdown_error(body["text"])
+                        if offset is not None:
+                            return self._reply(400, {
+                                "ok": False,
+                                "error_code": 400,
+                                "description": f"Bad Request: can't parse entities: Can't find end of the entity starting at byte offset {offset}",
+                            })
+                    with fake._lock:
+                        admitted = fake._admit(str(chat_id))
+                        message_id = fake._message_id
+                    if not admitted:
+                        return self._reply(429, {
+                            "ok": False,
+                            "error_code": 429,
+                            "description": f"Too Many Requests: retry after {fake.retry_after}",
+                            "parameters": {"retry_after": fake.retry_after},
+                        })
+                    return self._reply(200, {
+                        "ok": True,
+                        "result": {"message_id": message_id, "chat": {"id": chat_id}, "text": body["text"]},
+                    })
+                finally:
+                    with fake._lock:
+                        fake.in_flight -= 1
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake Telegram Bot API on localhost")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.1, help="Seconds per request")
+    args = parser.parse_args()
+
+    tg = FakeTelegram(latency=args.latency, port=args.port).start()
+    print(f"Fake Telegram listening on {tg.url} (TELEGRAM_API_BASE={tg.url})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        tg.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+# --- Watchdog Injection ---
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../scripts-py')))
+try:
+    import watchdog
+    watchdog.setup(300)
+except ImportError:
+    print('Warning: watchdog module not found', file=sys.stderr)
+# --------------------------
+
+"""
+Tests for the rolling-window circuit breaker: circuit_breaker_check() /
+circuit_breaker_record() / circuit_breaker_trip(), per-workflow settings and
+the NOTIFY trigger (database/migrations/20261018_23_circuit_breaker_half_open.sql,
+20261018_31_circuit_breaker_slow_probes.sql),
+and the in-process breakers in scripts-py/circuit_breaker.py.
+Needs a database with the migrations applied; skipped when DATABASE_URL is not set.
+
+Usage: DATABASE_URL=... python -m pytest tests/bb05_07/test_circuit_breaker.py -q
+"""
+
+import time
+import uuid
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+from config import get_database_url
+from circuit_breaker import CircuitBreakers, RollingWindow
+
+
+@pytest.fixture(scope="module")
+def dsn():
+    try:
+        return get_database_url()
+    except ValueError:
+        pytest.skip("DATABASE_URL not configured")
+
+
+@pytest.fixture
+def db(dsn):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def workflow(db):
+    """A breaker that opens at 50% of at least 4 calls and allows 2 probes"""
+    name = f"test-cb-{uuid.uuid4().hex[:12]}"
+    with db.cursor() as cur:
+        cur.execute(
+            "INSERT INTO public.circuit_breaker_config (workflow_name, failure_rate_threshold, min_calls, window_seconds, open_seconds, half_open_max_calls) "
+            "VALUES (%s, 0.5, 4, 600, 60, 2)",
+            (name,),
+        )
+    yield name
+    with db.cursor() as cur:
+        cur.execute("DELETE FROM public.circuit_breaker_state WHERE workflow_name = %s", (name,))
+        cur.execute("DELETE FROM public.circuit_breaker_config WHERE workflow_name = %s", (name,))
+
+
+def record(conn, name, success):
+    with conn.cursor() as cur:
+        cur.execute("SELECT state, transitioned FROM public.circuit_breaker_record(%s, %s)", (name, success))
+        return cur.fetchone()
+
+
+def check(conn, name):
+    with conn.cursor() as cur:
+        cur.execute("SELECT allowed, state, reason FROM public.circuit_breaker_check(%s)", (name,))
+        return cur.fetchone()
+
+
+def end_cool_down(conn, name):
+    with conn.cursor() as cur:
+        cur.execute("UPDATE public.circuit_breaker_state SET next_attempt_at = NOW() - INTERVAL '1 second' WHERE workflow_name = %s", (name,))
+
+
+def test_one_failure_does_not_open_the_breaker(db, workflow):
+    assert record(db, workflow, False) == ("CLOSED", False)
+    assert record(db, workflow, True) == ("CLOSED", False)
+    assert record(db, workflow, True) == ("CLOSED", False)
+    assert check(db, workflow) == (True, "CLOSED", "closed")
+    assert record(db, workflow, False) == ("OPEN", True)
+    assert check(db, workflow) == (False, "OPEN", "open")
+
+
+def test_half_open_admits_bounded_probes_and_closes(db, workflow):
+    for success in (False, False, False, False):
+        record(db, workflow, success)
+    end_cool_down(db, workflow)
+    assert check(db, workflow) == (True, "HALF_OPEN", "probe")
+    assert check(db, workflow) == (True, "HALF_OPEN", "probe")
+    assert check(db, workflow) == (False, "HALF_OPEN", "probes_in_flight")
+    assert record(db, workflow, True) == ("HALF_OPEN", False)
+    assert record(db, workflow, True) == ("CLOSED", True)
+    with db.cursor() as cur:
+        cur.execute("SELECT failure_count, window_calls, half_open_calls FROM public.circuit_breaker_state WHERE workflow_name = %s", (workflow,))
+        assert cur.fetchone() == (0, 0, 0)
+
+
+def test_failed_probe_reopens(db, workflow):
+    for success in (False, False, False, False):
+        record(db, workflow, success)
+    end_cool_down(db, workflow)
+    assert check(db, workflow)[2] == "probe"
+    assert record(db, workflow, False) == ("OPEN", True)
+    assert check(db, workflow) == (False, "OPEN", "open")
+
+
+def test_slow_probes_keep_their_successes(db, workflow):
+    """Probes further apart than the round deadline still close the breaker"""
+    for success in (False, False, False, False):
+        record(db, workflow, success)
+    end_cool_down(db, workflow)
+    assert check(db, workflow) == (True, "HALF_OPEN", "probe")
+    assert record(db, workflow, True) == ("HALF_OPEN", False)
+    end_cool_down(db, workflow)
+    assert check(db, workflow) == (True, "HALF_OPEN", "probe")
+    assert record(db, workflow, True) == ("CLOSED", True)
+
+
+def test_unreported_probe_starts_a_new_round(db, workflow):
+    for success in (False, False, False, False):
+        record(db, workflow, success)
+    end_cool_down(db, workflow)
+    check(db, workflow)
+    check(db, workflow)
+    assert record(db, workflow, True) == ("HALF_OPEN", False)
+    # The second probe never reported
+    end_cool_down(db, workflow)
+    assert check(db, workflow) == (True, "HALF_OPEN", "probe")
+    with db.cursor() as cur:
+        cur.execute("SELECT half_open_calls, half_open_successes FROM public.circuit_breaker_state WHERE workflow_name = %s", (workflow,))
+        assert cur.fetchone() == (1, 0)
+
+
+def test_rolling_window_weights_the_previous_window():
+    now = [1000.0]
+    window = RollingWindow(100, clock=lambda: now[0])
+    for success in (False, False, True, True):
+        window.record(success)
+    assert window.totals() == (4, 2)
+    now[0] = 1150.0
+    window.record(True)
+    assert window.totals() == pytest.approx((3, 1))
+    now[0] = 1400.0
+    assert window.totals() == (0, 0)
+
+
+def test_breakers_check_in_memory_and_persist_transitions(dsn, db, workflow):
+    breakers = CircuitBreakers(dsn, listen=False)
+    try:
+        assert breakers.allow(workflow).allowed
+        loaded = breakers.stats()["db_calls"]
+        for _ in range(100):
+            assert breakers.allow(workflow).allowed
+        for success in (True, False, True):
+            assert breakers.record(workflow, success) == "CLOSED"
+        assert breakers.stats()["db_calls"] == loaded
+
+        assert breakers.record(workflow, False) == "OPEN"
+        assert breakers.allow(workflow).reason == "open"
+        assert breakers.stats()["db_calls"] == loaded + 1
+        with db.cursor() as cur:
+            cur.execute("SELECT state FROM public.circuit_breaker_state WHERE workflow_name = %s", (workflow,))
+            assert cur.fetchone() == ("OPEN",)
+    finally:
+        breakers.close()
+
+
+def wait_until(predicate, what):
+    deadline = time.monotonic() + 3
+    while not predicate():
+        assert time.monotonic() < deadline, f"never saw {what}"
+        time.sleep(0.02)
+
+
+def test_probes_are_bounded_across_processes(dsn, db, workflow):
+    first = CircuitBreakers(dsn)
+    second = CircuitBreakers(dsn)
+    try:
+        for success in (False, False, False, False):
+            first.record(workflow, success)
+        wait_until(lambda: second.allow(workflow).reason == "open", "the breaker open in the second process")
+
+        end_cool_down(db, workflow)
+        for breakers in (first, second):
+            wait_until(lambda: breakers.breakers[workflow].next_attempt < time.time(), "the cool-down end")
+        decisions = [first.allow(workflow), second.allow(workflow), first.allow(workflow), second.allow(workflow)]
+        assert [d.reason for d in decisions] == ["probe", "probe", "probes_in_flight", "probes_in_flight"]
+
+        assert first.record(workflow, True) == "HALF_OPEN"
+        assert second.record(workflow, True) == "CLOSED"
+        wait_until(lambda: first.allow(workflow).state == "CLOSED", "the breaker closed in the first process")
+    finally:
+        first.close()
+        second.close()
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
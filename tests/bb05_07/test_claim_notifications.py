@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+# --- Watchdog Injection ---
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../scripts-py')))
+try:
+    import watchdog
+    watchdog.setup(300)
+except ImportError:
+    print('Warning: watchdog module not found', file=sys.stderr)
+# --------------------------
+
+"""
+Integration tests for public.claim_notifications()
+(database/migrations/20261018_09_claim_notifications.sql, claim order from
+20261018_26_notification_claim_priority.sql).
+Needs a database with the migrations applied; skipped when DATABASE_URL is not set.
+
+Usage: DATABASE_URL=... python -m pytest tests/bb05_07/test_claim_notifications.py -q
+"""
+
+import threading
+import uuid
+from collections import Counter
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+from config import get_database_url
+
+MESSAGES = 200
+CLAIMERS = 8
+
+
+@pytest.fixture(scope="module")
+def dsn():
+    try:
+        return get_database_url()
+    except ValueError:
+        pytest.skip("DATABASE_URL not configured")
+
+
+@pytest.fixture
+def db(dsn):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def queue(db):
+    """Inserts tagged notifications; returns a factory, rows removed afterwards"""
+    tag = str(uuid.uuid4())
+
+    def add(n, status="pending", retry_count=0, next_retry_at=None, priority=0):
+        with db.cursor() as cur:
+            cur.execute(
+                "INSERT INTO public.notification_queue (message, status, retry_count, next_retry_at, priority, payload) "
+                "SELECT 'test ' || g, %s, %s, COALESCE(%s::timestamptz, NOW()), %s, jsonb_build_object('test', %s::text) "
+                "FROM generate_series(1, %s) g RETURNING id",
+                (status, retry_count, next_retry_at, priority, tag, n),
+            )
+            return {r[0] for r in cur.fetchall()}
+
+    yield add
+    with db.cursor() as cur:
+        cur.execute("DELETE FROM public.notification_queue WHERE payload->>'test' = %s", (tag,))
+
+
+def claim(conn, worker_id, batch_size=10, lease=120, status="pending"):
+    with conn.cursor() as cur:
+        cur.execute("SELECT id FROM public.claim_notifications(%s, %s, %s, %s)", (worker_id, batch_size, lease, status))
+        return {r[0] for r in cur.fetchall()}
+
+
+def test_parallel_claimers_get_disjoint_batches(dsn, queue):
+    ids = queue(MESSAGES)
+    conns = [psycopg2.connect(dsn) for _ in range(CLAIMERS)]
+    for c in conns:
+        c.autocommit = True
+    barrier, claimed = threading.Barrier(CLAIMERS), [[] for _ in range(CLAIMERS)]
+
+    def run(i):
+        barrier.wait()
+        while True:
+            batch = claim(conns[i], f"test:{i}", batch_size=7) & ids
+            if not batch:
+                return
+            claimed[i].extend(batch)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(CLAIMERS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for c in conns:
+        c.close()
+
+    counts = Counter(i for batch in claimed for i in batch)
+    assert set(counts) == ids
+    assert max(counts.values()) == 1
+    assert sum(1 for batch in claimed if batch) > 1
+
+
+def test_claim_records_lease_owner(db, queue):
+    ids = queue(3)
+    assert claim(db, "test:owner", batch_size=50) >= ids
+    with db.cursor() as cur:
+        cur.execute(
+            "SELECT DISTINCT locked_by, locked_until > NOW() FROM public.notification_queue WHERE id = ANY(%s::uuid[])",
+            (list(ids),),
+        )
+        assert cur.fetchall() == [("test:owner", True)]
+
+
+def test_expired_lease_is_reclaimed(db, queue):
+    ids = queue(3)
+    assert claim(db, "test:crashed", batch_size=50, lease=0) >= ids
+    # the first owner never marked them sent
+    assert claim(db, "test:next", batch_size=50) >= ids
+    assert not claim(db, "test:third", batch_size=50) & ids
+
+
+def test_not_yet_due_rows_are_skipped(db, queue):
+    later = queue(3, next_retry_at="2099-01-01T00:00:00Z")
+    assert not claim(db, "test:due", batch_size=50) & later
+
+
+def test_high_priority_is_claimed_before_older_rows(db, queue):
+    queue(20, next_retry_at="2000-01-01T00:00:00Z")
+    urgent = queue(2, priority=100)
+    assert claim(db, "test:priority", batch_size=2) == urgent
+
+
+def test_failed_claim_respects_max_retries(db, queue):
+    retryable = queue(2, status="failed", retry_count=1)
+    exhausted = queue(2, status="failed", retry_count=3)
+    claimed = claim(db, "test:retry", batch_size=50, status="failed")
+    assert claimed >= retryable
+    assert not claimed & exhausted
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+# --- Watchdog Injection ---
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../scripts-py')))
+try:
+    import watchdog
+    watchdog.setup(300)
+except ImportError:
+    print('Warning: watchdog module not found', file=sys.stderr)
+# --------------------------
+
+"""
+Integration tests for mark_notifications_sent() / mark_notifications_failed()
+(database/migrations/20261018_10_bulk_notification_status.sql) and
+scripts-py/notification_dispatcher.py.
+Needs a database with the migrations applied; skipped when DATABASE_URL is not set.
+
+Usage: DATABASE_URL=... python -m pytest tests/bb05_07/test_mark_notifications.py -q
+"""
+
+import json
+import uuid
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+pytest.importorskip("requests")
+
+from config import get_database_url
+from notification_dispatcher import NotificationDispatcher, SendResult
+
+
+@pytest.fixture(scope="module")
+def dsn():
+    try:
+        return get_database_url()
+    except ValueError:
+        pytest.skip("DATABASE_URL not configured")
+
+
+@pytest.fixture
+def db(dsn):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def queue(db):
+    """Inserts tagged notifications; returns a factory, rows removed afterwards"""
+    tag = str(uuid.uuid4())
+
+    def add(n, retry_count=0):
+        with db.cursor() as cur:
+            cur.execute(
+                "INSERT INTO public.notification_queue (message, recipient, retry_count, locked_by, locked_until, payload) "
+                "SELECT 'test ' || g, 'chat', %s, 'test', NOW() + INTERVAL '1 minute', jsonb_build_object('test', %s::text) "
+                "FROM generate_series(1, %s) g RETURNING id::text",
+                (retry_count, tag, n),
+            )
+            return [r[0] for r in cur.fetchall()]
+
+    yield add
+    with db.cursor() as cur:
+        cur.execute("DELETE FROM public.notification_queue WHERE payload->>'test' = %s", (tag,))
+        cur.execute("DELETE FROM public.notification_dead_letter WHERE payload->>'test' = %s", (tag,))
+
+
+def rows(conn, ids):
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT status::text, retry_count, error_message, locked_by, "
+            "ROUND(EXTRACT(EPOCH FROM next_retry_at - NOW())) "
+            "FROM public.notification_queue WHERE id = ANY(%s::uuid[]) ORDER BY id",
+            (ids,),
+        )
+        return cur.fetchall()
+
+
+def call(conn, sql, params):
+    with conn.cursor() as cur:
+        cur.execute(sql, params)
+        return cur.fetchone()[0]
+
+
+def test_mark_sent_settles_whole_batch(db, queue):
+    ids = queue(5)
+    assert call(db, "SELECT public.mark_notifications_sent(%s::uuid[])", (ids,)) == 5
+    assert {r[:4] for r in rows(db, ids)} == {("sent", 0, None, None)}
+
+
+def test_mark_failed_schedules_retry_or_gives_up(db, queue):
+    fresh = queue(1)
+    exhausted = queue(1, retry_count=2)
+    failures = [
+        {"id": fresh[0], "error": "Too Many Requests: retry after 30", "retry_after": 30},
+        {"id": exhausted[0], "error": "chat not found"},
+    ]
+    assert call(db, "SELECT public.mark_notifications_failed(%s::jsonb)", (json.dumps(failures),)) == 2
+    # retry_after is a floor; the telegram policy adds up to 30 s of jitter
+    [(status, retry_count, error, locked_by, due_in)] = rows(db, fresh)
+    assert (status, retry_count, error, locked_by) == ("pending", 1, "Too Many Requests: retry after 30", None)
+    assert 30 <= due_in <= 60
+    # exhausted rows leave the hot queue (20261018_13)
+    assert rows(db, exhausted) == []
+    assert call(db, "SELECT retry_count || ' ' || error_message FROM public.notification_dead_letter WHERE id = %s", (exhausted[0],)) == "3 chat not found"
+
+
+def test_plain_update_still_stamps_updated_at(db, queue):
+    ids = queue(1)
+    with db.cursor() as cur:
+        cur.execute("UPDATE public.notification_queue SET updated_at = NOW() - INTERVAL '1 day' WHERE id = %s", (ids[0],))
+        cur.execute("UPDATE public.notification_queue SET priority = 1 WHERE id = %s", (ids[0],))
+    assert call(db, "SELECT updated_at > NOW() - INTERVAL '1 minute' FROM public.notification_queue WHERE id = %s", (ids[0],))
+
+
+class Sender:
+    def send(self, notification):
+        return SendResult(notification["message"] != "test 2", "chat not found")
+
+
+def test_dispatcher_settles_batch_in_one_round_trip(dsn, db, queue):
+    due = "SELECT COUNT(*) FROM public.notification_queue WHERE status = 'pending' AND (next_retry_at IS NULL OR next_retry_at <= NOW())"
+    if call(db, due, ()):
+        pytest.skip("queue has real due notifications the dispatcher would send")
+    ids = queue(3)
+    with db.cursor() as cur:
+        cur.execute("UPDATE public.notification_queue SET locked_until = NULL WHERE id = ANY(%s::uuid[])", (ids,))
+
+    dispatcher = NotificationDispatcher(dsn, Sender(), worker_id="test", batch_size=1000)
+    try:
+        stats = dispatcher.drain_once()
+    finally:
+        dispatcher.close()
+
+    assert dispatcher.round_trips == 2
+    assert stats["claimed"] == 3
+    statuses = sorted(r[0] for r in rows(db, ids))
+    assert statuses == ["pending", "sent", "sent"]
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
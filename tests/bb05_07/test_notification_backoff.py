@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+# --- Watchdog Injection ---
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../scripts-py')))
+try:
+    import watchdog
+    watchdog.setup(300)
+except ImportError:
+    print('Warning: watchdog module not found', file=sys.stderr)
+# --------------------------
+
+"""
+Integration tests for the notification retry backoff
+(database/migrations/20261018_12_notification_backoff.sql): the
+notification_backoff_seconds() policy, mark_notifications_failed() storing it
+on the row, and a retry-storm simulation against a rate-limited Telegram.
+Needs a database with the migrations applied; skipped when DATABASE_URL is not set.
+
+Usage: DATABASE_URL=... python -m pytest tests/bb05_07/test_notification_backoff.py -q
+"""
+
+import json
+import uuid
+from collections import Counter
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+from config import get_database_url
+
+TELEGRAM = {"base_seconds": 30, "factor": 2, "max_seconds": 1800, "jitter": 1}
+# The pre-backoff behaviour: retry exactly when told to (retry_after or 300 s)
+LOCKSTEP = {"base_seconds": 0, "jitter": 0}
+
+# Bot API limit (~30 messages/s); a rejected send is told to retry after 5 s
+RATE_LIMIT = 30
+RETRY_AFTER = 5
+MAX_RETRIES = 3
+
+
+@pytest.fixture(scope="module")
+def dsn():
+    try:
+        return get_database_url()
+    except ValueError:
+        pytest.skip("DATABASE_URL not configured")
+
+
+@pytest.fixture
+def db(dsn):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("SELECT setseed(0.42)")
+    yield conn
+    conn.close()
+
+
+def backoffs(conn, policy, retry_counts, retry_after=None):
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT public.notification_backoff_seconds(%s::jsonb, n, %s) FROM unnest(%s::int[]) n",
+            (json.dumps(policy), retry_after, list(retry_counts)),
+        )
+        return [r[0] for r in cur.fetchall()]
+
+
+def test_backoff_grows_exponentially_up_to_the_cap(db):
+    for retry_count in range(8):
+        ceiling = min(1800, 30 * 2 ** retry_count)
+        samples = backoffs(db, TELEGRAM, [retry_count] * 500)
+        assert 1 <= min(samples) and max(samples) <= ceiling
+        # full jitter: uniform over [0, ceiling)
+        assert ceiling * 0.4 < sum(samples) / len(samples) < ceiling * 0.6
+
+
+def test_retry_after_is_a_floor(db):
+    samples = backoffs(db, TELEGRAM, [0] * 500, retry_after=45)
+    assert min(samples) >= 45
+    assert max(samples) <= 45 + 30
+
+
+def test_zero_jitter_is_plain_exponential(db):
+    assert backoffs(db, {"base_seconds": 10, "factor": 3, "max_seconds": 200, "jitter": 0}, range(5)) == [10, 30, 90, 200, 200]
+
+
+def test_mark_failed_uses_channel_policy_and_stores_backoff(db):
+    tag = str(uuid.uuid4())
+    with db.cursor() as cur:
+        cur.execute(
+            "INSERT INTO public.notification_queue (message, recipient, channel, retry_count, max_retries, payload) "
+            "VALUES ('test', 'chat', 'telegram', 4, 10, jsonb_build_object('test', %s::text)), "
+            "       ('test', 'chat', 'carrier-pigeon', 0, 10, jsonb_build_object('test', %s::text)) "
+            "RETURNING id::text, channel",
+            (tag, tag),
+        )
+        ids = dict((channel, id_) for id_, channel in cur.fetchall())
+        failures = [{"id": i, "error": "Too Many Requests: retry after 7", "retry_after": 7} for i in ids.values()]
+        cur.execute("SELECT public.mark_notifications_failed(%s::jsonb)", (json.dumps(failures),))
+        cur.execute(
+            "SELECT channel, backoff_seconds, ROUND(EXTRACT(EPOCH FROM next_retry_at - NOW())) "
+            "FROM public.notification_queue WHERE payload->>'test' = %s",
+            (tag,),
+        )
+        stored = {channel: (backoff, due_in) for channel, backoff, due_in in cur.fetchall()}
+        cur.execute("DELETE FROM public.notification_queue WHERE payload->>'test' = %s", (tag,))
+
+    # telegram, 5th attempt: 7 + [0, 480); unknown channel -> default policy, 7 + [30, 60)
+    backoff, due_in = stored["telegram"]
+    assert 7 < backoff <= 7 + 480 and abs(due_in - backoff) <= 1
+    backoff, due_in = stored["carrier-pigeon"]
+    assert 7 + 30 <= backoff <= 7 + 60 and abs(due_in - backoff) <= 1
+
+
+def simulate_storm(conn, policy, messages=600):
+    """
+    Discrete-time model of a burst hitting the Bot API rate limit.
+
+    Every message is due at t=0. Each second the first RATE_LIMIT due sends
+    succeed, and the rest get 429 retry_after=RETRY_AFTER. They are
+    rescheduled with notification_backoff_seconds(), as mark_notifications_failed()
+    would, until MAX_RETRIES attempts are used up.
+    """
+    due = {0: [0] * messages}  # second -> retry_count of each message due then
+    delivered, dead, requests_per_second = 0, 0, Counter()
+    t = 0
+    while due:
+        batch = due.pop(t, [])
+        t += 1
+        if not batch:
+            continue
+        requests_per_second[t - 1] = len(batch)
+        delivered += min(len(batch), RATE_LIMIT)
+        rejected = [n for n in batch[RATE_LIMIT:]]
+        retryable = [n for n in rejected if n + 1 < MAX_RETRIES]
+        dead += len(rejected) - len(retryable)
+        for n, delay in zip(retryable, backoffs(conn, policy, retryable, RETRY_AFTER)):
+            due.setdefault(t - 1 + delay, []).append(n + 1)
+    return delivered, dead, requests_per_second
+
+
+def test_retry_storm_spreads_out(db):
+    lock_delivered, lock_dead, lock_rps = simulate_storm(db, LOCKSTEP)
+    delivered, dead, rps = simulate_storm(db, TELEGRAM)
+
+    # Lockstep: the whole wave comes back together, 30 get through per attempt
+    assert lock_delivered == RATE_LIMIT * MAX_RETRIES
+    assert lock_dead == 600 - RATE_LIMIT * MAX_RETRIES
+    assert sorted(lock_rps.values(), reverse=True)[:MAX_RETRIES] == [600, 570, 540]
+
+    # Jittered: after the initial burst no second carries more than a small
+    # overshoot of the limit, and nothing exhausts its retries
+    assert delivered == 600 and dead == 0
+    retry_peak = max(v for second, v in rps.items() if second > 0)
+    assert retry_peak <= RATE_LIMIT + 10
+    assert sum(v for second, v in rps.items() if second > 0) < 600 * 1.1
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+# --- Watchdog Injection ---
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../scripts-py')))
+try:
+    import watchdog
+    watchdog.setup(300)
+except ImportError:
+    print('Warning: watchdog module not found', file=sys.stderr)
+# --------------------------
+
+"""
+Integration tests for per-recipient notification coalescing:
+claim_notification_digests() (database/migrations/20261018_14_notification_digests.sql)
+and build_digests() / NotificationDispatcher(coalesce_window=...) in
+scripts-py/notification_dispatcher.py.
+Needs a database with the migrations applied; skipped when DATABASE_URL is not set.
+
+Usage: DATABASE_URL=... python -m pytest tests/bb05_07/test_notification_coalescing.py -q
+"""
+
+import uuid
+from collections import Counter
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+pytest.importorskip("requests")
+
+sys.path.insert(0, os.path.dirname(__file__))
+from config import get_database_url
+from fake_telegram import FakeTelegram
+from notification_dispatcher import (
+    TELEGRAM_MAX_LENGTH,
+    NotificationDispatcher,
+    SendResult,
+    TelegramSender,
+    build_digests,
+    escape_markdown,
+)
+
+DUE_SQL = "SELECT COUNT(*) FROM public.notification_queue WHERE status = 'pending' AND (next_retry_at IS NULL OR next_retry_at <= NOW())"
+
+
+@pytest.fixture(scope="module")
+def dsn():
+    try:
+        return get_database_url()
+    except ValueError:
+        pytest.skip("DATABASE_URL not configured")
+
+
+@pytest.fixture
+def db(dsn):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def tag(db):
+    t = str(uuid.uuid4())
+    yield t
+    with db.cursor() as cur:
+        cur.execute("DELETE FROM public.notification_queue WHERE payload->>'test' = %s", (t,))
+        cur.execute("DELETE FROM public.notification_dead_letter WHERE payload->>'test' = %s", (t,))
+
+
+@pytest.fixture
+def quiet_queue(db):
+    with db.cursor() as cur:
+        cur.execute(DUE_SQL)
+        if cur.fetchone()[0]:
+            pytest.skip("queue has real due notifications the dispatcher would send")
+
+
+def cancel_day(conn, tag, recipient, bookings, age_seconds=0):
+    """One cancellation notice per booking, queued in one transaction like a provider's day off"""
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO public.notification_queue (message, recipient, created_at, payload) "
+            "SELECT 'Tu reserva del 2026-10-20 a las ' || to_char(TIME '08:00' + g * INTERVAL '3 minutes', 'HH24:MI') "
+            "       || ' con Dr. Perez fue cancelada. Responde /agendar para elegir otro horario.', "
+            "       %s, NOW() - make_interval(secs => %s), jsonb_build_object('test', %s::text) "
+            "FROM generate_series(1, %s) g RETURNING id::text",
+            (recipient, age_seconds, tag, bookings),
+        )
+        return [r[0] for r in cur.fetchall()]
+
+
+class CountingSender:
+    """Counts sendMessage calls per chat"""
+
+    def __init__(self, fail=None):
+        self.calls = Counter()
+        self.lengths = []
+        self.fail = fail
+
+    def send(self, notification):
+        self.calls[notification["recipient"]] += 1
+        self.lengths.append(len(notification["message"]))
+        return self.fail or SendResult(True)
+
+
+def drain(dsn, sender, coalesce_window):
+    dispatcher = NotificationDispatcher(dsn, sender, worker_id="test:digest", batch_size=50, coalesce_window=coalesce_window)
+    try:
+        return dispatcher.drain()
+    finally:
+        dispatcher.close()
+
+
+def statuses(conn, ids):
+    with conn.cursor() as cur:
+        cur.execute("SELECT status::text, COUNT(*) FROM public.notification_queue WHERE id = ANY(%s::uuid[]) GROUP BY 1", (ids,))
+        return dict(cur.fetchall())
+
+
+def test_mass_cancellation_api_calls_before_and_after(dsn, db, tag, quiet_queue):
+    """200 bookings cancelled for one patient's chat, plus 2 for another chat"""
+    # Before: one sendMessage per row
+    ids = cancel_day(db, tag, "chat-a", 200) + cancel_day(db, tag, "chat-b", 2)
+    before = CountingSender()
+    drain(dsn, before, coalesce_window=None)
+    assert statuses(db, ids) == {"sent": 202}
+
+    # After: one digest per chat, split only at Telegram's message limit
+    ids = cancel_day(db, tag, "chat-a", 200) + cancel_day(db, tag, "chat-b", 2)
+    after = CountingSender()
+    stats = drain(dsn, after, coalesce_window=0)
+    assert statuses(db, ids) == {"sent": 202}
+    assert stats["claimed"] == 202
+
+    assert before.calls == {"chat-a": 200, "chat-b": 2}
+    assert after.calls["chat-b"] == 1
+    assert after.calls["chat-a"] <= 6
+    assert max(after.lengths) <= TELEGRAM_MAX_LENGTH
+    print(f"\nAPI calls for a 200-booking cancellation: {sum(before.calls.values())} -> {sum(after.calls.values())}")
+
+
+def test_burst_is_held_until_the_window_is_quiet(db, tag):
+    def claim():
+        with db.cursor() as cur:
+            cur.execute("SELECT id::text FROM public.claim_notification_digests('test:window', 10, 60, 5)")
+            return {r[0] for r in cur.fetchall()}
+
+    fresh = cancel_day(db, tag, f"chat-{tag}", 3)
+    assert not claim() & set(fresh)
+    with db.cursor() as cur:
+        cur.execute("UPDATE public.notification_queue SET created_at = NOW() - INTERVAL '6 seconds' WHERE id = ANY(%s::uuid[])", (fresh,))
+    assert claim() >= set(fresh)
+
+
+def test_high_priority_group_is_claimed_first(db, tag):
+    older = cancel_day(db, tag, f"chat-{tag}-a", 3, age_seconds=600)
+    urgent = cancel_day(db, tag, f"chat-{tag}-b", 1, age_seconds=60)
+    with db.cursor() as cur:
+        cur.execute("UPDATE public.notification_queue SET priority = 100 WHERE id = ANY(%s::uuid[])", (urgent,))
+        cur.execute("SELECT id::text FROM public.claim_notification_digests('test:priority', 1, 60, 5)")
+        claimed = {r[0] for r in cur.fetchall()}
+    assert claimed == set(urgent)
+    assert not claimed & set(older)
+
+
+def test_failed_digest_fails_every_row(dsn, db, tag, quiet_queue):
+    ids = cancel_day(db, tag, "chat-429", 5, age_seconds=60)
+    sender = CountingSender(fail=SendResult(False, "HTTP 429: Too Many Requests: retry after 9", 9))
+    drain(dsn, sender, coalesce_window=5)
+    assert sender.calls == {"chat-429": 1}
+    with db.cursor() as cur:
+        cur.execute(
+            "SELECT status::text, retry_count, backoff_seconds >= 9 FROM public.notification_queue WHERE id = ANY(%s::uuid[])",
+            (ids,),
+        )
+        assert set(cur.fetchall()) == {("pending", 1, True)}
+
+
+def test_build_digests_splits_long_groups_and_passes_singles_through():
+    rows = [{"id": i, "channel": "telegram", "recipient": "a", "message": "x" * 1000} for i in range(9)]
+    rows.append({"id": 99, "channel": "telegram", "recipient": "b", "message": "hola"})
+    digests = build_digests(rows)
+    by_chat = Counter(d["recipient"] for d in digests)
+    assert by_chat == {"a": 3, "b": 1}
+    assert sum(len(d["ids"]) for d in digests if d["recipient"] == "a") == 9
+    assert all(len(d["message"]) <= TELEGRAM_MAX_LENGTH for d in digests)
+    assert [d["message"] for d in digests if d["recipient"] == "b"] == ["hola"]
+
+
+def test_digests_with_markdown_metacharacters_are_sent():
+    messages = ["Cita de juan_perez cancelada", "Total: 2*3 [promo", "Usa `codigo", "Sin formato"]
+    rows = [{"id": i, "channel": "telegram", "recipient": "a", "message": m} for i, m in enumerate(messages)]
+    digest, = build_digests(rows)
+    assert FakeTelegram._markdown_error(digest["message"]) is not None
+    with FakeTelegram() as tg:
+        sender = TelegramSender("test-token", api_base=tg.url)
+        assert sender.send(digest) == SendResult(True)
+        assert sender.send({"recipient": "b", "message": messages[0]}) == SendResult(True)
+    assert tg.accepted == 2
+
+    # Escaping can double a message; digests are split on the escaped length
+    rows = [{"id": i, "channel": "telegram", "recipient": "a", "message": "_" * 1500} for i in range(5)]
+    digests = build_digests(rows)
+    assert sum(len(d["ids"]) for d in digests) == 5
+    assert all(len(escape_markdown(d["message"])) <= TELEGRAM_MAX_LENGTH for d in digests)
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
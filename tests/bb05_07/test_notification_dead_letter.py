@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+# --- Watchdog Injection ---
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../scripts-py')))
+try:
+    import watchdog
+    watchdog.setup(300)
+except ImportError:
+    print('Warning: watchdog module not found', file=sys.stderr)
+# --------------------------
+
+"""
+Integration tests for notification_dead_letter
+(database/migrations/20261018_13_notification_dead_letter.sql, 20261018_27) and
+scripts-py/notification_dead_letters.py.
+Needs a database with the migrations applied; skipped when DATABASE_URL is not set.
+
+Usage: DATABASE_URL=... python -m pytest tests/bb05_07/test_notification_dead_letter.py -q
+"""
+
+import csv
+import io
+import json
+import uuid
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+from config import get_database_url
+from notification_dead_letters import DeadLetterFilter, DeadLetterStore
+
+
+@pytest.fixture(scope="module")
+def dsn():
+    try:
+        return get_database_url()
+    except ValueError:
+        pytest.skip("DATABASE_URL not configured")
+
+
+@pytest.fixture
+def db(dsn):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def tag(db):
+    t = str(uuid.uuid4())
+    yield t
+    with db.cursor() as cur:
+        cur.execute("DELETE FROM public.notification_queue WHERE payload->>'test' = %s", (t,))
+        cur.execute("DELETE FROM public.notification_dead_letter WHERE payload->>'test' = %s", (t,))
+
+
+@pytest.fixture
+def store(dsn):
+    conn = psycopg2.connect(dsn)
+    yield DeadLetterStore(conn)
+    conn.close()
+
+
+def bury(conn, tag, n, channel="telegram", error="chat not found"):
+    """Inserts n dead letters directly; returns their ids"""
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO public.notification_dead_letter (id, message, recipient, channel, retry_count, error_message, payload, created_at) "
+            "SELECT gen_random_uuid(), 'test ' || g, 'chat', %s, 3, %s, jsonb_build_object('test', %s::text), NOW() "
+            "FROM generate_series(1, %s) g RETURNING id::text",
+            (channel, error, tag, n),
+        )
+        return [r[0] for r in cur.fetchall()]
+
+
+def where_is(conn, ids):
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT 'queue:' || status || ':' || retry_count FROM public.notification_queue WHERE id = ANY(%s::uuid[]) "
+            "UNION ALL SELECT 'dead' FROM public.notification_dead_letter WHERE id = ANY(%s::uuid[])",
+            (ids, ids),
+        )
+        return sorted(r[0] for r in cur.fetchall())
+
+
+def test_exhausted_failure_moves_to_dead_letter(db, tag):
+    with db.cursor() as cur:
+        cur.execute(
+            "INSERT INTO public.notification_queue (message, recipient, retry_count, max_retries, payload) "
+            "VALUES ('test', 'chat', 2, 3, jsonb_build_object('test', %s::text)) RETURNING id::text",
+            (tag,),
+        )
+        notification_id = cur.fetchone()[0]
+        cur.execute(
+            "SELECT public.mark_notifications_failed(%s::jsonb)",
+            (json.dumps([{"id": notification_id, "error": "Forbidden: bot was blocked by the user"}]),),
+        )
+        cur.execute(
+            "SELECT retry_count, error_message, last_attempt_at IS NOT NULL FROM public.notification_dead_letter WHERE id = %s",
+            (notification_id,),
+        )
+        assert cur.fetchone() == (3, "Forbidden: bot was blocked by the user", True)
+    assert where_is(db, [notification_id]) == ["dead"]
+
+
+def test_sweep_moves_legacy_failed_rows(db, tag, store):
+    with db.cursor() as cur:
+        cur.execute(
+            "INSERT INTO public.notification_queue (message, recipient, status, retry_count, payload) "
+            "SELECT 'test', 'chat', 'failed', 3, jsonb_build_object('test', %s::text) FROM generate_series(1, 5) "
+            "RETURNING id::text",
+            (tag,),
+        )
+        ids = [r[0] for r in cur.fetchall()]
+    assert store.sweep(None) >= 5
+    assert where_is(db, ids) == ["dead"] * 5
+
+
+def test_stale_dead_letter_copy_is_overwritten(db, tag, store):
+    """A row already buried under the same id must not be lost from both tables"""
+    with db.cursor() as cur:
+        cur.execute(
+            "INSERT INTO public.notification_queue (message, recipient, status, retry_count, max_retries, payload) "
+            "VALUES ('test', 'chat', 'pending', 2, 3, jsonb_build_object('test', %s::text)), "
+            "       ('test', 'chat', 'failed', 3, 3, jsonb_build_object('test', %s::text)) RETURNING id::text",
+            (tag, tag),
+        )
+        exhausted, legacy = [r[0] for r in cur.fetchall()]
+        cur.execute(
+            "INSERT INTO public.notification_dead_letter (id, message, retry_count, error_message, payload, dead_at) "
+            "SELECT id::uuid, 'stale', 1, 'old error', jsonb_build_object('test', %s::text), NOW() - INTERVAL '1 day' "
+            "FROM unnest(%s::text[]) id",
+            (tag, [exhausted, legacy]),
+        )
+        cur.execute(
+            "SELECT public.mark_notifications_failed(%s::jsonb)",
+            (json.dumps([{"id": exhausted, "error": "Forbidden: bot was blocked by the user"}]),),
+        )
+    assert store.sweep(None) >= 1
+    assert where_is(db, [exhausted, legacy]) == ["dead", "dead"]
+    with db.cursor() as cur:
+        cur.execute(
+            "SELECT message, retry_count, dead_at > NOW() - INTERVAL '1 minute' FROM public.notification_dead_letter "
+            "WHERE id = ANY(%s::uuid[])",
+            ([exhausted, legacy],),
+        )
+        assert set(cur.fetchall()) == {("test", 3, True)}
+
+
+def test_requeue_by_filter_moves_rows_back_as_due(db, tag, store):
+    blocked = bury(db, tag, 3, error="Forbidden: bot was blocked by the user")
+    flaky = bury(db, tag, 4, error="Gateway Timeout")
+    flt = DeadLetterFilter(error="gateway timeout", channel="telegram")
+
+    assert store.count(flt) >= 4
+    assert store.requeue(DeadLetterFilter(error="gateway timeout", recipient="chat"), limit=None) >= 4
+
+    assert where_is(db, flaky) == ["queue:pending:0"] * 4
+    assert where_is(db, blocked) == ["dead"] * 3
+    with db.cursor() as cur:
+        cur.execute("SELECT bool_and(next_retry_at <= NOW()) FROM public.notification_queue WHERE id = ANY(%s::uuid[])", (flaky,))
+        assert cur.fetchone()[0]
+
+
+def test_requeue_ids_loaded_with_copy(db, tag, store):
+    ids = bury(db, tag, 10)
+    picked = ids[:4]
+    assert store.load_ids(io.StringIO("".join(f"{i}\n" for i in picked))) == 4
+    assert store.requeue(DeadLetterFilter(use_ids=True)) == 4
+    assert where_is(db, picked) == ["queue:pending:0"] * 4
+    assert where_is(db, ids[4:]) == ["dead"] * 6
+
+
+def test_requeue_limit_takes_oldest_first(db, tag, store):
+    ids = bury(db, tag, 5)
+    with db.cursor() as cur:
+        cur.execute(
+            "UPDATE public.notification_dead_letter SET dead_at = NOW() - make_interval(mins => 10 - split_part(message, ' ', 2)::int) "
+            "WHERE id = ANY(%s::uuid[])",
+            (ids,),
+        )
+    assert store.load_ids(io.StringIO("".join(f"{i}\n" for i in ids))) == 5
+    assert store.requeue(DeadLetterFilter(use_ids=True), limit=2) == 2
+    # 'test 1' and 'test 2' have the oldest dead_at
+    with db.cursor() as cur:
+        cur.execute("SELECT message FROM public.notification_queue WHERE id = ANY(%s::uuid[]) ORDER BY message", (ids,))
+        assert [r[0] for r in cur.fetchall()] == ["test 1", "test 2"]
+
+
+def test_export_is_csv_of_the_filtered_rows(db, tag, store):
+    bury(db, tag, 3, channel="email", error="mailbox full")
+    out = io.StringIO()
+    store.export(DeadLetterFilter(channel="email", error="mailbox full"), out)
+    rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+    mine = [r for r in rows if json.loads(r["payload"]).get("test") == tag]
+    assert len(mine) == 3
+    assert {r["error_message"] for r in mine} == {"mailbox full"}
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
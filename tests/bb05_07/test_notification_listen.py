@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+# --- Watchdog Injection ---
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../scripts-py')))
+try:
+    import watchdog
+    watchdog.setup(300)
+except ImportError:
+    print('Warning: watchdog module not found', file=sys.stderr)
+# --------------------------
+
+"""
+Integration tests for the notification_queue NOTIFY trigger
+(database/migrations/20261018_11_notification_queue_notify.sql) and
+NotificationDispatcher.run_listening().
+Needs a database with the migrations applied; skipped when DATABASE_URL is not set.
+
+Usage: DATABASE_URL=... python -m pytest tests/bb05_07/test_notification_listen.py -q
+"""
+
+import select
+import threading
+import time
+import uuid
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+pytest.importorskip("requests")
+
+from config import get_database_url
+from notification_dispatcher import NotificationDispatcher, SendResult
+
+DUE_SQL = "SELECT COUNT(*) FROM public.notification_queue WHERE status = 'pending' AND (next_retry_at IS NULL OR next_retry_at <= NOW())"
+
+
+@pytest.fixture(scope="module")
+def dsn():
+    try:
+        return get_database_url()
+    except ValueError:
+        pytest.skip("DATABASE_URL not configured")
+
+
+@pytest.fixture
+def db(dsn):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def tag(db):
+    t = str(uuid.uuid4())
+    yield t
+    with db.cursor() as cur:
+        cur.execute("DELETE FROM public.notification_queue WHERE payload->>'test' = %s", (t,))
+
+
+def insert(conn, tag, n=1, delay_seconds=None):
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO public.notification_queue (message, recipient, next_retry_at, payload) "
+            "SELECT 'test ' || g, 'chat', NOW() + make_interval(secs => COALESCE(%s, 0)), jsonb_build_object('test', %s::text) "
+            "FROM generate_series(1, %s) g",
+            (delay_seconds, tag, n),
+        )
+
+
+class Sender:
+    def __init__(self):
+        self.sent_at = {}
+
+    def send(self, notification):
+        self.sent_at[notification["message"]] = time.monotonic()
+        return SendResult(True)
+
+
+@pytest.fixture
+def listening(dsn, db):
+    """A dispatcher in run_listening() with a 30 s safety-net poll"""
+    with db.cursor() as cur:
+        cur.execute(DUE_SQL)
+        if cur.fetchone()[0]:
+            pytest.skip("queue has real due notifications the dispatcher would send")
+    sender, stop = Sender(), threading.Event()
+    dispatcher = NotificationDispatcher(dsn, sender, worker_id="test:listen")
+    loop = threading.Thread(target=dispatcher.run_listening, kwargs={"poll_interval": 30, "stop": stop})
+    loop.start()
+    time.sleep(0.3)
+    yield sender
+    stop.set()
+    loop.join()
+    dispatcher.close()
+
+
+def wait_for(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_bulk_insert_sends_one_notification_after_commit(dsn, tag):
+    listener = psycopg2.connect(dsn)
+    listener.autocommit = True
+    with listener.cursor() as cur:
+        cur.execute("LISTEN notification_queue")
+
+    producer = psycopg2.connect(dsn)
+    insert(producer, tag, n=25)
+    assert not select.select([listener], [], [], 0.2)[0]  # nothing before COMMIT
+    producer.commit()
+    producer.close()
+
+    assert select.select([listener], [], [], 2)[0]
+    listener.poll()
+    assert len(listener.notifies) == 1
+    listener.close()
+
+
+def test_listening_dispatcher_sends_within_milliseconds(db, tag, listening):
+    t0 = time.monotonic()
+    insert(db, tag)
+    assert wait_for(lambda: "test 1" in listening.sent_at, 2)
+    assert listening.sent_at["test 1"] - t0 < 1.0
+
+
+def test_delayed_row_is_sent_when_due_not_at_next_poll(db, tag, listening):
+    t0 = time.monotonic()
+    insert(db, tag, delay_seconds=1.5)
+    assert wait_for(lambda: "test 1" in listening.sent_at, 5)
+    assert 1.0 < listening.sent_at["test 1"] - t0 < 3.0
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
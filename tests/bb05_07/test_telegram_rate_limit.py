@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+# --- Watchdog Injection ---
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../scripts-py')))
+try:
+    import watchdog
+    watchdog.setup(300)
+except ImportError:
+    print('Warning: watchdog module not found', file=sys.stderr)
+# --------------------------
+
+"""
+Tests for scripts-py/telegram_rate_limit.py and TelegramSender against tests/bb05_07/fake_telegram.py,
+a local Bot API that answers 429 above 30 msg/s globally or 1 msg/s per chat.
+No database or network needed.
+
+Usage: python -m pytest tests/bb05_07/test_telegram_rate_limit.py -q
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("requests")
+
+sys.path.insert(0, os.path.dirname(__file__))
+from fake_telegram import FakeTelegram
+from notification_dispatcher import SendResult, TelegramSender
+from telegram_rate_limit import RateLimitedSender, TokenBucket
+
+
+@pytest.fixture
+def tg():
+    with FakeTelegram(latency=0.05) as fake:
+        yield fake
+
+
+@pytest.fixture
+def limited(tg):
+    sender = RateLimitedSender(TelegramSender("test-token", api_base=tg.url), max_in_flight=16)
+    yield sender
+    sender.close()
+
+
+def notifications(chats, per_chat=1):
+    return [{"recipient": f"chat-{c}", "message": f"msg {i}"} for i in range(per_chat) for c in range(chats)]
+
+
+def test_many_chats_are_sent_at_the_global_limit_without_429(tg, limited):
+    started = time.monotonic()
+    results = limited.send_many(notifications(60))
+    elapsed = time.monotonic() - started
+
+    assert all(r.ok for r in results)
+    assert tg.rejected == 0 and limited.throttled == 0
+    assert tg.accepted == 60
+    # 60 messages at ~30/s: about 2 s, never faster than the limit allows
+    assert 1.5 <= elapsed < 4.0
+    assert tg.max_in_flight > 1
+
+
+def test_one_chat_is_paced_per_second_in_order(tg, limited):
+    started = time.monotonic()
+    results = limited.send_many(notifications(1, per_chat=4))
+    elapsed = time.monotonic() - started
+
+    assert all(r.ok for r in results)
+    assert tg.rejected == 0
+    assert elapsed >= 3.0
+    times = tg.sent["chat-0"]
+    assert all(b - a >= 1.0 for a, b in zip(times, times[1:]))
+
+
+def test_buckets_carry_over_between_batches(tg, limited):
+    limited.send_many(notifications(1))
+    limited.send_many(notifications(1))
+    assert tg.rejected == 0
+    assert tg.accepted == 2
+
+
+def test_unpaced_thread_pool_gets_429(tg):
+    """Baseline: what the dispatcher did before pacing"""
+    sender = TelegramSender("test-token", api_base=tg.url)
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(sender.send, notifications(60, per_chat=2)))
+    assert tg.rejected > 0
+    throttled = [r for r in results if not r.ok]
+    assert throttled and all(r.retry_after == tg.retry_after for r in throttled)
+
+
+def test_429_is_retried_after_retry_after():
+    class FloodOnce:
+        def __init__(self):
+            self.calls = []
+
+        def send(self, notification):
+            self.calls.append(time.monotonic())
+            if len(self.calls) == 1:
+                return SendResult(False, "HTTP 429: Too Many Requests: retry after 1", 1)
+            return SendResult(True)
+
+    inner = FloodOnce()
+    sender = RateLimitedSender(inner)
+    try:
+        assert sender.send({"recipient": "chat-x", "message": "hola"}).ok
+    finally:
+        sender.close()
+    assert sender.throttled == 1
+    assert len(inner.calls) == 2 and inner.calls[1] - inner.calls[0] >= 1.0
+
+
+def test_long_retry_after_is_left_to_the_queue_backoff():
+    class Flooded:
+        def send(self, notification):
+            return SendResult(False, "HTTP 429: Too Many Requests: retry after 30", 30)
+
+    sender = RateLimitedSender(Flooded(), max_inline_wait=5)
+    try:
+        result = sender.send({"recipient": "chat-x", "message": "hola"})
+    finally:
+        sender.close()
+    assert not result.ok and result.retry_after == 30
+
+
+def test_missing_recipient_goes_to_the_admin_chat(tg):
+    """Same fallback as BB_05 / BB_07 Format Telegram"""
+    sender = TelegramSender("test-token", api_base=tg.url, admin_chat_id="admin-chat")
+    assert sender.send({"recipient": None, "message": "hola"}).ok
+    assert list(tg.sent) == ["admin-chat"]
+
+    no_admin = TelegramSender("test-token", api_base=tg.url, admin_chat_id=None)
+    assert no_admin.send({"recipient": "", "message": "hola"}) == SendResult(False, "No recipient")
+    assert tg.requests == 1
+
+
+def test_token_bucket_spacing():
+    bucket = TokenBucket(rate=20, capacity=1)
+
+    async def take(n):
+        for _ in range(n):
+            await bucket.acquire()
+
+    started = time.monotonic()
+    asyncio.run(take(11))
+    # First token is banked, the other 10 arrive every 50 ms
+    assert 0.45 <= time.monotonic() - started < 0.8
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+
+# --- Watchdog Injection ---
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../scripts-py')))
+try:
+    import watchdog
+    watchdog.setup(300)
+except ImportError:
+    print('Warning: watchdog module not found', file=sys.stderr)
+# --------------------------
+
+"""
+Tests for the two-tier provider cache: public.get_provider_cache() and the
+providers/services invalidation triggers
+(database/migrations/20261018_19_provider_cache_invalidation.sql), and the
+LRU / single-flight / LISTEN tier in scripts-py/provider_cache.py, plus
+stale-while-revalidate and warm_provider_cache()
+(database/migrations/20261018_20_provider_cache_swr_warm.sql).
+Database tests are skipped when DATABASE_URL is not set.
+
+Usage: DATABASE_URL=... python -m pytest tests/bb95/test_provider_cache.py -q
+"""
+
+import select
+import threading
+import time
+import uuid
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+from config import get_database_url
+from provider_cache import MISSING, LRUCache, ProviderCache
+
+
+@pytest.fixture(scope="module")
+def dsn():
+    try:
+        return get_database_url()
+    except ValueError:
+        pytest.skip("DATABASE_URL not configured")
+
+
+@pytest.fixture
+def db(dsn):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def provider(db):
+    """A provider with one active and one inactive service, removed afterwards"""
+    provider_id = str(uuid.uuid4())
+    slug = f"test-cache-{uuid.uuid4().hex[:12]}"
+    with db.cursor() as cur:
+        cur.execute(
+            "INSERT INTO public.providers (id, name, slug, slot_duration_mins) VALUES (%s, 'Cache Test', %s, 45)",
+            (provider_id, slug),
+        )
+        cur.execute(
+            "INSERT INTO public.services (provider_id, name, duration_minutes, active) "
+            "VALUES (%s, 'Consulta', 30, true), (%s, 'Retirado', 45, false)",
+            (provider_id, provider_id),
+        )
+    yield {"id": provider_id, "slug": slug}
+    with db.cursor() as cur:
+        cur.execute("DELETE FROM public.services WHERE provider_id = %s", (provider_id,))
+        cur.execute("DELETE FROM public.providers WHERE id = %s", (provider_id,))
+
+
+def get_cached(conn, slug, stale_minutes=60):
+    with conn.cursor() as cur:
+        cur.execute("SELECT data, from_cache, is_stale FROM public.get_provider_cache(%s, 1440, %s)", (slug, stale_minutes))
+        return cur.fetchone()
+
+
+def expire(conn, slug, ago):
+    with conn.cursor() as cur:
+        cur.execute("UPDATE public.provider_cache SET expires_at = NOW() - %s::interval WHERE provider_slug = %s", (ago, slug))
+
+
+def cached_row(conn, slug):
+    with conn.cursor() as cur:
+        cur.execute("SELECT data FROM public.provider_cache WHERE provider_slug = %s", (slug,))
+        row = cur.fetchone()
+        return row[0] if row else None
+
+
+def test_lru_evicts_least_recently_used_and_expires():
+    now = [0.0]
+    lru = LRUCache(capacity=2, ttl=10, clock=lambda: now[0])
+    lru.put("a", 1)
+    lru.put("b", 2)
+    assert lru.get("a") == 1
+    lru.put("c", 3)
+    assert lru.get("b") is MISSING and lru.evictions == 1
+    now[0] = 11
+    assert lru.get("a") is MISSING and len(lru) == 1
+
+
+def test_lru_serves_stale_entries_within_stale_ttl():
+    now = [0.0]
+    lru = LRUCache(capacity=2, ttl=10, clock=lambda: now[0], stale_ttl=5)
+    lru.put("a", 1)
+    now[0] = 12
+    assert lru.lookup("a") == (1, True) and lru.get("a") is MISSING
+    lru.put("b", 2, stale=True)
+    assert lru.lookup("b") == (2, True)
+    now[0] = 16
+    assert lru.lookup("a") == (MISSING, False) and len(lru) == 1
+
+
+def test_fill_then_hit_with_active_services_only(db, provider):
+    data, from_cache, _ = get_cached(db, provider["slug"])
+    assert from_cache is False
+    assert data["slug"] == provider["slug"]
+    assert data["slot_duration_mins"] == 45
+    assert [s["name"] for s in data["services"]] == ["Consulta"]
+    assert get_cached(db, provider["slug"])[1:] == (True, False)
+    assert get_cached(db, "no-such-provider-slug") is None
+
+
+def test_expired_row_is_served_stale_within_grace(db, provider):
+    get_cached(db, provider["slug"])
+    with db.cursor() as cur:
+        # Bypasses the trigger's invalidation: only the cached row changes
+        cur.execute("UPDATE public.provider_cache SET data = data || '{\"name\": \"Old\"}' WHERE provider_slug = %s", (provider["slug"],))
+    expire(db, provider["slug"], "5 minutes")
+    data, from_cache, is_stale = get_cached(db, provider["slug"])
+    assert (data["name"], from_cache, is_stale) == ("Old", True, True)
+
+    # stale_minutes = 0 is the background refresh: the expired row is rebuilt
+    data, from_cache, is_stale = get_cached(db, provider["slug"], stale_minutes=0)
+    assert (data["name"], from_cache, is_stale) == ("Cache Test", False, False)
+
+    # Past the grace period the request rebuilds it inline
+    expire(db, provider["slug"], "2 hours")
+    assert get_cached(db, provider["slug"])[1:] == (False, False)
+
+
+def test_warm_fills_public_providers_and_refreshes_expiring_rows(db, provider):
+    def warm(ahead=60, force=False):
+        with db.cursor() as cur:
+            cur.execute("SELECT warmed, refreshed FROM public.warm_provider_cache(1440, %s, %s)", (ahead, force))
+            return cur.fetchone()
+
+    def expires_in(slug):
+        with db.cursor() as cur:
+            cur.execute("SELECT expires_at - NOW() > INTERVAL '23 hours' FROM public.provider_cache WHERE provider_slug = %s", (slug,))
+            return cur.fetchone()
+
+    warm()
+    assert cached_row(db, provider["slug"])["services"][0]["name"] == "Consulta"
+    assert warm() == (0, 0)
+
+    expire(db, provider["slug"], "-30 minutes")
+    assert warm()[1] >= 1 and expires_in(provider["slug"]) == (True,)
+
+    with db.cursor() as cur:
+        cur.execute("UPDATE public.providers SET public_booking_enabled = false WHERE id = %s", (provider["id"],))
+    warm()
+    assert cached_row(db, provider["slug"]) is None
+    # A forced warm rewrites every cached row, whether it expires soon or not
+    get_cached(db, provider["slug"])
+    assert warm(force=True)[1] >= 1
+
+
+def test_provider_and_service_changes_invalidate_and_notify(dsn, db, provider):
+    listener = psycopg2.connect(dsn)
+    listener.autocommit = True
+    try:
+        with listener.cursor() as cur:
+            cur.execute("LISTEN provider_cache")
+        get_cached(db, provider["slug"])
+        with db.cursor() as cur:
+            cur.execute("UPDATE public.providers SET name = 'Renamed' WHERE id = %s", (provider["id"],))
+        assert cached_row(db, provider["slug"]) is None
+
+        get_cached(db, provider["slug"])
+        with db.cursor() as cur:
+            cur.execute("UPDATE public.services SET active = true WHERE provider_id = %s", (provider["id"],))
+        assert cached_row(db, provider["slug"]) is None
+        data, from_cache, _ = get_cached(db, provider["slug"])
+        assert from_cache is False and data["name"] == "Renamed" and len(data["services"]) == 2
+
+        payloads = set()
+        deadline = time.monotonic() + 2
+        while len(payloads) < 1 and time.monotonic() < deadline:
+            if select.select([listener], [], [], 0.2)[0]:
+                listener.poll()
+                payloads.update(n.payload for n in listener.notifies)
+                listener.notifies.clear()
+        assert payloads == {provider["slug"]}
+    finally:
+        listener.close()
+
+
+def test_cold_slug_is_filled_once_under_concurrency(dsn, provider):
+    results = []
+    barrier = threading.Barrier(8)
+
+    def worker():
+        conn = psycopg2.connect(dsn)
+        conn.autocommit = True
+        try:
+            barrier.wait()
+            results.append(get_cached(conn, provider["slug"])[1])
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(results) == [False] + [True] * 7
+
+
+def test_in_process_single_flight(dsn, provider):
+    calls = []
+
+    class SlowCache(ProviderCache):
+        def _fetch(self, slug, refresh=False):
+            calls.append(slug)
+            time.sleep(0.2)
+            return super()._fetch(slug, refresh)
+
+    cache = SlowCache(dsn, listen=False)
+    try:
+        values = []
+        threads = [threading.Thread(target=lambda: values.append(cache.get(provider["slug"]))) for _ in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert calls == [provider["slug"]]
+        assert len(values) == 10 and all(v["slug"] == provider["slug"] for v in values)
+        assert cache.get(provider["slug"]) is values[0]
+        stats = cache.stats()
+        assert stats["coalesced"] == 9 and stats["hits"] == 1
+    finally:
+        cache.close()
+
+
+def test_stale_lru_entry_is_served_while_refreshed_in_background(dsn, db, provider):
+    cache = ProviderCache(dsn, ttl=0.05, stale_ttl=30, listen=False)
+    try:
+        assert cache.get(provider["slug"])["name"] == "Cache Test"
+        with db.cursor() as cur:
+            cur.execute("UPDATE public.providers SET name = 'Refrescado' WHERE id = %s", (provider["id"],))
+        time.sleep(0.1)
+        assert cache.get(provider["slug"])["name"] == "Cache Test"
+        deadline = time.monotonic() + 3
+        while cache.stats()["refreshes"] < 1:
+            assert time.monotonic() < deadline, "background refresh did not run"
+            time.sleep(0.01)
+        assert cache.get(provider["slug"])["name"] == "Refrescado"
+        stats = cache.stats()
+        assert stats["stale_hits"] == 1 and stats["fills"] == 2
+    finally:
+        cache.close()
+
+
+def test_notify_evicts_the_in_process_entry(dsn, db, provider):
+    cache = ProviderCache(dsn)
+    try:
+        assert cache.get(provider["slug"])["name"] == "Cache Test"
+        with db.cursor() as cur:
+            cur.execute("UPDATE public.providers SET name = 'Nuevo Nombre' WHERE id = %s", (provider["id"],))
+        deadline = time.monotonic() + 3
+        while cache.get(provider["slug"])["name"] != "Nuevo Nombre":
+            assert time.monotonic() < deadline, "LRU entry was not invalidated"
+            time.sleep(0.02)
+        assert cache.stats()["invalidations"] >= 1
+    finally:
+        cache.close()
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))